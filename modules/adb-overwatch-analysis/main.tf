@@ -9,9 +9,15 @@ data "azurerm_databricks_workspace" "adb-ws" {
 
 //Upload Databricks notebooks used to analyse the Overwatch results
 resource "databricks_notebook" "overwatch_analysis" {
-  for_each = toset(["Cluster", "Helpers", "Jobs", "Notebook", "Readme", "Workspace"])
+  for_each = toset(["Benchmark", "Cluster", "Helpers", "Jobs", "Notebook", "Readme", "SyntheticData", "Workspace"])
   source   = "${path.module}/notebooks/${each.key}.py"
   path     = "/Overwatch/Analysis/${each.key}"
   format   = "SOURCE"
   language = "PYTHON"
-}
\ No newline at end of file
+}
+//Upload the overwatch_analysis package next to the notebooks, so they can import it
+resource "databricks_workspace_file" "overwatch_analysis_package" {
+  for_each = fileset("${path.module}/python/overwatch_analysis", "*.py")
+  source   = "${path.module}/python/overwatch_analysis/${each.key}"
+  path     = "/Overwatch/Analysis/overwatch_analysis/${each.key}"
+}
@@ -0,0 +1,619 @@
+# Databricks notebook source
+# MAGIC %md
+# MAGIC # Read Me
+# MAGIC >
+# MAGIC - **Benchmarks for the helpers and master classes of the overwatch_analysis package (loaded by the Helpers notebook)**
+# MAGIC - **Every benchmark writes its own synthetic tables to the benchmark database, your Overwatch databases are never read or written**
+# MAGIC - **Run it on a cluster sized like the one used by the dashboards to get comparable numbers**
+# MAGIC
+# MAGIC Widgets Used:
+# MAGIC | # | Widgets | Value | Default
+# MAGIC | ----------- | ----------- | ----------- | ----------- |
+# MAGIC | 1 | Benchmark Database | Database prefix used for the synthetic tables | overwatch_benchmark
+# MAGIC | 2 | Repetitions | Number of timed runs per measurement (median is reported) | 3
+# MAGIC | 3 | Synthetic Workspaces | Workspaces of the synthetic Overwatch database | 10
+# MAGIC | 4 | Synthetic Days | Days of the synthetic Overwatch database | 30
+# MAGIC | 5 | Spark Jobs Per Day | Spark jobs per workspace and day (sparkJob rows) | 100
+# MAGIC | 6 | Tasks Per Job | Spark tasks per spark job (sparkTask rows = workspaces x days x jobs x tasks) | 20
+
+# COMMAND ----------
+
+# MAGIC %run "./Helpers"
+
+# COMMAND ----------
+
+# MAGIC %run "./SyntheticData"
+
+# COMMAND ----------
+
+dbutils.widgets.text("benchDB", "overwatch_benchmark", "1. Benchmark Database")
+dbutils.widgets.text("repetitions", "3", "2. Repetitions")
+dbutils.widgets.text("syntheticWorkspaces", "10", "3. Synthetic Workspaces")
+dbutils.widgets.text("syntheticDays", "30", "4. Synthetic Days")
+dbutils.widgets.text("sparkJobsPerDay", "100", "5. Spark Jobs Per Day")
+dbutils.widgets.text("tasksPerJob", "20", "6. Tasks Per Job")
+
+benchDB = str(dbutils.widgets.get("benchDB"))
+repetitions = int(dbutils.widgets.get("repetitions"))
+synthetic_workspaces = int(dbutils.widgets.get("syntheticWorkspaces"))
+synthetic_days = int(dbutils.widgets.get("syntheticDays"))
+spark_jobs_per_day = int(dbutils.widgets.get("sparkJobsPerDay"))
+tasks_per_job = int(dbutils.widgets.get("tasksPerJob"))
+
+# COMMAND ----------
+
+import time
+from statistics import median
+from pyspark.sql.window import Window
+import pyspark.sql.functions as F
+import pandas as pd
+
+def time_planning(build_df):
+  """
+  Returns the median wall time (seconds) to build a dataframe and produce its physical plan.
+  Any driver side collect done while building the dataframe is included.
+  """
+  timings = []
+  for _ in range(repetitions):
+    start = time.perf_counter()
+    build_df()._jdf.queryExecution().executedPlan()
+    timings.append(time.perf_counter() - start)
+  return round(median(timings), 4)
+
+def time_call(call):
+  """
+  Returns the median wall time (seconds) of a call that runs its own Spark jobs (snapshot refresh, table writes).
+  """
+  timings = []
+  for _ in range(repetitions):
+    start = time.perf_counter()
+    call()
+    timings.append(time.perf_counter() - start)
+  return round(median(timings), 4)
+
+def time_runtime(build_df):
+  """
+  Returns the median wall time (seconds) to build and fully execute a dataframe (noop sink).
+  """
+  timings = []
+  for _ in range(repetitions):
+    start = time.perf_counter()
+    build_df().write.format("noop").mode("overwrite").save()
+    timings.append(time.perf_counter() - start)
+  return round(median(timings), 4)
+
+# COMMAND ----------
+
+# MAGIC %md
+# MAGIC ## Workspace filter: isin literal vs broadcast left-semi join
+# MAGIC > Compares `helpers.filter_workspaces` in `isin` mode (organization id literal read from the workspace catalog) with the `semi_join` mode (broadcast lookup, plus a partition filter when the fact table is partitioned by organization_id) at 10, 100 and 1000 monitored workspaces, and checks both modes select the same rows.
+
+# COMMAND ----------
+
+workspace_counts = [10, 100, 1000]
+rows_per_workspace = 2000
+
+def create_workspace_filter_tables(n):
+  db = f"{benchDB}_wsfilter_{n}"
+  spark.sql(f"create database if not exists {db}")
+  spark.range(n)\
+    .select(F.concat(F.lit("org_"), F.col("id")).alias("organization_id"),
+            F.concat(F.lit("workspace_"), F.col("id")).alias("workspace_name"),
+            # The columns the workspace catalog reads
+            F.struct(F.struct(F.lit(None).cast("struct<connectionString:string>").alias("azureAuditLogEventhubConfig"))
+                     .alias("auditLogConfig")).alias("inputConfig"),
+            F.current_timestamp().alias("Pipeline_SnapTS"))\
+    .write.mode("overwrite").format("delta").saveAsTable(f"{db}.pipeline_report")
+  spark.range(n * rows_per_workspace)\
+    .select(F.concat(F.lit("org_"), (F.col("id") % n)).alias("organization_id"),
+            (F.rand(seed=42) * 100).alias("total_dbu_cost"))\
+    .write.mode("overwrite").format("delta").partitionBy("organization_id").saveAsTable(f"{db}.clusterstatefact")
+  workspace_catalog.get(db).invalidate()
+  return db
+
+workspace_filter_results = []
+for n in workspace_counts:
+  db = create_workspace_filter_tables(n)
+  bench = helpers(db, db)
+  # Half of the workspaces are selected, as in a typical widget selection
+  selected = [f"workspace_{i}" for i in range(0, n, 2)]
+  fact_table = f"{db}.clusterstatefact"
+  selected_rows = {}
+  for mode in ["isin", "semi_join"]:
+    build_df = lambda: spark.table(fact_table)\
+      .transform(bench.filter_workspaces(selected, fact_table, mode))\
+      .groupBy("organization_id")\
+      .agg(F.sum("total_dbu_cost").alias("total_dbu_cost"))
+    workspace_filter_results.append({"workspaces": n,
+                                     "mode": mode,
+                                     "planning_s": time_planning(build_df),
+                                     "runtime_s": time_runtime(build_df)})
+    selected_rows[mode] = sorted(spark.table(fact_table).transform(bench.filter_workspaces(selected, fact_table, mode)).groupBy("organization_id").count().collect())
+  if selected_rows["isin"] != selected_rows["semi_join"]:
+    raise Exception(f"Sorry, the isin and semi_join workspace filters select different rows at {n} workspaces")
+
+workspace_filter_results = pd.DataFrame(workspace_filter_results)
+display(workspace_filter_results)
+
+# COMMAND ----------
+
+fig = px.bar(workspace_filter_results.melt(id_vars=["workspaces", "mode"], value_vars=["planning_s", "runtime_s"]),
+             x = "workspaces",
+             y = "value",
+             color = "mode",
+             barmode = "group",
+             facet_col = "variable",
+             title = "Workspace filter: isin vs broadcast semi-join",
+             labels = {"value": "Seconds (median)", "workspaces": "Monitored workspaces"})
+fig.update_xaxes(type='category')
+fig.show()
+
+# COMMAND ----------
+
+# MAGIC %md
+# MAGIC ## Top 20 plus Others: row_number + left join back vs helpers.top_k_with_others
+# MAGIC > Daily workspace cost of 5000 workspaces over 365 days, ranked per day (as in the Workspace dashboard) and over the whole year (window without partitionBy).
+# MAGIC > The planning time of `top_k_with_others` includes the job collecting the per group thresholds.
+
+# COMMAND ----------
+
+topk_workspaces = 5000
+topk_days = 365
+
+topk_costs = spark.range(topk_workspaces * topk_days)\
+  .select(F.date_sub(F.current_date(), (F.col("id") % topk_days).cast("int")).alias("state_start_date"),
+          F.concat(F.lit("org_"), (F.col("id") / topk_days).cast("long")).alias("organization_id"),
+          F.concat(F.lit("workspace_"), (F.col("id") / topk_days).cast("long")).alias("workspace_name"),
+          F.round(F.rand(seed=7) * 1000, 2).alias("DBU_Cost (USD)"))
+topk_costs.write.mode("overwrite").format("delta").saveAsTable(f"{benchDB}.topk_daily_cost")
+
+def top_k_row_number(df, partition_by, keys):
+  ranking = Window.partitionBy(*partition_by).orderBy(F.col("DBU_Cost (USD)").desc()) if partition_by else Window.orderBy(F.col("DBU_Cost (USD)").desc())
+  top = df.withColumn("row", F.row_number().over(ranking)).filter(F.col("row") <= 20)
+  joined = df.join(top, [df[c] == top[c] for c in partition_by + keys], "left").select(df["*"], F.col("row"))
+  for key in keys:
+    joined = joined.withColumn(key, F.expr(f"case when row is null then 'Others' else {key} end"))
+  return joined
+
+# Any database holding a pipeline_report works, top_k_with_others does not read it
+topk_bench = helpers(f"{benchDB}_wsfilter_{workspace_counts[0]}", benchDB)
+topk_results = []
+for scope, partition_by in [("per day", ["state_start_date"]), ("global", [])]:
+  for implementation in ["row_number + join", "top_k_with_others"]:
+    def build_df():
+      df = spark.table(f"{benchDB}.topk_daily_cost")
+      keys = ["organization_id", "workspace_name"]
+      if implementation == "row_number + join":
+        labelled = top_k_row_number(df, partition_by, keys)
+      else:
+        labelled = df.transform(topk_bench.top_k_with_others("DBU_Cost (USD)", keys, 20, partitionBy=partition_by))
+      return labelled.groupBy(*partition_by, *keys).agg(F.sum("DBU_Cost (USD)").alias("DBU_Cost (USD)"))
+    topk_results.append({"scope": scope,
+                         "implementation": implementation,
+                         "planning_s": time_planning(build_df),
+                         "runtime_s": time_runtime(build_df)})
+
+topk_results = pd.DataFrame(topk_results)
+display(topk_results)
+
+# COMMAND ----------
+
+fig = px.bar(topk_results.melt(id_vars=["scope", "implementation"], value_vars=["planning_s", "runtime_s"]),
+             x = "scope",
+             y = "value",
+             color = "implementation",
+             barmode = "group",
+             facet_col = "variable",
+             title = f"Top 20 plus Others ({topk_workspaces} workspaces x {topk_days} days)",
+             labels = {"value": "Seconds (median)", "scope": "Ranking scope"})
+fig.show()
+
+# COMMAND ----------
+
+# MAGIC %md
+# MAGIC ## Master methods and dashboard aggregations on a synthetic Overwatch database
+# MAGIC > Writes the synthetic consumer tables (SyntheticData notebook) at the scale set by the widgets, then times the master builders, snapshot refreshes and the main aggregation of each dashboard.
+# MAGIC > Every run is appended to `<Benchmark Database>.benchmark_results` with its scale, compare runs of the same scale to catch regressions.
+
+# COMMAND ----------
+
+synthetic_db = f"{benchDB}_synthetic"
+synthetic = synthetic_overwatch(synthetic_db,
+                                workspaces = synthetic_workspaces,
+                                days = synthetic_days,
+                                sparkJobsPerDay = spark_jobs_per_day,
+                                tasksPerJob = tasks_per_job)
+synthetic_counts = synthetic.write_tables()
+workspace_catalog.get(synthetic_db).invalidate()
+display(pd.DataFrame([synthetic_counts]))
+
+# COMMAND ----------
+
+synthetic_master = master(synthetic_db, synthetic_db, synthetic.workspace_names(), str(synthetic.start_date), str(synthetic.end_date),
+                          analysisDB = synthetic_db)
+base_kwargs = {"includeWeekend": "Yes", "onlyWeekend": "No"}
+# Master of the window before the synthetic one, what a period comparison needed before period_comparison
+previous_start, previous_end = synthetic_master.previous_period()
+previous_master = master(synthetic_db, synthetic_db, synthetic.workspace_names(), str(previous_start), str(previous_end),
+                         analysisDB = synthetic_db)
+
+cluster_frame = lambda: synthetic_master.cluster_master_filter(**base_kwargs)
+job_frame = lambda: synthetic_master.job_master_filter(**base_kwargs, dateColumn = "job_start_date", clusterTable = None)
+spark_frame = lambda: synthetic_master.spark_notebook_master(**base_kwargs)
+
+frame_benchmarks = {
+  "master.cluster_master_filter": cluster_frame,
+  "master.job_master_filter": job_frame,
+  "master.spark_notebook_master": spark_frame,
+  "master.expensive_jobs_top_n": lambda: synthetic_master.expensive_jobs_top_n(job_frame(), topN = 3),
+  "master.notebook_folder_rollup (all path depths)": lambda: synthetic_master.notebook_folder_rollup(spark_frame()).unpersist(),
+  "master.notebook_folder_metrics (new path depth, cached rollup)": lambda: synthetic_master.notebook_folder_metrics(spark_frame(), 4),
+  "master.cluster_daily_cost": lambda: synthetic_master.cluster_daily_cost(**base_kwargs),
+  "master.node_type_rollup": lambda: synthetic_master.node_type_rollup(cluster_frame()).unpersist(),
+  "Workspace: tag count (json_tuple per key)": lambda: cluster_frame()\
+    .select("organization_id", "workspace_name", "cluster_identity",
+            F.explode(F.create_map(*[x for key in ["JobId", "SqlEndpointId"] for x in (F.lit(key), F.json_tuple(F.col("custom_tags"), key))])).alias("tag_key", "tag_value"))\
+    .where(F.col("tag_value").isNotNull())\
+    .groupBy("organization_id", "workspace_name", "tag_key")\
+    .agg(F.countDistinct("cluster_identity").alias("tag_count")),
+  "Workspace: tag count (tag index)": lambda: synthetic_master.snapshot("cluster_tag_index", refresh = False, **base_kwargs)\
+    .where(F.col("tag_key").isin(["JobId", "SqlEndpointId"]) & F.col("tag_value").isNotNull())\
+    .groupBy("organization_id", "workspace_name", "tag_key")\
+    .agg(F.countDistinct("cluster_identity").alias("tag_count")),
+  "Cluster: failures per node type (state OR chain)": lambda: cluster_frame()\
+    .where(F.col("state").isin(["SPARK_EXCEPTION", "DRIVER_UNAVAILABLE", "DBFS_DOWN", "NODES_LOST", "DRIVER_NOT_RESPONDING", "METASTORE_DOWN"])
+           & (F.col("is_automated") == "false"))\
+    .groupBy("state", "node_type_id")\
+    .agg(F.countDistinct("cluster_id").alias("Count_ClusterID")),
+  "Cluster: failures per node type (transitions snapshot)": lambda: synthetic_master.snapshot("cluster_transitions", refresh = False, **base_kwargs)\
+    .where(F.col("is_failure") & (F.col("is_automated") == "false"))\
+    .groupBy("state", "node_type_id")\
+    .agg(F.countDistinct("cluster_id").alias("Count_ClusterID")),
+  "master.cluster_mtbf (node type)": lambda: synthetic_master.cluster_mtbf(synthetic_master.snapshot("cluster_transitions", refresh = False, **base_kwargs)),
+  "master.concurrency_timeline (sweep line)": lambda: synthetic_master.concurrency_timeline(**base_kwargs),
+  "master.concurrency_peaks (daily, workspace)": lambda: synthetic_master.concurrency_peaks(synthetic_master.snapshot("concurrency_timeline", refresh = False, **base_kwargs), ["workspace_name"]),
+  "master.chargeback (runtime shares)": lambda: synthetic_master.chargeback(**base_kwargs),
+  "master.chargeback_rollup (folders, depth 3)": lambda: synthetic_master.chargeback_rollup(synthetic_master.snapshot("chargeback", refresh = False, **base_kwargs), ["folder_path", "workspace_name"], folderLevel = 3),
+  "master.tag_clusters (JobId=1)": lambda: synthetic_master.tag_clusters("JobId=1", **base_kwargs),
+  "Cluster: daily cost per cluster (explode state_dates)": lambda: cluster_frame()\
+    .withColumn("date", F.explode("state_dates"))\
+    .groupBy("date", "organization_id", "workspace_name", "days_in_state", "cluster_id", "cluster_name")\
+    .agg((F.sum("total_DBU_cost") / F.col("days_in_state")).alias("total_DBU_cost")),
+  "Cluster: daily cost per cluster (allocation snapshot)": lambda: synthetic_master.snapshot("cluster_daily_cost", refresh = False, **base_kwargs)\
+    .groupBy("date", "organization_id", "workspace_name", "cluster_id", "cluster_name")\
+    .agg(F.sum("total_dbu_cost").alias("total_DBU_cost")),
+  "helpers.top_k_with_others (daily)": lambda: cluster_frame()\
+    .groupBy("state_start_date", "organization_id", "workspace_name")\
+    .agg(F.sum("total_DBU_cost").alias("DBU_Cost (USD)"))\
+    .transform(synthetic_master.top_k_with_others("DBU_Cost (USD)", ["organization_id", "workspace_name"], 20, partitionBy = ["state_start_date"])),
+  "Cluster: daily cost by category": lambda: cluster_frame()\
+    .groupBy("state_start_date", "workspace_name", "cluster_category")\
+    .agg(F.sum("total_DBU_cost"), F.sum("total_compute_cost"), F.sum("total_cost")),
+  "Jobs: job count by workspace (countDistinct)": lambda: job_frame()\
+    .groupBy("workspace_name")\
+    .agg(F.countDistinct("job_id").alias("job_count")),
+  "Jobs: job count by workspace (daily HLL sketches)": lambda: synthetic_master.distinct_count("job_id", groupBy = ["workspace_name"], refresh = False, **base_kwargs),
+  "Notebook: interactive users per folder (daily HLL sketches)": lambda: synthetic_master.distinct_count("interactive_user_email", groupBy = ["folder_path", "organization_id", "workspace_name"], folderLevel = 3, refresh = False, **base_kwargs),
+  "Jobs: daily cost percentiles (exact percentile windows)": lambda: job_frame()\
+    .groupBy("job_start_date", "workspace_name")\
+    .agg(F.sum("total_dbu_cost").alias("total_dbu_cost"))\
+    .select("*", *[F.expr(f"percentile(total_dbu_cost, {p})").over(Window.partitionBy("job_start_date")).alias(str(p)) for p in [0.5, 0.9, 0.99, 1]]),
+  "Jobs: daily cost percentiles (master.quantiles)": lambda: synthetic_master.quantiles(job_frame()\
+    .groupBy("job_start_date", "workspace_name")\
+    .agg(F.sum("total_dbu_cost").alias("total_dbu_cost")), "total_dbu_cost", ["job_start_date"], {"50%": 0.5, "90%": 0.9, "99%": 0.99, "max": 1.0}),
+  "Cluster: DBU spend box statistics (master.box_stats)": lambda: synthetic_master.box_stats(cluster_frame()\
+    .groupBy("cluster_category", "state_start_date", "workspace_name")\
+    .agg(F.sum("total_DBU_cost").alias("total_DBU_cost")), "total_DBU_cost", ["cluster_category", "workspace_name"]),
+  "Cluster: DBU spend against the previous period (two masters)": lambda: synthetic_master.snapshot("cluster_master", refresh = False, **base_kwargs)\
+    .groupBy("workspace_name")\
+    .agg(F.sum("total_dbu_cost").alias("dbu_cost_current"))\
+    .join(previous_master.snapshot("cluster_master", refresh = False, **base_kwargs)
+          .groupBy("workspace_name")
+          .agg(F.sum("total_dbu_cost").alias("dbu_cost_previous")), "workspace_name", "full"),
+  "Cluster: DBU spend against the previous period (master.period_comparison)": lambda: synthetic_master.period_comparison("cluster_master", {"dbu_cost": "total_dbu_cost"}, ["workspace_name"], refresh = False, **base_kwargs),
+  "Jobs: daily DBU cost by workspace": lambda: job_frame()\
+    .groupBy("job_start_date", "workspace_name")\
+    .agg(F.sum("total_dbu_cost").alias("total_dbu_cost")),
+  "Workspace: daily cost by workspace": lambda: cluster_frame()\
+    .groupBy("state_start_date", "organization_id", "workspace_name", "cluster_id")\
+    .agg(F.sum(F.col("total_dbu_cost") / F.col("days_in_state")).alias("cost_by_date"))\
+    .groupBy("state_start_date", "organization_id", "workspace_name")\
+    .agg(F.sum("cost_by_date").alias("DBU_Cost (USD)")),
+  "Notebook: longest running per path (partition_split)": lambda: spark_frame()\
+    .transform(synthetic_master.partition_split(3, synthetic_db))\
+    .groupBy("folder_path", "organization_id", "workspace_name", "Execution_type")\
+    .agg(F.sum("task_runtime.runTimeH").alias("total_runtime (hrs)")),
+  "Notebook: longest running per path (path hierarchy)": lambda: synthetic_master.with_folder_path(spark_frame(), 3)\
+    .groupBy("folder_path", "organization_id", "workspace_name", "Execution_type")\
+    .agg(F.sum("task_runtime.runTimeH").alias("total_runtime (hrs)")),
+}
+
+call_benchmarks = {
+  "master.refresh_snapshot(cluster_master, full)": lambda: synthetic_master.refresh_snapshot("cluster_master", fullRefresh = True),
+  "master.refresh_snapshot(job_master, full)": lambda: synthetic_master.refresh_snapshot("job_master", fullRefresh = True),
+  "master.refresh_snapshot(spark_notebook_master, full)": lambda: synthetic_master.refresh_snapshot("spark_notebook_master", fullRefresh = True),
+  "master.refresh_snapshot(cluster_daily_cost, full)": lambda: synthetic_master.refresh_snapshot("cluster_daily_cost", fullRefresh = True),
+  "master.refresh_snapshot(cluster_transitions, full)": lambda: synthetic_master.refresh_snapshot("cluster_transitions", fullRefresh = True),
+  "master.refresh_snapshot(concurrency_timeline, full)": lambda: synthetic_master.refresh_snapshot("concurrency_timeline", fullRefresh = True),
+  "master.refresh_snapshot(chargeback, full)": lambda: synthetic_master.refresh_snapshot("chargeback", fullRefresh = True),
+  "master.refresh_snapshot(cluster_master, up to date)": lambda: synthetic_master.refresh_snapshot("cluster_master"),
+  "master.refresh_cost_cube(full)": lambda: synthetic_master.refresh_cost_cube(fullRefresh = True),
+  "master.cost_cube (workspace totals)": lambda: synthetic_master.cost_cube(groupBy = ["organization_id", "workspace_name"]).collect(),
+}
+
+# The allocation, transition, concurrency, chargeback, tag index and distinct sketch snapshots are read without refresh in the frame benchmarks
+synthetic_master.refresh_snapshot("cluster_daily_cost")
+synthetic_master.refresh_snapshot("chargeback")
+synthetic_master.refresh_snapshot("cluster_transitions")
+synthetic_master.refresh_snapshot("concurrency_timeline")
+synthetic_master.refresh_snapshot("cluster_tag_index")
+synthetic_master.refresh_snapshot("distinct_sketches")
+synthetic_master.refresh_snapshot("cluster_master")
+
+master_results = []
+for name, build_df in frame_benchmarks.items():
+  master_results.append({"benchmark": name, "planning_s": time_planning(build_df), "runtime_s": time_runtime(build_df)})
+for name, call in call_benchmarks.items():
+  master_results.append({"benchmark": name, "planning_s": None, "runtime_s": time_call(call)})
+
+master_results = pd.DataFrame(master_results)
+display(master_results)
+
+# COMMAND ----------
+
+spark.createDataFrame(master_results.assign(workspaces = synthetic_workspaces,
+                                            days = synthetic_days,
+                                            spark_tasks = synthetic_counts["sparkTask"],
+                                            repetitions = repetitions,
+                                            run_at = pd.Timestamp.now()),
+                      "benchmark string, planning_s double, runtime_s double, workspaces int, days int, spark_tasks bigint, repetitions int, run_at timestamp")\
+  .write.format("delta").mode("append").saveAsTable(f"{benchDB}.benchmark_results")
+
+# Runtime of the last runs at the current scale, one column per run
+display(spark.table(f"{benchDB}.benchmark_results")
+        .filter((F.col("workspaces") == synthetic_workspaces) & (F.col("days") == synthetic_days) & (F.col("spark_tasks") == synthetic_counts["sparkTask"]))
+        .groupBy("benchmark")
+        .pivot("run_at")
+        .agg(F.first("runtime_s"))
+        .orderBy("benchmark"))
+
+# COMMAND ----------
+
+fig = px.bar(master_results,
+             x = "runtime_s",
+             y = "benchmark",
+             orientation = "h",
+             title = f"Master methods and dashboard aggregations ({synthetic_workspaces} workspaces, {synthetic_days} days, {synthetic_counts['sparkTask']} spark tasks)",
+             labels = {"runtime_s": "Seconds (median)", "benchmark": ""})
+fig.show()
+
+# COMMAND ----------
+
+# MAGIC %md
+# MAGIC ## Idle time: interval join vs binned range join
+# MAGIC > Writes the cluster and sparkTask tables of a synthetic Overwatch database with 5, 10 and 20 tasks per spark job, then joins the task intervals with the RUNNING / RESIZING states:
+# MAGIC > a plain interval join (equi-join on the cluster plus an overlap condition, overlapping tasks are not merged so it only times the join) against `master.cluster_idle_time` (tasks merged into busy periods per cluster, then equi-joined per time bin).
+# MAGIC > The runtime of the binned join should grow linearly with the number of spark tasks.
+
+# COMMAND ----------
+
+idle_task_counts = [5, 10, 20]
+
+def interval_join_idle_time(idle_master):
+  states = idle_master.cluster_master_filter(**base_kwargs)\
+    .filter(F.col("state").isin(master.cluster_up_states))
+  tasks = idle_master.read_source("sparkTask",
+                                  columns = ["organization_id", "cluster_id", "date",
+                                             F.col("task_runtime.startEpochMS").alias("task_start_ms"),
+                                             F.col("task_runtime.endEpochMS").alias("task_end_ms")],
+                                  dateColumn = "date",
+                                  weekdays = False)
+  return states\
+    .join(tasks, (states["organization_id"] == tasks["organization_id"])
+                 & (states["cluster_id"] == tasks["cluster_id"])
+                 & (tasks["task_start_ms"] < states["unixTimeMS_state_end"])
+                 & (tasks["task_end_ms"] > states["unixTimeMS_state_start"]))\
+    .groupBy(states["organization_id"], states["cluster_id"], states["unixTimeMS_state_start"])\
+    .agg(F.sum(F.least(tasks["task_end_ms"], states["unixTimeMS_state_end"]) - F.greatest(tasks["task_start_ms"], states["unixTimeMS_state_start"])).alias("busy_ms"))
+
+idle_results = []
+for n in idle_task_counts:
+  idle_db = f"{benchDB}_idle_{n}"
+  idle_synthetic = synthetic_overwatch(idle_db,
+                                       workspaces = synthetic_workspaces,
+                                       days = synthetic_days,
+                                       sparkJobsPerDay = spark_jobs_per_day,
+                                       tasksPerJob = n)
+  idle_counts = idle_synthetic.write_tables(tables = ["pipeline_report", "cluster", "clusterstatefact", "sparkTask"])
+  workspace_catalog.get(idle_db).invalidate()
+  idle_master = master(idle_db, idle_db, idle_synthetic.workspace_names(), str(idle_synthetic.start_date), str(idle_synthetic.end_date),
+                       analysisDB = idle_db)
+  for implementation, build_df in [("interval join", lambda: interval_join_idle_time(idle_master)),
+                                   ("binned range join", lambda: idle_master.cluster_idle_time(**base_kwargs))]:
+    idle_results.append({"spark_tasks": idle_counts["sparkTask"],
+                         "implementation": implementation,
+                         "planning_s": time_planning(build_df),
+                         "runtime_s": time_runtime(build_df)})
+
+idle_results = pd.DataFrame(idle_results)
+display(idle_results)
+
+# COMMAND ----------
+
+fig = px.line(idle_results,
+              x = "spark_tasks",
+              y = "runtime_s",
+              color = "implementation",
+              markers = True,
+              title = "Idle time: interval join vs binned range join",
+              labels = {"runtime_s": "Seconds (median)", "spark_tasks": "Spark tasks"})
+fig.show()
+
+# COMMAND ----------
+
+# MAGIC %md
+# MAGIC ## Top N expensive jobs: Python heap vs row_number window vs expensive_jobs_top_n
+# MAGIC > Daily job costs of 1000, 10000 and 100000 jobs per day over 30 days, top 3 per day for every slice of `master.top_n_slices`:
+# MAGIC > a bounded heap per day and slice in Python (`rdd.reduceByKey`, what `expensive_jobs_top_n` used to do), a `row_number` window over the exploded slices filtered to N, and `master.expensive_jobs_top_n` (one `row_number` per slice over the conditional sums, at most N jobs per day and slice collected).
+
+# COMMAND ----------
+
+import heapq
+
+topn_job_counts = [1000, 10000, 100000]
+topn_days = 30
+
+def top_n_job_costs(jobs):
+  return jobs\
+    .groupBy("job_name", "job_start_date", "workspace_name")\
+    .agg(*[F.sum(F.when(F.expr(condition), F.col("total_dbu_cost"))).alias(cost_column) for cost_column, condition in master.top_n_slices.values()])\
+    .select("job_start_date", "workspace_name", "job_name",
+            F.explode(F.create_map(*[x for name, (cost_column, _) in master.top_n_slices.items() for x in (F.lit(name), F.col(cost_column))])).alias("slice", "cost_in_USD"))\
+    .filter(F.col("cost_in_USD").isNotNull())
+
+def top_n_python_heap(jobs, top_n):
+  ranked = top_n_job_costs(jobs).rdd\
+    .map(lambda row: ((row["slice"], row["job_start_date"]), [(row["cost_in_USD"], row["workspace_name"], row["job_name"])]))\
+    .reduceByKey(lambda left, right: heapq.nlargest(top_n, left + right))\
+    .flatMap(lambda day_jobs: [(*day_jobs[0], workspace, job, cost) for cost, workspace, job in day_jobs[1]])
+  return spark.createDataFrame(ranked, "slice string, job_start_date date, workspace_name string, job_name string, cost_in_USD double")
+
+def top_n_row_number(jobs, top_n):
+  ranking = Window.partitionBy("slice", "job_start_date").orderBy(F.col("cost_in_USD").desc())
+  return top_n_job_costs(jobs).withColumn("rank", F.row_number().over(ranking)).filter(F.col("rank") <= top_n)
+
+topn_results = []
+for n in topn_job_counts:
+  spark.range(n * topn_days)\
+    .select(F.date_sub(F.current_date(), (F.col("id") % topn_days).cast("int")).alias("job_start_date"),
+            F.concat(F.lit("workspace_"), F.col("id") % 10).alias("workspace_name"),
+            F.concat(F.lit("job_"), (F.col("id") / topn_days).cast("long")).alias("job_name"),
+            F.round(F.rand(seed=11) * 100, 2).alias("total_dbu_cost"),
+            F.when(F.rand(seed=12) < 0.1, "Failed").otherwise("Succeeded").alias("terminal_state"),
+            F.when(F.rand(seed=13) < 0.3, "interactive").otherwise("job_cluster").alias("cluster_type"))\
+    .write.mode("overwrite").format("delta").saveAsTable(f"{benchDB}.topn_job_costs")
+  for implementation, build_df in [("python heap", lambda: top_n_python_heap(spark.table(f"{benchDB}.topn_job_costs"), 3)),
+                                   ("row_number window", lambda: top_n_row_number(spark.table(f"{benchDB}.topn_job_costs"), 3)),
+                                   ("expensive_jobs_top_n", lambda: synthetic_master.expensive_jobs_top_n(spark.table(f"{benchDB}.topn_job_costs"), topN = 3))]:
+    topn_results.append({"jobs_per_day": n,
+                         "implementation": implementation,
+                         "planning_s": time_planning(build_df),
+                         "runtime_s": time_runtime(build_df)})
+
+topn_results = pd.DataFrame(topn_results)
+display(topn_results)
+
+# COMMAND ----------
+
+fig = px.line(topn_results,
+              x = "jobs_per_day",
+              y = "runtime_s",
+              color = "implementation",
+              markers = True,
+              log_x = True,
+              title = f"Top 3 expensive jobs per day and slice ({topn_days} days)",
+              labels = {"runtime_s": "Seconds (median)", "jobs_per_day": "Jobs per day"})
+fig.show()
+
+# COMMAND ----------
+
+# MAGIC %md
+# MAGIC ## Startup: overwatch_analysis import and master construction
+# MAGIC > Times a cold `import overwatch_analysis` in a fresh Python process (checking that plotly is not pulled in), the construction of a master object, and the workspace catalog (first load and cached reads) against the distinct `pipeline_report` query the widgets used to run.
+
+# COMMAND ----------
+
+import os
+import subprocess
+import sys
+import overwatch_analysis
+
+package_root = os.path.dirname(os.path.dirname(overwatch_analysis.__file__))
+import_probe = "import sys, time; start = time.perf_counter(); import overwatch_analysis; print(time.perf_counter() - start, 'plotly' in sys.modules)"
+
+def cold_import():
+  out = subprocess.run([sys.executable, "-c", import_probe],
+                       env = {**os.environ, "PYTHONPATH": package_root},
+                       capture_output = True, text = True, check = True).stdout.split()
+  return float(out[0]), out[1] == "True"
+
+import_timings, plotly_loaded = zip(*[cold_import() for _ in range(repetitions)])
+
+synthetic_catalog = workspace_catalog.get(synthetic_db)
+
+def catalog_load():
+  synthetic_catalog.invalidate()
+  synthetic_catalog.workspace_names()
+
+startup_results = pd.DataFrame([
+  {"benchmark": "import overwatch_analysis (cold process)", "seconds": round(median(import_timings), 4), "plotly_imported": any(plotly_loaded)},
+  {"benchmark": "master() construction", "seconds": time_call(lambda: master(synthetic_db, synthetic_db, synthetic.workspace_names(), str(synthetic.start_date), str(synthetic.end_date),
+                                                                            analysisDB = synthetic_db)), "plotly_imported": None},
+  {"benchmark": "workspace catalog: load from pipeline_report", "seconds": time_call(catalog_load), "plotly_imported": None},
+  {"benchmark": "workspace catalog: cached workspace names", "seconds": time_call(synthetic_catalog.workspace_names), "plotly_imported": None},
+  {"benchmark": "distinct workspace_name query (previous widget fill)", "seconds": time_call(lambda: spark.sql(f"select distinct workspace_name from {synthetic_db}.pipeline_report").rdd.flatMap(lambda x: x).collect()), "plotly_imported": None},
+])
+display(startup_results)
+
+# COMMAND ----------
+
+# MAGIC %md
+# MAGIC ## Result cache: first view vs re-view of a dashboard cell
+# MAGIC > Times `master.cached_pandas` on the Workspace daily cost frame with an empty cache (Spark job + Parquet write) and when the same cell is viewed again with unchanged widgets and sources (Parquet read only).
+
+# COMMAND ----------
+
+cache_master = master(synthetic_db, synthetic_db, synthetic.workspace_names(), str(synthetic.start_date), str(synthetic.end_date),
+                      analysisDB = synthetic_db, resultCacheDir = os.path.join(result_cache.default_dir, "benchmark"))
+cache_master.snapshot("cluster_master")
+daily_cost = lambda: cache_master.cached_pandas("benchmark.daily_cost", frame_benchmarks["Workspace: daily cost by workspace"], ["cluster_master"])
+
+def first_view():
+  cache_master.result_cache.clear()
+  daily_cost()
+
+result_cache_results = pd.DataFrame([
+  {"benchmark": "first view (toPandas + cache write)", "seconds": time_call(first_view)},
+  {"benchmark": "re-view (cache hit)", "seconds": time_call(daily_cost)},
+])
+display(result_cache_results)
+
+# COMMAND ----------
+
+# MAGIC %md
+# MAGIC ## Weekend filter: per row dayofweek vs calendar date predicate
+# MAGIC > Weekday only and weekend only selections on a date partitioned table, filtered on a per row `dayofweek` column (previous `read_source`) or with `helpers.filter_calendar_days` (date list from the calendar dimension, pruned at the scan) and `is_weekend` from the broadcast calendar.
+
+# COMMAND ----------
+
+calendar_days = 365
+calendar_rows_per_day = 200000
+calendar_start = date.today() - timedelta(days=calendar_days - 1)
+spark.range(calendar_days * calendar_rows_per_day)\
+  .select(F.date_add(F.lit(str(calendar_start)).cast("date"), (F.col("id") % calendar_days).cast("int")).alias("date"),
+          (F.rand(seed=42) * 100).alias("runtime_s"))\
+  .write.mode("overwrite").format("delta").partitionBy("date").saveAsTable(f"{benchDB}.calendar_facts")
+
+calendar_bench = helpers(f"{benchDB}_wsfilter_{workspace_counts[0]}", benchDB)
+calendar_results = []
+for selection, include_weekend, only_weekend in [("weekdays only", "No", "No"), ("weekends only", "Yes", "Yes")]:
+  for implementation in ["dayofweek column", "calendar dimension"]:
+    def build_df():
+      df = spark.table(f"{benchDB}.calendar_facts")\
+        .transform(calendar_bench.filter_dates("date", calendar_start, date.today()))
+      if implementation == "dayofweek column":
+        df = df\
+          .withColumn("is_weekend", F.dayofweek("date").isin([1,7]).cast("int"))\
+          .transform(calendar_bench.filter_by_weekdays(include_weekend, only_weekend))
+      else:
+        df = df\
+          .transform(calendar_bench.filter_calendar_days("date", calendar_start, date.today(), include_weekend, only_weekend))\
+          .transform(calendar_bench.with_calendar("date", calendar_start, date.today()))
+      return df.groupBy("is_weekend").agg(F.sum("runtime_s").alias("runtime_s"))
+    calendar_results.append({"selection": selection,
+                             "implementation": implementation,
+                             "planning_s": time_planning(build_df),
+                             "runtime_s": time_runtime(build_df)})
+
+calendar_results = pd.DataFrame(calendar_results)
+display(calendar_results)
@@ -14,7 +14,7 @@
 # MAGIC | 3 | Workspace Name | List of workspace (overwatch deployed) name | all
 # MAGIC | 4 | Start Date | Start date for analysis | Current Date
 # MAGIC | 5 | End Date | End date for analysis | 30 days from current
-# MAGIC | 6 | Cluster tags | To filter by cluster tag names | None
+# MAGIC | 6 | Cluster tags | Custom tags of the clusters, comma separated key=value or key (all of them must match) | all
 # MAGIC | 7 | Include weekends | To record all days, include weekends | Yes |
 # MAGIC | 8 | Only weekends | To record only weekends | No |
 
@@ -54,6 +54,12 @@ consumerDB = str(dbutils.widgets.get("consumerDB"))
 
 # COMMAND ----------
 
+from pyspark.sql.functions import *
+from pyspark.sql.window import Window
+from datetime import date, timedelta
+
+# COMMAND ----------
+
 dbutils.widgets.text("tags", "all", "6. Cluster tags")
 dbutils.widgets.dropdown("include_weekends", "Yes", ["Yes", "No"], "7. Include weekends")
 dbutils.widgets.dropdown("only_weekends", "No", ["Yes", "No"], "8. Only weekends")
@@ -61,9 +67,9 @@ cluster_tags = str(dbutils.widgets.get("tags"))
 include_weekends = dbutils.widgets.get("include_weekends")
 only_weekends = dbutils.widgets.get("only_weekends")
 
-fetch_Name = spark.sql(f"select distinct workspace_name from {etlDB}.pipeline_report").rdd.flatMap(lambda x: x).collect()+["all"]
+fetch_Name = workspace_catalog.get(etlDB).workspace_names()+["all"]
 dbutils.widgets.multiselect("workspace_name","all",fetch_Name, "3. Workspace Name")
-workspaceName =  spark.sql(f"select distinct workspace_name from {etlDB}.pipeline_report").rdd.flatMap(lambda x: x).collect() if 'all' in dbutils.widgets.get("workspace_name").split(',') else dbutils.widgets.get("workspace_name").split(',')
+workspaceName =  workspace_catalog.get(etlDB).workspace_names() if 'all' in dbutils.widgets.get("workspace_name").split(',') else dbutils.widgets.get("workspace_name").split(',')
 dbutils.widgets.combobox("4. Start Date", f"{date.today() - timedelta(days=30)}", "")
 dbutils.widgets.combobox("5. End Date", f"{date.today()}", "")
 start_date = str(dbutils.widgets.get("4. Start Date"))
@@ -76,9 +82,26 @@ end_date = str(dbutils.widgets.get("5. End Date"))
 
 # COMMAND ----------
 
-masters = master(etlDB,consumerDB,workspaceName,start_date,end_date)
+masters = master(etlDB,consumerDB,workspaceName,start_date,end_date, includeWeekend = include_weekends, onlyWeekend = only_weekends)
+
+# Master frames are built on first use inside a cell missing the result cache, a dashboard read from the cache refreshes no snapshot
+# Clusters carrying the selected tags (tag index lookup), None keeps every cluster
+tag_clusters = masters.lazy_frame(lambda: masters.tag_clusters(cluster_tags, includeWeekend = include_weekends, onlyWeekend = only_weekends))
 
-clsf_master = masters.cluster_master_filter(includeWeekend = include_weekends,onlyWeekend = only_weekends)
+clsf_master = masters.lazy_frame(lambda: masters.snapshot("cluster_master", includeWeekend = include_weekends,onlyWeekend = only_weekends, clusterTable = tag_clusters()))
+# Cluster costs already spread over the days of each state, one row per date and cluster
+daily_cost = masters.lazy_frame(lambda: masters.snapshot("cluster_daily_cost", includeWeekend = include_weekends,onlyWeekend = only_weekends, clusterTable = tag_clusters()))
+# Starts, resizes, restarts and failures of every cluster, ordered once per cluster
+transitions = masters.lazy_frame(lambda: masters.snapshot("cluster_transitions", includeWeekend = include_weekends,onlyWeekend = only_weekends, clusterTable = tag_clusters()))
+# Tables the charted frames are read from, their versions are part of the result cache key
+cache_sources = ["cluster_master", "cluster_daily_cost", "cluster_transitions"]
+# Widget values the charted frames depend on, part of the result cache key with the workspaces and dates
+cache_params = {"tags": cluster_tags, "includeWeekend": include_weekends, "onlyWeekend": only_weekends}
+
+# COMMAND ----------
+
+# Scan summary of every consumer table read above (read schema, partition / pushed filters, files read)
+# display(masters.scan_summary(execute=True))
 
 # COMMAND ----------
 
@@ -89,34 +112,57 @@ clsf_master = masters.cluster_master_filter(includeWeekend = include_weekends,on
 
 # COMMAND ----------
 
-df = clsf_master\
+df = masters.cached_pandas("cluster.categories", lambda: clsf_master()\
 .select("cluster_category")\
-.distinct()
+.distinct(), cache_sources, **cache_params)
 
 display(df)
 
 # COMMAND ----------
 
-dbu_spend = clsf_master\
-.groupBy("cluster_category",
-         "state_start_date",
-         "workspace_name")\
-.agg(round(sum(col("total_DBU_cost")),2).alias("total_DBU_cost(USD)"))\
-.toPandas()
+# Box statistics of the daily spend per category and workspace, one row per box instead of one point per day
+dbu_spend = masters.cached_pandas("cluster.dbu_spend", lambda: masters.box_stats(
+  masters.cost_cube(groupBy=["cluster_category", "state_start_date", "workspace_name"], clusterTable = tag_clusters())\
+  .select("cluster_category",
+          "state_start_date",
+          "workspace_name",
+          round(col("total_DBU_cost"),2).alias("total_DBU_cost(USD)")),
+  "total_DBU_cost(USD)", ["cluster_category", "workspace_name"]), cache_sources, **cache_params)
 
 display(dbu_spend)
 
 # COMMAND ----------
 
 
-fig = px.box(dbu_spend, 
-             x = "cluster_category", 
-             y = "total_DBU_cost(USD)",
-             title = "DBU Spend by cluster category",
-             hover_data = ["state_start_date"],
-             points = "all", 
-             color = "workspace_name")
-##fig.update_traces(quartilemethod="exclusive")
+fig = box_figure(dbu_spend, "cluster_category", "total_DBU_cost(USD)", "DBU Spend by cluster category", color = "workspace_name")
+fig.show()
+
+# COMMAND ----------
+
+# DBU spend per workspace against the previous period of the same length, both periods read and aggregated together
+previous_start, previous_end = masters.previous_period()
+spend_comparison = masters.cached_pandas("cluster.spend_comparison", lambda: masters.period_comparison("cluster_daily_cost",
+                                                                                                    {"dbu_cost": "total_dbu_cost", "total_cost": "total_cost"},
+                                                                                                    ["workspace_name"],
+                                                                                                    includeWeekend = include_weekends,
+                                                                                                    onlyWeekend = only_weekends,
+                                                                                                    clusterTable = tag_clusters())\
+.orderBy(col("dbu_cost_current").desc()), cache_sources, **cache_params)
+
+display(spend_comparison)
+
+# COMMAND ----------
+
+fig = px.bar(spend_comparison.melt(id_vars = ["workspace_name", "dbu_cost_delta_pct"],
+                                   value_vars = ["dbu_cost_previous", "dbu_cost_current"],
+                                   var_name = "period",
+                                   value_name = "DBU Cost (USD)"),
+             x = "workspace_name",
+             y = "DBU Cost (USD)",
+             color = "period",
+             barmode = "group",
+             hover_data = ["dbu_cost_delta_pct"],
+             title = f"DBU spend by workspace, {start_date} to {end_date} against {previous_start} to {previous_end}")
 fig.show()
 
 # COMMAND ----------
@@ -125,24 +171,24 @@ from pyspark.sql import SparkSession, Row
 from pyspark.sql.window import Window
 from pyspark.sql.functions import col, row_number
 
-daily_cluster_cost = clsf_master\
-.withColumn("date", explode("state_dates"))\
-.groupBy("date", "organization_id", "workspace_name", "days_in_state", "cluster_id", "cluster_name")\
-.agg(round((sum(col("total_DBU_cost"))/col("days_in_state")),2).alias("total_DBU_cost_(USD)"),
-    round((sum(col("total_compute_cost"))/col("days_in_state")),2).alias("total_compute_cost_(USD)"),
-    round((sum(col("total_cost"))/col("days_in_state")),2).alias("total_cost_(USD)"),
-    )\
-.orderBy(col("total_DBU_cost_(USD)").desc())\
-.distinct()
+def build_daily_cluster_cost():
+  daily_cluster_cost = daily_cost()\
+  .groupBy("date", "organization_id", "workspace_name", "cluster_id", "cluster_name")\
+  .agg(round(sum(col("total_dbu_cost")),2).alias("total_DBU_cost_(USD)"),
+      round(sum(col("total_compute_cost")),2).alias("total_compute_cost_(USD)"),
+      round(sum(col("total_cost")),2).alias("total_cost_(USD)"),
+      )\
+  .orderBy(col("total_DBU_cost_(USD)").desc())\
+  .distinct()
 
+  windowdf = Window.partitionBy(daily_cluster_cost["date"]).orderBy(daily_cluster_cost["total_DBU_cost_(USD)"].desc())
 
-windowdf = Window.partitionBy(daily_cluster_cost["date"]).orderBy(daily_cluster_cost["total_DBU_cost_(USD)"].desc())
+  return daily_cluster_cost\
+  .withColumn("row", row_number().over(windowdf))\
+  .filter(col("row") == 1 )\
+  .distinct()
 
-daily_cluster_cost = daily_cluster_cost\
-.withColumn("row", row_number().over(windowdf))\
-.filter(col("row") == 1 )\
-.distinct()\
-.toPandas()
+daily_cluster_cost = masters.cached_pandas("cluster.daily_cluster_cost", build_daily_cluster_cost, cache_sources, **cache_params)
 
 display(daily_cluster_cost)
 
@@ -169,35 +215,33 @@ from pyspark.sql import SparkSession, Row
 from pyspark.sql.window import Window
 from pyspark.sql.functions import col, row_number
 
-daily_cluster_spent = clsf_master\
-.withColumn("date", explode("state_dates"))\
-.groupBy("date",
-         "days_in_state",
-         "cluster_id",
-         "cluster_name",
-         "organization_id", 
-         "workspace_name")\
-.agg(round((sum(col("total_DBU_cost"))/col("days_in_state")),2).alias("total_DBU_cost_(USD)"),
-    round((sum(col("total_compute_cost"))/col("days_in_state")),2).alias("total_compute_cost_(USD)"),
-    round((sum(col("total_cost"))/col("days_in_state")),2).alias("total_cost_(USD)"))\
-.orderBy(col("date").asc())\
-.distinct()
-
-windowdf = Window.partitionBy(daily_cluster_spent["date"]).orderBy(daily_cluster_spent["total_DBU_cost_(USD)"].desc())
-
-daily_cluster_spent = daily_cluster_spent\
-.withColumn("row", row_number().over(windowdf))\
-.filter(col("row") <= 20)
-
-daily_cluster_spent_grouped = daily_cluster_spent\
-.groupBy("date",
-         "organization_id",
-         "workspace_name"
-        )\
-.agg(round(sum("total_DBU_cost_(USD)"),2).alias("Total_DBU_cost_(USD)"))\
-.orderBy(col("date").desc())\
-.distinct()\
-.toPandas()
+def build_daily_cluster_spent_grouped():
+  daily_cluster_spent = daily_cost()\
+  .groupBy("date",
+           "cluster_id",
+           "cluster_name",
+           "organization_id", 
+           "workspace_name")\
+  .agg(round(sum(col("total_dbu_cost")),2).alias("total_DBU_cost_(USD)"),
+      round(sum(col("total_compute_cost")),2).alias("total_compute_cost_(USD)"),
+      round(sum(col("total_cost")),2).alias("total_cost_(USD)"))\
+  .orderBy(col("date").asc())\
+  .distinct()
+
+  windowdf = Window.partitionBy(daily_cluster_spent["date"]).orderBy(daily_cluster_spent["total_DBU_cost_(USD)"].desc())
+
+  return daily_cluster_spent\
+  .withColumn("row", row_number().over(windowdf))\
+  .filter(col("row") <= 20)\
+  .groupBy("date",
+           "organization_id",
+           "workspace_name"
+          )\
+  .agg(round(sum("total_DBU_cost_(USD)"),2).alias("Total_DBU_cost_(USD)"))\
+  .orderBy(col("date").desc())\
+  .distinct()
+
+daily_cluster_spent_grouped = masters.cached_pandas("cluster.daily_cluster_spent_grouped", build_daily_cluster_spent_grouped, cache_sources, **cache_params)
 
 
 display(daily_cluster_spent_grouped)
@@ -218,34 +262,32 @@ fig.show()
 
 # COMMAND ----------
 
-dbu_spend_without_autotermination = clsf_master\
-.filter(((col("auto_termination_minutes") == 0) | (col("auto_termination_minutes").isNull())) 
-        & (col("cluster_category") == "Interactive")
-        
-       )\
-.fillna(0, subset=["core_hours"])\
-.withColumn("date", explode("state_dates"))\
-.groupBy("date", "organization_id", "workspace_name", "days_in_state", "cluster_id", "cluster_name")\
-.agg(round((sum(col("total_DBU_cost"))/col("days_in_state")),2).alias("DBU_cost_(USD)"),
-     round((sum(col("total_compute_cost"))/col("days_in_state")),2).alias("Compute_cost_(USD)"),
-     round((sum(col("total_cost"))/col("days_in_state")),2).alias("total_cost_(USD)"),
-     round((sum(col("core_hours"))/col("days_in_state")),2).alias("core_hours"))\
-.orderBy(col("DBU_cost_(USD)").desc())\
-.distinct()
+def build_dbu_spend_without_autotermination():
+  dbu_spend_without_autotermination = daily_cost()\
+  .filter(((col("auto_termination_minutes") == 0) | (col("auto_termination_minutes").isNull())) 
+          & (col("cluster_category") == "Interactive")
+          
+         )\
+  .groupBy("date", "organization_id", "workspace_name", "cluster_id", "cluster_name")\
+  .agg(round(sum(col("total_dbu_cost")),2).alias("DBU_cost_(USD)"),
+       round(sum(col("total_compute_cost")),2).alias("Compute_cost_(USD)"),
+       round(sum(col("total_cost")),2).alias("total_cost_(USD)"),
+       round(sum(col("core_hours")),2).alias("core_hours"))\
+  .orderBy(col("DBU_cost_(USD)").desc())\
+  .distinct()
 
-Windowdf = Window.partitionBy(dbu_spend_without_autotermination["date"]).orderBy(dbu_spend_without_autotermination["DBU_cost_(USD)"].desc())
+  Windowdf = Window.partitionBy(dbu_spend_without_autotermination["date"]).orderBy(dbu_spend_without_autotermination["DBU_cost_(USD)"].desc())
 
-dbu_spend_without_autotermination = dbu_spend_without_autotermination\
-.withColumn("row", row_number().over(Windowdf))\
-.filter(col("row") <= 3 )
+  return dbu_spend_without_autotermination\
+  .withColumn("row", row_number().over(Windowdf))\
+  .filter(col("row") <= 3 )\
+  .withColumn("rank", when(col("row") == 1, "Most expensive")\
+              .when(col("row") == 2, "second expensive")\
+              .when(col("row") == 3, "third expensive")\
+             )\
+  .distinct()
 
-dbu_spend_without_autotermination = dbu_spend_without_autotermination\
-.withColumn("rank", when(col("row") == 1, "Most expensive")\
-            .when(col("row") == 2, "second expensive")\
-            .when(col("row") == 3, "third expensive")\
-           )\
-.distinct()\
-.toPandas()
+dbu_spend_without_autotermination = masters.cached_pandas("cluster.dbu_spend_without_autotermination", build_dbu_spend_without_autotermination, cache_sources, **cache_params)
 
 
 
@@ -273,6 +315,36 @@ fig.show()
 
 # COMMAND ----------
 
+idle_clusters = masters.cached_pandas("cluster.idle_clusters", lambda: masters.cluster_idle_time(includeWeekend = include_weekends, onlyWeekend = only_weekends, clusterTable = tag_clusters())\
+.where(col("cluster_category") == "Interactive")\
+.groupBy("organization_id", "workspace_name", "cluster_id", "cluster_name", "auto_termination_minutes")\
+.agg(round(sum("uptime_h"), 2).alias("uptime_h"),
+     round(sum("idle_h"), 2).alias("idle_h"),
+     round(sum("idle_DBU_cost"), 2).alias("idle_DBU_cost_(USD)"),
+     round(sum("idle_cost"), 2).alias("idle_cost_(USD)"))\
+.withColumn("idle_pct", round(col("idle_h") * 100 / col("uptime_h"), 2))\
+.orderBy(col("idle_DBU_cost_(USD)").desc())\
+.limit(20), ["clusterstatefact", "cluster", "sparkTask"], **cache_params)
+
+display(idle_clusters)
+
+# COMMAND ----------
+
+fig = px.bar(idle_clusters,
+             x = "cluster_name",
+             y = "idle_DBU_cost_(USD)",
+             color = "workspace_name",
+             hover_data = ["organization_id", "cluster_id", "auto_termination_minutes", "uptime_h", "idle_h", "idle_pct", "idle_cost_(USD)"],
+             title = "DBU Spent by interactive clusters while no Spark task was running (top 20)")
+
+fig = fig.update_layout(
+    xaxis_title = "Cluster",
+    yaxis_title = "Idle DBU cost (USD)")
+
+fig.show()
+
+# COMMAND ----------
+
 # import plotly.graph_objects as go
 # from plotly.subplots import make_subplots
 
@@ -330,13 +402,11 @@ fig.show()
 
 # COMMAND ----------
 
-cluster_count_SN = clsf_master\
-.groupBy("organization_id", "workspace_name", "cluster_category")\
-.agg(countDistinct("cluster_id").alias("Number_of_clusters"),
-    round(sum(col("total_DBU_cost")),2).alias("Total_DBU_Cost_(USD)")
-    )\
-.filter(clsf_master["cluster_category"] == "Single Node")\
-.toPandas()
+cluster_count_SN = masters.cached_pandas("cluster.cluster_count_SN", lambda: masters.cost_cube(groupBy=["organization_id", "workspace_name", "cluster_category"],
+                                     filters={"cluster_category": "Single Node"}, clusterTable = tag_clusters())\
+.select("organization_id", "workspace_name", "cluster_category",
+        col("cluster_count").alias("Number_of_clusters"),
+        round(col("total_DBU_cost"),2).alias("Total_DBU_Cost_(USD)")), cache_sources, **cache_params)
 
 
 display(cluster_count_SN)
@@ -355,13 +425,11 @@ fig.show()
 
 # COMMAND ----------
 
-cluster_count_Interactive = clsf_master\
-.groupBy("organization_id", "workspace_name", "cluster_category")\
-.agg(countDistinct("cluster_id").alias("Number_of_clusters"),
-    round(sum(col("total_DBU_cost")),2).alias("Total_DBU_Cost_(USD)")
-    )\
-.filter(clsf_master["cluster_category"] == "Interactive")\
-.toPandas()
+cluster_count_Interactive = masters.cached_pandas("cluster.cluster_count_Interactive", lambda: masters.cost_cube(groupBy=["organization_id", "workspace_name", "cluster_category"],
+                                              filters={"cluster_category": "Interactive"}, clusterTable = tag_clusters())\
+.select("organization_id", "workspace_name", "cluster_category",
+        col("cluster_count").alias("Number_of_clusters"),
+        round(col("total_DBU_cost"),2).alias("Total_DBU_Cost_(USD)")), cache_sources, **cache_params)
 
 
 fig = px.pie(cluster_count_Interactive,             
@@ -376,13 +444,11 @@ fig.show()
 
 # COMMAND ----------
 
-cluster_count_Automated = clsf_master\
-.groupBy("organization_id", "workspace_name", "cluster_category")\
-.agg(countDistinct("cluster_id").alias("Number_of_clusters"),
-    round(sum(col("total_DBU_cost")),2).alias("Total_DBU_Cost_(USD)")
-    )\
-.filter(clsf_master["cluster_category"] == "Automated")\
-.toPandas()
+cluster_count_Automated = masters.cached_pandas("cluster.cluster_count_Automated", lambda: masters.cost_cube(groupBy=["organization_id", "workspace_name", "cluster_category"],
+                                            filters={"cluster_category": "Automated"}, clusterTable = tag_clusters())\
+.select("organization_id", "workspace_name", "cluster_category",
+        col("cluster_count").alias("Number_of_clusters"),
+        round(col("total_DBU_cost"),2).alias("Total_DBU_Cost_(USD)")), cache_sources, **cache_params)
 
 
 fig = px.pie(cluster_count_Automated,             
@@ -397,13 +463,11 @@ fig.show()
 
 # COMMAND ----------
 
-cluster_count_Warehouse = clsf_master\
-.groupBy("organization_id", "workspace_name", "cluster_category")\
-.agg(countDistinct("cluster_id").alias("Number_of_clusters"),
-    round(sum(col("total_DBU_cost")),2).alias("Total_DBU_Cost_(USD)")
-    )\
-.filter(clsf_master["cluster_category"] == "Warehouse")\
-.toPandas()
+cluster_count_Warehouse = masters.cached_pandas("cluster.cluster_count_Warehouse", lambda: masters.cost_cube(groupBy=["organization_id", "workspace_name", "cluster_category"],
+                                            filters={"cluster_category": "Warehouse"}, clusterTable = tag_clusters())\
+.select("organization_id", "workspace_name", "cluster_category",
+        col("cluster_count").alias("Number_of_clusters"),
+        round(col("total_DBU_cost"),2).alias("Total_DBU_Cost_(USD)")), cache_sources, **cache_params)
 
 
 fig = px.pie(cluster_count_Warehouse,             
@@ -418,13 +482,11 @@ fig.show()
 
 # COMMAND ----------
 
-cluster_count_HC = clsf_master\
-.groupBy("organization_id", "workspace_name", "cluster_category")\
-.agg(countDistinct("cluster_id").alias("Number_of_clusters"),
-    round(sum(col("total_DBU_cost")),2).alias("Total_DBU_Cost_(USD)")
-    )\
-.filter(clsf_master["cluster_category"] == "High-Concurrency")\
-.toPandas()
+cluster_count_HC = masters.cached_pandas("cluster.cluster_count_HC", lambda: masters.cost_cube(groupBy=["organization_id", "workspace_name", "cluster_category"],
+                                     filters={"cluster_category": "High-Concurrency"}, clusterTable = tag_clusters())\
+.select("organization_id", "workspace_name", "cluster_category",
+        col("cluster_count").alias("Number_of_clusters"),
+        round(col("total_DBU_cost"),2).alias("Total_DBU_Cost_(USD)")), cache_sources, **cache_params)
 
 
 fig = px.pie(cluster_count_HC,             
@@ -439,13 +501,11 @@ fig.show()
 
 # COMMAND ----------
 
-cluster_count_ST = clsf_master\
-.groupBy("organization_id", "workspace_name", "cluster_category")\
-.agg(countDistinct("cluster_id").alias("Number_of_clusters"),
-    round(sum(col("total_DBU_cost")),2).alias("Total_DBU_Cost_(USD)")
-    )\
-.filter(clsf_master["cluster_category"] == "Standard")\
-.toPandas()
+cluster_count_ST = masters.cached_pandas("cluster.cluster_count_ST", lambda: masters.cost_cube(groupBy=["organization_id", "workspace_name", "cluster_category"],
+                                     filters={"cluster_category": "Standard"}, clusterTable = tag_clusters())\
+.select("organization_id", "workspace_name", "cluster_category",
+        col("cluster_count").alias("Number_of_clusters"),
+        round(col("total_DBU_cost"),2).alias("Total_DBU_Cost_(USD)")), cache_sources, **cache_params)
 
 
 fig = px.pie(cluster_count_ST,             
@@ -461,11 +521,9 @@ fig.show()
 # COMMAND ----------
 
 from pyspark.sql.functions import *
-node_type_count_percent = clsf_master\
-.groupBy("organization_id","workspace_name","node_type_id")\
-.agg(countDistinct(col("cluster_id")).alias("cluster_count"))\
-.orderBy(col("cluster_count").desc())\
-.toPandas()
+node_type_count_percent = masters.cached_pandas("cluster.node_type_count_percent", lambda: masters.cost_cube(groupBy=["organization_id","workspace_name","node_type_id"], clusterTable = tag_clusters())\
+.select("organization_id","workspace_name","node_type_id","cluster_count")\
+.orderBy(col("cluster_count").desc()), cache_sources, **cache_params)
 
 node_type_count_percent.loc[((node_type_count_percent['cluster_count'] / node_type_count_percent['cluster_count'].sum())* 100) < 2 ,'node_type_id'] = 'Other Types'
 
@@ -486,14 +544,12 @@ fig.show()
 # COMMAND ----------
 
 from pyspark.sql.functions import *
-node_type_potential = clsf_master\
+node_type_potential = masters.cached_pandas("cluster.node_type_potential", lambda: masters.cost_cube(groupBy=["organization_id", "workspace_name", "node_type_id"], clusterTable = tag_clusters())\
 .filter(col("worker_potential_core_H").isNotNull())\
-.groupBy("organization_id", "workspace_name", "node_type_id")\
-.agg(round(sum(col("worker_potential_core_H")),2).alias("Total_node_potential_hours"),
-     round(sum(col("total_worker_cost")),2).alias("Total_worker_cost(USD)")
-    )\
-.orderBy(col("Total_node_potential_hours").desc())\
-.toPandas()
+.select("organization_id", "workspace_name", "node_type_id",
+        round(col("worker_potential_core_H"),2).alias("Total_node_potential_hours"),
+        round(col("potential_worker_cost"),2).alias("Total_worker_cost(USD)"))\
+.orderBy(col("Total_node_potential_hours").desc()), cache_sources, **cache_params)
 
 display(node_type_potential)
 
@@ -517,14 +573,12 @@ fig.show()
 
 # COMMAND ----------
 
-node_type_potential_by_category = clsf_master\
+node_type_potential_by_category = masters.cached_pandas("cluster.node_type_potential_by_category", lambda: masters.cost_cube(groupBy=["organization_id", "workspace_name", "cluster_category"], clusterTable = tag_clusters())\
 .filter(col("worker_potential_core_H").isNotNull())\
-.groupBy("organization_id", "workspace_name", "cluster_category")\
-.agg(round(sum(col("worker_potential_core_H")),2).alias("Total_node_potential_hours"),
-     round(sum(col("total_worker_cost")),2).alias("Total_worker_cost(USD)")
-    )\
-.orderBy(col("Total_node_potential_hours").desc())\
-.toPandas()
+.select("organization_id", "workspace_name", "cluster_category",
+        round(col("worker_potential_core_H"),2).alias("Total_node_potential_hours"),
+        round(col("potential_worker_cost"),2).alias("Total_worker_cost(USD)"))\
+.orderBy(col("Total_node_potential_hours").desc()), cache_sources, **cache_params)
 
 display(node_type_potential_by_category)
 
@@ -546,32 +600,37 @@ from pyspark.sql import SparkSession, Row
 from pyspark.sql.window import Window
 from pyspark.sql.functions import col, row_number
 
-cluster_cost_per_category = (
-    clsf_master.groupBy("state_start_date", "workspace_name", "cluster_category")
-    .agg(
-        round(sum(col("total_DBU_cost")), 2).alias("total_DBU_cost(USD)"),
-        round(sum(col("total_compute_cost")), 2).alias("Total_compute_cost(USD)"),
-        round(sum(col("total_cost")), 2).alias("Total_cost(USD)"),
+def build_cluster_cost_per_category():
+    cluster_cost_per_category = (
+        masters.cost_cube(groupBy=["state_start_date", "workspace_name", "cluster_category"], clusterTable = tag_clusters())
+        .select(
+            "state_start_date",
+            "workspace_name",
+            "cluster_category",
+            round(col("total_DBU_cost"), 2).alias("total_DBU_cost(USD)"),
+            round(col("total_compute_cost"), 2).alias("Total_compute_cost(USD)"),
+            round(col("total_cost"), 2).alias("Total_cost(USD)"),
+        )
+        .orderBy(col("Total_cost(USD)").desc())
     )
-    .orderBy(round(sum(col("total_cost")), 2).desc())
-)
 
-windowDept = Window.partitionBy(cluster_cost_per_category["cluster_category"]).orderBy(
-    cluster_cost_per_category["Total_cost(USD)"].desc()
-)
+    windowDept = Window.partitionBy(cluster_cost_per_category["cluster_category"]).orderBy(
+        cluster_cost_per_category["Total_cost(USD)"].desc()
+    )
 
-cluster_cost_per_category = (
-    cluster_cost_per_category.withColumn("row", row_number().over(windowDept))
-    .filter(
-        (col("row") <= 20)
-        & (
-            (cluster_cost_per_category["cluster_category"] == ("Interactive"))
-            | (cluster_cost_per_category["cluster_category"] == ("Automated"))
-            | (cluster_cost_per_category["cluster_category"] == ("High-Concurrency"))
+    return (
+        cluster_cost_per_category.withColumn("row", row_number().over(windowDept))
+        .filter(
+            (col("row") <= 20)
+            & (
+                (cluster_cost_per_category["cluster_category"] == ("Interactive"))
+                | (cluster_cost_per_category["cluster_category"] == ("Automated"))
+                | (cluster_cost_per_category["cluster_category"] == ("High-Concurrency"))
+            )
         )
     )
-    .toPandas()
-)
+
+cluster_cost_per_category = masters.cached_pandas("cluster.cluster_cost_per_category", build_cluster_cost_per_category, cache_sources, **cache_params)
 
 display(cluster_cost_per_category)
 
@@ -601,13 +660,12 @@ fig.show()
 
 # COMMAND ----------
 
-autoscaling_cluster = clsf_master\
-.filter(col("autoscale").isNotNull())\
-.groupBy("organization_id", "workspace_name", "cluster_category")\
-.agg(countDistinct(col("cluster_id")).alias("cluster_count"),
-    round(sum(col("total_DBU_cost")),2).alias("total_DBU_cost(USD)"))\
-.orderBy(col("cluster_count").desc())\
-.toPandas()
+autoscaling_cluster = masters.cached_pandas("cluster.autoscaling_cluster", lambda: masters.cost_cube(groupBy=["organization_id", "workspace_name", "cluster_category"],
+                                        filters={"is_autoscaling": True}, clusterTable = tag_clusters())\
+.select("organization_id", "workspace_name", "cluster_category",
+        "cluster_count",
+        round(col("total_DBU_cost"),2).alias("total_DBU_cost(USD)"))\
+.orderBy(col("cluster_count").desc()), cache_sources, **cache_params)
 
 display(autoscaling_cluster)
 
@@ -624,48 +682,31 @@ fig.show()
 
 # COMMAND ----------
 
-scaleup_time_withoutPools = clsf_master\
-.filter(
-      (col("autoscale").isNotNull())
-       & (col("state") == "RESIZING") 
-       & (col("current_num_workers") < col("target_num_workers"))
-       & (col("instance_pool_id").isNull())
-      
-      )\
-.groupBy("state_start_date", "organization_id", "workspace_name", "cluster_category")\
-.agg(round(avg("uptime_in_state_H"), 2).alias("average_scale_up_time(Hours)"))\
-.orderBy(col("average_scale_up_time(Hours)").desc())\
-.distinct()\
-.toPandas()
+# Box statistics of the daily scale up time per category and workspace
+scaleup_time_withoutPools = masters.cached_pandas("cluster.scaleup_time_withoutPools", lambda: masters.box_stats(
+  transitions()\
+  .filter(col("is_autoscaling") & (col("scale_direction") == "up") & ~col("uses_pool"))\
+  .groupBy("state_start_date", "organization_id", "workspace_name", "cluster_category")\
+  .agg(round(avg("duration_h"), 2).alias("average_scale_up_time(Hours)")),
+  "average_scale_up_time(Hours)", ["cluster_category", "workspace_name"]), cache_sources, **cache_params)
 
 display(scaleup_time_withoutPools)
 # clusters with pools are not getting resized.
 
 # COMMAND ----------
 
-fig = px.box(scaleup_time_withoutPools, 
-             x = "cluster_category", 
-             y = "average_scale_up_time(Hours)",
-             title = "Scale up time of clusters (Without pools) by cluster category", 
-             points = "all", 
-             color = "workspace_name")
-##fig.update_traces(quartilemethod="exclusive")
+fig = box_figure(scaleup_time_withoutPools, "cluster_category", "average_scale_up_time(Hours)",
+                 "Scale up time of clusters (Without pools) by cluster category", color = "workspace_name")
 
 fig.show()
 
 # COMMAND ----------
 
-scaleup_time_withPools = clsf_master\
-.filter(
-      (col("autoscale").isNotNull())
-       & (col("state") == "RESIZING") 
-       & (col("current_num_workers") < col("target_num_workers"))
-       & (col("instance_pool_id").isNotNull())
-      )\
+scaleup_time_withPools = masters.cached_pandas("cluster.scaleup_time_withPools", lambda: transitions()\
+.filter(col("is_autoscaling") & (col("scale_direction") == "up") & col("uses_pool"))\
 .groupBy("state_start_date", "organization_id", "workspace_name", "cluster_category")\
-.agg(round(avg("uptime_in_state_H"), 2).alias("average_scale_up_time(Hours)"))\
-.orderBy(col("average_scale_up_time(Hours)").desc())\
-# .toPandas()
+.agg(round(avg("duration_h"), 2).alias("average_scale_up_time(Hours)"))\
+.orderBy(col("average_scale_up_time(Hours)").desc()), cache_sources, **cache_params)
 
 display(scaleup_time_withPools)
 
@@ -683,27 +724,25 @@ display(scaleup_time_withPools)
 
 # COMMAND ----------
 
-cost_of_autoscaling_clusters_per_category = clsf_master\
-.filter(col("autoscale").isNotNull())\
-.groupBy("state_start_date","workspace_name","cluster_category")\
-.agg(
-     round(sum(col("total_DBU_cost")),2).alias("total_DBU_cost(USD)"),
-     round(sum(col("total_compute_cost")),2).alias("Total_compute_cost(USD)"),
-     round(sum(col("total_cost")),2).alias("Total_cost(USD)")
-    )\
-.orderBy((col("Total_cost(USD)")).desc())
+def build_cost_of_autoscaling_clusters_per_category():
+  cost_of_autoscaling_clusters_per_category = masters.cost_cube(groupBy=["state_start_date","workspace_name","cluster_category"],
+                                                                filters={"is_autoscaling": True}, clusterTable = tag_clusters())\
+  .select("state_start_date","workspace_name","cluster_category",
+          round(col("total_DBU_cost"),2).alias("total_DBU_cost(USD)"),
+          round(col("total_compute_cost"),2).alias("Total_compute_cost(USD)"),
+          round(col("total_cost"),2).alias("Total_cost(USD)"))\
+  .orderBy((col("Total_cost(USD)")).desc())
 
-windowDept = Window.partitionBy(cost_of_autoscaling_clusters_per_category["cluster_category"]).orderBy(
-    cost_of_autoscaling_clusters_per_category["Total_cost(USD)"].desc()
-)
+  windowDept = Window.partitionBy(cost_of_autoscaling_clusters_per_category["cluster_category"]).orderBy(
+      cost_of_autoscaling_clusters_per_category["Total_cost(USD)"].desc()
+  )
 
-cost_of_autoscaling_clusters_per_category = (
-    cost_of_autoscaling_clusters_per_category.withColumn("row", row_number().over(windowDept))\
-    .filter(
-        (col("row") <= 20))\
-    .drop("row")\
-    .toPandas()
-)
+  return cost_of_autoscaling_clusters_per_category.withColumn("row", row_number().over(windowDept))\
+  .filter(
+      (col("row") <= 20))\
+  .drop("row")
+
+cost_of_autoscaling_clusters_per_category = masters.cached_pandas("cluster.cost_of_autoscaling_clusters_per_category", build_cost_of_autoscaling_clusters_per_category, cache_sources, **cache_params)
 
 
 display(cost_of_autoscaling_clusters_per_category)
@@ -735,22 +774,12 @@ fig.show()
 
 # COMMAND ----------
 
-ClusterFailedCount = clsf_master\
-.where(
-  ((col("state") == "SPARK_EXCEPTION")
-      |(col("state") == "DRIVER_UNAVAILABLE")
-      |(col("state") == "DBFS_DOWN")
-      |(col("state") == "NODES_LOST")
-      |(col("state") == "DRIVER_NOT_RESPONDING")
-      |(col("state") == "METASTORE_DOWN")
-      ) &
-      (col("is_automated") == "false")
-  )\
-.groupBy(clsf_master["state"], clsf_master["node_type_id"])\
+ClusterFailedCount = masters.cached_pandas("cluster.ClusterFailedCount", lambda: transitions()\
+.where(col("is_failure") & (col("is_automated") == "false"))\
+.groupBy("state", "node_type_id")\
 .agg(countDistinct("cluster_id").alias("Count_ClusterID"))\
 .orderBy(col("Count_ClusterID").desc())\
-.limit(20)\
-.toPandas()
+.limit(20), cache_sources, **cache_params)
 
 
 display(ClusterFailedCount)
@@ -777,23 +806,13 @@ fig.show()
 
 # COMMAND ----------
 
-ClusterFailedCountbyWorkspace = clsf_master\
-.where(
-  ((col("state") == "SPARK_EXCEPTION")
-      |(col("state") == "DRIVER_UNAVAILABLE")
-      |(col("state") == "DBFS_DOWN")
-      |(col("state") == "NODES_LOST")
-      |(col("state") == "DRIVER_NOT_RESPONDING")
-      |(col("state") == "METASTORE_DOWN")
-      ) &
-      (col("is_automated") == "false")
-  )\
-.groupBy(clsf_master["organization_id"], clsf_master["workspace_name"], clsf_master["state"], clsf_master["node_type_id"])\
+ClusterFailedCountbyWorkspace = masters.cached_pandas("cluster.ClusterFailedCountbyWorkspace", lambda: transitions()\
+.where(col("is_failure") & (col("is_automated") == "false"))\
+.groupBy("organization_id", "workspace_name", "state", "node_type_id")\
 .agg(countDistinct("cluster_id").alias("Count_ClusterID"),
      round(sum(col("total_cost")),2).alias("cost_of_failure")
     )\
-.orderBy(col("cost_of_failure").desc())\
-.toPandas()
+.orderBy(col("cost_of_failure").desc()), cache_sources, **cache_params)
 
 
 display(ClusterFailedCountbyWorkspace)
@@ -819,27 +838,18 @@ fig.show()
 # COMMAND ----------
 
 
-ClusterFailedCountViolin = clsf_master\
-.where(
-  ((col("state") == "SPARK_EXCEPTION")
-      |(col("state") == "DRIVER_UNAVAILABLE")
-      |(col("state") == "DBFS_DOWN")
-      |(col("state") == "NODES_LOST")
-      |(col("state") == "DRIVER_NOT_RESPONDING")
-      |(col("state") == "METASTORE_DOWN")
-      ) & (col("is_automated") == "false")
-)\
-.groupBy(clsf_master["organization_id"],
-         clsf_master["workspace_name"],
-         clsf_master["cluster_category"],
-         clsf_master["state"],
-         clsf_master["node_type_id"]
+ClusterFailedCountViolin = masters.cached_pandas("cluster.ClusterFailedCountViolin", lambda: transitions()\
+.where(col("is_failure") & (col("is_automated") == "false"))\
+.groupBy("organization_id",
+         "workspace_name",
+         "cluster_category",
+         "state",
+         "node_type_id"
         )\
 .agg(countDistinct("cluster_id").alias("Count_ClusterID"))\
 .orderBy(col("Count_ClusterID").desc())\
 .limit(30)\
-.distinct()\
-.toPandas()
+.distinct(), cache_sources, **cache_params)
 
 display(ClusterFailedCountViolin)
 
@@ -863,7 +873,46 @@ fig.show()
 
 # COMMAND ----------
 
-restart_count = clsf_master\
+cluster_mtbf = masters.cached_pandas("cluster.cluster_mtbf", lambda: masters.cluster_mtbf(
+  transitions().where(col("is_automated") == "false"), ["node_type_id"])\
+.orderBy(col("failure_count").desc())\
+.limit(20), cache_sources, **cache_params)
+
+display(cluster_mtbf)
+
+# COMMAND ----------
+
+fig = px.bar(cluster_mtbf,
+             x = "node_type_id",
+             y = "mtbf_h",
+             color = "failure_count",
+             color_continuous_scale = ["green", "red"],
+             hover_data = ["failure_count", "failed_cluster_count"],
+             title = "Mean time between failures per node type")
+
+fig = fig.update_layout(
+    xaxis_title = "Node type",
+    yaxis_title = "MTBF (Hours)")
+
+fig.show()
+
+# COMMAND ----------
+
+start_latency = masters.cached_pandas("cluster.start_latency", lambda: masters.box_stats(
+  transitions().where(col("start_latency_h").isNotNull())\
+  .withColumn("start_latency(Hours)", round(col("start_latency_h"), 3)),
+  "start_latency(Hours)", ["cluster_category", "workspace_name"]), cache_sources, **cache_params)
+
+display(start_latency)
+
+# COMMAND ----------
+
+fig = box_figure(start_latency, "cluster_category", "start_latency(Hours)", "Cluster start latency by cluster category", color = "workspace_name")
+fig.show()
+
+# COMMAND ----------
+
+restart_count = masters.cached_pandas("cluster.restart_count", lambda: transitions()\
 .where((col("cluster_category") == "Interactive")
        & (col("state") == "RESTARTING")
       )\
@@ -876,8 +925,7 @@ restart_count = clsf_master\
         )\
 .agg(countDistinct("unixTimeMS_state_start").alias("cluster_restart_count"),
      round(sum(col("total_cost")),2).alias("Restarting_cost_(USD)"),
-     round(sum(col("uptime_in_state_H")),2).alias("Uptime_in_state_Hours"))\
-.toPandas()
+     round(sum(col("duration_h")),2).alias("Uptime_in_state_Hours")), cache_sources, **cache_params)
 
 
 display(restart_count)
@@ -895,3 +943,30 @@ fig.show()
 
 # COMMAND ----------
 
+
+# MAGIC %md
+# MAGIC ### Concurrency
+# MAGIC > As an admin I want to know how many clusters, cores and job runs were live at the same time to plan capacity and quotas (the cluster tag filter does not apply)
+
+# COMMAND ----------
+
+concurrency = masters.cached_pandas("cluster.concurrency", lambda: masters.concurrency_peaks(
+  masters.snapshot("concurrency_timeline", includeWeekend = include_weekends, onlyWeekend = only_weekends), ["workspace_name"], period = "day")\
+.orderBy("period_start", "workspace_name"), ["concurrency_timeline"], includeWeekend = include_weekends, onlyWeekend = only_weekends)
+
+display(concurrency)
+
+# COMMAND ----------
+
+fig = px.line(concurrency,
+              x = "period_start",
+              y = "peak_cores",
+              color = "workspace_name",
+              hover_data = ["peak_clusters", "peak_runs", "p95_clusters", "p95_cores", "p95_runs"],
+              title = "Daily peak of live cores per workspace")
+
+fig = fig.update_layout(
+    xaxis_title = "Date",
+    yaxis_title = "Live cores")
+
+fig.show()
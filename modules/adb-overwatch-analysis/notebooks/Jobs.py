@@ -17,7 +17,7 @@
 # MAGIC | 2 | Consumer DB Name | Your Consumer Database Name | None
 # MAGIC | 3 | Workspace Name | List of workspace (overwatch deployed) name | all
 # MAGIC | 4 | Cluster | List of clusters in the above workspaces | all
-# MAGIC | 5 | Job Tags | Custom tags of jobs | None
+# MAGIC | 5 | Job Tags | Custom tags of the job clusters, comma separated key=value or key (all of them must match) | None
 # MAGIC | 6 | Start Date | Start date for analysis | 30 days back from current
 # MAGIC | 7 | End Date | End date for analysis | Current date
 # MAGIC | 8 | Include weekends | To record all days, include weekends | Yes |
@@ -37,6 +37,11 @@
 
 # COMMAND ----------
 
+from pyspark.sql.functions import *
+from datetime import date, timedelta
+
+# COMMAND ----------
+
 # Run only for the first time and comment it out after the first run
 # dbutils.widgets.removeAll()
 
@@ -52,7 +57,7 @@ consumerDB = str(dbutils.widgets.get("consumerDB"))
 
 # COMMAND ----------
 
-fetch_workspace_name = spark.sql(f"select distinct workspace_name from {etlDB}.pipeline_report").rdd.flatMap(lambda x: x).collect()+["all"]
+fetch_workspace_name = workspace_catalog.get(etlDB).workspace_names()+["all"]
 
 # COMMAND ----------
 
@@ -64,7 +69,7 @@ dbutils.widgets.text("end_date", f"{date.today()}", "7. End Date")
 dbutils.widgets.dropdown("include_weekends", "Yes", ["Yes", "No"], "8. Include weekends")
 dbutils.widgets.dropdown("only_weekends", "No", ["Yes", "No"], "9. Only weekends")
 
-workspace_name =  spark.sql(f"select distinct workspace_name from {etlDB}.pipeline_report").rdd.flatMap(lambda x: x).collect() if 'all' in dbutils.widgets.get("workspace_name").split(',') else dbutils.widgets.get("workspace_name").split(',')
+workspace_name =  workspace_catalog.get(etlDB).workspace_names() if 'all' in dbutils.widgets.get("workspace_name").split(',') else dbutils.widgets.get("workspace_name").split(',')
 
 # COMMAND ----------
 
@@ -87,18 +92,38 @@ cluster_filter = spark.sql(f"select distinct cluster_id from {consumerDB}.jobrun
 
 # COMMAND ----------
 
-masters = master(etlDB,consumerDB,workspace_name,start_date,end_date)
+masters = master(etlDB,consumerDB,workspace_name,start_date,end_date, includeWeekend = include_weekends, onlyWeekend = only_weekends)
+
+# COMMAND ----------
+
+# Master frames are built on first use inside a cell missing the result cache, a dashboard read from the cache refreshes no snapshot
+# Clusters carrying the selected tags (tag index lookup), None keeps every cluster
+tag_clusters = masters.lazy_frame(lambda: masters.tag_clusters(job_tags, includeWeekend = include_weekends, onlyWeekend = only_weekends))
+
+job = masters.lazy_frame(lambda: masters.snapshot("job_master",
+                                                  includeWeekend = include_weekends,
+                                                  onlyWeekend = only_weekends,
+                                                  clusterTable = cluster_filter)\
+                                        .transform(masters.filter_clusters(tag_clusters()))\
+                                        .distinct())
+top_n = 3
+top_jobs = masters.lazy_frame(lambda: masters.expensive_jobs_top_n(job(), topN = top_n))
+# Tables and widget values the charted frames depend on, part of the result cache key with the workspaces and dates
+# (the cluster tables behind the tag and cluster filters included, the tag filter reads the cluster tag index)
+cache_sources = ["job_master", "distinct_sketches", "cluster_tag_index", "clusterstatefact", "cluster"]
+cache_params = {"clusterID": dbutils.widgets.get("cluster_id"), "tags": job_tags, "topN": top_n,
+                "includeWeekend": include_weekends, "onlyWeekend": only_weekends}
+
+# "workspace  :  job  :  cost" label of the i-th entry of a ranked slice, used as hover data
+top_job_label = lambda slice_column, i: concat_ws("  :  ",
+                                                  col(slice_column)[i]["workspace_name"],
+                                                  col(slice_column)[i]["job_name"],
+                                                  col(slice_column)[i]["cost_in_USD"])
 
 # COMMAND ----------
 
-job = masters.job_master_filter(includeWeekend = include_weekends,
-                                       onlyWeekend = only_weekends,
-                                       dateColumn="job_start_date", 
-                                       clusterTable = cluster_filter)\
-             .distinct()
-expensive_jobs = masters.expensive_jobs(data=job)
-expensive_faliures = masters.expensive_failure(job)
-expensive_jobs_int_clusters = masters.expensive_jobs_interactive_clusters(job)
+# Scan summary of every consumer table read above (read schema, partition / pushed filters, files read)
+# display(masters.scan_summary(execute=True))
 
 # COMMAND ----------
 
@@ -111,46 +136,42 @@ expensive_jobs_int_clusters = masters.expensive_jobs_interactive_clusters(job)
 # MAGIC ## $DBUs by workflow by workspace by date
 # MAGIC #### In the below dataframe and visulization:
 # MAGIC ###### total_dbu_cost :-  is the DBU spend in USD for the day per workspace
-# MAGIC ###### top_3_expensive_jobs :- Provides the list of three top expensive jobs of the day across workspaces and this is by $DBUs by date.
-# MAGIC ###### top_3_expensive_job_fails -- Provides the list of three top expensive jobs of the day across workspaces and this is by $DBUs by date.
+# MAGIC ###### top_expensive_jobs :- Provides the list of the top expensive jobs of the day across workspaces and this is by $DBUs by date.
+# MAGIC ###### top_expensive_failures -- Provides the list of the top expensive failed jobs of the day across workspaces and this is by $DBUs by date.
 
 # COMMAND ----------
 
-job_cost = job\
-           .groupBy("job_start_date","workspace_name")\
-           .agg(round(sum(col("total_dbu_cost")),2).alias("total_dbu_cost"))
-
-job_cost_master = job_cost\
-                  .join(expensive_jobs, ['job_start_date'])\
-                  .join(expensive_faliures, ['job_start_date'])
-
-dbu_cost = job_cost_master\
-           .groupBy("job_start_date","workspace_name","top_3_expensive_jobs","top3_expensive_job_fails")\
-           .agg(round(sum(col("total_dbu_cost")),2).alias("total_dbu_cost"))\
-           .orderBy(col("job_start_date").asc())\
-           .withColumn("top_1_expensive_job",col("top_3_expensive_jobs")[0])\
-           .withColumn("top_2_expensive_job",col("top_3_expensive_jobs")[1])\
-           .withColumn("top_3_expensive_job",col("top_3_expensive_jobs")[2])\
-           .withColumn("top_1_expensive_fails",col("top3_expensive_job_fails")[0])\
-           .withColumn("top_2_expensive_fails",col("top3_expensive_job_fails")[1])\
-           .withColumn("top_3_expensive_fails",col("top3_expensive_job_fails")[2])\
-           .withColumn('50%', F.expr('percentile(total_dbu_cost, 0.5)').over(Window.partitionBy('job_start_date')))\
-           .withColumn('90%', F.expr('percentile(total_dbu_cost, 0.9)').over(Window.partitionBy('job_start_date')))\
-           .withColumn('99%', F.expr('percentile(total_dbu_cost, 0.99)').over(Window.partitionBy('job_start_date')))\
-           .withColumn('max', F.expr('percentile(total_dbu_cost, 1)').over(Window.partitionBy('job_start_date')))\
-           .toPandas()
+def build_dbu_cost():
+  job_cost = job()\
+             .groupBy("job_start_date","workspace_name")\
+             .agg(round(sum(col("total_dbu_cost")),2).alias("total_dbu_cost"))
+
+  job_cost_master = job_cost\
+                    .join(top_jobs().select("job_start_date","top_expensive_jobs","top_expensive_failures"), ['job_start_date'])
+
+  # Daily percentiles of the workspace costs, one approximate quantile aggregation instead of a percentile window per percentage
+  job_cost_quantiles = masters.quantiles(job_cost, "total_dbu_cost", ["job_start_date"], {"50%": 0.5, "90%": 0.9, "99%": 0.99, "max": 1.0})
+
+  return job_cost_master\
+         .select("*",
+                 *[top_job_label("top_expensive_jobs", i).alias(f"top_{i+1}_expensive_job") for i in range(top_n)],
+                 *[top_job_label("top_expensive_failures", i).alias(f"top_{i+1}_expensive_fails") for i in range(top_n)])\
+         .join(job_cost_quantiles, ["job_start_date"], "left")\
+         .orderBy(col("job_start_date").asc())
+
+dbu_cost = masters.cached_pandas("jobs.dbu_cost", build_dbu_cost, cache_sources, **cache_params)
 #compute
 #filters job type
 # jobs which are not runnu=ing for a period of time
 
 try:
-  display(job_cost_master)
+  display(dbu_cost)
   fig = px.bar(dbu_cost
               ,x=dbu_cost["job_start_date"]
               ,y=dbu_cost["total_dbu_cost"]
-              ,hover_data=["top_1_expensive_job","top_2_expensive_job","top_3_expensive_job",
-                           "top_1_expensive_fails","top_2_expensive_fails","top_3_expensive_fails",
-                           "50%","90%","99%","max"]
+              ,hover_data=[f"top_{i+1}_expensive_job" for i in range(top_n)] +
+                          [f"top_{i+1}_expensive_fails" for i in range(top_n)] +
+                          ["50%","90%","99%","max"]
               ,color = "workspace_name"
               ,color_discrete_sequence = px.colors.sequential.Electric
               ,title="$DBUs by workflow by workspace by date"
@@ -164,7 +185,7 @@ try:
 
   fig.show()
 except ValueError:
-  print("Its an empty dataframe - Kindly check the job_cost_master dataframe")
+  print("Its an empty dataframe - Kindly check the dbu_cost dataframe")
 except Exception as e:
   print(f"An exception occurred : {e}")
 
@@ -175,11 +196,19 @@ except Exception as e:
 
 # COMMAND ----------
 
-job_count = job\
-            .groupBy("workspace_name")\
-            .agg(countDistinct("job_id").alias("job_count"),
-                round(sum((col("total_dbu_cost"))),2).alias("total_dbu_cost_USD"))\
-            .toPandas()
+# Without a cluster or tag filter the distinct jobs are merged from the daily sketches, the filtered jobs are counted exactly
+def build_job_count():
+  jobs_filtered = 'all' not in dbutils.widgets.get("cluster_id").split(',') or tag_clusters() is not None
+  return job()\
+         .groupBy("workspace_name")\
+         .agg(countDistinct("job_id").alias("job_count"),
+             round(sum((col("total_dbu_cost"))),2).alias("total_dbu_cost_USD"))\
+         if jobs_filtered else\
+         masters.distinct_count("job_id", groupBy = ["workspace_name"], includeWeekend = include_weekends, onlyWeekend = only_weekends)\
+         .withColumnRenamed("distinct_count", "job_count")\
+         .join(job().groupBy("workspace_name").agg(round(sum((col("total_dbu_cost"))),2).alias("total_dbu_cost_USD")), "workspace_name", "inner")
+
+job_count = masters.cached_pandas("jobs.job_count", build_job_count, cache_sources, **cache_params)
 
 minimum_job_count = int(job_count["job_count"].sum()*0.2) 
 #The value collects 20% of total number jobs, any Workspace with job count less than this value will go to other category
@@ -204,30 +233,29 @@ except Exception as e:
 
 # COMMAND ----------
 
-job_int_cost = job\
-              .filter(col("cluster_type") != "job_cluster")\
-              .groupBy("job_start_date","job_id","workspace_name","organization_id","created_by")\
-              .agg(round(sum(col("total_dbu_cost")),2).alias("total_dbu_cost"))
+def build_job_int_cost_master():
+  job_int_cost = job()\
+                .filter(col("cluster_type") != "job_cluster")\
+                .groupBy("job_start_date","job_id","workspace_name","organization_id","created_by")\
+                .agg(round(sum(col("total_dbu_cost")),2).alias("total_dbu_cost"))
 
-job_int_cost_master = job_int_cost\
-                      .join(expensive_jobs_int_clusters, ['job_start_date'])
+  return job_int_cost\
+         .join(top_jobs().select("job_start_date","top_expensive_interactive_jobs"), ['job_start_date'])
 
-jobrun_interactive_cluster = job_int_cost_master\
-                             .groupby("organization_id","workspace_name","created_by","top3expensive_int_jobs")\
+jobrun_interactive_cluster = masters.cached_pandas("jobs.jobrun_interactive_cluster", lambda: build_job_int_cost_master()\
+                             .groupby("organization_id","workspace_name","created_by","top_expensive_interactive_jobs")\
                              .agg(countDistinct("job_id").alias("job_on_interactive_count")
                                  ,round(sum(col("total_dbu_cost")),2).alias("total_dbu_cost"))\
                              .sort(col("job_on_interactive_count").desc())\
-                             .withColumn("top_1_expensive_jobs",col("top3expensive_int_jobs")[0])\
-                             .withColumn("top_2_expensive_jobs",col("top3expensive_int_jobs")[1])\
-                             .withColumn("top_3_expensive_jobs",col("top3expensive_int_jobs")[2])\
+                             .select("*", *[top_job_label("top_expensive_interactive_jobs", i).alias(f"top_{i+1}_expensive_jobs") for i in range(top_n)])\
+                             .drop("top_expensive_interactive_jobs")\
                              .fillna(value="Unknown", subset=["created_by"])\
-                             .limit(20)\
-                             .toPandas()
+                             .limit(20), cache_sources, **cache_params)
 try:
   display(jobrun_interactive_cluster)
   fig = px.box(jobrun_interactive_cluster, x="workspace_name", y="job_on_interactive_count"
               ,points="all",height = 650,width=1200
-              ,hover_data=['organization_id','created_by','total_dbu_cost',"top_1_expensive_jobs","top_2_expensive_jobs","top_3_expensive_jobs"]
+              ,hover_data=['organization_id','created_by','total_dbu_cost'] + [f"top_{i+1}_expensive_jobs" for i in range(top_n)]
               ,title="Jobs running in Interactive Clusters (Top 20 workspaces)"
               ,labels={"workspace_name" : "Workspace name",
                         "job_on_interactive_count": "Jobs running on interactive Clusters(Count)"}
@@ -251,14 +279,13 @@ except Exception as e:
 
 # COMMAND ----------
 
-job_per_status = job\
+job_per_status = masters.cached_pandas("jobs.job_per_status", lambda: job()\
                  .select("terminal_state","job_start_date","run_id","job_id")\
                  .where(col("terminal_state")!="null")\
                  .groupby("terminal_state","job_start_date")\
                  .agg(countDistinct("run_id").alias("number_of_runs"),
                      countDistinct("job_id").alias("number_of_jobs"))\
-                 .orderBy(col("job_start_date"))\
-                 .toPandas()
+                 .orderBy(col("job_start_date")), cache_sources, **cache_params)
 
 jb_fail = job_per_status[job_per_status.terminal_state=="Failed"]
 
@@ -326,12 +353,11 @@ except Exception as e:
 
 # COMMAND ----------
 
-job_success_vs_failed =  job\
+job_success_vs_failed =  masters.cached_pandas("jobs.job_success_vs_failed", lambda: job()\
                          .select("terminal_state","workspace_name","run_id")\
                          .where(col("terminal_state").isin(["Succeeded","Failed","Cancelled"]))\
                          .groupby("workspace_name","terminal_state")\
-                         .agg(countDistinct("run_id").alias("number_of_runs"))\
-                         .toPandas()
+                         .agg(countDistinct("run_id").alias("number_of_runs")), cache_sources, **cache_params)
 try:
   fig = px.bar(job_success_vs_failed,
                x=job_success_vs_failed["workspace_name"],
@@ -357,14 +383,13 @@ except Exception as e:
 
 # COMMAND ----------
 
-job_cost_faliure =  job\
+job_cost_faliure =  masters.cached_pandas("jobs.job_cost_faliure", lambda: job()\
                     .select("terminal_state","workspace_name","run_id","runTimeH")\
                     .where(col("terminal_state") != "Succeeded")\
                     .groupby("workspace_name")\
                     .agg(countDistinct("run_id").alias("number_of_runs")
                         ,round(sum("runTimeH"),2).alias("Compute_timeH"))\
-                    .orderBy(col("number_of_runs").desc())\
-                    .toPandas()
+                    .orderBy(col("number_of_runs").desc()), cache_sources, **cache_params)
 try:
   fig = px.bar(job_cost_faliure, x='workspace_name', y='Compute_timeH',
                hover_data=['number_of_runs'], color='Compute_timeH',
@@ -376,4 +401,40 @@ try:
 except ValueError:
   print("Its an empty dataframe - Kindly check the dataframe")
 except Exception as e:
-  print(f"An exception occurred : {e}")
\ No newline at end of file
+  print(f"An exception occurred : {e}")
+# COMMAND ----------
+
+# MAGIC %md
+# MAGIC ## Cost of failure against the previous period
+
+# COMMAND ----------
+
+# Failed job cost per workspace against the previous period of the same length, both periods read and aggregated together
+failed = col("terminal_state") != "Succeeded"
+previous_start, previous_end = masters.previous_period()
+failure_comparison = masters.cached_pandas("jobs.failure_comparison", lambda: masters.period_comparison("job_master",
+                                                                                                     {"failed_cost": when(failed, col("total_cost")),
+                                                                                                      "failed_compute_h": when(failed, col("runTimeH"))},
+                                                                                                     ["workspace_name"],
+                                                                                                     includeWeekend = include_weekends,
+                                                                                                     onlyWeekend = only_weekends,
+                                                                                                     clusterTable = cluster_filter,
+                                                                                                     transform = lambda df: df.transform(masters.filter_clusters(tag_clusters())).distinct())\
+                                               .orderBy(col("failed_cost_current").desc()), cache_sources, **cache_params)
+try:
+  display(failure_comparison)
+  fig = px.bar(failure_comparison.melt(id_vars = ["workspace_name", "failed_cost_delta_pct"],
+                                       value_vars = ["failed_cost_previous", "failed_cost_current"],
+                                       var_name = "period",
+                                       value_name = "Failed job cost (USD)"),
+               x = "workspace_name",
+               y = "Failed job cost (USD)",
+               color = "period",
+               barmode = "group",
+               hover_data = ["failed_cost_delta_pct"],
+               title = f"Cost of failure by workspace, {start_date} to {end_date} against {previous_start} to {previous_end}")
+  fig.show()
+except ValueError:
+  print("Its an empty dataframe - Kindly check the dataframe")
+except Exception as e:
+  print(f"An exception occurred : {e}")
@@ -11,7 +11,7 @@
 # MAGIC | ----------- | ----------- | ----------- | ----------- |
 # MAGIC | 1 | ETL Database Name | Your ETL Database Name | overwatch_etl
 # MAGIC | 2 | Consumer DB Name | Your Consumer Database Name | overwatch
-# MAGIC | 3 | Path Depth | Adjust folder/notebook path level | 2
+# MAGIC | 3 | Path Depth | Adjust folder/notebook path level (1 to 10) | 2
 # MAGIC | 4 | Workspace Name | List of workspace (overwatch deployed) name | all
 # MAGIC | 5 | Start Date | Start date for analysis | 30 days from current date
 # MAGIC | 6 | End Date | End date for analysis | current date
@@ -50,12 +50,17 @@ consumerDB = str(dbutils.widgets.get("consumerDB"))
 
 # COMMAND ----------
 
-fetch_Name = spark.sql(f"select distinct workspace_name from {etlDB}.pipeline_report").rdd.flatMap(lambda x: x).collect()+["all"]
+from pyspark.sql.functions import *
+from datetime import date, timedelta
+
+# COMMAND ----------
+
+fetch_Name = workspace_catalog.get(etlDB).workspace_names()+["all"]
 dbutils.widgets.multiselect("workspace_name","all",fetch_Name, "4. Workspace Name")
 
 # COMMAND ----------
 
-workspaceName =  spark.sql(f"select distinct workspace_name from {etlDB}.pipeline_report").rdd.flatMap(lambda x: x).collect() if 'all' in dbutils.widgets.get("workspace_name").split(',') else dbutils.widgets.get("workspace_name").split(',')
+workspaceName =  workspace_catalog.get(etlDB).workspace_names() if 'all' in dbutils.widgets.get("workspace_name").split(',') else dbutils.widgets.get("workspace_name").split(',')
 
 # COMMAND ----------
 
@@ -80,46 +85,39 @@ end_date = str(dbutils.widgets.get("6. End Date"))
 
 # COMMAND ----------
 
-master = master(etlDB, consumerDB, workspaceName, start_date, end_date)
-sparkMaster = master.spark_notebook_master(includeWeekend = include_weekends, onlyWeekend = only_weekends, folder_level = folder_level)
+master = master(etlDB, consumerDB, workspaceName, start_date, end_date, includeWeekend = include_weekends, onlyWeekend = only_weekends)
+# Master frames are built on first use inside a cell missing the result cache, a dashboard read from the cache refreshes no snapshot
+sparkMaster = master.lazy_frame(lambda: master.snapshot("spark_notebook_master", includeWeekend = include_weekends, onlyWeekend = only_weekends))
+# Every per folder task metric charted below, aggregated once for all path depths and cached, a new path depth only filters it
+folder_metrics = master.lazy_frame(lambda: master.notebook_folder_metrics(sparkMaster(), folder_level))
+# Tables and widget values the charted frames depend on, part of the result cache key with the workspaces and dates
+cache_sources = ["spark_notebook_master", "notebook", "jobRun"]
+cache_params = {"folderLevel": folder_level, "includeWeekend": include_weekends, "onlyWeekend": only_weekends}
 
-notebook = spark.sql("select * from {}.notebook".format(consumerDB))
-notebook = notebook.withColumn("folder_path", concat_ws('/', slice(split(col('notebook_path'), '/'), 1, folder_level + 1)))
+notebook = master.lazy_frame(lambda: master.with_folder_path(spark.sql("select * from {}.notebook".format(consumerDB)), folder_level))
+
+# COMMAND ----------
+
+# Row count invariant of the task to job attribution (raises when a spark task would be counted more than once), also run by python/tests
+# Reads sparkTask four times, uncomment to check a new Overwatch version; timestamp_rows is the row count of the legacy timestamp join
+# print(master.spark_task_attribution_check(includeWeekend = include_weekends, onlyWeekend = only_weekends))
 
 # COMMAND ----------
 
 # Data Intensive Notebooks (top 40 descending) 
 # Read + Shuffle + Write GBs (stacked bar)
 
-nb_throughput = sparkMaster\
-.groupBy(sparkMaster["folder_path"], sparkMaster["organization_id"], sparkMaster["workspace_name"])\
-.agg(
-  round(((
-  sum(sparkMaster.task_metrics.ShuffleReadMetrics.LocalBytesRead)
-    + sum(sparkMaster.task_metrics.ShuffleReadMetrics.RemoteBytesRead)
-    + sum(sparkMaster.task_metrics.ShuffleReadMetrics.RemoteBytesReadToDisk)
-    + sum(sparkMaster.task_metrics.ShuffleWriteMetrics.ShuffleBytesWritten)
-    + sum(sparkMaster.task_metrics.ShuffleWriteMetrics.ShuffleRecordsWritten)
-    + sum(sparkMaster.task_metrics.ShuffleWriteMetrics.ShuffleWriteTime)
-  )/1000000000),2).alias("TotalShuffle (GBs)")
-,
-  round(((
-    sum(sparkMaster.task_metrics.InputMetrics.BytesRead)
-     + sum(sparkMaster.task_metrics.InputMetrics.RecordsRead)
-  )/1000000000), 2).alias("TotalReads (GBs)")
-,
-  round(((
-    sum(sparkMaster.task_metrics.OutputMetrics.BytesWritten)
-     + (sum(sparkMaster.task_metrics.OutputMetrics.RecordsWritten))
-  )/1000000000), 2).alias("TotalWrites (GBs)")
-)
+nb_throughput = master.lazy_frame(lambda: folder_metrics()\
+.select("folder_path", "organization_id", "workspace_name",
+        round(col("shuffle_total")/1000000000, 2).alias("TotalShuffle (GBs)"),
+        round(col("read_total")/1000000000, 2).alias("TotalReads (GBs)"),
+        round(col("write_total")/1000000000, 2).alias("TotalWrites (GBs)")))
 
-Total_throughput = nb_throughput\
+Total_throughput = master.cached_pandas("notebook.Total_throughput", lambda: nb_throughput()\
 .withColumn('TotalThroughput (GBs)', round((col("TotalShuffle (GBs)") + col("TotalReads (GBs)") + col("TotalWrites (GBs)")), 2))\
 .where(col("folder_path").isNotNull() & (col("folder_path") != ""))\
 .orderBy(col('TotalThroughput (GBs)').desc())\
-.limit(10)\
-.toPandas()  
+.limit(10), cache_sources, **cache_params)  
 
 fig = px.bar(Total_throughput,
              x = "folder_path",
@@ -148,13 +146,11 @@ display(Total_throughput)
 
 # sparkTask resultSize (total result size -- colored by avg result size for tasks with resultSize > 10KB)
 
-resultSize = sparkMaster\
-.groupBy(sparkMaster["folder_path"], sparkMaster["organization_id"], sparkMaster["workspace_name"])\
-.agg(round(avg(sparkMaster.task_metrics.ResultSize)/1000000,2).alias("ResultSize (MB)"))\
+resultSize = master.cached_pandas("notebook.resultSize", lambda: folder_metrics()\
+.select("folder_path", "organization_id", "workspace_name", round(col("avg_result_size")/1000000,2).alias("ResultSize (MB)"))\
 .where(col("folder_path").isNotNull() & (col("folder_path") != ""))\
 .orderBy(col('ResultSize (MB)').desc())\
-.limit(10)\
-.toPandas()  
+.limit(10), cache_sources, **cache_params)  
 
 fig = px.bar(resultSize,
              x = "folder_path",
@@ -179,17 +175,14 @@ display(resultSize)
 
 # Spark executions (i.e. actions) Count 
 
-sp_execution = sparkMaster\
-.groupBy(sparkMaster["folder_path"],
-         sparkMaster["organization_id"],
-         sparkMaster["workspace_name"])\
-.agg(countDistinct(col('execution_id')).alias('Execution_count')
-    ,round(sum(col('task_runtime.runTimeH')),2).alias("Execution_Runtime_Hrs")
-    )\
+sp_execution = master.cached_pandas("notebook.sp_execution", lambda: folder_metrics()\
+.select("folder_path", "organization_id", "workspace_name"
+       ,col("execution_count").alias('Execution_count')
+       ,round(col("runtime_h"),2).alias("Execution_Runtime_Hrs")
+       )\
 .where(col("folder_path").isNotNull() & (col("folder_path") != ""))\
 .orderBy(col("Execution_count").desc())\
-.limit(10)\
-.toPandas()  
+.limit(10), cache_sources, **cache_params)  
 
 fig = px.bar(sp_execution,
              x = "folder_path",
@@ -214,38 +207,17 @@ display(sp_execution)
 
 # largest records (1000s of records / MB) (higher is better -- meaning lower number of rec/mb means larger records)
 
-nb_records = sparkMaster\
-.groupBy(sparkMaster["folder_path"]
-         ,sparkMaster["organization_id"]
-         ,sparkMaster["workspace_name"]
-        )\
-.agg(
-  (round(((
-  sum(sparkMaster.task_metrics.ShuffleReadMetrics.LocalBytesRead)
-    + sum(sparkMaster.task_metrics.ShuffleReadMetrics.RemoteBytesRead)
-    + sum(sparkMaster.task_metrics.ShuffleReadMetrics.RemoteBytesReadToDisk)
-    + sum(sparkMaster.task_metrics.ShuffleWriteMetrics.ShuffleBytesWritten)
-    + sum(sparkMaster.task_metrics.ShuffleWriteMetrics.ShuffleRecordsWritten)
-    + sum(sparkMaster.task_metrics.ShuffleWriteMetrics.ShuffleWriteTime)
-  )/1024)/1000,2)).alias("TotalShuffle (MBs)")
-,
-  (round(((
-    sum(sparkMaster.task_metrics.InputMetrics.BytesRead)
-     + sum(sparkMaster.task_metrics.InputMetrics.RecordsRead)
-  )/1024)/1000, 2)).alias("TotalReads (MBs)")
-,
-  (round(((
-    sum(sparkMaster.task_metrics.OutputMetrics.BytesWritten)
-     + (sum(sparkMaster.task_metrics.OutputMetrics.RecordsWritten))
-  )/1024)/1000, 2)).alias("TotalWrites (MBs)")
-)
+nb_records = master.lazy_frame(lambda: folder_metrics()\
+.select("folder_path", "organization_id", "workspace_name",
+        round(col("shuffle_total")/1024/1000, 2).alias("TotalShuffle (MBs)"),
+        round(col("read_total")/1024/1000, 2).alias("TotalReads (MBs)"),
+        round(col("write_total")/1024/1000, 2).alias("TotalWrites (MBs)")))
 
-NBlargestRecords = nb_records\
+NBlargestRecords = master.cached_pandas("notebook.NBlargestRecords", lambda: nb_records()\
 .withColumn('TotalThroughput (MBs)', round((col("TotalShuffle (MBs)") + col("TotalReads (MBs)") + col("TotalWrites (MBs)")), 2))\
 .where(col("folder_path").isNotNull() & (col("folder_path") != ""))\
 .orderBy(col('TotalThroughput (MBs)').desc())\
-.limit(10)\
-.toPandas() 
+.limit(10), cache_sources, **cache_params) 
 
 fig = px.bar(NBlargestRecords,
              x = "folder_path",
@@ -268,40 +240,20 @@ display(NBlargestRecords)
 
 # Task count by task type (stacked bar of number of task's count group by path)
 
-cnt_cond = lambda cond: F.sum(F.when(cond, 1).otherwise(0))
-
-SparkTask_type = sparkMaster\
-.groupBy(sparkMaster["folder_path"], sparkMaster["organization_id"], sparkMaster["workspace_name"])\
-.agg(
-  (
-    cnt_cond(F.col('task_metrics.InputMetrics.BytesRead') > 0)
-    + cnt_cond(F.col('task_metrics.InputMetrics.RecordsRead') > 0)
-  ).alias('InputMetrics_count')
-  ,
-  (
-    cnt_cond(F.col('task_metrics.OutputMetrics.BytesWritten') > 0)
-    + cnt_cond(F.col('task_metrics.OutputMetrics.RecordsWritten') > 0)
-  ).alias('OutputMetrics_count')
-  ,
-  (
-    cnt_cond(F.col('task_metrics.ShuffleReadMetrics.RemoteBytesRead') > 0) 
-    + cnt_cond(F.col('task_metrics.ShuffleReadMetrics.RemoteBytesReadToDisk') > 0)
-    + cnt_cond(F.col('task_metrics.ShuffleReadMetrics.LocalBytesRead') > 0)
-    + cnt_cond(F.col('task_metrics.ShuffleWriteMetrics.ShuffleBytesWritten') > 0)
-    + cnt_cond(F.col('task_metrics.ShuffleWriteMetrics.ShuffleRecordsWritten') > 0)
-    + cnt_cond(F.col('task_metrics.ShuffleWriteMetrics.ShuffleWriteTime') > 0)
-  ).alias('ShuffleMetrics_count')
-)
+SparkTask_type = master.lazy_frame(lambda: folder_metrics()\
+.select("folder_path", "organization_id", "workspace_name",
+        col("input_task_count").alias('InputMetrics_count'),
+        col("output_task_count").alias('OutputMetrics_count'),
+        col("shuffle_task_count").alias('ShuffleMetrics_count')))
 
-SparkTask_typeCount = SparkTask_type\
+SparkTask_typeCount = master.cached_pandas("notebook.SparkTask_typeCount", lambda: SparkTask_type()\
 .withColumn("Throughput_Count",
-            SparkTask_type["InputMetrics_count"]
-            + SparkTask_type["OutputMetrics_count"]
-            + SparkTask_type["ShuffleMetrics_count"])\
+            SparkTask_type()["InputMetrics_count"]
+            + SparkTask_type()["OutputMetrics_count"]
+            + SparkTask_type()["ShuffleMetrics_count"])\
 .where(col("folder_path").isNotNull() & (col("folder_path") != ""))\
 .orderBy(col('Throughput_Count').desc())\
-.limit(10)\
-.toPandas()  
+.limit(10), cache_sources, **cache_params)  
 
 fig = px.bar(SparkTask_typeCount,
              x = "folder_path",
@@ -325,36 +277,18 @@ display(SparkTask_typeCount)
 # Notebook Efficiency (most inefficient i.e. sorted -- top 40)
 # Large tasks (count of tasks > 400MB) (lower is better)
 
-spark_largeTask = sparkMaster\
-.groupBy(sparkMaster["folder_path"], sparkMaster["organization_id"], sparkMaster["workspace_name"])\
-.agg(
-  round(((
-  sum(sparkMaster.task_metrics.ShuffleReadMetrics.LocalBytesRead)
-    + sum(sparkMaster.task_metrics.ShuffleReadMetrics.RemoteBytesRead)
-    + sum(sparkMaster.task_metrics.ShuffleReadMetrics.RemoteBytesReadToDisk)
-    + sum(sparkMaster.task_metrics.ShuffleWriteMetrics.ShuffleBytesWritten)
-    + sum(sparkMaster.task_metrics.ShuffleWriteMetrics.ShuffleRecordsWritten)
-    + sum(sparkMaster.task_metrics.ShuffleWriteMetrics.ShuffleWriteTime)
-  )/1000000),2).alias("TotalShuffle (MBs)")
-,
-  round(((
-    sum(sparkMaster.task_metrics.InputMetrics.BytesRead)
-     + sum(sparkMaster.task_metrics.InputMetrics.RecordsRead)
-  )/1000000), 2).alias("TotalReads (MBs)")
-,
-  round(((
-    sum(sparkMaster.task_metrics.OutputMetrics.BytesWritten)
-     + (sum(sparkMaster.task_metrics.OutputMetrics.RecordsWritten))
-  )/1000000), 2).alias("TotalWrites (MBs)")
-)
+spark_largeTask = master.lazy_frame(lambda: folder_metrics()\
+.select("folder_path", "organization_id", "workspace_name",
+        round(col("shuffle_total")/1000000, 2).alias("TotalShuffle (MBs)"),
+        round(col("read_total")/1000000, 2).alias("TotalReads (MBs)"),
+        round(col("write_total")/1000000, 2).alias("TotalWrites (MBs)")))
 
-spark_largeTasks = spark_largeTask\
+spark_largeTasks = master.cached_pandas("notebook.spark_largeTasks", lambda: spark_largeTask()\
 .withColumn('TotalThroughput (MBs)', round((col("TotalShuffle (MBs)") + col("TotalReads (MBs)") + col("TotalWrites (MBs)")), 2))\
 .where((col("TotalShuffle (MBs)") > 400) | (col("TotalReads (MBs)") > 400) | (col("TotalWrites (MBs)") > 400))\
 .where(col("folder_path").isNotNull() & (col("folder_path") != ""))\
 .orderBy(col("TotalThroughput (MBs)").asc())\
-.limit(10)\
-.toPandas()  
+.limit(10), cache_sources, **cache_params)  
 
 fig = px.bar(spark_largeTasks,
              x = "folder_path",
@@ -379,13 +313,14 @@ display(spark_largeTasks)
 # Compute Intensive Notebooks
 # Notebooks with longest compute times
   
-longestNotebooks = sparkMaster\
-.groupBy(sparkMaster["folder_path"], sparkMaster["organization_id"], sparkMaster["workspace_name"], sparkMaster["Execution_type"])\
-.agg(round(sum("task_runtime.runTimeH"),2).alias("total_runtime (hrs)"))\
+longestNotebooks = master.cached_pandas("notebook.longestNotebooks", lambda: folder_metrics()\
+.select("folder_path", "organization_id", "workspace_name",
+        expr("stack(2, 'Manual_notebook', manual_runtime_h, 'Job_notebook', job_runtime_h)").alias("Execution_type", "runtime_h"))\
+.where(col("runtime_h").isNotNull())\
+.select("folder_path", "organization_id", "workspace_name", "Execution_type", round(col("runtime_h"),2).alias("total_runtime (hrs)"))\
 .where(col("folder_path").isNotNull() & (col("folder_path") != ""))\
 .orderBy(col("total_runtime (hrs)").desc())\
-.limit(10)\
-.toPandas()  
+.limit(10), cache_sources, **cache_params)  
 
 fig = px.bar(longestNotebooks,
              x = "folder_path",
@@ -436,18 +371,23 @@ display(longestNotebooks)
 
 # Jobs Executing on Notebooks (count)
 
-jobrun = spark.sql("select job_id from {}.jobrun where task_type in ('notebook','pipeline','python')".format(consumerDB))
+def build_JobsNotebook():
+  jobrun = spark.sql("select job_id from {}.jobrun where task_type in ('notebook','pipeline','python')".format(consumerDB))
 
-jb = jobrun.join(sparkMaster, jobrun['job_id'] == sparkMaster['db_job_id'], "inner")
+  # Notebook paths run by the jobs, cached before the path depth is applied so a new depth only re-joins small frames
+  jb = jobrun.join(sparkMaster(), jobrun['job_id'] == sparkMaster()['db_job_id'], "inner")\
+  .where(sparkMaster()["db_job_id"].isNotNull() & sparkMaster()["db_id_in_job"].isNotNull())\
+  .select("notebook_path", "organization_id", "workspace_name")\
+  .distinct()\
+  .cache()
+  jb = master.with_folder_path(jb, folder_level)
+  return jb.join(notebook(), notebook().folder_path == jb.folder_path, "inner")\
+  .where((jb["folder_path"].isNotNull()) & (jb["folder_path"] != ""))\
+  .groupBy(jb["folder_path"], jb["organization_id"], jb["workspace_name"])\
+  .agg(countDistinct(notebook()["notebook_id"]).alias("Notebook_Count"))\
+  .limit(10)
 
-
-JobsNotebook = jb.join(notebook, notebook.folder_path == jb.folder_path, "inner")\
-.where(jb["db_job_id"].isNotNull() & jb["db_id_in_job"].isNotNull())\
-.where((jb["folder_path"].isNotNull()) & (jb["folder_path"] != ""))\
-.groupBy(jb["folder_path"], jb["organization_id"], jb["workspace_name"])\
-.agg(countDistinct(notebook["notebook_id"]).alias("Notebook_Count"))\
-.limit(10)\
-.toPandas() 
+JobsNotebook = master.cached_pandas("notebook.JobsNotebook", build_JobsNotebook, cache_sources, **cache_params) 
 
 fig = px.bar(JobsNotebook,
              x = "folder_path",
@@ -472,18 +412,23 @@ display(JobsNotebook)
 
 # Jobs Executing on Notebooks (count) which is not configured from workflow
 
-jobrun = spark.sql("select job_id from {}.jobrun where task_type not in ('notebook','pipeline','python')".format(consumerDB))
-
-jb1 = jobrun.join(sparkMaster, jobrun['job_id'] == sparkMaster['db_job_id'], "inner")
+def build_JobsNotebook1():
+  jobrun = spark.sql("select job_id from {}.jobrun where task_type not in ('notebook','pipeline','python')".format(consumerDB))
 
+  # Notebook paths run by the jobs, cached before the path depth is applied so a new depth only re-joins small frames
+  jb1 = jobrun.join(sparkMaster(), jobrun['job_id'] == sparkMaster()['db_job_id'], "inner")\
+  .where(sparkMaster()["db_job_id"].isNotNull() & sparkMaster()["db_id_in_job"].isNotNull())\
+  .select("notebook_path", "organization_id", "workspace_name")\
+  .distinct()\
+  .cache()
+  jb1 = master.with_folder_path(jb1, folder_level)
+  return jb1.join(notebook(), notebook().folder_path == jb1.folder_path, "inner")\
+  .where((jb1["folder_path"].isNotNull()) & (jb1["folder_path"] != ""))\
+  .groupBy(jb1["folder_path"], jb1["organization_id"], jb1["workspace_name"])\
+  .agg(countDistinct(notebook()["notebook_id"]).alias("Notebook_Count"))\
+  .limit(10)
 
-JobsNotebook1 = jb1.join(notebook, notebook.folder_path == jb1.folder_path, "inner")\
-.where(jb1["db_job_id"].isNotNull() & jb1["db_id_in_job"].isNotNull())\
-.where((jb1["folder_path"].isNotNull()) & (jb1["folder_path"] != ""))\
-.groupBy(jb1["folder_path"], jb1["organization_id"], jb1["workspace_name"])\
-.agg(countDistinct(notebook["notebook_id"]).alias("Notebook_Count"))\
-.limit(10)\
-.toPandas() 
+JobsNotebook1 = master.cached_pandas("notebook.JobsNotebook1", build_JobsNotebook1, cache_sources, **cache_params) 
 
 fig = px.bar(JobsNotebook1,
              x = "folder_path",
@@ -505,18 +450,17 @@ fig.show()
 # Notebook Efficiency (most inefficient i.e. sorted -- top 40)
 # Disk / Memory spill (stacked bar by notebook) (lower is better) (desc)
 
-NotebookSpills = sparkMaster\
-.groupBy(sparkMaster["folder_path"], sparkMaster["organization_id"], sparkMaster["workspace_name"])\
-.agg((sum(col('MemoryBytesSpilled'))/1000000000).alias("MemorySpilled (GB)")
-    ,(sum(col('DiskBytesSpilled'))/1000000000).alias("DiskSpilled (GB)")
-    )\
-.where(col("folder_path") != "")
+NotebookSpills = master.lazy_frame(lambda: folder_metrics()\
+.select("folder_path", "organization_id", "workspace_name"
+       ,(col("memory_bytes_spilled")/1000000000).alias("MemorySpilled (GB)")
+       ,(col("disk_bytes_spilled")/1000000000).alias("DiskSpilled (GB)")
+       )\
+.where(col("folder_path") != ""))
 
-NBTotalSpills = NotebookSpills\
-.withColumn("TotalSpills (GB)", (NotebookSpills["MemorySpilled (GB)"] + NotebookSpills["DiskSpilled (GB)"]))\
+NBTotalSpills = master.cached_pandas("notebook.NBTotalSpills", lambda: NotebookSpills()\
+.withColumn("TotalSpills (GB)", (NotebookSpills()["MemorySpilled (GB)"] + NotebookSpills()["DiskSpilled (GB)"]))\
 .orderBy(col("TotalSpills (GB)").desc())\
-.limit(10)\
-.toPandas()
+.limit(10), cache_sources, **cache_params)
 
 fig = px.bar(NBTotalSpills,
              x = "folder_path",
@@ -533,39 +477,21 @@ fig.show()
 
 # COMMAND ----------
 
-display(NotebookSpills)
+display(master.cached_pandas("notebook.NotebookSpills", NotebookSpills, cache_sources, **cache_params))
 
 # COMMAND ----------
 
 # Notebook Efficiency (most inefficient i.e. sorted -- top 40)  
 # Processing speed (MB/sec) -- (read+shuffled+written) (mb) / taskRuntime (sec) (higher is better) (P0)
 
-ProcessSpeed = sparkMaster\
-.groupBy(sparkMaster["folder_path"], sparkMaster["organization_id"], sparkMaster["workspace_name"])\
-.agg(
-  round(((
-  sum(sparkMaster.task_metrics.ShuffleReadMetrics.LocalBytesRead)
-    + sum(sparkMaster.task_metrics.ShuffleReadMetrics.RemoteBytesRead)
-    + sum(sparkMaster.task_metrics.ShuffleReadMetrics.RemoteBytesReadToDisk)
-    + sum(sparkMaster.task_metrics.ShuffleWriteMetrics.ShuffleBytesWritten)
-    + sum(sparkMaster.task_metrics.ShuffleWriteMetrics.ShuffleRecordsWritten)
-    + sum(sparkMaster.task_metrics.ShuffleWriteMetrics.ShuffleWriteTime)
-  )/1000000),2).alias("TotalShuffle (MBs)")
-,
-  round(((
-    sum(sparkMaster.task_metrics.InputMetrics.BytesRead)
-     + sum(sparkMaster.task_metrics.InputMetrics.RecordsRead)
-  )/1000000), 2).alias("TotalReads (MBs)")
-,
-  round(((
-    sum(sparkMaster.task_metrics.OutputMetrics.BytesWritten)
-     + (sum(sparkMaster.task_metrics.OutputMetrics.RecordsWritten))
-  )/1000000), 2).alias("TotalWrites (MBs)")
-,
-  round((sum(sparkMaster.task_runtime.runTimeS)),2).alias("TaskRunTime (sec)")    #take nanoseconds
-)
+ProcessSpeed = master.lazy_frame(lambda: folder_metrics()\
+.select("folder_path", "organization_id", "workspace_name",
+        round(col("shuffle_total")/1000000, 2).alias("TotalShuffle (MBs)"),
+        round(col("read_total")/1000000, 2).alias("TotalReads (MBs)"),
+        round(col("write_total")/1000000, 2).alias("TotalWrites (MBs)"),
+        round(col("runtime_s"), 2).alias("TaskRunTime (sec)")))
 
-ProcessSpeedDF = ProcessSpeed\
+ProcessSpeedDF = master.cached_pandas("notebook.ProcessSpeedDF", lambda: ProcessSpeed()\
 .withColumn('ProcessSpeed (MB/sec)',
             round(((col("TotalShuffle (MBs)") + col("TotalReads (MBs)") + col("TotalWrites (MBs)"))/(col("TaskRunTime (sec)"))), 2)
            )\
@@ -573,8 +499,7 @@ ProcessSpeedDF = ProcessSpeed\
   (col("ProcessSpeed (MB/sec)")>0) 
 )\
 .orderBy(col("ProcessSpeed (MB/sec)").asc())\
-.limit(10)\
-.toPandas()cccccbgfbkbrbiucnruhcjligndiutjkjrfffeicubek
+.limit(10), cache_sources, **cache_params)
 
 
 fig = px.bar(ProcessSpeedDF,
@@ -596,27 +521,13 @@ display(ProcessSpeedDF)
 
 # COMMAND ----------
 
-Notebook_failedJobs = sparkMaster\
-.where(
-  (sparkMaster["job_result.Result"] == "JobFailed")
-  & ((col("task_info.Failed") == True) | (col("task_info.Killed") == True))
-  & ((col("task_info.speculative") == False))  
-  & ((col("folder_path") != ""))
-  )\
-.withColumn("Failed_Count", when(((col("task_info.Failed") == True) | (col("task_info.Killed") == True)), lit(1)).otherwise(lit(0)))
-
-JobRuntime = Notebook_failedJobs\
-.groupBy(Notebook_failedJobs["folder_path"]
-         ,Notebook_failedJobs["organization_id"]
-         ,Notebook_failedJobs["workspace_name"]
-        )\
-.agg(
-  round(avg(Notebook_failedJobs["task_runtime.runTimeH"]), 2).alias("AvgRunTimeH")
- ,  round(sum(Notebook_failedJobs["Failed_Count"]), 2).alias("Failed_Count")
-  )\
+JobRuntime = master.cached_pandas("notebook.JobRuntime", lambda: folder_metrics()\
+.where((col("folder_path") != "") & (col("failed_task_count") > 0))\
+.select("folder_path", "organization_id", "workspace_name",
+        round(col("failed_runtime_h") / col("failed_runtime_count"), 2).alias("AvgRunTimeH"),
+        col("failed_task_count").alias("Failed_Count"))\
 .orderBy(col("AvgRunTimeH").desc())\
-.limit(10)\
-.toPandas()
+.limit(10), cache_sources, **cache_params)
 
 fig = px.bar(JobRuntime,
              x = "folder_path",
@@ -642,18 +553,16 @@ display(JobRuntime)
 # Notebook Efficiency (most inefficient i.e. sorted -- top 40)
 # Serde time (stacked bar - ExecutorDeserializeTime + ResultSerializationTime)(minutes) (lower is better) (P0)
 
-SerdeTime = sparkMaster\
+SerdeTime = master.cached_pandas("notebook.SerdeTime", lambda: folder_metrics()\
 .where(col("folder_path") != '')\
-.where(col("db_job_id").isNull())\
-.groupBy(sparkMaster["folder_path"], sparkMaster["organization_id"], sparkMaster["workspace_name"])\
-.agg(
-  round(sum("task_metrics.ExecutorDeserializeTime"), 2).alias("ExecutorDeserializeTime")
- ,round(sum("task_metrics.ResultSerializationTime"), 2).alias("ResultSerializationTime")
-)\
+.where(col("interactive_task_count") > 0)\
+.select("folder_path", "organization_id", "workspace_name"
+       ,round(col("interactive_deserialize_time"), 2).alias("ExecutorDeserializeTime")
+       ,round(col("interactive_serialization_time"), 2).alias("ResultSerializationTime")
+       )\
 .withColumn("Serde_Time (mins)", (col("ExecutorDeserializeTime") + col("ResultSerializationTime")))\
 .orderBy(col("Serde_Time (mins)").desc())\
-.limit(10)\
-.toPandas()
+.limit(10), cache_sources, **cache_params)
 
 fig = px.bar(SerdeTime,
              x = "folder_path",
@@ -677,20 +586,16 @@ display(SerdeTime)
 
 # Most popular (distinct users) notebooks -- top 10 -- bar chart 
 
-DistinctUserNB = sparkMaster\
+DistinctUserNB = master.cached_pandas("notebook.DistinctUserNB", lambda: folder_metrics()\
 .where((col("folder_path") != '')
-      & (col("db_job_id").isNull()))\
-.groupBy(sparkMaster["folder_path"]
-         ,sparkMaster["organization_id"]
-         ,sparkMaster["workspace_name"])\
-.agg(
-  round(sum("task_runtime.runTimeH"), 2).alias("runTimeH")
- ,countDistinct("notebook_id").alias("Notebook_Count")
- ,countDistinct("user_email").alias("Distinct_Users")
- )\
+      & (col("interactive_task_count") > 0))\
+.select("folder_path", "organization_id", "workspace_name"
+       ,round(col("interactive_runtime_h"), 2).alias("runTimeH")
+       ,col("interactive_notebook_count").alias("Notebook_Count")
+       ,col("interactive_user_count").alias("Distinct_Users")
+       )\
 .orderBy(col("Distinct_Users").desc())\
-.limit(10)\
-.toPandas()
+.limit(10), cache_sources, **cache_params)
 
 fig = px.bar(DistinctUserNB,
              x = "folder_path",
@@ -713,16 +618,15 @@ display(DistinctUserNB)
 
 # COMMAND ----------
 
-NBComputeHrs = sparkMaster\
-.where((col("folder_path") != '')
+NBComputeHrs = master.cached_pandas("notebook.NBComputeHrs", lambda: sparkMaster()\
+.where(col("notebook_path").isNotNull() & (col("notebook_path") != '')
       & col("db_job_id").isNull())\
-.groupBy(sparkMaster["organization_id"], sparkMaster["workspace_name"], sparkMaster["date"])\
+.groupBy(sparkMaster()["organization_id"], sparkMaster()["workspace_name"], sparkMaster()["date"])\
 .agg(
   round(sum("task_runtime.runTimeH"), 2).alias("runTimeH")
  )\
 .orderBy(col("runTimeH").desc())\
-.limit(50)\
-.toPandas()
+.limit(50), cache_sources, **cache_params)
 
 fig = px.box(
   NBComputeHrs,
@@ -742,15 +646,37 @@ display(NBComputeHrs)
 
 # COMMAND ----------
 
-NBExecutionID = sparkMaster\
-.where((col("folder_path") != '')
-      & col("db_job_id").isNull())\
-.groupBy(sparkMaster["organization_id"], sparkMaster["folder_path"], sparkMaster["workspace_name"])\
-.agg(countDistinct("execution_id").alias("execution_id"))\
+# Interactive notebook compute hours per workspace against the previous period of the same length, both periods read and aggregated together
+previous_start, previous_end = master.previous_period()
+interactive_notebook = col("notebook_path").isNotNull() & (col("notebook_path") != '') & col("db_job_id").isNull()
+NBComputeHrsComparison = master.cached_pandas("notebook.NBComputeHrsComparison", lambda: master.period_comparison("spark_notebook_master",
+                                                                                                                {"runTimeH": when(interactive_notebook, col("task_runtime.runTimeH"))},
+                                                                                                                ["organization_id", "workspace_name"],
+                                                                                                                includeWeekend = include_weekends,
+                                                                                                                onlyWeekend = only_weekends)\
+.orderBy(col("runTimeH_current").desc()), cache_sources, **cache_params)
+
+fig = px.bar(NBComputeHrsComparison.melt(id_vars = ["workspace_name", "runTimeH_delta_pct"],
+                                         value_vars = ["runTimeH_previous", "runTimeH_current"],
+                                         var_name = "period",
+                                         value_name = "runTimeH"),
+             x = "workspace_name",
+             y = "runTimeH",
+             color = "period",
+             barmode = "group",
+             hover_data = ["runTimeH_delta_pct"],
+             title = f"Notebook Compute Hours, {start_date} to {end_date} against {previous_start} to {previous_end}")
+
+fig.show()
+
+# COMMAND ----------
+
+NBExecutionID = master.cached_pandas("notebook.NBExecutionID", lambda: folder_metrics()\
+.where(col("folder_path") != '')\
+.select("organization_id", "folder_path", "workspace_name", col("interactive_execution_count").alias("execution_id"))\
 .where(col("execution_id") > 1)\
 .orderBy(col("execution_id").desc())\
-.limit(10)\
-.toPandas()
+.limit(10), cache_sources, **cache_params)
 
 fig = px.bar(NBExecutionID,
              x = "folder_path",
@@ -773,15 +699,14 @@ display(NBExecutionID)
 
 # COMMAND ----------
 
-ShuffleExplosion = nb_throughput\
-.where(nb_throughput["folder_path"] != '')\
-.withColumn("Explosion_Ratio", (round((col("TotalWrites (GBs)")/col("TotalReads (GBs)")),2)))
+ShuffleExplosion = master.lazy_frame(lambda: nb_throughput()\
+.where(nb_throughput()["folder_path"] != '')\
+.withColumn("Explosion_Ratio", (round((col("TotalWrites (GBs)")/col("TotalReads (GBs)")),2))))
 
-ExplosionRatio = ShuffleExplosion\
+ExplosionRatio = master.cached_pandas("notebook.ExplosionRatio", lambda: ShuffleExplosion()\
 .where(col("Explosion_Ratio").isNotNull() & (col("Explosion_Ratio") > 0))\
 .orderBy(col("Explosion_Ratio").desc())\
-.limit(10)\
-.toPandas()
+.limit(10), cache_sources, **cache_params)
 
 fig = px.bar(ExplosionRatio,
              x = "folder_path",
@@ -804,6 +729,61 @@ display(ExplosionRatio)
 
 # COMMAND ----------
 
+# MAGIC %md
+# MAGIC ### Chargeback
+# MAGIC > As a budget owner I want the cost of the shared interactive clusters split between the users and notebook folders running on them, in proportion to their Spark task runtime
+
+# COMMAND ----------
+
+# Daily cluster costs allocated to users and notebooks (finance can query the same snapshot table)
+chargeback = master.lazy_frame(lambda: master.snapshot("chargeback", includeWeekend = include_weekends, onlyWeekend = only_weekends)\
+.where(col("cluster_category") == "Interactive"))
+
+ChargebackUsers = master.cached_pandas("notebook.ChargebackUsers", lambda: master.chargeback_rollup(chargeback(), ["user_email", "workspace_name"])\
+.orderBy(col("allocated_cost").desc())\
+.limit(20), ["chargeback"], **cache_params)
+
+display(ChargebackUsers)
+
+# COMMAND ----------
+
+fig = px.bar(ChargebackUsers,
+             x = "user_email",
+             y = "allocated_cost",
+             color = "workspace_name",
+             hover_data = ["task_runtime_h", "allocated_dbu_cost", "allocated_compute_cost"],
+             title = "Interactive cluster cost charged back per user (top 20)")
+
+fig = fig.update_layout(
+    xaxis_title = "User",
+    yaxis_title = "Allocated cost (USD)",
+)
+
+fig.show()
+
+# COMMAND ----------
+
+ChargebackFolders = master.cached_pandas("notebook.ChargebackFolders", lambda: master.chargeback_rollup(chargeback(), ["folder_path", "workspace_name"], folderLevel = folder_level)\
+.where(col("folder_path") != "")\
+.orderBy(col("allocated_cost").desc())\
+.limit(20), ["chargeback"], **cache_params)
+
+fig = px.bar(ChargebackFolders,
+             x = "folder_path",
+             y = "allocated_cost",
+             color = "workspace_name",
+             hover_data = ["task_runtime_h", "allocated_dbu_cost", "allocated_compute_cost"],
+             title = "Interactive cluster cost charged back per folder (top 20)")
+
+fig = fig.update_layout(
+    xaxis_title = "Path",
+    yaxis_title = "Allocated cost (USD)",
+)
+
+fig.show()
+
+# COMMAND ----------
+
 # MAGIC %md
 # MAGIC ## TESTING
 
@@ -811,17 +791,23 @@ display(ExplosionRatio)
 
 # Jobs Executing on Notebooks (count)
 
-jobrun = spark.sql("select job_id from {}.jobrun where task_type in ('notebook','pipeline','python')".format(consumerDB))
+def build_JobsNotebook_2():
+  jobrun = spark.sql("select job_id from {}.jobrun where task_type in ('notebook','pipeline','python')".format(consumerDB))
 
-jb = jobrun.join(sparkMaster, jobrun['job_id'] == sparkMaster['db_job_id'], "inner")
+  # Notebook paths run by the jobs, cached before the path depth is applied so a new depth only re-joins small frames
+  jb = jobrun.join(sparkMaster(), jobrun['job_id'] == sparkMaster()['db_job_id'], "inner")\
+  .where(sparkMaster()["db_job_id"].isNotNull() & sparkMaster()["db_id_in_job"].isNotNull())\
+  .select("notebook_path", "organization_id", "workspace_name")\
+  .distinct()\
+  .cache()
+  jb = master.with_folder_path(jb, folder_level)
+  return jb.join(notebook(), notebook().folder_path == jb.folder_path, "inner")\
+  .where((jb["folder_path"].isNotNull()) & (jb["folder_path"] != ""))\
+  .groupBy(jb["folder_path"], jb["organization_id"], jb["workspace_name"])\
+  .agg(countDistinct(notebook()["notebook_id"]).alias("Notebook_Count"))\
+  .limit(10)
 
-JobsNotebook = jb.join(notebook, notebook.folder_path == jb.folder_path, "inner")\
-.where(jb["db_job_id"].isNotNull() & jb["db_id_in_job"].isNotNull())\
-.where((jb["folder_path"].isNotNull()) & (jb["folder_path"] != ""))\
-.groupBy(jb["folder_path"], jb["organization_id"], jb["workspace_name"])\
-.agg(countDistinct(notebook["notebook_id"]).alias("Notebook_Count"))\
-.limit(10)\
-.toPandas() 
+JobsNotebook = master.cached_pandas("notebook.JobsNotebook_2", build_JobsNotebook_2, cache_sources, **cache_params) 
 
 fig = px.bar(JobsNotebook,
              x = "folder_path",
@@ -842,18 +828,23 @@ fig.show()
 
 # Jobs Executing on Notebooks (count)
 
-jobrun = spark.sql("select job_id from {}.jobrun where task_type not in ('notebook','pipeline','python')".format(consumerDB))
-
-jb1 = jobrun.join(sparkMaster, jobrun['job_id'] == sparkMaster['db_job_id'], "inner")
-
-
-JobsNotebook1 = jb1.join(notebook, notebook.folder_path == jb1.folder_path, "inner")\
-.where(jb1["db_job_id"].isNotNull() & jb1["db_id_in_job"].isNotNull())\
-.where((jb1["folder_path"].isNotNull()) & (jb1["folder_path"] != ""))\
-.groupBy(jb1["folder_path"], jb1["organization_id"], jb1["workspace_name"])\
-.agg(countDistinct(notebook["notebook_id"]).alias("Notebook_Count"))\
-.limit(10)\
-.toPandas() 
+def build_JobsNotebook1_2():
+  jobrun = spark.sql("select job_id from {}.jobrun where task_type not in ('notebook','pipeline','python')".format(consumerDB))
+
+  # Notebook paths run by the jobs, cached before the path depth is applied so a new depth only re-joins small frames
+  jb1 = jobrun.join(sparkMaster(), jobrun['job_id'] == sparkMaster()['db_job_id'], "inner")\
+  .where(sparkMaster()["db_job_id"].isNotNull() & sparkMaster()["db_id_in_job"].isNotNull())\
+  .select("notebook_path", "organization_id", "workspace_name")\
+  .distinct()\
+  .cache()
+  jb1 = master.with_folder_path(jb1, folder_level)
+  return jb1.join(notebook(), notebook().folder_path == jb1.folder_path, "inner")\
+  .where((jb1["folder_path"].isNotNull()) & (jb1["folder_path"] != ""))\
+  .groupBy(jb1["folder_path"], jb1["organization_id"], jb1["workspace_name"])\
+  .agg(countDistinct(notebook()["notebook_id"]).alias("Notebook_Count"))\
+  .limit(10)
+
+JobsNotebook1 = master.cached_pandas("notebook.JobsNotebook1_2", build_JobsNotebook1_2, cache_sources, **cache_params) 
 
 fig = px.bar(JobsNotebook1,
              x = "folder_path",
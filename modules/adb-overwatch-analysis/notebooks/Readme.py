@@ -35,6 +35,57 @@
 # MAGIC 
 # MAGIC 1. Plotly 
 # MAGIC 2. Overwatch Latest Library "com.databricks.labs:overwatch_2.12:latest"
+# MAGIC 3. overwatch_analysis (helpers and master classes, `python/` folder of this module). Terraform uploads it next to these notebooks, it can also be built as a wheel (`pip wheel ./python`) for jobs and other clusters
+# MAGIC 
+# MAGIC Databricks Runtime 13.3 LTS or above is recommended (HyperLogLog distinct counts, see `distinct_sketches` below), older runtimes count the distinct ids exactly
+
+# COMMAND ----------
+
+# MAGIC %md
+# MAGIC ## Master snapshots:
+# MAGIC 
+# MAGIC The dashboards read their master dataframes from Delta snapshots (`<ETL DB>.<Consumer DB>_<master>_snapshot`) instead of rebuilding them from the consumer tables.
+# MAGIC - The first run builds the snapshot for the selected dates, later runs only add the new days
+# MAGIC - When an Overwatch run changes a source table, the last 2 days are recomputed (`snapshotLookbackDays`), and for the fact tables (clusterstatefact, jobruncostpotentialfact, sparkTask, sparkJob) every day from the oldest day the run rewrote, read from the Delta commits of the table (the whole snapshot when that day is unknown)
+# MAGIC - Changes of the dimension tables (cluster, job, jobRun) only reach the recomputed days: after renaming or re-tagging older clusters or jobs, run a full refresh
+# MAGIC - Refresh history and source table versions are kept in `<ETL DB>.master_snapshot_log`
+# MAGIC - Use `masters.refresh_snapshot("<master>", fullRefresh=True)` to rebuild a snapshot from scratch
+# MAGIC - `cluster_daily_cost` holds the cluster costs and core hours spread over the days of each state (one row per date and cluster), the daily cluster charts read it instead of exploding `state_dates`
+# MAGIC - `cluster_transitions` holds the starts, resizes, restarts and failures of every cluster with their previous / next state, start latency, scale direction and hours since the previous failure, ordered once per cluster. The stability and autoscaling charts filter it instead of the cluster master, `masters.cluster_mtbf(transitions, ["node_type_id"])` returns the mean time between failures
+# MAGIC - `concurrency_timeline` holds the live clusters, cores and concurrent job runs per minute, workspace and category (set the bucket with `master(..., concurrencyBucketMinutes=<n>)`, then run a full refresh), built with a sweep line over the state and run start / end times. `masters.concurrency_peaks(timeline, ["workspace_name"], period="hour")` returns the peaks and 95th percentiles
+# MAGIC - `chargeback` holds the daily cost of every cluster split between the users and notebooks that ran Spark tasks on it, in proportion to their task runtime (cluster-days without tasks stay on an "Unallocated" row). It is partitioned by date and organization_id and can be queried directly by finance, `masters.chargeback_rollup(chargeback, ["folder_path"], folderLevel=3)` sums it per folder
+# MAGIC - `cluster_tag_index` holds one row per day, cluster and custom tag (tag_key, tag_value), the tag widgets and the tag count chart look clusters up there instead of parsing `custom_tags`
+# MAGIC - The Notebook dashboard aggregates the task metrics once for every path depth (`notebook_folder_rollup`, depths 1 to 10, set with `master(..., maxPathDepth=<n>)`), changing the "Path depth" widget only filters that cached frame
+# MAGIC - `distinct_sketches` holds daily HyperLogLog sketches of the cluster, job, run, execution, notebook and user ids, `masters.distinct_count("<entity>", groupBy=[...])` merges them over the selected dates and workspaces (job count by workspace, scheduled jobs). The error bound is set with `master(..., distinctErrorBound=0.02)`, `exactDistinctCounts="Yes"` or `exact=True` counts the consumer tables instead. The sketch functions need Spark 3.5 (Databricks Runtime 13.3 LTS and above), on older runtimes the distinct counts are exact
+# MAGIC - Run `masters.refresh_snapshot("task_metrics")` once to materialize a flat task metrics table (partitioned by date and organization_id), the Notebook dashboard then reads it instead of the nested sparkTask columns
 
 # COMMAND ----------
 
+# MAGIC %md
+# MAGIC ## Period comparison:
+# MAGIC 
+# MAGIC `masters.period_comparison("<snapshot>", {"<measure>": "<column>"}, ["<group by>"])` compares the widget window with the previous period of the same length (or `previousStartDate` / `previousEndDate`). The snapshot is read once over both periods and each measure gets `_current`, `_previous`, `_delta` and `_delta_pct` columns from the same aggregation. The Cluster (DBU spend), Jobs (cost of failure) and Notebook (compute hours) dashboards chart it per workspace.
+
+# COMMAND ----------
+
+# MAGIC %md
+# MAGIC ## Box charts:
+# MAGIC 
+# MAGIC The box charts are drawn from precomputed statistics (`masters.box_stats`: count, mean, approximate quartiles, Tukey whiskers, outlier count and a sample of the furthest outliers) with `box_figure` from the Helpers notebook, so the chart payload is one row per box whatever the number of days and workspaces. The daily job cost percentiles use `masters.quantiles` (one `percentile_approx` aggregation).
+
+# COMMAND ----------
+
+# MAGIC %md
+# MAGIC ## Idle clusters:
+# MAGIC 
+# MAGIC The Cluster dashboard charts the DBU cost of the interactive clusters while no Spark task was running (`masters.cluster_idle_time`). The sparkTask start / end times of each cluster are merged into busy periods and matched with the RUNNING and RESIZING states per time bin (15 minutes, set with `master(..., idleBinMinutes=<n>)`), the idle hours and idle cost are reported per cluster and day. The Benchmark notebook compares it with a plain interval join at 3 sparkTask sizes.
+
+# COMMAND ----------
+
+# MAGIC %md
+# MAGIC ## Result cache:
+# MAGIC 
+# MAGIC The pandas frame of every chart cell is cached as Parquet (`/dbfs/tmp/overwatch_analysis/result_cache`), keyed by the cell, its code, the widget values and the Delta versions of the consumer tables it reads.
+# MAGIC - Re-viewing a dashboard with unchanged widgets and sources reads the frames from the cache, the chart queries are not run again
+# MAGIC - Least recently used entries are evicted above 500 entries or 2 GB
+# MAGIC - Use `master(..., resultCache="No")` to always recompute, or `resultCacheDir="<path>"` to cache somewhere else
@@ -0,0 +1,311 @@
+# Databricks notebook source
+# MAGIC %md
+# MAGIC # Read Me
+# MAGIC >
+# MAGIC - **Writes synthetic Overwatch ETL / consumer tables with the columns and types read by the Helpers notebook**
+# MAGIC - **Used by the Benchmark notebook (`%run "./SyntheticData"`) and by the pytest suite of `python/tests` (local Spark session), the scale is set by the constructor arguments**
+# MAGIC - **Every table is written in the given database, your Overwatch databases are never read or written**
+# MAGIC
+# MAGIC Tables written:
+# MAGIC | # | Table | Rows
+# MAGIC | ----------- | ----------- | ----------- |
+# MAGIC | 1 | pipeline_report | workspaces
+# MAGIC | 2 | cluster | workspaces x clusters
+# MAGIC | 3 | clusterstatefact | workspaces x clusters x days
+# MAGIC | 4 | job | workspaces x jobs
+# MAGIC | 5 | jobRun | workspaces x jobs x days
+# MAGIC | 6 | jobruncostpotentialfact | workspaces x jobs x days
+# MAGIC | 7 | notebook | workspaces x notebooks
+# MAGIC | 8 | sparkJob | workspaces x days x spark jobs per day
+# MAGIC | 9 | sparkTask | workspaces x days x spark jobs per day x tasks per job
+
+# COMMAND ----------
+
+import pyspark.sql.functions as F
+from datetime import date, timedelta
+import pandas as pd
+import pyspark
+
+# COMMAND ----------
+
+class synthetic_overwatch:
+
+  cluster_types = ["Standard", "Standard", "Serverless", "SQL Analytics", "Single Node", "Standard"]
+  node_types = ["Standard_DS3_v2", "Standard_DS4_v2", "Standard_E8s_v3", "i3.xlarge", "m5d.2xlarge", "r5d.4xlarge"]
+  stages_per_spark_job = 3
+
+  def __init__(self, _db, **kwargs):
+    self.db = _db
+    self.workspaces = kwargs.get("workspaces", 10)
+    self.days = kwargs.get("days", 30)
+    self.clusters = kwargs.get("clustersPerWorkspace", 20)
+    self.jobs = kwargs.get("jobsPerWorkspace", 20)
+    self.notebooks = kwargs.get("notebooksPerWorkspace", 50)
+    self.spark_jobs_per_day = kwargs.get("sparkJobsPerDay", 100)
+    self.tasks_per_job = kwargs.get("tasksPerJob", 20)
+    self.end_date = pd.to_datetime(kwargs.get("endDate", date.today())).date()
+    self.start_date = self.end_date - timedelta(days=self.days - 1)
+    self.seed = kwargs.get("seed", 42)
+
+  def workspace_names(self) -> list:
+    return [f"workspace_{w}" for w in range(self.workspaces)]
+
+  def grid(self, **dimensions) -> pyspark.sql.dataframe.DataFrame:
+    """
+    Returns one row per combination of the dimensions (name=size), each dimension as an integer column,
+    plus organization_id and workspace_name when a "w" dimension is given.
+    """
+    total = 1
+    for size in dimensions.values():
+      total *= size
+    df = spark.range(total)
+    divisor = 1
+    for name, size in reversed(list(dimensions.items())):
+      df = df.withColumn(name, ((F.col("id") / divisor).cast("long") % size).cast("int"))
+      divisor *= size
+    if "w" in dimensions:
+      df = df\
+        .withColumn("organization_id", (F.col("w") + 1000000000).cast("string"))\
+        .withColumn("workspace_name", F.concat(F.lit("workspace_"), F.col("w")))
+    return df
+
+  def day(self, day_column="d"):
+    return F.date_add(F.lit(str(self.start_date)).cast("date"), F.col(day_column))
+
+  def noise(self, salt):
+    return F.rand(seed=self.seed + salt)
+
+  def pipeline_report(self) -> pyspark.sql.dataframe.DataFrame:
+    return self.grid(w=self.workspaces)\
+      .select("organization_id",
+              "workspace_name",
+              F.struct(F.struct(F.when(F.col("w") % 2 == 0, F.struct(F.lit("Endpoint=sb://synthetic/").alias("connectionString")))
+                              .alias("azureAuditLogEventhubConfig")).alias("auditLogConfig")).alias("inputConfig"),
+              F.lit("SUCCESS").alias("status"),
+              F.current_timestamp().alias("Pipeline_SnapTS"))
+
+  def cluster(self) -> pyspark.sql.dataframe.DataFrame:
+    cluster_type = F.element_at(F.array(*[F.lit(t) for t in self.cluster_types]), (F.col("c") % len(self.cluster_types) + 1).cast("int"))
+    node_type = F.element_at(F.array(*[F.lit(t) for t in self.node_types]), (F.col("c") % len(self.node_types) + 1).cast("int"))
+    return self.grid(w=self.workspaces, c=self.clusters)\
+      .select("organization_id",
+              "workspace_name",
+              F.concat_ws("-", F.col("w"), F.col("c")).alias("cluster_id"),
+              F.when(F.col("c") % 2 == 0, F.concat(F.lit("job-"), F.col("c"), F.lit("-run-"), F.col("w"))).otherwise(F.concat(F.lit("cluster_"), F.col("c"))).alias("cluster_name"),
+              F.concat(F.lit("user"), F.col("c") % 7, F.lit("@example.com")).alias("created_by"),
+              F.concat(F.lit("user"), F.col("c") % 5, F.lit("@example.com")).alias("last_edited_by"),
+              F.lit(None).cast("string").alias("deleted_by"),
+              node_type.alias("driver_node_type"),
+              node_type.alias("node_type"),
+              F.when(F.col("c") % 3 == 0, F.struct(F.lit(1).alias("min_workers"), F.lit(8).alias("max_workers"))).alias("autoscale"),
+              (F.col("c") % 2 == 0).alias("is_automated"),
+              cluster_type.alias("cluster_type"),
+              F.when(F.col("c") % 4 == 0, F.lit(None)).otherwise(F.lit(60)).cast("int").alias("auto_termination_minutes"),
+              F.when(F.col("c") % 5 == 0, F.concat(F.lit("pool-"), F.col("w"))).alias("instance_pool_id"),
+              F.when(F.col("c") % 5 == 0, F.concat(F.lit("pool_"), F.col("w"))).alias("instance_pool_name"))
+
+  def clusterstatefact(self) -> pyspark.sql.dataframe.DataFrame:
+    uptime = F.round(self.noise(1) * 24, 2)
+    workers = (self.noise(2) * 8).cast("int") + 1
+    dbu_cost = F.round(self.noise(3) * 50, 2)
+    compute_cost = F.round(self.noise(4) * 80, 2)
+    node_type = F.element_at(F.array(*[F.lit(t) for t in self.node_types]), (F.col("c") % len(self.node_types) + 1).cast("int"))
+    return self.grid(w=self.workspaces, c=self.clusters, d=self.days)\
+      .withColumn("state_start_date", self.day())\
+      .withColumn("unixTimeMS_state_start", F.unix_timestamp(F.col("state_start_date").cast("timestamp")) * 1000)\
+      .select("organization_id",
+              "workspace_name",
+              F.concat_ws("-", F.col("w"), F.col("c")).alias("cluster_id"),
+              F.when(F.col("c") % 2 == 0, F.concat(F.lit("job-"), F.col("c"), F.lit("-run-"), F.col("w"))).otherwise(F.concat(F.lit("cluster_"), F.col("c"))).alias("cluster_name"),
+              F.to_json(F.create_map(F.lit("JobId"), F.col("c").cast("string"),
+                                 F.lit("SqlEndpointId"), F.when(F.col("c") % len(self.cluster_types) == 3, F.concat(F.lit("endpoint-"), F.col("c"))),
+                                 F.lit("Owner"), F.concat(F.lit("user"), F.col("c") % 7, F.lit("@example.com")),
+                                 F.lit("team"), F.concat(F.lit("team_"), F.col("c") % 4))).alias("custom_tags"),
+              (F.col("c") % 2 == 0).alias("isAutomated"),
+              F.when(self.noise(5) < 0.05, F.lit("TERMINATING")).otherwise(F.lit("RUNNING")).alias("state"),
+              "state_start_date",
+              F.array(F.col("state_start_date")).alias("state_dates"),
+              F.lit(1).alias("days_in_state"),
+              "unixTimeMS_state_start",
+              (F.col("unixTimeMS_state_start") + (uptime * 3600000).cast("long")).alias("unixTimeMS_state_end"),
+              uptime.alias("uptime_in_state_H"),
+              workers.alias("current_num_workers"),
+              workers.alias("target_num_workers"),
+              node_type.alias("driver_node_type_id"),
+              node_type.alias("node_type_id"),
+              F.when(self.noise(6) < 0.9, F.round(self.noise(7) * 64, 2)).alias("worker_potential_core_H"),
+              F.round(self.noise(8) * 96, 2).alias("core_hours"),
+              compute_cost.alias("total_compute_cost"),
+              dbu_cost.alias("total_DBU_cost"),
+              F.round(compute_cost * 0.8, 2).alias("total_worker_cost"),
+              (compute_cost + dbu_cost).alias("total_cost"))
+
+  def job(self) -> pyspark.sql.dataframe.DataFrame:
+    return self.grid(w=self.workspaces, j=self.jobs)\
+      .select("organization_id",
+              "workspace_name",
+              (F.col("w") * self.jobs + F.col("j")).cast("long").alias("job_id"),
+              F.concat(F.lit("job_"), F.col("j")).alias("job_name"),
+              F.array(F.struct(F.struct(F.concat(F.lit("/Repos/team_"), F.col("j") % 4, F.lit("/project_"), F.col("j") % 8, F.lit("/etl_"), F.col("j")).alias("notebook_path"))
+                           .alias("notebook_task"))).alias("tasks"),
+              F.concat(F.lit("user"), F.col("j") % 7, F.lit("@example.com")).alias("created_by"))
+
+  def job_runs(self) -> pyspark.sql.dataframe.DataFrame:
+    """
+    Returns one run per job and day with the columns shared by jobRun and jobruncostpotentialfact.
+    """
+    runtime_h = F.round(self.noise(11) * 3, 3)
+    return self.grid(w=self.workspaces, j=self.jobs, d=self.days)\
+      .withColumn("startTS", (self.day().cast("timestamp").cast("long") + (self.noise(12) * 86000).cast("long")).cast("timestamp"))\
+      .withColumn("runTimeH", runtime_h)\
+      .withColumn("job_id", (F.col("w") * self.jobs + F.col("j")).cast("long"))\
+      .withColumn("run_id", F.col("id"))\
+      .withColumn("cluster_id", F.concat_ws("-", F.col("w"), (F.col("j") % self.clusters)))\
+      .withColumn("cluster_type", F.when(F.col("j") % 5 == 0, F.lit("interactive")).otherwise(F.lit("job_cluster")))
+
+  def jobRun(self) -> pyspark.sql.dataframe.DataFrame:
+    return self.job_runs()\
+      .select("organization_id", "workspace_name", "run_id", "job_id", "cluster_id", "cluster_type",
+              F.element_at(F.array(F.lit("notebook"), F.lit("python"), F.lit("jar"), F.lit("pipeline")), (F.col("j") % 4 + 1).cast("int")).alias("task_type"))
+
+  def jobruncostpotentialfact(self) -> pyspark.sql.dataframe.DataFrame:
+    dbu_cost = F.round(self.noise(13) * 20, 2)
+    compute_cost = F.round(self.noise(14) * 30, 2)
+    return self.job_runs()\
+      .select("organization_id",
+              "workspace_name",
+              "job_id",
+              "run_id",
+              F.concat(F.lit("job_"), F.col("j")).alias("job_name"),
+              F.struct(F.col("startTS"),
+                     (F.col("startTS").cast("long") + (F.col("runTimeH") * 3600).cast("long")).cast("timestamp").alias("endTS"),
+                     (F.col("runTimeH") * 3600).alias("runTimeS"),
+                     F.col("runTimeH")).alias("task_runtime"),
+              F.element_at(F.array(F.lit("notebook"), F.lit("python"), F.lit("jar"), F.lit("pipeline")), (F.col("j") % 4 + 1).cast("int")).alias("task_type"),
+              "cluster_id",
+              F.concat(F.lit("job-"), F.col("j"), F.lit("-run-"), F.col("run_id")).alias("cluster_name"),
+              F.when(self.noise(15) < 0.1, F.lit("Failed")).otherwise(F.lit("Succeeded")).alias("terminal_state"),
+              F.round(self.noise(16) * 32, 2).alias("worker_potential_core_H"),
+              compute_cost.alias("total_compute_cost"),
+              dbu_cost.alias("total_dbu_cost"),
+              (compute_cost + dbu_cost).alias("total_cost"),
+              F.concat(F.lit("user"), F.col("j") % 7, F.lit("@example.com")).alias("created_by"),
+              F.concat(F.lit("user"), F.col("j") % 5, F.lit("@example.com")).alias("last_edited_by"),
+              F.round(self.noise(17), 2).alias("job_run_cluster_util"),
+              F.when(F.col("j") % 3 == 0, F.lit("manual")).otherwise(F.lit("cron")).alias("job_trigger_type"))
+
+  def notebook(self) -> pyspark.sql.dataframe.DataFrame:
+    return self.grid(w=self.workspaces, n=self.notebooks)\
+      .select("organization_id",
+              "workspace_name",
+              (F.col("w") * self.notebooks + F.col("n")).cast("long").alias("notebook_id"),
+              F.concat(F.lit("notebook_"), F.col("n")).alias("notebook_name"),
+              F.concat(F.lit("/Users/user"), F.col("n") % 7, F.lit("@example.com/folder_"), F.col("n") % 5, F.lit("/sub_"), F.col("n") % 3, F.lit("/notebook_"), F.col("n")).alias("notebook_path"),
+              F.lit("createNotebook").alias("action"),
+              F.lit(str(self.start_date)).cast("date").alias("date"))
+
+  def spark_jobs(self) -> pyspark.sql.dataframe.DataFrame:
+    """
+    Returns one row per workspace, day and spark job with the keys shared by sparkJob and sparkTask.
+    A spark context lives one day on one cluster, its spark job j owns the stages j*stages_per_spark_job + 0..stages_per_spark_job-1.
+    """
+    return self.grid(w=self.workspaces, d=self.days, s=self.spark_jobs_per_day)\
+      .withColumn("date", self.day())\
+      .withColumn("cluster_id", F.concat_ws("-", F.col("w"), (F.col("s") % self.clusters)))\
+      .withColumn("spark_context_id", F.concat(F.lit("context-"), F.col("d"), F.lit("-"), F.col("s") % self.clusters))\
+      .withColumn("job_id", (F.col("s") / self.clusters).cast("long"))\
+      .withColumn("timestamp", F.unix_timestamp(F.col("date").cast("timestamp")) * 1000 + F.col("s") * 1000)\
+      .withColumn("n", F.col("s") % self.notebooks)
+
+  def sparkJob(self) -> pyspark.sql.dataframe.DataFrame:
+    stages = self.stages_per_spark_job
+    return self.spark_jobs()\
+      .select("organization_id",
+              "workspace_name",
+              "cluster_id",
+              "spark_context_id",
+              "job_id",
+              "date",
+              "timestamp",
+              F.when(F.col("n") % 2 == 0, (F.col("w") * self.jobs + F.col("n") % self.jobs).cast("long")).alias("db_job_id"),
+              F.when(F.col("n") % 2 == 0, F.col("id")).alias("db_id_in_job"),
+              (F.col("w") * self.notebooks + F.col("n")).cast("long").alias("notebook_id"),
+              F.concat(F.lit("/Users/user"), F.col("n") % 7, F.lit("@example.com/folder_"), F.col("n") % 5, F.lit("/sub_"), F.col("n") % 3, F.lit("/notebook_"), F.col("n")).alias("notebook_path"),
+              F.concat(F.lit("execution-"), F.col("id") % 997).alias("execution_id"),
+              F.struct(F.col("timestamp").alias("startEpochMS"),
+                     (F.col("timestamp") + 60000).alias("endEpochMS"),
+                     F.lit(60.0).alias("runTimeS")).alias("job_runtime"),
+              F.struct(F.when(self.noise(21) < 0.05, F.lit("JobFailed")).otherwise(F.lit("JobSucceeded")).alias("Result")).alias("job_result"),
+              F.concat(F.lit("user"), F.col("n") % 7, F.lit("@example.com")).alias("user_email"),
+              F.sequence(F.col("job_id") * stages, F.col("job_id") * stages + stages - 1).alias("stage_ids"))
+
+  def sparkTask(self) -> pyspark.sql.dataframe.DataFrame:
+    stages = self.stages_per_spark_job
+    bytes_metric = lambda salt, scale: (self.noise(salt) * scale).cast("long")
+    tasks = self.spark_jobs()\
+      .withColumn("t", F.explode(F.sequence(F.lit(0), F.lit(self.tasks_per_job - 1))))
+    runtime_s = F.round(self.noise(31) * 120, 3)
+    return tasks\
+      .select("organization_id",
+              "workspace_name",
+              "cluster_id",
+              "spark_context_id",
+              (F.col("job_id") * stages + F.col("t") % stages).alias("stage_id"),
+              F.lit(0).alias("stage_attempt_id"),
+              (F.col("id") * self.tasks_per_job + F.col("t")).alias("task_id"),
+              F.lit(0).alias("task_attempt_id"),
+              "date",
+              "timestamp",
+              F.struct(F.struct(bytes_metric(32, 5e7).alias("LocalBytesRead"),
+                            bytes_metric(33, 5e7).alias("RemoteBytesRead"),
+                            bytes_metric(34, 1e6).alias("RemoteBytesReadToDisk")).alias("ShuffleReadMetrics"),
+                     F.struct(bytes_metric(35, 5e7).alias("ShuffleBytesWritten"),
+                            bytes_metric(36, 1e5).alias("ShuffleRecordsWritten"),
+                            bytes_metric(37, 1e8).alias("ShuffleWriteTime")).alias("ShuffleWriteMetrics"),
+                     F.struct(bytes_metric(38, 2e8).alias("BytesRead"),
+                            bytes_metric(39, 1e6).alias("RecordsRead")).alias("InputMetrics"),
+                     F.struct(bytes_metric(40, 1e8).alias("BytesWritten"),
+                            bytes_metric(41, 5e5).alias("RecordsWritten")).alias("OutputMetrics"),
+                     bytes_metric(42, 1e6).alias("ResultSize"),
+                     bytes_metric(43, 500).alias("ExecutorDeserializeTime"),
+                     bytes_metric(44, 50).alias("ResultSerializationTime"),
+                     F.when(self.noise(45) < 0.1, bytes_metric(46, 1e9)).otherwise(F.lit(0)).alias("MemoryBytesSpilled"),
+                     F.when(self.noise(47) < 0.05, bytes_metric(48, 1e9)).otherwise(F.lit(0)).alias("DiskBytesSpilled")).alias("task_metrics"),
+              F.struct(F.col("timestamp").alias("startEpochMS"),
+                     (F.col("timestamp") + (runtime_s * 1000).cast("long")).alias("endEpochMS"),
+                     runtime_s.alias("runTimeS"),
+                     F.round(runtime_s / 3600, 6).alias("runTimeH")).alias("task_runtime"),
+              F.struct((self.noise(49) < 0.02).alias("Failed"),
+                     (self.noise(50) < 0.01).alias("Killed"),
+                     (self.noise(51) < 0.03).alias("Speculative")).alias("task_info"))
+
+  def write_tables(self, **kwargs) -> dict:
+    """
+    Writes every synthetic table as a Delta table of the database and returns the row count of each.
+
+            Parameters:
+                    tables (list): Tables to write, defaults to all of them
+                    format (str): Table format, defaults to delta (parquet for local Spark sessions without Delta, as in the tests)
+
+            Returns:
+                    dict: table -> row count
+
+            Example:
+                    synthetic_overwatch("overwatch_synthetic", workspaces=100, days=90).write_tables()
+    """
+    partitions = {"clusterstatefact": ["organization_id"],
+                  "jobruncostpotentialfact": ["organization_id"],
+                  "sparkJob": ["organization_id", "date"],
+                  "sparkTask": ["organization_id", "date"]}
+    tables = kwargs.get("tables", ["pipeline_report", "cluster", "clusterstatefact", "job", "jobRun",
+                                   "jobruncostpotentialfact", "notebook", "sparkJob", "sparkTask"])
+    table_format = kwargs.get("format", "delta")
+    spark.sql(f"create database if not exists {self.db}")
+    counts = {}
+    for table in tables:
+      writer = getattr(self, table)().write.format(table_format).mode("overwrite").option("overwriteSchema", "true")
+      if table in partitions:
+        writer = writer.partitionBy(*partitions[table])
+      writer.saveAsTable(f"{self.db}.{table}")
+      counts[table] = spark.table(f"{self.db}.{table}").count()
+    return counts
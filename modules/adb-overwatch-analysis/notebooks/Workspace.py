@@ -47,12 +47,18 @@ consumerDB = str(dbutils.widgets.get("consumerDB"))
 
 # COMMAND ----------
 
-fetch_Name = spark.sql(f"select distinct workspace_name from {etlDB}.pipeline_report").rdd.flatMap(lambda x: x).collect()+["all"]
+from pyspark.sql.functions import *
+import pyspark.sql.functions as F
+from datetime import date, timedelta
+
+# COMMAND ----------
+
+fetch_Name = workspace_catalog.get(etlDB).workspace_names()+["all"]
 dbutils.widgets.multiselect("workspace_name","all",fetch_Name, "4. Workspace Name")
 
 # COMMAND ----------
 
-workspaceName =  spark.sql(f"select distinct workspace_name from {etlDB}.pipeline_report").rdd.flatMap(lambda x: x).collect() if 'all' in dbutils.widgets.get("workspace_name").split(',') else dbutils.widgets.get("workspace_name").split(',')
+workspaceName =  workspace_catalog.get(etlDB).workspace_names() if 'all' in dbutils.widgets.get("workspace_name").split(',') else dbutils.widgets.get("workspace_name").split(',')
 
 # COMMAND ----------
 
@@ -74,14 +80,20 @@ only_weekends = dbutils.widgets.get("only_weekends")
 
 # COMMAND ----------
 
-masters = master(etlDB, consumerDB, workspaceName,start_date,end_date)
+masters = master(etlDB, consumerDB, workspaceName,start_date,end_date, includeWeekend = include_weekends, onlyWeekend = only_weekends)
 
 # COMMAND ----------
 
-cluster_master = masters.cluster_master_filter(includeWeekend = include_weekends,onlyWeekend = only_weekends)
-job_master = masters.job_test_filter(includeWeekend = include_weekends,
-                                       onlyWeekend = only_weekends,
-                                       dateColumn="job_start_date")
+# Master frames are built on first use inside a cell missing the result cache, a dashboard read from the cache refreshes no snapshot
+cluster_master = masters.lazy_frame(lambda: masters.snapshot("cluster_master", includeWeekend = include_weekends,onlyWeekend = only_weekends))
+job_master = masters.lazy_frame(lambda: masters.snapshot("job_master", includeWeekend = include_weekends,onlyWeekend = only_weekends))
+# Cluster costs already spread over the days of each state, one row per date and cluster
+daily_cost = masters.lazy_frame(lambda: masters.snapshot("cluster_daily_cost", includeWeekend = include_weekends,onlyWeekend = only_weekends)\
+.withColumnRenamed("date", "state_start_date"))
+# Tables the charted frames are read from, their versions are part of the result cache key
+cache_sources = ["cluster_master", "job_master", "cluster_daily_cost", "cluster_tag_index", "distinct_sketches"]
+# Widget values the charted frames depend on, part of the result cache key with the workspaces and dates
+cache_params = {"includeWeekend": include_weekends, "onlyWeekend": only_weekends}
 
 # COMMAND ----------
 
@@ -90,32 +102,26 @@ job_master = masters.job_test_filter(includeWeekend = include_weekends,
 
 # COMMAND ----------
 
-costByDate = cluster_master\
-.groupBy(["state_start_date", "organization_id",
-          "workspace_name", "cluster_id"])\
-.agg(round(sum(cluster_master["total_dbu_cost"]/cluster_master["days_in_state"]), 2).alias("cost_by_date"))\
-.groupBy(["state_start_date", "organization_id",
-          "workspace_name"])\
-.agg(round(sum(col("cost_by_date")), 2).alias("DBU_Cost (USD)"))\
-.orderBy(col('DBU_Cost (USD)').desc())
-
-# costByDate.loc[costByDate['DBU_Cost (USD)'] < 3,'workspace_name'] = 'Other Types'
-
-windowDept = Window.partitionBy("state_start_date").orderBy(col("DBU_Cost (USD)").desc())
-costByDate_p = costByDate.withColumn("row",row_number().over(windowDept)) \
-  .filter(col("row") <= 20)
+def build_costByDate():
+  costByDate = daily_cost()\
+  .groupBy(["state_start_date", "organization_id",
+            "workspace_name", "cluster_id"])\
+  .agg(round(sum("total_dbu_cost"), 2).alias("cost_by_date"))\
+  .groupBy(["state_start_date", "organization_id",
+            "workspace_name"])\
+  .agg(round(sum(col("cost_by_date")), 2).alias("DBU_Cost (USD)"))\
+  .orderBy(col('DBU_Cost (USD)').desc())
 
-top20Workspaces = costByDate.join(costByDate_p, ((costByDate.state_start_date == costByDate_p.state_start_date) & (costByDate.organization_id == costByDate_p.organization_id) & (costByDate.workspace_name == costByDate_p.workspace_name)), 'left')\
-.select(costByDate['*'], col('row'))
+  # costByDate.loc[costByDate['DBU_Cost (USD)'] < 3,'workspace_name'] = 'Other Types'
 
-top20Workspaces_p = top20Workspaces.withColumn('organization_id', expr("case when row is null then 'Others' else organization_id end"))\
-.withColumn('workspace_name', expr("case when row is null then 'Others' else workspace_name end"))\
-.groupby('state_start_date', 'organization_id', 'workspace_name')\
-.agg(round(sum(col('DBU_Cost (USD)')), 2).alias('DBU_Cost (USD)'))\
-.orderBy(col('DBU_Cost (USD)').desc())
+  return costByDate\
+  .transform(masters.top_k_with_others("DBU_Cost (USD)", ["organization_id", "workspace_name"], 20, partitionBy=["state_start_date"]))\
+  .groupby('state_start_date', 'organization_id', 'workspace_name')\
+  .agg(round(sum(col('DBU_Cost (USD)')), 2).alias('DBU_Cost (USD)'))\
+  .orderBy(col('DBU_Cost (USD)').desc())
 
 # Converting pyspark to pandas for visualization
-costByDate_pandas = top20Workspaces_p.toPandas()
+costByDate_pandas = masters.cached_pandas("workspace.costByDate_pandas", build_costByDate, cache_sources, **cache_params)
 
 
 fig = px.bar(costByDate_pandas, 
@@ -137,27 +143,22 @@ fig.show()
 
 # COMMAND ----------
 
-costByOrg = cluster_master\
-.groupBy(["organization_id",
-          "workspace_name"])\
-.agg(round(sum(cluster_master["total_dbu_cost"]), 2).alias("DBU_Cost (USD)"))\
-.orderBy(col('DBU_Cost (USD)').desc())
-
-top20 = costByOrg\
-.withColumn('row', lit('Nan'))\
-.limit(20)
-
-top20Workspaces = costByOrg.join(top20, top20['organization_id'] == costByOrg['organization_id'], 'left')\
-.select(costByOrg['*'], 'row')
+def build_costByOrg():
+  costByOrg = masters.cost_cube(groupBy=["organization_id",
+                                        "workspace_name"])\
+  .select("organization_id",
+          "workspace_name",
+          round(col("total_DBU_cost"), 2).alias("DBU_Cost (USD)"))\
+  .orderBy(col('DBU_Cost (USD)').desc())
 
-top20_p = top20Workspaces.withColumn('organization_id', expr("case when row is null then 'Others' else organization_id end"))\
-.withColumn('workspace_name', expr("case when row is null then 'Others' else workspace_name end"))\
-.groupby('organization_id', 'workspace_name')\
-.agg(round(sum(col('DBU_Cost (USD)')), 2).alias('DBU_Cost (USD)'))\
-.orderBy(col('DBU_Cost (USD)').desc())
+  return costByOrg\
+  .transform(masters.top_k_with_others("DBU_Cost (USD)", ["organization_id", "workspace_name"], 20))\
+  .groupby('organization_id', 'workspace_name')\
+  .agg(round(sum(col('DBU_Cost (USD)')), 2).alias('DBU_Cost (USD)'))\
+  .orderBy(col('DBU_Cost (USD)').desc())
 
 # Converting pyspark to pandas for visualization
-costByOrg_pandas = top20_p.toPandas()
+costByOrg_pandas = masters.cached_pandas("workspace.costByOrg_pandas", build_costByOrg, cache_sources, **cache_params)
 
 
 # Plotting dataframe view using plotly library
@@ -178,39 +179,35 @@ fig.show()
 
 # COMMAND ----------
 
-costByType = cluster_master\
-.groupBy(["organization_id",
-          "workspace_name"])\
-.agg(round(sum(cluster_master["total_dbu_cost"]), 2).alias("DBU_Cost (USD)"), 
-     round(sum(cluster_master["total_compute_cost"]), 2).alias("Compute_Cost (USD)"))\
-.orderBy(col('DBU_Cost (USD)').desc())
-
-top20 = costByType\
-.withColumn('row', lit('Nan'))\
-.limit(20)
-
-top20Workspaces = costByType.join(top20, top20['organization_id'] == costByType['organization_id'], 'left')\
-.select(costByType['*'], 'row')
-
-top20_p = top20Workspaces.withColumn('organization_id', expr("case when row is null then 'Others' else organization_id end"))\
-.withColumn('workspace_name', expr("case when row is null then 'Others' else workspace_name end"))\
-.groupby('organization_id', 'workspace_name')\
-.agg(round(sum(col('DBU_Cost (USD)')), 2).alias('DBU_Cost (USD)'),
-     round(sum(col('Compute_Cost (USD)')), 2).alias('Compute_Cost (USD)'))
-
-costMap = top20_p.withColumn("costMap",create_map(
-        lit("DBU_Cost (USD)"),col("DBU_Cost (USD)"),
-        lit("Compute_Cost (USD)"),col("Compute_Cost (USD)")
-        )).drop("DBU_Cost (USD)","Compute_Cost (USD)")\
-    .select(
-    "organization_id",
-    "workspace_name",
-    F.explode("costMap").alias("Cost Type", "Cost (USD)"),
-)\
-.orderBy(col('DBU_Cost (USD)').desc())
+def build_costMap():
+  costByType = masters.cost_cube(groupBy=["organization_id",
+                                         "workspace_name"])\
+  .select("organization_id",
+          "workspace_name",
+          round(col("total_DBU_cost"), 2).alias("DBU_Cost (USD)"), 
+          round(col("total_compute_cost"), 2).alias("Compute_Cost (USD)"))\
+  .orderBy(col('DBU_Cost (USD)').desc())
+
+  top20_p = costByType\
+  .transform(masters.top_k_with_others("DBU_Cost (USD)", ["organization_id", "workspace_name"], 20))\
+  .groupby('organization_id', 'workspace_name')\
+  .agg(round(sum(col('DBU_Cost (USD)')), 2).alias('DBU_Cost (USD)'),
+       round(sum(col('Compute_Cost (USD)')), 2).alias('Compute_Cost (USD)'))
+
+  costMap = top20_p.withColumn("costMap",create_map(
+          lit("DBU_Cost (USD)"),col("DBU_Cost (USD)"),
+          lit("Compute_Cost (USD)"),col("Compute_Cost (USD)")
+          )).drop("DBU_Cost (USD)","Compute_Cost (USD)")\
+      .select(
+      "organization_id",
+      "workspace_name",
+      F.explode("costMap").alias("Cost Type", "Cost (USD)"),
+  )\
+  .orderBy(col('DBU_Cost (USD)').desc())
+  return costMap
 
 # Converting pyspark to pandas for visualization
-costMap_pandas = costMap.toPandas()
+costMap_pandas = masters.cached_pandas("workspace.costMap_pandas", build_costMap, cache_sources, **cache_params)
 
 # # Plotting dataframe view using plotly library
 fig = px.bar(costMap_pandas, 
@@ -232,85 +229,70 @@ fig.show()
 
 # COMMAND ----------
 
-# Obtain the total cost of clusters by category on daily basis on each workspace
-costByType = cluster_master\
-.withColumn('cluster_type', 
-            expr("case when isAutomated = 'false' and SqlEndpointId is null then 'interactive'" 
-                 + "when isAutomated = 'true' then 'automated'" 
-                 + "when SqlEndpointId is not null then 'SQL' else cluster_name end"))\
-.groupBy(["state_start_date", 
-          "organization_id",
-          "workspace_name",
-          "cluster_category",
-          "cluster_id"])\
-.agg(round(sum(cluster_master["total_dbu_cost"]/cluster_master["days_in_state"]), 2).alias("cost_by_date"))\
-.groupBy(["state_start_date",
-          "organization_id",
-          "workspace_name", 
-          "cluster_category"])\
-.agg(round(sum(col("cost_by_date")), 2).alias("DBU_Cost"),
-     countDistinct('cluster_id').alias('cluster_count'))\
-.filter(col('cluster_category').isNotNull())
-
-# Calculate the worksapce cost on every day
-costByType_p = costByType.withColumn('costMap', create_map(col('cluster_category'), col('DBU_Cost')))\
-.withColumn('countMap', create_map(col('cluster_category'), col('cluster_count')))\
-.groupBy(["state_start_date", 
-          "organization_id", 
-          "workspace_name"])\
-.agg(round(sum(col("DBU_Cost")), 2).alias("DBU_Cost (USD)"), 
-     collect_list(col('DBU_Cost')).alias('cost_by_type'), 
-     collect_list(col('costMap')).alias('cost'),
-     collect_list(col('countMap')).alias('cluster_count'))\
-.orderBy(col('DBU_Cost (USD)').desc())
-
-# Limit the workspaces to top 20 costing more
-windowDept = Window.partitionBy("state_start_date")\
-.orderBy(col("DBU_Cost (USD)").desc())
-
-costByDate_p = costByType_p\
-.withColumn("row",row_number().over(windowDept))\
-.filter(col("row") <= 20)
-
-# Grouping all the other workspaces apart from top 20 to Others category
-top20Workspaces = costByType_p\
-.join(costByDate_p, ((costByType_p.state_start_date == costByDate_p.state_start_date) & (costByType_p.organization_id == costByDate_p.organization_id) & (costByType_p.workspace_name == costByDate_p.workspace_name)), 'left')\
-.select(costByType_p['*'], 
-        col('row'))
-
-top20Workspaces_p = top20Workspaces\
-.withColumn('organization_id', expr("case when row is null then 'Others' else organization_id end"))\
-.withColumn('workspace_name', expr("case when row is null then 'Others' else workspace_name end"))\
-.select(
-    "state_start_date",
-    "organization_id",
-    "workspace_name",
-    explode(top20Workspaces.cost).alias("mapClusterTypes"),
-    "cluster_count"
-)
-
-# Calculate the clusters cost by category
-top20 = top20Workspaces_p\
-.withColumn('cluster_type', map_keys(col("mapClusterTypes"))[0])\
-.withColumn('Cost (USD)', map_values(col('mapClusterTypes'))[0])\
-.groupby('state_start_date', 
-         'organization_id', 
-         'workspace_name', 
-         'cluster_type')\
-.agg(round(sum(col('Cost (USD)')), 2).alias('DBU_Cost (USD)'))\
-.orderBy(col('DBU_Cost (USD)').desc())
+# Top 20 workspaces of each day with their cost and cluster count per cluster type, also charted by the cluster count cell below
+def build_typeWorkspaces():
+  # Obtain the total cost of clusters by category on daily basis on each workspace
+  costByType = daily_cost()\
+  .groupBy(["state_start_date", 
+            "organization_id",
+            "workspace_name",
+            "cluster_category",
+            "cluster_id"])\
+  .agg(round(sum("total_dbu_cost"), 2).alias("cost_by_date"))\
+  .groupBy(["state_start_date",
+            "organization_id",
+            "workspace_name", 
+            "cluster_category"])\
+  .agg(round(sum(col("cost_by_date")), 2).alias("DBU_Cost"),
+       countDistinct('cluster_id').alias('cluster_count'))\
+  .filter(col('cluster_category').isNotNull())
+
+  # Calculate the worksapce cost on every day
+  costByType_p = costByType.withColumn('costMap', create_map(col('cluster_category'), col('DBU_Cost')))\
+  .withColumn('countMap', create_map(col('cluster_category'), col('cluster_count')))\
+  .groupBy(["state_start_date", 
+            "organization_id", 
+            "workspace_name"])\
+  .agg(round(sum(col("DBU_Cost")), 2).alias("DBU_Cost (USD)"), 
+       collect_list(col('DBU_Cost')).alias('cost_by_type'), 
+       collect_list(col('costMap')).alias('cost'),
+       collect_list(col('countMap')).alias('cluster_count'))\
+  .orderBy(col('DBU_Cost (USD)').desc())
+
+  # Limit the workspaces to top 20 costing more each day, the other workspaces are grouped in the Others category
+  return costByType_p\
+  .transform(masters.top_k_with_others("DBU_Cost (USD)", ["organization_id", "workspace_name"], 20, partitionBy=["state_start_date"]))
+
+typeWorkspaces = masters.lazy_frame(build_typeWorkspaces)
 
+def build_costByType():
+  top20Workspaces = typeWorkspaces()
+  top20Workspaces_p = top20Workspaces\
+  .select(
+      "state_start_date",
+      "organization_id",
+      "workspace_name",
+      explode(top20Workspaces.cost).alias("mapClusterTypes"),
+      "cluster_count"
+  )
+
+  # Calculate the clusters cost by category
+  top20 = top20Workspaces_p\
+  .withColumn('cluster_type', map_keys(col("mapClusterTypes"))[0])\
+  .withColumn('Cost (USD)', map_values(col('mapClusterTypes'))[0])\
+  .groupby('state_start_date', 
+           'organization_id', 
+           'workspace_name', 
+           'cluster_type')\
+  .agg(round(sum(col('Cost (USD)')), 2).alias('DBU_Cost (USD)'))\
+  .orderBy(col('DBU_Cost (USD)').desc())
+  return masters.box_stats(top20, "DBU_Cost (USD)", ["workspace_name", "cluster_type"])
 
 # Converting pyspark to pandas for visualization
-costByType_pandas = top20.toPandas()
+costByType_pandas = masters.cached_pandas("workspace.costByType_pandas", build_costByType, cache_sources, **cache_params)
 
-# Plotting dataframe view using plotly library
-fig = px.box(costByType_pandas, 
-             x = "workspace_name",
-             y = "DBU_Cost (USD)", 
-             color = 'cluster_type', hover_data=['state_start_date'],
-             title = "Cluster spend by type on each workspace",
-            points = "all")
+# Plotting dataframe view using plotly library (one precomputed box per workspace and cluster type)
+fig = box_figure(costByType_pandas, "workspace_name", "DBU_Cost (USD)", "Cluster spend by type on each workspace", color = "cluster_type")
 
 # # Visualizing the graph
 fig.show()
@@ -322,216 +304,135 @@ fig.show()
 
 # COMMAND ----------
 
-clusterCount = top20Workspaces\
-.withColumn('organization_id', expr("case when row is null then 'Others' else organization_id end"))\
-.withColumn('workspace_name', expr("case when row is null then 'Others' else workspace_name end"))\
-.select(
-    "state_start_date",
-    "organization_id",
-    "workspace_name",
-    explode(top20Workspaces.cluster_count).alias("mapClusterCount")
-)
-
-clusterCount_p = clusterCount\
-.withColumn('cluster_type', map_keys(col("mapClusterCount"))[0])\
-.withColumn('Cluster Count', map_values(col('mapClusterCount'))[0])\
-.groupby('state_start_date', 
-         'organization_id', 
-         'workspace_name', 
-         'cluster_type')\
-.agg(round(sum(col('Cluster Count')), 2).alias('cluster_count'))\
-.orderBy(col('cluster_count').desc())
+def build_countByType():
+  top20Workspaces = typeWorkspaces()
+  clusterCount = top20Workspaces\
+  .select(
+      "state_start_date",
+      "organization_id",
+      "workspace_name",
+      explode(top20Workspaces.cluster_count).alias("mapClusterCount")
+  )
 
+  clusterCount_p = clusterCount\
+  .withColumn('cluster_type', map_keys(col("mapClusterCount"))[0])\
+  .withColumn('Cluster Count', map_values(col('mapClusterCount'))[0])\
+  .groupby('state_start_date', 
+           'organization_id', 
+           'workspace_name', 
+           'cluster_type')\
+  .agg(round(sum(col('Cluster Count')), 2).alias('cluster_count'))\
+  .orderBy(col('cluster_count').desc())
+  return masters.box_stats(clusterCount_p, "cluster_count", ["workspace_name", "cluster_type"])
 
 # Converting pyspark to pandas for visualization
-countByType_pandas = clusterCount_p.toPandas()
+countByType_pandas = masters.cached_pandas("workspace.countByType_pandas", build_countByType, cache_sources, **cache_params)
 
-# Plotting dataframe view using plotly library
-fig = px.box(countByType_pandas, 
-             x = "workspace_name",
-             y = "cluster_count", 
-             color = 'cluster_type', hover_data=['state_start_date'],
-             title = "Cluster count by type on each workspace",
-            points = "all")
+# Plotting dataframe view using plotly library (one precomputed box per workspace and cluster type)
+fig = box_figure(countByType_pandas, "workspace_name", "cluster_count", "Cluster count by type on each workspace", color = "cluster_type")
 
 # # Visualizing the graph
 fig.show()
 
 # COMMAND ----------
 
-scheduledJobs = job_master\
-.filter(col('job_trigger_type') == 'cron')\
-.groupBy(["job_start_date", 
-          "organization_id",
-          "workspace_name"])\
-.agg(countDistinct(col('job_id')).alias('job_count'))\
-.orderBy(col('job_count').desc())
-
-windowDept = Window.partitionBy("job_start_date")\
-.orderBy(col("job_count").desc())
-
-costByDate_p = scheduledJobs\
-.withColumn("row",row_number().over(windowDept))\
-.filter(col("row") <= 20)
-
-top20Workspaces = scheduledJobs\
-.join(costByDate_p, ((scheduledJobs.job_start_date == costByDate_p.job_start_date) & (scheduledJobs.organization_id == costByDate_p.organization_id) & (scheduledJobs.workspace_name == costByDate_p.workspace_name)), 'left')\
-.select(scheduledJobs['*'], 
-        col('row'))
-
-top20Workspaces_p = top20Workspaces\
-.withColumn('organization_id', expr("case when row is null then 'Others' else organization_id end"))\
-.withColumn('workspace_name', expr("case when row is null then 'Others' else workspace_name end"))\
-.groupby('job_start_date', 
-         'organization_id', 
-         'workspace_name')\
-.agg(round(sum(col('job_count')), 2).alias('Job Count'))\
-.orderBy(col('Job Count').desc())
+def build_scheduledJobs():
+  # Distinct scheduled jobs per day, estimated from the daily sketches instead of the job master rows
+  scheduledJobs = masters.distinct_count("scheduled_job_id",
+                                         groupBy = ["date", "organization_id", "workspace_name"],
+                                         includeWeekend = include_weekends,
+                                         onlyWeekend = only_weekends)\
+  .select(col("date").alias("job_start_date"), "organization_id", "workspace_name", col("distinct_count").alias("job_count"))\
+  .orderBy(col('job_count').desc())
+
+  top20Workspaces_p = scheduledJobs\
+  .transform(masters.top_k_with_others("job_count", ["organization_id", "workspace_name"], 20, partitionBy=["job_start_date"]))\
+  .groupby('job_start_date', 
+           'organization_id', 
+           'workspace_name')\
+  .agg(round(sum(col('job_count')), 2).alias('Job Count'))\
+  .orderBy(col('Job Count').desc())
+  return masters.box_stats(top20Workspaces_p, "Job Count", ["workspace_name"])
 
 # Converting pyspark to pandas for visualization
-scheduledJobs_pandas = top20Workspaces_p.toPandas()
+scheduledJobs_pandas = masters.cached_pandas("workspace.scheduledJobs_pandas", build_scheduledJobs, cache_sources, **cache_params)
 
-# Plotting dataframe view using plotly library
-fig = px.box(scheduledJobs_pandas, 
-             x = "workspace_name",
-             y = "Job Count",
-             points = 'all',
-             hover_data=['job_start_date'],
-             color = "workspace_name", 
-             title = "Count of scheduled jobs on each workspace")
+# Plotting dataframe view using plotly library (one precomputed box per workspace)
+fig = box_figure(scheduledJobs_pandas, "workspace_name", "Job Count", "Count of scheduled jobs on each workspace", color = "workspace_name")
 
 # # Visualizing the graph
 fig.show()
 
 # COMMAND ----------
 
-jobsComputeTime = job_master\
-.filter(col('job_trigger_type') == 'cron')\
-.groupBy(["job_start_date", 
-          "organization_id",
-          "workspace_name"])\
-.agg(round(sum(job_master['runTimeH']), 2).alias('compute_time'))\
-.orderBy(col('compute_time').desc())
-
-windowDept = Window.partitionBy("job_start_date")\
-.orderBy(col("compute_time").desc())
-
-costByDate_p = jobsComputeTime\
-.withColumn("row",row_number().over(windowDept))\
-.filter(col("row") <= 20)
-
-top20Workspaces = jobsComputeTime\
-.join(costByDate_p, ((jobsComputeTime.job_start_date == costByDate_p.job_start_date) & (jobsComputeTime.organization_id == costByDate_p.organization_id) & (jobsComputeTime.workspace_name == costByDate_p.workspace_name)), 'left')\
-.select(jobsComputeTime['*'], 
-        col('row'))
-
-jobComputeTime = top20Workspaces\
-.withColumn('organization_id', expr("case when row is null then 'Others' else organization_id end"))\
-.withColumn('workspace_name', expr("case when row is null then 'Others' else workspace_name end"))\
-.groupby('job_start_date', 
-         'organization_id', 
-         'workspace_name')\
-.agg(round(sum(col('compute_time')), 2).alias('Compute Time (hrs)'))\
-.orderBy(col('Compute Time (hrs)').desc())
+def build_jobsComputeTime():
+  jobsComputeTime = job_master()\
+  .filter(col('job_trigger_type') == 'cron')\
+  .groupBy(["job_start_date", 
+            "organization_id",
+            "workspace_name"])\
+  .agg(round(sum(job_master()['runTimeH']), 2).alias('compute_time'))\
+  .orderBy(col('compute_time').desc())
+
+  jobComputeTime = jobsComputeTime\
+  .transform(masters.top_k_with_others("compute_time", ["organization_id", "workspace_name"], 20, partitionBy=["job_start_date"]))\
+  .groupby('job_start_date', 
+           'organization_id', 
+           'workspace_name')\
+  .agg(round(sum(col('compute_time')), 2).alias('Compute Time (hrs)'))\
+  .orderBy(col('Compute Time (hrs)').desc())
+  return masters.box_stats(jobComputeTime, "Compute Time (hrs)", ["workspace_name"])
 
 # Converting pyspark to pandas for visualization
-jobsComputeTime_pandas = jobComputeTime.toPandas()
+jobsComputeTime_pandas = masters.cached_pandas("workspace.jobsComputeTime_pandas", build_jobsComputeTime, cache_sources, **cache_params)
 
-# Plotting dataframe view using plotly library
-fig = px.box(jobsComputeTime_pandas, 
-             x = "workspace_name",
-             y = "Compute Time (hrs)",
-             hover_data = ['job_start_date'],
-             points='all',
-             color = "workspace_name", 
-             title = "Compute Time of scheduled jobs on each workspace")
+# Plotting dataframe view using plotly library (one precomputed box per workspace)
+fig = box_figure(jobsComputeTime_pandas, "workspace_name", "Compute Time (hrs)", "Compute Time of scheduled jobs on each workspace", color = "workspace_name")
 
 # # Visualizing the graph
 fig.show()
 
 # COMMAND ----------
 
-customTags = cluster_master.withColumn("job_id", (cluster_master["cluster_name"].substr(lit(1), instr(col("cluster_name"), 'run')-2)))\
-.withColumn("clusterName", expr("case when cluster_name like '%-run-%' then job_id else cluster_name end"))\
-.withColumn('JobId', json_tuple(col('custom_tags'), 'JobId'))\
-.withColumn('RunName', json_tuple(col('custom_tags'), 'RunName'))\
-.withColumn('KeepAlive', json_tuple(col('custom_tags'), 'KeepAlive'))\
-.withColumn('end_date ', json_tuple(col('custom_tags'), 'end_date '))\
-.withColumn('SqlEndpointId', json_tuple(col('custom_tags'), 'SqlEndpointId'))\
-.withColumn('dbsql-channel', json_tuple(col('custom_tags'), 'dbsql-channel'))\
-.withColumn('databricks-cloud', json_tuple(col('custom_tags'), 'databricks-cloud'))\
-.withColumn('databricks-cloud-priority', json_tuple(col('custom_tags'), 'databricks-cloud-priority'))\
-.withColumn('isTesting', json_tuple(col('custom_tags'), 'isTesting'))\
-.withColumn('test_new_tag', json_tuple(col('custom_tags'), 'test_new_tag'))\
-.withColumn('type', json_tuple(col('custom_tags'), 'type'))\
-.withColumn('OwnerEmail', json_tuple(col('custom_tags'), 'OwnerEmail'))\
-.withColumn('Owner', json_tuple(col('custom_tags'), 'Owner'))\
-.withColumn('cluster_type', json_tuple(col('custom_tags'), 'cluster_type'))
-
-costMap = customTags.withColumn("tagMap",create_map(
-        lit("JobId"),col("JobId"),
-        lit("RunName"),col("RunName"),
-        lit("KeepAlive"),col("KeepAlive"), 
-        lit("SqlEndpointId"),col("SqlEndpointId"), 
-        lit("dbsql-channel"),col("dbsql-channel"), 
-        lit("databricks-cloud"),col("databricks-cloud"), 
-        lit("databricks-cloud-priority"),col("databricks-cloud-priority"), 
-        lit("isTesting"),col("isTesting"), 
-        lit("test_new_tag"),col("test_new_tag"), 
-        lit("type"),col("type"), 
-        lit("OwnerEmail"),col("OwnerEmail"), 
-        lit("Owner"),col("Owner"), 
-        lit("cluster_type"),col("cluster_type")
-        ))\
-    .select(
-    "organization_id",
-    "workspace_name",
-    "clusterName",
-    F.explode("tagMap").alias("Tag Type", "Tag Value")
-)
-
-tagCount = costMap.where(col('Tag Value').isNotNull()).groupby("organization_id", "workspace_name", "Tag Type")\
-.agg(countDistinct(col('clusterName')).alias('Tag Count'))\
-.orderBy(col('workspace_name').desc(), col('Tag Count'))
-
-costByWorkspace = tagCount\
-.withColumn('tagMap', create_map(col('Tag Type'), col('Tag Count')))\
-.groupBy(["organization_id",		
-          "workspace_name"])\
-.agg(sum(col('Tag Count')).alias('workspace_tag_count'), collect_list(col('tagMap')).alias('tagCountByType'))\
-.orderBy(col('workspace_tag_count').desc())
-
-windowDept = Window\
-.orderBy(col("workspace_tag_count").desc())
-
-top20workspace = costByWorkspace\
-.withColumn("row",row_number().over(windowDept))\
-.filter(col("row") <= 20)
-
-top20Workspaces = costByWorkspace\
-.join(top20workspace, ((costByWorkspace.organization_id == top20workspace.organization_id) & (costByWorkspace.workspace_name == top20workspace.workspace_name)), 'left')\
-.select(costByWorkspace['*'], 		
-        col('row'))
-
-jobComputeTime = top20Workspaces\
-.withColumn('organization_id', expr("case when row is null then 'Others' else organization_id end"))\
-.withColumn('workspace_name', expr("case when row is null then 'Others' else workspace_name end"))\
-.select(		
-    "organization_id",		
-    "workspace_name",		
-    explode(top20Workspaces.tagCountByType).alias("mapTagTypes")		
-)		
-# Calculate the clusters cost by category		
-top20 = jobComputeTime\
-.withColumn('tag_type', map_keys(col("mapTagTypes"))[0])\
-.withColumn('tag_count', map_values(col('mapTagTypes'))[0])\
-.groupby('organization_id', 		
-         'workspace_name', 		
-         'tag_type')\
-.agg(sum(col('tag_count')).alias('Tag_Count'))\
-.orderBy(col('Tag_Count').desc())
-
-tagCount_pandas = top20.toPandas()
+def build_tagCount():
+  # Tag keys charted below, counted from the cluster tag index instead of parsing custom_tags
+  tag_keys = ["JobId", "RunName", "KeepAlive", "SqlEndpointId", "dbsql-channel", "databricks-cloud", "databricks-cloud-priority",
+              "isTesting", "test_new_tag", "type", "OwnerEmail", "Owner", "cluster_type"]
+
+  tagCount = masters.snapshot("cluster_tag_index", includeWeekend = include_weekends,onlyWeekend = only_weekends)\
+  .where(col('tag_key').isin(tag_keys) & col('tag_value').isNotNull())\
+  .groupby("organization_id", "workspace_name", col("tag_key").alias("Tag Type"))\
+  .agg(countDistinct(col('cluster_identity')).alias('Tag Count'))\
+  .orderBy(col('workspace_name').desc(), col('Tag Count'))
+
+  costByWorkspace = tagCount\
+  .withColumn('tagMap', create_map(col('Tag Type'), col('Tag Count')))\
+  .groupBy(["organization_id",		
+            "workspace_name"])\
+  .agg(sum(col('Tag Count')).alias('workspace_tag_count'), collect_list(col('tagMap')).alias('tagCountByType'))\
+  .orderBy(col('workspace_tag_count').desc())
+
+  top20Workspaces = costByWorkspace\
+  .transform(masters.top_k_with_others("workspace_tag_count", ["organization_id", "workspace_name"], 20))
+
+  jobComputeTime = top20Workspaces\
+  .select(		
+      "organization_id",		
+      "workspace_name",		
+      explode(top20Workspaces.tagCountByType).alias("mapTagTypes")		
+  )		
+  # Calculate the clusters cost by category		
+  top20 = jobComputeTime\
+  .withColumn('tag_type', map_keys(col("mapTagTypes"))[0])\
+  .withColumn('tag_count', map_values(col('mapTagTypes'))[0])\
+  .groupby('organization_id', 		
+           'workspace_name', 		
+           'tag_type')\
+  .agg(sum(col('tag_count')).alias('Tag_Count'))\
+  .orderBy(col('Tag_Count').desc())
+  return top20
+
+tagCount_pandas = masters.cached_pandas("workspace.tagCount_pandas", build_tagCount, cache_sources, **cache_params)
 new_df = tagCount_pandas.pivot(index='tag_type', columns='workspace_name')['Tag_Count'].fillna(0)
 
 fig = px.imshow(new_df, 
@@ -545,6 +446,11 @@ fig.show()
 
 # COMMAND ----------
 
+# Node type count and DBU cost of every cloud, aggregated once for the node type charts below
+node_rollup = masters.lazy_frame(lambda: masters.node_type_rollup(cluster_master()))
+
+# COMMAND ----------
+
 # MAGIC %md
 # MAGIC # AZURE ONLY
 # MAGIC Please skip the Azure code (24 & 25) if you are under AWS cloud and vice versa.
@@ -553,63 +459,44 @@ fig.show()
 
 try:
   
-  splitByCloud = spark.sql(f"select * from {etlDB}.pipeline_report")\
-  .withColumn('Cloud', expr("case when inputConfig.auditLogConfig.azureAuditLogEventhubConfig is null then 'AWS' else 'Azure' end"))\
-  .select('organization_id', 'workspace_name', 'Cloud').distinct()
-  
-  node_count = cluster_master\
-  .join(splitByCloud, cluster_master.organization_id == splitByCloud.organization_id, "left").select(cluster_master['*'], splitByCloud.Cloud)\
-  .withColumn("job_id", (cluster_master["cluster_name"].substr(lit(1), instr(col("cluster_name"), 'run')-2)))\
-  .withColumn("clusterName", expr("case when cluster_name like '%-run-%' then job_id else cluster_name end"))\
-  .withColumn('node_type', cluster_master['worker_node_type'])\
-  .where((splitByCloud['Cloud'] == 'Azure') & (col('node_type').isNotNull()))\
-  .groupBy(["organization_id",
+  def build_azure_node_count():
+    node_count = node_rollup()\
+    .where(col('Cloud') == 'Azure')\
+    .select("organization_id",
             "workspace_name",
-           "node_type"])\
-  .agg(countDistinct(col('clusterName')).alias('nodeType_count'))\
-  .orderBy(col('nodeType_count').desc())
-
-  countByWorkspace = node_count\
-  .withColumn('nodeMap', create_map(col('node_type'), col('nodeType_count')))\
-  .groupBy(["organization_id",
-            "workspace_name"])\
-  .agg(sum(col('nodeType_count')).alias('workspace_node_count'), collect_list(col('nodeMap')).alias('nodeCountByType'))\
-  .orderBy(col('workspace_node_count').desc())
-
-  windowDept = Window\
-  .orderBy(col("workspace_node_count").desc())
-
-  top20workspace = countByWorkspace\
-  .withColumn("row",row_number().over(windowDept))\
-  .filter(col("row") <= 20)
-
-
-  top20Workspaces = countByWorkspace\
-  .join(top20workspace, ((countByWorkspace.organization_id == top20workspace.organization_id) & (countByWorkspace.workspace_name == top20workspace.workspace_name)), 'left')\
-  .select(countByWorkspace['*'], 
-          col('row'))
-
-  jobComputeTime = top20Workspaces\
-  .withColumn('organization_id', expr("case when row is null then 'Others' else organization_id end"))\
-  .withColumn('workspace_name', expr("case when row is null then 'Others' else workspace_name end"))\
-  .select(
-      "organization_id",
-      "workspace_name",
-      explode(top20Workspaces.nodeCountByType).alias("mapNodeTypes")
-  )
+            "node_type",
+            col('cluster_count').alias('nodeType_count'))\
+    .orderBy(col('nodeType_count').desc())
 
-  # Calculate the clusters cost by category
-  top20 = jobComputeTime\
-  .withColumn('node_type', map_keys(col("mapNodeTypes"))[0])\
-  .withColumn('node_count', map_values(col('mapNodeTypes'))[0])\
-  .groupby('organization_id', 
-           'workspace_name', 
-           'node_type')\
-  .agg(sum(col('node_count')).alias('Node Count'))\
-  .orderBy(col('Node Count').desc())
+    countByWorkspace = node_count\
+    .withColumn('nodeMap', create_map(col('node_type'), col('nodeType_count')))\
+    .groupBy(["organization_id",
+              "workspace_name"])\
+    .agg(sum(col('nodeType_count')).alias('workspace_node_count'), collect_list(col('nodeMap')).alias('nodeCountByType'))\
+    .orderBy(col('workspace_node_count').desc())
 
+    top20Workspaces = countByWorkspace\
+    .transform(masters.top_k_with_others("workspace_node_count", ["organization_id", "workspace_name"], 20))
 
-  new_df_pandas = top20.toPandas()
+    jobComputeTime = top20Workspaces\
+    .select(
+        "organization_id",
+        "workspace_name",
+        explode(top20Workspaces.nodeCountByType).alias("mapNodeTypes")
+    )
+
+    # Calculate the clusters cost by category
+    top20 = jobComputeTime\
+    .withColumn('node_type', map_keys(col("mapNodeTypes"))[0])\
+    .withColumn('node_count', map_values(col('mapNodeTypes'))[0])\
+    .groupby('organization_id', 
+             'workspace_name', 
+             'node_type')\
+    .agg(sum(col('node_count')).alias('Node Count'))\
+    .orderBy(col('Node Count').desc())
+    return top20
+
+  new_df_pandas = masters.cached_pandas("workspace.new_df_pandas", build_azure_node_count, cache_sources, **cache_params)
   new_df = new_df_pandas.pivot(index='node_type', columns='workspace_name')['Node Count'].fillna(0)
 
   fig = px.imshow(new_df, 
@@ -631,60 +518,43 @@ except Exception as e:
 
 try:
 
-  splitByCloud = spark.sql(f"select * from {etlDB}.pipeline_report")\
-    .withColumn('Cloud', expr("case when inputConfig.auditLogConfig.azureAuditLogEventhubConfig is null then 'AWS' else 'Azure' end"))\
-    .select('organization_id', 'workspace_name', 'Cloud').distinct()
-
-  node_cost = cluster_master\
-  .join(splitByCloud, cluster_master.organization_id == splitByCloud.organization_id, "left").select(cluster_master['*'], splitByCloud.Cloud)\
-  .withColumn("job_id", (cluster_master["cluster_name"].substr(lit(1), instr(col("cluster_name"), 'run')-2)))\
-  .withColumn("clusterName", expr("case when cluster_name like '%-run-%' then job_id else cluster_name end"))\
-  .withColumn('node_type', cluster_master['worker_node_type'])\
-  .where((splitByCloud['Cloud'] == 'Azure') & (col('node_type').isNotNull()))\
-  .groupBy(["organization_id",
+  def build_azure_node_cost():
+    node_cost = node_rollup()\
+    .where(col('Cloud') == 'Azure')\
+    .select("organization_id",
             "workspace_name",
-           "node_type"])\
-  .agg(round(sum(cluster_master['total_dbu_cost']), 2).alias('DBU Cost(USD)'))\
-  .orderBy(col('DBU Cost(USD)').desc())
-
-  costByWorkspace = node_cost\
-  .withColumn('nodeMap', create_map(col('node_type'), col('DBU Cost(USD)')))\
-  .groupBy(["organization_id",		
-            "workspace_name"])\
-  .agg(sum(col('DBU Cost(USD)')).alias('workspace_node_cost'), collect_list(col('nodeMap')).alias('nodeCostByType'))\
-  .orderBy(col('workspace_node_cost').desc())
-
-  windowDept = Window\
-  .orderBy(col("workspace_node_cost").desc())
-
-  top20workspace = costByWorkspace\
-  .withColumn("row",row_number().over(windowDept))\
-  .filter(col("row") <= 20)
-
-  top20Workspaces = costByWorkspace\
-  .join(top20workspace, ((costByWorkspace.organization_id == top20workspace.organization_id) & (costByWorkspace.workspace_name == top20workspace.workspace_name)), 'left')\
-  .select(costByWorkspace['*'], 		
-          col('row'))
-
-  jobComputeTime = top20Workspaces\
-  .withColumn('organization_id', expr("case when row is null then 'Others' else organization_id end"))\
-  .withColumn('workspace_name', expr("case when row is null then 'Others' else workspace_name end"))\
-  .select(		
-      "organization_id",		
-      "workspace_name",		
-      explode(top20Workspaces.nodeCostByType).alias("mapNodeTypes")		
-  )		
-  # Calculate the clusters cost by category		
-  top20 = jobComputeTime\
-  .withColumn('node_type', map_keys(col("mapNodeTypes"))[0])\
-  .withColumn('node_cost', map_values(col('mapNodeTypes'))[0])\
-  .groupby('organization_id', 		
-           'workspace_name', 		
-           'node_type')\
-  .agg(sum(col('node_cost')).alias('Node Cost'))\
-  .orderBy(col('Node Cost').desc())
-
-  new_df_pandas = top20.toPandas()
+            "node_type",
+            col('dbu_cost').alias('DBU Cost(USD)'))\
+    .orderBy(col('DBU Cost(USD)').desc())
+
+    costByWorkspace = node_cost\
+    .withColumn('nodeMap', create_map(col('node_type'), col('DBU Cost(USD)')))\
+    .groupBy(["organization_id",		
+              "workspace_name"])\
+    .agg(sum(col('DBU Cost(USD)')).alias('workspace_node_cost'), collect_list(col('nodeMap')).alias('nodeCostByType'))\
+    .orderBy(col('workspace_node_cost').desc())
+
+    top20Workspaces = costByWorkspace\
+    .transform(masters.top_k_with_others("workspace_node_cost", ["organization_id", "workspace_name"], 20))
+
+    jobComputeTime = top20Workspaces\
+    .select(		
+        "organization_id",		
+        "workspace_name",		
+        explode(top20Workspaces.nodeCostByType).alias("mapNodeTypes")		
+    )		
+    # Calculate the clusters cost by category		
+    top20 = jobComputeTime\
+    .withColumn('node_type', map_keys(col("mapNodeTypes"))[0])\
+    .withColumn('node_cost', map_values(col('mapNodeTypes'))[0])\
+    .groupby('organization_id', 		
+             'workspace_name', 		
+             'node_type')\
+    .agg(sum(col('node_cost')).alias('Node Cost'))\
+    .orderBy(col('Node Cost').desc())
+    return top20
+
+  new_df_pandas = masters.cached_pandas("workspace.new_df_pandas_2", build_azure_node_cost, cache_sources, **cache_params)
   new_df = new_df_pandas.pivot(index='node_type', columns='workspace_name')['Node Cost'].fillna(0)
 
   fig = px.imshow(new_df, 
@@ -710,60 +580,43 @@ except Exception as e:
 
 try:
 
-  splitByCloud = spark.sql(f"select * from {etlDB}.pipeline_report")\
-    .withColumn('Cloud', expr("case when inputConfig.auditLogConfig.azureAuditLogEventhubConfig is null then 'AWS' else 'Azure' end"))\
-    .select('organization_id', 'workspace_name', 'Cloud').distinct()
-
-  node_count = cluster_master\
-  .join(splitByCloud, cluster_master.organization_id == splitByCloud.organization_id, "left").select(cluster_master['*'], splitByCloud.Cloud)\
-  .withColumn("job_id", (cluster_master["cluster_name"].substr(lit(1), instr(col("cluster_name"), 'run')-2)))\
-  .withColumn("clusterName", expr("case when cluster_name like '%-run-%' then job_id else cluster_name end"))\
-  .withColumn('node_type', cluster_master['worker_node_type'])\
-  .where((splitByCloud['Cloud'] == 'AWS') & (col('node_type').isNotNull()))\
-  .groupBy(["organization_id",
+  def build_aws_node_count():
+    node_count = node_rollup()\
+    .where(col('Cloud') == 'AWS')\
+    .select("organization_id",
             "workspace_name",
-           "node_type"])\
-  .agg(countDistinct(col('clusterName')).alias('nodeType_count'))\
-  .orderBy(col('nodeType_count').desc())
-
-  countByWorkspace = node_count\
-  .withColumn('nodeMap', create_map(col('node_type'), col('nodeType_count')))\
-  .groupBy(["organization_id",	
-            "workspace_name"])\
-  .agg(sum(col('nodeType_count')).alias('workspace_node_count'), collect_list(col('nodeMap')).alias('nodeCountByType'))\
-  .orderBy(col('workspace_node_count').desc())	
-
-  windowDept = Window\
-  .orderBy(col("workspace_node_count").desc())
-
-  top20workspace = countByWorkspace\
-  .withColumn("row",row_number().over(windowDept))\
-  .filter(col("row") <= 1)
-
-  top20Workspaces = countByWorkspace\
-  .join(top20workspace, ((countByWorkspace.organization_id == top20workspace.organization_id) & (countByWorkspace.workspace_name == top20workspace.workspace_name)), 'left')\
-  .select(countByWorkspace['*'], 	
-          col('row'))
-
-  jobComputeTime = top20Workspaces\
-  .withColumn('organization_id', expr("case when row is null then 'Others' else organization_id end"))\
-  .withColumn('workspace_name', expr("case when row is null then 'Others' else workspace_name end"))\
-  .select(	
-      "organization_id",	
-      "workspace_name",	
-      explode(top20Workspaces.nodeCountByType).alias("mapNodeTypes")	
-  )	
-  # Calculate the clusters cost by category	
-  top20 = jobComputeTime\
-  .withColumn('node_type', map_keys(col("mapNodeTypes"))[0])\
-  .withColumn('node_count', map_values(col('mapNodeTypes'))[0])\
-  .groupby('organization_id', 	
-           'workspace_name', 	
-           'node_type')\
-  .agg(sum(col('node_count')).alias('Node Count'))\
-  .orderBy(col('Node Count').desc())
-
-  new_df_pandas = top20.toPandas()
+            "node_type",
+            col('cluster_count').alias('nodeType_count'))\
+    .orderBy(col('nodeType_count').desc())
+
+    countByWorkspace = node_count\
+    .withColumn('nodeMap', create_map(col('node_type'), col('nodeType_count')))\
+    .groupBy(["organization_id",	
+              "workspace_name"])\
+    .agg(sum(col('nodeType_count')).alias('workspace_node_count'), collect_list(col('nodeMap')).alias('nodeCountByType'))\
+    .orderBy(col('workspace_node_count').desc())	
+
+    top20Workspaces = countByWorkspace\
+    .transform(masters.top_k_with_others("workspace_node_count", ["organization_id", "workspace_name"], 1))
+
+    jobComputeTime = top20Workspaces\
+    .select(	
+        "organization_id",	
+        "workspace_name",	
+        explode(top20Workspaces.nodeCountByType).alias("mapNodeTypes")	
+    )	
+    # Calculate the clusters cost by category	
+    top20 = jobComputeTime\
+    .withColumn('node_type', map_keys(col("mapNodeTypes"))[0])\
+    .withColumn('node_count', map_values(col('mapNodeTypes'))[0])\
+    .groupby('organization_id', 	
+             'workspace_name', 	
+             'node_type')\
+    .agg(sum(col('node_count')).alias('Node Count'))\
+    .orderBy(col('Node Count').desc())
+    return top20
+
+  new_df_pandas = masters.cached_pandas("workspace.new_df_pandas_3", build_aws_node_count, cache_sources, **cache_params)
   new_df = new_df_pandas.pivot(index='node_type', columns='workspace_name')['Node Count'].fillna(0)
   fig = px.imshow(new_df, 	
                   labels=dict(x="Workspace Name", y="Node Type", color="NodeType Count"),	
@@ -784,60 +637,43 @@ except Exception as e:
 
 try:
 
-  splitByCloud = spark.sql(f"select * from {etlDB}.pipeline_report")\
-    .withColumn('Cloud', expr("case when inputConfig.auditLogConfig.azureAuditLogEventhubConfig is null then 'AWS' else 'Azure' end"))\
-    .select('organization_id', 'workspace_name', 'Cloud').distinct()
-
-  node_cost = cluster_master\
-  .join(splitByCloud, cluster_master.organization_id == splitByCloud.organization_id, "left").select(cluster_master['*'], splitByCloud.Cloud)\
-  .withColumn("job_id", (cluster_master["cluster_name"].substr(lit(1), instr(col("cluster_name"), 'run')-2)))\
-  .withColumn("clusterName", expr("case when cluster_name like '%-run-%' then job_id else cluster_name end"))\
-  .withColumn('node_type', cluster_master['worker_node_type'])\
-  .where((splitByCloud['Cloud'] == 'AWS') & (col('node_type').isNotNull()))\
-  .groupBy(["organization_id",
+  def build_aws_node_cost():
+    node_cost = node_rollup()\
+    .where(col('Cloud') == 'AWS')\
+    .select("organization_id",
             "workspace_name",
-           "node_type"])\
-  .agg(round(sum(cluster_master['total_dbu_cost']), 2).alias('DBU Cost(USD)'))\
-  .orderBy(col('DBU Cost(USD)').desc())
-
-  costByWorkspace = node_cost\
-  .withColumn('nodeMap', create_map(col('node_type'), col('DBU Cost(USD)')))\
-  .groupBy(["organization_id",		
-            "workspace_name"])\
-  .agg(sum(col('DBU Cost(USD)')).alias('workspace_node_cost'), collect_list(col('nodeMap')).alias('nodeCostByType'))\
-  .orderBy(col('workspace_node_cost').desc())
-
-  windowDept = Window\
-  .orderBy(col("workspace_node_cost").desc())
-
-  top20workspace = costByWorkspace\
-  .withColumn("row",row_number().over(windowDept))\
-  .filter(col("row") <= 20)
-
-  top20Workspaces = costByWorkspace\
-  .join(top20workspace, ((costByWorkspace.organization_id == top20workspace.organization_id) & (costByWorkspace.workspace_name == top20workspace.workspace_name)), 'left')\
-  .select(costByWorkspace['*'], 		
-          col('row'))
-
-  jobComputeTime = top20Workspaces\
-  .withColumn('organization_id', expr("case when row is null then 'Others' else organization_id end"))\
-  .withColumn('workspace_name', expr("case when row is null then 'Others' else workspace_name end"))\
-  .select(		
-      "organization_id",		
-      "workspace_name",		
-      explode(top20Workspaces.nodeCostByType).alias("mapNodeTypes")		
-  )		
-  # Calculate the clusters cost by category		
-  top20 = jobComputeTime\
-  .withColumn('node_type', map_keys(col("mapNodeTypes"))[0])\
-  .withColumn('node_cost', map_values(col('mapNodeTypes'))[0])\
-  .groupby('organization_id', 		
-           'workspace_name', 		
-           'node_type')\
-  .agg(sum(col('node_cost')).alias('Node Cost'))\
-  .orderBy(col('Node Cost').desc())
-
-  new_df_pandas = top20.toPandas()
+            "node_type",
+            col('dbu_cost').alias('DBU Cost(USD)'))\
+    .orderBy(col('DBU Cost(USD)').desc())
+
+    costByWorkspace = node_cost\
+    .withColumn('nodeMap', create_map(col('node_type'), col('DBU Cost(USD)')))\
+    .groupBy(["organization_id",		
+              "workspace_name"])\
+    .agg(sum(col('DBU Cost(USD)')).alias('workspace_node_cost'), collect_list(col('nodeMap')).alias('nodeCostByType'))\
+    .orderBy(col('workspace_node_cost').desc())
+
+    top20Workspaces = costByWorkspace\
+    .transform(masters.top_k_with_others("workspace_node_cost", ["organization_id", "workspace_name"], 20))
+
+    jobComputeTime = top20Workspaces\
+    .select(		
+        "organization_id",		
+        "workspace_name",		
+        explode(top20Workspaces.nodeCostByType).alias("mapNodeTypes")		
+    )		
+    # Calculate the clusters cost by category		
+    top20 = jobComputeTime\
+    .withColumn('node_type', map_keys(col("mapNodeTypes"))[0])\
+    .withColumn('node_cost', map_values(col('mapNodeTypes'))[0])\
+    .groupby('organization_id', 		
+             'workspace_name', 		
+             'node_type')\
+    .agg(sum(col('node_cost')).alias('Node Cost'))\
+    .orderBy(col('Node Cost').desc())
+    return top20
+
+  new_df_pandas = masters.cached_pandas("workspace.new_df_pandas_4", build_aws_node_cost, cache_sources, **cache_params)
   new_df = new_df_pandas.pivot(index='node_type', columns='workspace_name')['Node Cost'].fillna(0)
 
   fig = px.imshow(new_df, 
@@ -0,0 +1,5 @@
+from overwatch_analysis.analysis import helpers, master
+from overwatch_analysis.catalog import workspace_catalog
+from overwatch_analysis.result_cache import result_cache
+
+__all__ = ["helpers", "master", "result_cache", "workspace_catalog"]
@@ -0,0 +1,2303 @@
+"""
+helpers and master classes used by the Overwatch analysis dashboards.
+
+The notebooks get them through the Helpers bootstrap notebook, jobs and other
+notebooks can simply `from overwatch_analysis import master`. Plotting libraries
+are not imported here, only the dashboards need them.
+"""
+from pyspark.sql.window import Window
+from pyspark.sql.types import StructType, StructField
+from operator import add
+from functools import reduce
+from datetime import date, timedelta
+import pyspark.sql.functions as F
+import pandas as pd
+import pyspark
+import copy
+import heapq
+import math
+
+from overwatch_analysis.catalog import workspace_catalog
+from overwatch_analysis.result_cache import result_cache
+from overwatch_analysis.session import spark
+
+
+class helpers:
+  
+  
+  def __init__(self, _etl_db, _consumer_db, _filter_mode="semi_join"):
+    self.etl_db = _etl_db
+    self.consumer_db = _consumer_db
+    self.filter_mode = _filter_mode
+    self.partition_columns = {}
+    self.calendars = {}
+    self.fiscal_year_start_month = 1
+#     try:
+#       if _etl_db == "" or _etl_db is null:
+#         print("add the database widget")
+#     except:
+#       print("add the database widget")
+    self.catalog = workspace_catalog.get(_etl_db)
+#     self.masters = new master(...)
+#   masters.clusterstatefact(...)
+
+  @property
+  def org_ids_lookup(self):
+    """
+    Returns the organization_id / workspace_name pairs of the ETL database, served by the shared workspace
+    catalog (pipeline_report is read on first use, then kept in memory until its Delta version changes).
+    """
+    return self.catalog.lookup().select("organization_id", "workspace_name")
+    
+  def workspace_org_ids(self, workspace_names) -> list:
+    """
+    Returns the organization ids of the selected workspaces, read from the workspace catalog held by the driver.
+
+            Parameters:
+                    workspace_names (list): Workspace Names
+
+            Returns:
+                    list: organization_id of every selected workspace
+
+            Example:
+                    org_ids = object_name.workspace_org_ids(["workspace_names"])
+    """
+    return self.catalog.org_ids(workspace_names)
+
+  def source_table(self, table_name) -> str:
+    """
+    Returns the Delta table backing a consumer table. Overwatch consumer tables are views over the
+    {etl_db}.<table>_gold tables, which is where partitioning and table versions live.
+
+            Parameters:
+                    table_name (str): Fully qualified table or view name (db.table)
+
+            Returns:
+                    str: Fully qualified Delta table name
+
+            Example:
+                    object_name.source_table(f"{consumer_db}.clusterstatefact")
+    """
+    try:
+      spark.sql(f"describe detail {table_name}").first()
+      return table_name
+    except Exception:
+      return f"{self.etl_db}.{table_name.split('.')[-1]}_gold"
+
+  def table_version(self, table_name):
+    """
+    Returns the current Delta version of the table backing a consumer table, None if it has no Delta history.
+
+            Parameters:
+                    table_name (str): Fully qualified table or view name (db.table)
+
+            Returns:
+                    int: Latest table version
+
+            Example:
+                    object_name.table_version(f"{consumer_db}.clusterstatefact")
+    """
+    try:
+      return spark.sql(f"describe history {self.source_table(table_name)} limit 1").select("version").first()[0]
+    except Exception:
+      return None
+
+  def is_partitioned_by(self, table_name, column="organization_id") -> bool:
+    """
+    Returns True if the Delta table is partitioned by the given column.
+
+            Parameters:
+                    table_name (str): Fully qualified table name (db.table)
+                    column (str): Partition column to look for
+
+            Returns:
+                    bool: True if column is one of the table partition columns
+
+            Example:
+                    object_name.is_partitioned_by(f"{consumer_db}.sparkTask")
+    """
+    if table_name not in self.partition_columns:
+      try:
+        self.partition_columns[table_name] = spark.sql(f"describe detail {self.source_table(table_name)}")\
+          .select("partitionColumns")\
+          .first()[0]
+      except Exception:
+        self.partition_columns[table_name] = []
+    return column in self.partition_columns[table_name]
+
+  def filter_workspaces(self, workspace_names, partition_table=None, mode=None) -> pyspark.sql.dataframe.DataFrame:
+    """
+    Returns a dataframe filter by selected workspace name.
+
+            Parameters:
+                    workspace_names (str): Workspace Name
+                    partition_table (str): Source table of the dataframe, used to push the org ids down as a partition filter
+                    mode (str): 'semi_join' (broadcast left-semi join on the lookup) or 'isin' (collected org id literal), defaults to the object filter mode
+
+            Returns:
+                    DataFrame: Filtered by selected workspace(From widgets)
+
+            Example:
+                    outputDF = inputDF.transform(object_name.filter_workspaces("workspace_names"))
+    """
+    def inner(df):
+      if workspace_names is None:
+        return df
+      filter_mode = mode or self.filter_mode
+      if filter_mode == "isin":
+        return df.filter(F.col("organization_id").isin(self.workspace_org_ids(workspace_names)))
+      elif filter_mode == "semi_join":
+        org_ids = self.org_ids_lookup\
+          .filter(F.col("workspace_name").isin(workspace_names))\
+          .select(F.col("organization_id"))\
+          .distinct()
+        data = df.join(F.broadcast(org_ids), on="organization_id", how="left_semi")
+        # Literal org ids let the scan prune organization_id partitions before the join runs
+        if partition_table is not None and self.is_partitioned_by(partition_table):
+          data = data.filter(F.col("organization_id").isin(self.workspace_org_ids(workspace_names)))
+        return data
+      else:
+        raise Exception(f"Sorry, unknown workspace filter mode '{filter_mode}' (use 'semi_join' or 'isin')")
+    return inner
+
+  def filter_dates(self,dateColumn:str,start_date,end_date) -> pyspark.sql.dataframe.DataFrame:
+    """
+    Returns a dataframe filter by dates(between selected start and end date).
+
+            Parameters:
+                    dateColumn (str): Date column name
+                    start_date (date): Start date
+                    end_date (date): End date
+                    
+            Returns:
+                    DataFrame: Data between selected dates
+                    
+            Example:
+                    outputDF = inputDF.transform(object_name.filter_dates(date_column_name,start_date,end_date))
+    """
+    def inner(df):
+      return df.filter(F.col(dateColumn).between(pd.to_datetime(start_date),pd.to_datetime(end_date))) 
+    return inner
+  
+  def filter_timestamps(self,timestampColumn:str,start_date,end_date) -> pyspark.sql.dataframe.DataFrame:
+    """
+    Returns a dataframe filter by the days of a timestamp column (between selected start and end date, both included).
+    Unlike filter_dates on a derived DATE(...) column, the range predicate can be pushed down to the scan.
+
+            Parameters:
+                    timestampColumn (str): Timestamp column name
+                    start_date (date): Start date
+                    end_date (date): End date
+
+            Returns:
+                    DataFrame: Data between selected dates
+
+            Example:
+                    outputDF = inputDF.transform(object_name.filter_timestamps("task_runtime.startTS",start_date,end_date))
+    """
+    def inner(df):
+      return df.filter((F.col(timestampColumn) >= pd.to_datetime(start_date))
+                       & (F.col(timestampColumn) < pd.to_datetime(end_date) + pd.Timedelta(days=1)))
+    return inner
+
+  def weekend_flag(self, value) -> str:
+    """
+    Returns the Yes/No widget value of a weekend flag, booleans are accepted as well (True is Yes, False is No).
+
+            Example:
+                    object_name.weekend_flag(True)
+    """
+    if isinstance(value, bool):
+      return "Yes" if value else "No"
+    return value
+
+  def filter_by_weekdays(self,include_weekends,only_weekends) -> pyspark.sql.dataframe.DataFrame:
+    """
+    Returns a dataframe filter by weekends and weekdays.
+
+            Parameters:
+                    include_weekends (str): yes/no (or a boolean)
+                    only_weekends (str):  yes/no (or a boolean)
+                    
+            Returns:
+                    DataFrame: filter by weekends and weekdays.
+                    
+            Example:
+                    outputDF = inputDF.transform(object_name.filter_dates(yes,no))
+    """
+    
+    include_weekends, only_weekends = self.weekend_flag(include_weekends), self.weekend_flag(only_weekends)
+    
+    def inner(df):
+      if include_weekends == 'Yes'and only_weekends == 'No':
+        return df
+      elif include_weekends == 'Yes' and only_weekends == 'Yes':
+        return df.filter(F.col('is_weekend') == 1)
+      elif include_weekends == 'No' and only_weekends == 'No':
+        return df.filter(F.col('is_weekend') == 0)
+      else:
+        raise Exception("Sorry, Please check the widget values (If Include weekends is 'NO' you cant keep Only weekends as 'Yes')")
+    return inner
+
+  def calendar_days(self, start_date, end_date) -> pd.DataFrame:
+    """
+    Returns the calendar dimension of a date window, built on the driver once per window.
+
+            Parameters:
+                    start_date (date): Start date
+                    end_date (date): End date
+
+            Returns:
+                    pandas.DataFrame: date, is_weekend (1 on Saturday and Sunday), iso_week (YYYY-Www), month (YYYY-MM),
+                    fiscal_year and fiscal_period (1-12, the fiscal year starts on fiscal_year_start_month)
+
+            Example:
+                    days = object_name.calendar_days("2023-01-01", "2023-01-31")
+    """
+    window = (str(start_date), str(end_date), self.fiscal_year_start_month)
+    if window not in self.calendars:
+      dates = pd.date_range(pd.to_datetime(start_date), pd.to_datetime(end_date), freq="D")
+      iso = dates.isocalendar()
+      shift = (dates.month - self.fiscal_year_start_month) % 12
+      self.calendars[window] = pd.DataFrame({
+        "date": dates.date,
+        "is_weekend": (dates.dayofweek >= 5).astype("int32"),
+        "iso_week": [f"{year}-W{week:02d}" for year, week in zip(iso["year"], iso["week"])],
+        "month": dates.strftime("%Y-%m"),
+        # Fiscal years are named after the calendar year they end in
+        "fiscal_year": (dates.year + ((dates.month >= self.fiscal_year_start_month) & (self.fiscal_year_start_month > 1))).astype("int32"),
+        "fiscal_period": (shift + 1).astype("int32"),
+      })
+    return self.calendars[window]
+
+  def calendar(self, start_date, end_date) -> pyspark.sql.dataframe.DataFrame:
+    """
+    Returns the calendar dimension of a date window as a small Spark dataframe (one row per day), to be broadcast in joins.
+
+            Example:
+                    df.join(broadcast(object_name.calendar(start_date, end_date)), on="date")
+    """
+    return spark.createDataFrame(self.calendar_days(start_date, end_date),
+                                 "date date, is_weekend int, iso_week string, month string, fiscal_year int, fiscal_period int")
+
+  def filter_calendar_days(self, dateColumn:str, start_date, end_date, include_weekends, only_weekends) -> pyspark.sql.dataframe.DataFrame:
+    """
+    Returns a dataframe filter by weekends and weekdays, as a predicate on the dates of the window selected in the calendar.
+    Unlike filter_by_weekdays it needs no is_weekend column, and the date list prunes date partitions before the scan.
+
+            Parameters:
+                    dateColumn (str): Date column name
+                    start_date (date): Start date
+                    end_date (date): End date
+                    include_weekends (str): Yes/No (or a boolean)
+                    only_weekends (str): Yes/No (or a boolean)
+
+            Returns:
+                    DataFrame: Rows of the selected days
+
+            Example:
+                    outputDF = inputDF.transform(object_name.filter_calendar_days("date", start_date, end_date, "No", "No"))
+    """
+    include_weekends, only_weekends = self.weekend_flag(include_weekends), self.weekend_flag(only_weekends)
+    
+    def inner(df):
+      if include_weekends == 'Yes' and only_weekends == 'No':
+        return df
+      elif include_weekends == 'Yes' and only_weekends == 'Yes':
+        weekend = 1
+      elif include_weekends == 'No' and only_weekends == 'No':
+        weekend = 0
+      else:
+        raise Exception("Sorry, Please check the widget values (If Include weekends is 'NO' you cant keep Only weekends as 'Yes')")
+      days = self.calendar_days(start_date, end_date)
+      dates = days[days["is_weekend"] == weekend]["date"].tolist()
+      return df.filter(F.col(dateColumn).isin(dates) if dates else F.lit(False))
+    return inner
+
+  def with_calendar(self, dateColumn:str, start_date, end_date, columns=None) -> pyspark.sql.dataframe.DataFrame:
+    """
+    Returns a dataframe with calendar columns of its date column, from a broadcast join on the calendar dimension
+    instead of a per row date computation.
+
+            Parameters:
+                    dateColumn (str): Date column name
+                    start_date (date): Start date of the calendar, rows outside the window get nulls
+                    end_date (date): End date of the calendar
+                    columns (list): Calendar columns to add, defaults to ["is_weekend"]
+
+            Returns:
+                    DataFrame: Input columns plus the calendar columns
+
+            Example:
+                    outputDF = inputDF.transform(object_name.with_calendar("state_start_date", start_date, end_date, ["is_weekend", "month"]))
+    """
+    columns = ["is_weekend"] if columns is None else columns
+    def inner(df):
+      days = self.calendar(start_date, end_date)\
+        .select(F.col("date").alias(dateColumn), *columns)
+      return df.join(F.broadcast(days), on=dateColumn, how="left").select(*df.columns, *columns)
+    return inner
+  
+  def filter_clusters(self,clusterTable) -> pyspark.sql.dataframe.DataFrame:
+    """
+      Returns a dataframe filter with selected cluster_ids.
+
+              Parameters:
+                      clusterTable (DataFrame): Contains only selected clusters
+
+              Returns:
+                      DataFrame: Data selected clusters
+
+              Example:
+                      outputDF = inputDF.transform(object_name.filter_clusters(clusterTableName))
+      """
+    def inner(df):
+      if clusterTable is None or clusterTable is False:
+        return df
+      # Semi join: a cluster listed twice in clusterTable does not duplicate its rows
+      keys = [column for column in ["organization_id", "cluster_id"] if column in clusterTable.columns and column in df.columns]
+      return df.join(clusterTable.select(*keys).distinct(), on=keys, how="left_semi")
+    return inner
+  
+  # split_path
+  def partition_split(self,folder_level, consumerDB):
+    def inner(df):
+      if int(folder_level) < 1:
+        raise Exception("Please enter the folder depth level")
+      num = int(folder_level) + 1  
+      nb_df = df.withColumn("folder_path", F.concat_ws('/', F.slice(F.split(F.col('notebook_path'), '/'), 1, num)))
+      return nb_df
+    return inner
+  
+  def top_k_with_others(self, rankColumn:str, keyColumns:list, k=20, **kwargs) -> pyspark.sql.dataframe.DataFrame:
+    """
+    Returns the dataframe with keyColumns relabelled to 'Others' on every row outside the top k rows by rankColumn (per partitionBy group).
+    Each partition keeps at most k candidates per group in a heap, the k-th value of every group is collected to the driver
+    and broadcast back as a threshold, so there is no global window and no join of the frame with itself.
+    Ties are broken on keyColumns and rows with a null rankColumn only make the top k when the group has less than k ranked rows.
+
+            Parameters:
+                    rankColumn (str): Numeric column the rows are ranked on (descending)
+                    keyColumns (list): Columns identifying a row in its group, set to othersLabel outside the top k
+                    k (int): Number of rows kept per group
+                    partitionBy (list): Columns the ranking is done within, empty for a global top k
+                    othersLabel (str): Label of the rows outside the top k, defaults to 'Others'
+
+            Returns:
+                    DataFrame: Same columns, to be re-grouped on partitionBy + keyColumns
+
+            Example:
+                    outputDF = inputDF.transform(object_name.top_k_with_others("DBU_Cost (USD)", ["organization_id", "workspace_name"], 20, partitionBy=["state_start_date"]))
+    """
+    partition_by = kwargs.get("partitionBy", [])
+    others_label = kwargs.get("othersLabel", "Others")
+    
+    def partial_top_k(rows):
+      heaps = {}
+      for row in rows:
+        rank_key = tuple(row["top_k_rank_key"])
+        if rank_key[0] is None:
+          continue
+        heap = heaps.setdefault(tuple(row[column] for column in partition_by), [])
+        if len(heap) < k:
+          heapq.heappush(heap, rank_key)
+        elif rank_key > heap[0]:
+          heapq.heapreplace(heap, rank_key)
+      return heaps.items()
+    
+    def inner(df):
+      # Tie break on the keys as strings so Python and Spark order the candidates the same way
+      ranked = df.withColumn("top_k_rank_key", F.struct(F.col(rankColumn).alias("value"),
+                                                      *[F.coalesce(F.col(column).cast("string"), F.lit("")).alias(column) for column in keyColumns]))
+      candidates = ranked.select(*partition_by, "top_k_rank_key")
+      thresholds = candidates.rdd\
+        .mapPartitions(partial_top_k)\
+        .reduceByKey(lambda left, right: heapq.nlargest(k, left + right))\
+        .filter(lambda group_heap: len(group_heap[1]) >= k)\
+        .map(lambda group_heap: (*group_heap[0], heapq.nsmallest(1, group_heap[1])[0]))\
+        .collect()
+      threshold_schema = StructType(candidates.schema.fields[:-1] +
+                                    [StructField("top_k_threshold", candidates.schema["top_k_rank_key"].dataType)])
+      thresholds = spark.createDataFrame(thresholds, threshold_schema)\
+        .select(*[F.col(column).alias(f"top_k_group_{i}") for i, column in enumerate(partition_by)], "top_k_threshold")
+      
+      same_group = reduce(lambda left, right: left & right,
+                          [F.col(column).eqNullSafe(F.col(f"top_k_group_{i}")) for i, column in enumerate(partition_by)],
+                          F.lit(True))
+      is_top_k = F.col("top_k_threshold").isNull() | F.coalesce(F.col("top_k_rank_key") >= F.col("top_k_threshold"), F.lit(False))
+      data = ranked.join(F.broadcast(thresholds), same_group, "left")
+      for column in keyColumns:
+        data = data.withColumn(column, F.when(is_top_k, F.col(column)).otherwise(F.lit(others_label)))
+      return data.select(*df.columns)
+    return inner
+
+
+class master(helpers):
+
+  # Columns read from each consumer table, everything else is pruned at the scan
+  source_columns = {
+    "jobruncostpotentialfact": ["organization_id", "workspace_name", "job_id", "run_id", "job_name", "task_runtime", "task_type",
+                                "cluster_id", "cluster_name", "terminal_state", "worker_potential_core_H", "total_compute_cost",
+                                "total_dbu_cost", "total_cost", "created_by", "last_edited_by", "job_run_cluster_util", "job_trigger_type"],
+    "jobRun": ["organization_id", "run_id", "cluster_type"],
+    "job": ["organization_id", "job_id", "tasks.notebook_task.notebook_path", "created_by"],
+    "clusterstatefact": ["organization_id", "workspace_name", "cluster_id", "cluster_name", "custom_tags", "isAutomated",
+                         "state", "state_start_date", "state_dates", "days_in_state", "unixTimeMS_state_start", "unixTimeMS_state_end",
+                         "uptime_in_state_H", "current_num_workers", "target_num_workers", "driver_node_type_id", "node_type_id",
+                         "worker_potential_core_H", "core_hours", "total_compute_cost", "total_DBU_cost", "total_worker_cost", "total_cost"],
+    "cluster": ["organization_id", "cluster_id", "created_by", "last_edited_by", "deleted_by", "driver_node_type", "node_type",
+                "autoscale", "is_automated", "cluster_type", "auto_termination_minutes", "instance_pool_id", "instance_pool_name"],
+    "sparkTask": ["organization_id", "workspace_name", "cluster_id", "spark_context_id", "stage_id", "date", "timestamp",
+                  "task_metrics", "task_runtime", "task_info"],
+    "sparkJob": ["organization_id", "workspace_name", "cluster_id", "spark_context_id", "job_id", "date", "timestamp", "db_job_id",
+                 "db_id_in_job", "notebook_id", "notebook_path", "execution_id", "job_runtime", "job_result", "user_email", "stage_ids"],
+  }
+  
+  # Columns identifying a spark task attempt in sparkTask
+  task_key_columns = ["organization_id", "spark_context_id", "stage_id", "stage_attempt_id", "task_id", "task_attempt_id"]
+  
+  # Persisted master frames: builder method, date column and consumer tables of each snapshot
+  snapshot_builders = {
+    "cluster_master": ("cluster_master_filter", "state_start_date", ["clusterstatefact", "cluster"]),
+    "job_master": ("job_master_filter", "job_start_date", ["jobruncostpotentialfact", "jobRun", "job"]),
+    "spark_notebook_master": ("spark_notebook_master", "date", ["sparkTask", "sparkJob"]),
+    "task_metrics": ("task_metrics_flat", "date", ["sparkTask"]),
+    "cluster_daily_cost": ("cluster_daily_cost", "date", ["clusterstatefact", "cluster"]),
+    "cluster_tag_index": ("cluster_tag_index", "state_start_date", ["clusterstatefact"]),
+    "distinct_sketches": ("distinct_sketches", "date", ["clusterstatefact", "jobruncostpotentialfact", "sparkJob"]),
+    "cluster_transitions": ("cluster_transitions", "state_start_date", ["clusterstatefact", "cluster"]),
+    "concurrency_timeline": ("concurrency_timeline", "date", ["clusterstatefact", "cluster", "jobruncostpotentialfact", "jobRun", "job"]),
+    "chargeback": ("chargeback", "date", ["clusterstatefact", "cluster", "sparkTask", "sparkJob"]),
+  }
+  # Snapshot tables whose columns were compared with their builder in this process
+  checked_snapshot_columns = set()
+  # Partition columns of a snapshot written after its date column
+  snapshot_partitions = {
+    "task_metrics": ["organization_id"],
+    "chargeback": ["organization_id"],
+  }
+  # Date column of the fact tables, read from their Delta commits to find the oldest day an Overwatch run restated.
+  # The other sources (cluster, job, jobRun) are dimensions, their changes are applied to the lookback days only
+  source_date_columns = {
+    "clusterstatefact": "state_start_date",
+    "jobruncostpotentialfact": "task_runtime.startTS",
+    "sparkTask": "date",
+    "sparkJob": "date",
+  }
+  
+  # Flat task metrics table: column, sparkTask field it is read from and type
+  task_metric_fields = [
+    ("shuffle_local_bytes_read", "task_metrics.ShuffleReadMetrics.LocalBytesRead", "bigint"),
+    ("shuffle_remote_bytes_read", "task_metrics.ShuffleReadMetrics.RemoteBytesRead", "bigint"),
+    ("shuffle_remote_bytes_read_to_disk", "task_metrics.ShuffleReadMetrics.RemoteBytesReadToDisk", "bigint"),
+    ("shuffle_bytes_written", "task_metrics.ShuffleWriteMetrics.ShuffleBytesWritten", "bigint"),
+    ("shuffle_records_written", "task_metrics.ShuffleWriteMetrics.ShuffleRecordsWritten", "bigint"),
+    ("shuffle_write_time", "task_metrics.ShuffleWriteMetrics.ShuffleWriteTime", "bigint"),
+    ("input_bytes_read", "task_metrics.InputMetrics.BytesRead", "bigint"),
+    ("input_records_read", "task_metrics.InputMetrics.RecordsRead", "bigint"),
+    ("output_bytes_written", "task_metrics.OutputMetrics.BytesWritten", "bigint"),
+    ("output_records_written", "task_metrics.OutputMetrics.RecordsWritten", "bigint"),
+    ("result_size", "task_metrics.ResultSize", "bigint"),
+    ("executor_deserialize_time", "task_metrics.ExecutorDeserializeTime", "bigint"),
+    ("result_serialization_time", "task_metrics.ResultSerializationTime", "bigint"),
+    ("memory_bytes_spilled", "task_metrics.MemoryBytesSpilled", "bigint"),
+    ("disk_bytes_spilled", "task_metrics.DiskBytesSpilled", "bigint"),
+    ("runtime_s", "task_runtime.runTimeS", "double"),
+    ("runtime_h", "task_runtime.runTimeH", "double"),
+    ("task_failed", "task_info.Failed", "boolean"),
+    ("task_killed", "task_info.Killed", "boolean"),
+    ("task_speculative", "task_info.Speculative", "boolean"),
+  ]
+  
+  # Dimensions of the cost cube and the grouping sets it is materialized at (is_weekend follows the date, cluster_name the cluster_id)
+  cost_cube_columns = ["state_start_date", "is_weekend", "organization_id", "workspace_name", "cluster_category",
+                       "node_type_id", "is_autoscaling", "cluster_id", "cluster_name"]
+  cost_cube_sets = [
+    ["state_start_date", "is_weekend", "organization_id", "workspace_name", "cluster_category", "node_type_id", "is_autoscaling", "cluster_id", "cluster_name"],
+    ["state_start_date", "is_weekend", "organization_id", "workspace_name", "cluster_category", "is_autoscaling"],
+    ["state_start_date", "is_weekend", "organization_id", "workspace_name", "node_type_id"],
+    ["state_start_date", "is_weekend", "organization_id", "workspace_name"],
+  ]
+  cost_cube_measures = ["total_DBU_cost", "total_compute_cost", "total_cost", "total_worker_cost", "potential_worker_cost",
+                        "worker_potential_core_H", "core_hours"]
+  
+  # Cluster states counted as failures and states a cluster starts from before RUNNING (see cluster_transitions)
+  cluster_failure_states = ["SPARK_EXCEPTION", "DRIVER_UNAVAILABLE", "DBFS_DOWN", "NODES_LOST", "DRIVER_NOT_RESPONDING", "METASTORE_DOWN"]
+  cluster_start_states = ["PENDING", "CREATING", "STARTING", "RESTARTING"]
+  # Cluster states not counted as live in the concurrency timeline
+  cluster_idle_states = ["TERMINATING", "TERMINATED"]
+  # Cluster states whose uptime is checked for Spark tasks in cluster_idle_time
+  cluster_up_states = ["RUNNING", "RESIZING"]
+  
+  # Entities of the daily distinct count sketches: consumer table, id column, row filter and key column the ids are sketched by
+  distinct_entities = {
+    "cluster_id": ("clusterstatefact", "cluster_id", None, None),
+    "job_id": ("jobruncostpotentialfact", "job_id", None, None),
+    "scheduled_job_id": ("jobruncostpotentialfact", "job_id", "job_trigger_type = 'cron'", None),
+    "run_id": ("jobruncostpotentialfact", "run_id", None, None),
+    "execution_id": ("sparkJob", "execution_id", None, "notebook_path"),
+    "notebook_id": ("sparkJob", "notebook_id", None, "notebook_path"),
+    "user_email": ("sparkJob", "user_email", None, "notebook_path"),
+    "interactive_user_email": ("sparkJob", "user_email", "db_job_id is null", "notebook_path"),
+  }
+  
+  # Ranked slices of expensive_jobs_top_n: output column -> (daily cost column, rows counted in the slice)
+  top_n_slices = {
+    "top_expensive_jobs": ("cost_in_USD", "true"),
+    "top_expensive_failures": ("failed_cost_in_USD", "terminal_state = 'Failed'"),
+    "top_expensive_interactive_jobs": ("interactive_cost_in_USD", "cluster_type != 'job_cluster'"),
+  }
+  
+  def __init__(self,_etl_db,_consumer_db,_workspace_name,_from_date,_until_date,**kwargs):
+    
+    self.etl_db = _etl_db
+    self.consumer_db = _consumer_db
+    self.start_date = _from_date
+    self.end_date = _until_date
+    self.workspace_name = _workspace_name
+    helpers.__init__(self, self.etl_db, self.consumer_db, kwargs.get("filterMode","semi_join"))
+    self.sources = {}
+    self.analysis_db = kwargs.get("analysisDB", _etl_db)
+    self.snapshot_lookback_days = kwargs.get("snapshotLookbackDays", 2)
+    self.spark_join_mode = kwargs.get("sparkJoinMode", "stage")
+    # Weekend filter of read_source and of the methods called without includeWeekend / onlyWeekend, the master frame
+    # builders set it again from their arguments
+    self.include_weekend = kwargs.get("includeWeekend", "Yes")
+    self.only_weekend = kwargs.get("onlyWeekend", "No")
+    self.fiscal_year_start_month = kwargs.get("fiscalYearStartMonth", 1)
+    self.allocation_lookback_days = kwargs.get("allocationLookbackDays", 30)
+    self.max_path_depth = kwargs.get("maxPathDepth", 10)
+    self.concurrency_bucket_minutes = kwargs.get("concurrencyBucketMinutes", 1)
+    self.idle_bin_minutes = kwargs.get("idleBinMinutes", 15)
+    self.distinct_error_bound = kwargs.get("distinctErrorBound", 0.02)
+    self.exact_distinct_counts = kwargs.get("exactDistinctCounts", "No") == "Yes"
+    self.hll_sketches = None
+    # Frames cached by the rollup methods: name -> (input frame, cached frame), see cached_frame
+    self.cached_frames = {}
+    self.use_result_cache = kwargs.get("resultCache", "Yes") == "Yes"
+    self.result_cache = result_cache.get(kwargs.get("resultCacheDir"))
+    
+  def read_source(self, table_name, **kwargs) -> pyspark.sql.dataframe.DataFrame:
+    """
+    Returns a column pruned consumer table, filtered by date, workspace and weekends before any join.
+
+            Parameters:
+                    table_name (str): Consumer table name
+                    columns (list): Columns to read, defaults to master.source_columns[table_name]
+                    dateColumn (str): Date column used by the date and weekend filters, only the workspace filter is applied if None
+                    timestampColumn (str): Timestamp column to filter on instead of dateColumn, when dateColumn is derived from it
+                    weekdays (bool): Apply the weekend filter of the calling master method (default True)
+                    
+            The workspace filter is skipped when the master workspace_name is None (snapshot builds).
+
+            Returns:
+                    DataFrame: Filtered source, registered in object_name.sources for scan_summary
+
+            Example:
+                    sparkTask = object_name.read_source("sparkTask", dateColumn="date")
+    """
+    columns = kwargs.get("columns", self.source_columns.get(table_name, ["*"]))
+    date_column = kwargs.get("dateColumn")
+    timestamp_column = kwargs.get("timestampColumn")
+    source = f"{self.consumer_db}.{table_name}"
+    
+    df = spark.table(source)
+    if timestamp_column:
+      df = df.transform(helpers.filter_timestamps(self, timestamp_column, self.start_date, self.end_date))
+    df = df.select(*columns)
+    if date_column:
+      if not timestamp_column:
+        df = df.transform(helpers.filter_dates(self, date_column, self.start_date, self.end_date))
+      if kwargs.get("weekdays", True):
+        df = df.transform(helpers.filter_calendar_days(self, date_column, self.start_date, self.end_date, self.include_weekend, self.only_weekend))
+      df = df.transform(helpers.with_calendar(self, date_column, self.start_date, self.end_date))
+    if self.workspace_name is not None:
+      df = df.transform(helpers.filter_workspaces(self, self.workspace_name, source))
+    df = df.alias(table_name)
+    self.sources[table_name] = df
+    return df
+  
+  def scan_summary(self, **kwargs) -> pd.DataFrame:
+    """
+    Returns one row per file scan of every source read so far, to check column pruning, partition pruning and data skipping.
+
+            Parameters:
+                    execute (bool): Also run each source (no output) and report its scan metrics (files, partitions, size). Default False
+
+            Returns:
+                    pandas.DataFrame: source, scan node, read schema, partition / pushed / data filters and scan metrics
+
+            Example:
+                    display(object_name.scan_summary(execute=True))
+    """
+    execute = kwargs.get("execute", False)
+    metric_names = ["numFiles", "filesSize", "numPartitions", "staticFilesNum", "staticFilesSize", "pruningTime", "numOutputRows"]
+    metadata_names = ["ReadSchema", "PartitionFilters", "PushedFilters", "DataFilters"]
+    
+    def scan_nodes(node):
+      name = node.nodeName()
+      if name == "AdaptiveSparkPlan":
+        return scan_nodes(node.executedPlan())
+      if "QueryStage" in name:
+        return scan_nodes(node.plan())
+      children = node.children()
+      if children.size() == 0:
+        return [node]
+      return [leaf for i in range(children.size()) for leaf in scan_nodes(children.apply(i))]
+    
+    def option_value(option):
+      return option.get() if option.isDefined() else None
+    
+    rows = []
+    for source, df in self.sources.items():
+      plan = df._jdf.queryExecution().executedPlan()
+      if execute:
+        plan.execute().count()
+      for node in scan_nodes(plan):
+        row = {"source": source, "scan": node.nodeName()}
+        for name in metadata_names:
+          try:
+            row[name] = option_value(node.metadata().get(name))
+          except Exception:
+            row[name] = None
+        if execute:
+          for name in metric_names:
+            try:
+              metric = option_value(node.metrics().get(name))
+              row[name] = metric.value() if metric is not None else None
+            except Exception:
+              row[name] = None
+        rows.append(row)
+    return pd.DataFrame(rows)
+    
+    
+  def spark_notebook_master(self, **kwargs):
+    self.include_weekend = kwargs.get("includeWeekend","Yes")
+    self.only_weekend = kwargs.get("onlyWeekend","No")
+    self.path_depth = kwargs.get("folder_level")
+    spark_join_mode = kwargs.get("sparkJoinMode", self.spark_join_mode)
+    
+    sparkJob = self.read_source("sparkJob", dateColumn="date")
+    if spark.catalog.tableExists(self.snapshot_table("task_metrics")):
+      sparkTask = self.task_metrics_source()
+    else:
+      sparkTask = self.read_source("sparkTask", dateColumn="date")
+    
+    job_columns = ["db_job_id", "db_id_in_job", "notebook_id", "notebook_path", "execution_id", "job_runtime", "job_result", "user_email"]
+    if spark_join_mode == "stage":
+      # Each task is attributed once, to the job owning its stage
+      stage_jobs = self.stage_job_map(sparkJob, job_columns)
+      SparkTask_master = sparkTask.join(stage_jobs, ["organization_id", "cluster_id", "spark_context_id", "stage_id"], "inner")\
+      .select(sparkTask["*"], *job_columns)
+    elif spark_join_mode == "timestamp":
+      # Legacy join: every task row is repeated once per stage of the job sharing its timestamp
+      SparkTask_master = sparkTask.join(sparkJob, 
+                                        (sparkTask["cluster_id"] == sparkJob["cluster_id"]) &
+                                        (sparkTask["workspace_name"] == sparkJob["workspace_name"]) &
+                                        (sparkTask["timestamp"] == sparkJob["timestamp"]) &
+                                        (sparkTask["organization_id"] == sparkJob["organization_id"])
+                                        ,"inner")\
+      .select(*[sparkTask[column] for column in sparkTask.columns if column != "stage_id"]
+             ,*[sparkJob[column] for column in job_columns]
+             ,F.explode(sparkJob["stage_ids"]).alias("stage_id")
+             )
+    else:
+      raise Exception(f"Sorry, unknown spark join mode '{spark_join_mode}' (use 'stage' or 'timestamp')")
+    
+    SparkTask_master = SparkTask_master\
+    .withColumn('MemoryBytesSpilled', F.col("task_metrics.MemoryBytesSpilled"))\
+    .withColumn('DiskBytesSpilled', F.col("task_metrics.DiskBytesSpilled"))\
+    .withColumn("Execution_type", F.expr("case when db_job_id is null and db_id_in_job is null then 'Manual_notebook' else 'Job_notebook' end"))
+
+#     sparkMaster = SparkTask_master.join(notebook, SparkTask_master["notebook_path"] == notebook["notebook_path"], "inner")\
+#     .withColumn("Execution_type", expr("case when db_job_id is null and db_id_in_job is null then 'Manual_notebook' else 'Job_notebook' end"))\
+#                   .select(sparkTask["*"]
+#                    ,sparkJob["db_job_id"]
+#                    ,sparkJob["db_id_in_job"]
+#                    ,sparkJob["execution_id"]
+#                    ,sparkJob["job_runtime"]
+#                    ,notebook["notebook_id"]
+#                    ,notebook["notebook_path"]
+#                    ,"Execution_type" 
+#                    ,"MemoryBytesSpilled"
+#                    ,"DiskBytesSpilled"
+#            )
+    df = SparkTask_master
+    if self.path_depth is not None:
+      df = df.transform(helpers.partition_split(self, self.path_depth, self.consumer_db))
+    return df
+  
+  def task_metrics_flat(self, **kwargs) -> pyspark.sql.dataframe.DataFrame:
+    """
+    Returns the sparkTask rows of the master date window with the task metrics read by the Notebook dashboard flattened
+    to typed top level columns (master.task_metric_fields). Builder of the task_metrics snapshot, which is refreshed
+    incrementally and partitioned by date and organization_id like the other snapshots.
+
+            Returns:
+                    DataFrame: sparkTask keys, date, is_weekend and one column per task_metric_fields entry
+
+            Example:
+                    object_name.refresh_snapshot("task_metrics")
+    """
+    self.include_weekend = kwargs.get("includeWeekend", "Yes")
+    self.only_weekend = kwargs.get("onlyWeekend", "No")
+    keys = ["organization_id", "workspace_name", "cluster_id", "spark_context_id", "stage_id", "date", "timestamp"]
+    return self.read_source("sparkTask",
+                            dateColumn="date",
+                            columns=keys + [F.col(path).cast(data_type).alias(name) for name, path, data_type in self.task_metric_fields])
+  
+  def task_metrics_source(self) -> pyspark.sql.dataframe.DataFrame:
+    """
+    Returns the task_metrics snapshot (refreshed first) shaped like a sparkTask read: the flat columns are nested back into
+    task_metrics, task_runtime and task_info structs holding only the task_metric_fields, so the master frames are unchanged.
+
+            Returns:
+                    DataFrame: sparkTask keys, date, is_weekend, task_metrics, task_runtime and task_info
+
+            Example:
+                    sparkTask = object_name.task_metrics_source()
+    """
+    tree = {}
+    for name, path, _ in self.task_metric_fields:
+      *parents, leaf = path.split(".")
+      node = tree
+      for parent in parents:
+        node = node.setdefault(parent, {})
+      node[leaf] = F.col(name)
+    to_struct = lambda node: F.struct(*[(to_struct(value) if isinstance(value, dict) else value).alias(key) for key, value in node.items()])
+    
+    flat_columns = [name for name, _, _ in self.task_metric_fields]
+    flat = self.snapshot("task_metrics", includeWeekend=self.include_weekend, onlyWeekend=self.only_weekend)
+    sparkTask = flat\
+      .select(*[column for column in flat.columns if column not in flat_columns],
+              *[to_struct(node).alias(key) for key, node in tree.items()])\
+      .alias("sparkTask")
+    self.sources["sparkTask"] = sparkTask
+    return sparkTask
+  
+  def stage_job_map(self, sparkJob, job_columns) -> pyspark.sql.dataframe.DataFrame:
+    """
+    Returns one row per (organization_id, cluster_id, spark_context_id, stage_id) with the columns of the spark job owning the stage.
+    A stage reused by later jobs (skipped stages) is listed in several stage_ids arrays, it is attributed to the lowest job_id.
+
+            Parameters:
+                    sparkJob (DataFrame): sparkJob rows with spark_context_id, job_id and stage_ids
+                    job_columns (list): sparkJob columns carried to the tasks
+
+            Returns:
+                    DataFrame: Stage to job mapping, one row per stage
+
+            Example:
+                    stage_jobs = object_name.stage_job_map(sparkJob, ["db_job_id", "notebook_path"])
+    """
+    return sparkJob\
+      .select("organization_id", "cluster_id", "spark_context_id", "job_id", *job_columns, F.explode("stage_ids").alias("stage_id"))\
+      .groupBy("organization_id", "cluster_id", "spark_context_id", "stage_id")\
+      .agg(F.min(F.struct("job_id", *job_columns)).alias("job"))\
+      .select("organization_id", "cluster_id", "spark_context_id", "stage_id", *[F.col(f"job.{column}").alias(column) for column in job_columns])
+  
+  def spark_task_attribution_check(self, **kwargs) -> dict:
+    """
+    Returns the row counts of spark_notebook_master in both join modes and raises an exception when the stage join does not
+    return each spark task of the window exactly once (distinct task keys of sparkTask, less the tasks whose stage has no
+    job in the window, which the master frame drops). The timestamp join count shows the fan-out of the legacy join.
+
+            Parameters:
+                    includeWeekend (str): Yes/No, defaults to the last value given to the master
+                    onlyWeekend (str): Yes/No, defaults to the last value given to the master
+
+            Returns:
+                    dict: task_keys, unattributed_tasks, stage_rows and timestamp_rows
+
+            Example:
+                    object_name.spark_task_attribution_check(includeWeekend="Yes", onlyWeekend="No")
+    """
+    checker = copy.copy(self)
+    checker.sources = {}
+    weekend = {"includeWeekend": kwargs.get("includeWeekend", self.include_weekend),
+               "onlyWeekend": kwargs.get("onlyWeekend", self.only_weekend)}
+    checker.include_weekend, checker.only_weekend = weekend["includeWeekend"], weekend["onlyWeekend"]
+    
+    tasks = checker.read_source("sparkTask", dateColumn="date", columns=self.task_key_columns + ["cluster_id", "date"])\
+      .select(*self.task_key_columns, "cluster_id")\
+      .distinct()
+    stage_jobs = checker.stage_job_map(checker.read_source("sparkJob", dateColumn="date"), [])
+    result = {"task_keys": tasks.count(),
+              "unattributed_tasks": tasks.join(stage_jobs, ["organization_id", "cluster_id", "spark_context_id", "stage_id"], "left_anti").count(),
+              "stage_rows": checker.spark_notebook_master(sparkJoinMode="stage", **weekend).count(),
+              "timestamp_rows": checker.spark_notebook_master(sparkJoinMode="timestamp", **weekend).count()}
+    if result["stage_rows"] != result["task_keys"] - result["unattributed_tasks"]:
+      raise Exception(f"Sorry, the stage join does not attribute each spark task once: {result}")
+    return result
+  
+  def cached_frame(self, name, dataframe, build_df) -> pyspark.sql.dataframe.DataFrame:
+    """
+    Returns build_df() cached, once per rollup method and input frame: asked again for the same input frame it returns
+    the frame cached by the first call, asked for another input frame it unpersists the previous one first, so a
+    dashboard re-running a cell holds a single cached copy.
+
+            Parameters:
+                    name (str): Rollup method name
+                    dataframe (DataFrame): Input frame of the rollup
+                    build_df (function): Returns the rollup of dataframe
+
+            Returns:
+                    DataFrame: Cached rollup
+
+            Example:
+                    return self.cached_frame("node_type_rollup", dataframe, lambda: dataframe.groupBy("node_type").count())
+    """
+    previous = self.cached_frames.get(name)
+    if previous is not None and previous[0] is dataframe:
+      return previous[1] if previous[1].is_cached else previous[1].cache()
+    if previous is not None:
+      previous[1].unpersist()
+    frame = build_df().cache()
+    self.cached_frames[name] = (dataframe, frame)
+    return frame
+  
+  def notebook_path_hierarchy(self, dataframe) -> pyspark.sql.dataframe.DataFrame:
+    """
+    Returns the notebook path hierarchy of a frame: one cached row per distinct notebook_path and path depth with the
+    folder at that depth (the same folder_path as partition_split). Every path has a row for the depths 1..maxPathDepth,
+    depths past its own folder levels map to the full notebook path, and deeper paths get a row for every level they have.
+    The cached plan does not depend on a path depth, so a new depth widget value reuses it (see cached_frame).
+
+            Parameters:
+                    dataframe (DataFrame): Any frame with a notebook_path column
+
+            Returns:
+                    DataFrame: notebook_path, path_depth and folder_path
+
+            Example:
+                    hierarchy = object_name.notebook_path_hierarchy(notebook)
+    """
+    parts = F.split(F.col("notebook_path"), "/")
+    return self.cached_frame("notebook_path_hierarchy", dataframe, lambda: dataframe\
+      .select("notebook_path")\
+      .distinct()\
+      .select("notebook_path",
+              F.explode(F.sequence(F.lit(1), F.greatest(F.size(parts) - 1, F.lit(self.max_path_depth)))).alias("path_depth"))\
+      .withColumn("folder_path", F.concat_ws("/", F.slice(parts, 1, F.col("path_depth") + 1))))
+  
+  def check_path_depth(self, folder_level) -> int:
+    if int(folder_level) < 1:
+      raise Exception("Please enter the folder depth level")
+    if int(folder_level) > self.max_path_depth:
+      raise Exception(f"Sorry, the path depth can be at most {self.max_path_depth} (maxPathDepth)")
+    return int(folder_level)
+  
+  def with_folder_path(self, dataframe, folder_level) -> pyspark.sql.dataframe.DataFrame:
+    """
+    Returns the frame with the folder_path of its notebook_path at a path depth, looked up in the path hierarchy
+    instead of splitting the path of every row. Rows without a notebook path get an empty folder_path, as with partition_split.
+
+            Parameters:
+                    dataframe (DataFrame): Any frame with a notebook_path column
+                    folder_level (int): Path depth, 1..maxPathDepth
+
+            Returns:
+                    DataFrame: Input columns and folder_path
+
+            Example:
+                    notebook = object_name.with_folder_path(spark.table(f"{consumerDB}.notebook"), folder_level)
+    """
+    depth = self.check_path_depth(folder_level)
+    folders = self.notebook_path_hierarchy(dataframe)\
+      .filter(F.col("path_depth") == depth)\
+      .select("notebook_path", "folder_path")
+    return dataframe\
+      .join(folders, on="notebook_path", how="left")\
+      .withColumn("folder_path", F.coalesce(F.col("folder_path"), F.lit("")))
+  
+  def notebook_folder_rollup(self, dataframe) -> pyspark.sql.dataframe.DataFrame:
+    """
+    Returns one cached row per path depth, folder_path, organization_id and workspace_name with every task metric the Notebook
+    dashboard charts, for all the depths of the path hierarchy at once. The tasks are first summed per notebook path and
+    spark execution, then the partial sums are rolled up to the folders of every depth, so the tasks are read once whatever
+    the depth and switching depth is a filter of this frame (see notebook_folder_metrics), cached once per input frame
+    (see cached_frame).
+    Shuffle / read / write totals add up the same task_metrics fields as the dashboard, interactive_* columns only count
+    tasks of spark jobs not started by a Databricks job (db_job_id is null), failed_* columns the failed or killed
+    non speculative tasks of failed spark jobs.
+
+            Parameters:
+                    dataframe (DataFrame): spark notebook master frame (snapshot("spark_notebook_master", ...)), without folder_path
+
+            Returns:
+                    DataFrame: Raw sums / counts per depth and folder, unit conversions are left to the charts
+
+            Example:
+                    folder_rollup = object_name.notebook_folder_rollup(sparkMaster)
+    """
+    metrics = "task_metrics"
+    interactive = F.col("db_job_id").isNull()
+    failed = (F.col("job_result.Result") == "JobFailed")\
+      & ((F.col("task_info.Failed") == True) | (F.col("task_info.Killed") == True))\
+      & (F.col("task_info.speculative") == False)
+    count_if = lambda condition: F.sum(F.when(condition, 1).otherwise(0))
+    # Additive task sums, kept apart until the final aggregation so a total is null exactly when the dashboard's was
+    task_sums = {
+      "shuffle_local_bytes_read": F.sum(f"{metrics}.ShuffleReadMetrics.LocalBytesRead"),
+      "shuffle_remote_bytes_read": F.sum(f"{metrics}.ShuffleReadMetrics.RemoteBytesRead"),
+      "shuffle_remote_bytes_read_to_disk": F.sum(f"{metrics}.ShuffleReadMetrics.RemoteBytesReadToDisk"),
+      "shuffle_bytes_written": F.sum(f"{metrics}.ShuffleWriteMetrics.ShuffleBytesWritten"),
+      "shuffle_records_written": F.sum(f"{metrics}.ShuffleWriteMetrics.ShuffleRecordsWritten"),
+      "shuffle_write_time": F.sum(f"{metrics}.ShuffleWriteMetrics.ShuffleWriteTime"),
+      "input_bytes_read": F.sum(f"{metrics}.InputMetrics.BytesRead"),
+      "input_records_read": F.sum(f"{metrics}.InputMetrics.RecordsRead"),
+      "output_bytes_written": F.sum(f"{metrics}.OutputMetrics.BytesWritten"),
+      "output_records_written": F.sum(f"{metrics}.OutputMetrics.RecordsWritten"),
+      "result_size": F.sum(f"{metrics}.ResultSize"),
+      "result_size_count": F.count(f"{metrics}.ResultSize"),
+      "runtime_s": F.sum("task_runtime.runTimeS"),
+      "runtime_h": F.sum("task_runtime.runTimeH"),
+      "input_task_count": count_if(F.col(f"{metrics}.InputMetrics.BytesRead") > 0)
+                          + count_if(F.col(f"{metrics}.InputMetrics.RecordsRead") > 0),
+      "output_task_count": count_if(F.col(f"{metrics}.OutputMetrics.BytesWritten") > 0)
+                           + count_if(F.col(f"{metrics}.OutputMetrics.RecordsWritten") > 0),
+      "shuffle_task_count": count_if(F.col(f"{metrics}.ShuffleReadMetrics.RemoteBytesRead") > 0)
+                            + count_if(F.col(f"{metrics}.ShuffleReadMetrics.RemoteBytesReadToDisk") > 0)
+                            + count_if(F.col(f"{metrics}.ShuffleReadMetrics.LocalBytesRead") > 0)
+                            + count_if(F.col(f"{metrics}.ShuffleWriteMetrics.ShuffleBytesWritten") > 0)
+                            + count_if(F.col(f"{metrics}.ShuffleWriteMetrics.ShuffleRecordsWritten") > 0)
+                            + count_if(F.col(f"{metrics}.ShuffleWriteMetrics.ShuffleWriteTime") > 0),
+      "memory_bytes_spilled": F.sum("MemoryBytesSpilled"),
+      "disk_bytes_spilled": F.sum("DiskBytesSpilled"),
+      "interactive_task_count": count_if(interactive),
+      "interactive_deserialize_time": F.sum(F.when(interactive, F.col(f"{metrics}.ExecutorDeserializeTime"))),
+      "interactive_serialization_time": F.sum(F.when(interactive, F.col(f"{metrics}.ResultSerializationTime"))),
+      "interactive_runtime_h": F.sum(F.when(interactive, F.col("task_runtime.runTimeH"))),
+      "manual_runtime_h": F.sum(F.when(F.col("Execution_type") == "Manual_notebook", F.col("task_runtime.runTimeH"))),
+      "job_runtime_h": F.sum(F.when(F.col("Execution_type") == "Job_notebook", F.col("task_runtime.runTimeH"))),
+      "failed_task_count": count_if(failed),
+      "failed_runtime_h": F.sum(F.when(failed, F.col("task_runtime.runTimeH"))),
+      "failed_runtime_count": F.count(F.when(failed, F.col("task_runtime.runTimeH"))),
+    }
+    # Grain of the partial sums: the distinct counts of the folders are counted over these columns
+    partial_keys = ["notebook_path", "organization_id", "workspace_name", "execution_id", "notebook_id", "user_email",
+                    interactive.alias("interactive")]
+    total = lambda *names: reduce(add, [F.sum(name) for name in names])
+    return self.cached_frame("notebook_folder_rollup", dataframe, lambda: dataframe\
+      .groupBy(*partial_keys)\
+      .agg(*[value.alias(name) for name, value in task_sums.items()])\
+      .join(self.notebook_path_hierarchy(dataframe), on="notebook_path", how="inner")\
+      .groupBy("path_depth", "folder_path", "organization_id", "workspace_name")\
+      .agg(
+        total("shuffle_local_bytes_read", "shuffle_remote_bytes_read", "shuffle_remote_bytes_read_to_disk",
+              "shuffle_bytes_written", "shuffle_records_written", "shuffle_write_time").alias("shuffle_total"),
+        total("input_bytes_read", "input_records_read").alias("read_total"),
+        total("output_bytes_written", "output_records_written").alias("write_total"),
+        (F.sum("result_size") / F.sum("result_size_count")).alias("avg_result_size"),
+        *[F.sum(name).alias(name) for name in ["runtime_s", "runtime_h", "input_task_count", "output_task_count", "shuffle_task_count",
+                                             "memory_bytes_spilled", "disk_bytes_spilled", "interactive_task_count",
+                                             "interactive_deserialize_time", "interactive_serialization_time", "interactive_runtime_h",
+                                             "manual_runtime_h", "job_runtime_h", "failed_task_count", "failed_runtime_h",
+                                             "failed_runtime_count"]],
+        F.countDistinct("execution_id").alias("execution_count"),
+        F.countDistinct(F.when(F.col("interactive"), F.col("execution_id"))).alias("interactive_execution_count"),
+        F.countDistinct(F.when(F.col("interactive"), F.col("notebook_id"))).alias("interactive_notebook_count"),
+        F.countDistinct(F.when(F.col("interactive"), F.col("user_email"))).alias("interactive_user_count")))
+  
+  def notebook_folder_metrics(self, dataframe, folder_level) -> pyspark.sql.dataframe.DataFrame:
+    """
+    Returns one row per folder_path, organization_id and workspace_name at a path depth with every task metric the Notebook
+    dashboard charts: a filter of the cached notebook_folder_rollup, so each chart is a projection of a small frame and a new
+    depth does not aggregate the sparkTask x sparkJob rows again.
+
+            Parameters:
+                    dataframe (DataFrame): spark notebook master frame (snapshot("spark_notebook_master", ...)), without folder_path
+                    folder_level (int): Path depth, 1..maxPathDepth
+
+            Returns:
+                    DataFrame: Raw sums / counts per folder, unit conversions are left to the charts
+
+            Example:
+                    folder_metrics = object_name.notebook_folder_metrics(sparkMaster, folder_level)
+    """
+    depth = self.check_path_depth(folder_level)
+    return self.notebook_folder_rollup(dataframe)\
+      .filter(F.col("path_depth") == depth)\
+      .drop("path_depth")
+    
+  def job_master_filter(self,**kwargs):
+    self.cluster_id = kwargs.get("clusterID","all")
+    self.tags = kwargs.get("tags","all")
+    self.include_weekend = kwargs.get("includeWeekend","Yes")
+    self.only_weekend = kwargs.get("onlyWeekend","No")
+    self.date_col = kwargs.get("dateColumn",False)
+    self.cluster_table = kwargs.get("clusterTable",False)
+         
+    
+    jrcp = self.read_source("jobruncostpotentialfact",
+                            columns=self.source_columns["jobruncostpotentialfact"] + [F.expr("DATE(task_runtime.startTS) as job_start_date")],
+                            dateColumn=self.date_col,
+                            timestampColumn="task_runtime.startTS" if self.date_col == "job_start_date" else None)
+
+    job = self.read_source("job")
+    
+    jobrun = self.read_source("jobRun")
+
+
+    jrcp_master = jrcp\
+                  .transform(helpers.filter_clusters(self,self.cluster_table))\
+                  .join(jobrun, jrcp["run_id"] == jobrun["run_id"], "inner")\
+                  .join(job, jrcp["job_id"] == job["job_id"], "inner")\
+                  .select(jrcp["*"],
+                          job["notebook_path"],
+                          jobrun["cluster_type"]
+                         )\
+                  .select("organization_id", "workspace_name","job_start_date","job_id","run_id","job_name"
+                           ,"task_runtime.startTS","task_runtime.endTS","task_runtime.runTimeH","cluster_id","cluster_name","cluster_type"
+                           ,"terminal_state","worker_potential_core_H","total_compute_cost","task_type"
+                           ,"total_dbu_cost","total_cost","is_weekend","notebook_path","created_by","last_edited_by","job_run_cluster_util", "job_trigger_type")
+    return jrcp_master
+  
+  def expensive_jobs_top_n(self, dataframe, **kwargs) -> pyspark.sql.dataframe.DataFrame:
+    """
+    Returns one row per job_start_date with the top N most expensive jobs of the day for every slice of master.top_n_slices
+    (all jobs, failed runs only, runs outside job clusters). The job frame is aggregated once with conditional sums, each slice
+    is ranked with row_number over the same job_start_date partitioning, and only the rows ranked within N in some slice are
+    collected, so no list grows beyond N entries per day and slice.
+
+            Parameters:
+                    dataframe (DataFrame): job master frame (job_master_filter / snapshot("job_master"))
+                    topN (int): Number of jobs kept per day and slice, defaults to 3
+
+            Returns:
+                    DataFrame: job_start_date and one array<struct<workspace_name, job_name, cost_in_USD>> column per slice,
+                               sorted by cost_in_USD descending
+
+            Example:
+                    top_jobs = object_name.expensive_jobs_top_n(job, topN = 3)
+    """
+    top_n = int(kwargs.get("topN", 3))
+    slices = list(self.top_n_slices.items())
+    
+    job_costs = dataframe\
+      .groupby("job_name","job_start_date","workspace_name")\
+      .agg(*[F.round(F.sum(F.when(F.expr(condition), F.col("total_dbu_cost"))),2).cast("double").alias(cost_column)
+             for _, (cost_column, condition) in slices])\
+      .withColumn("workspace_name", F.coalesce("workspace_name", F.lit("")))\
+      .withColumn("job_name", F.coalesce("job_name", F.lit("")))
+    
+    # Ties are broken on workspace and job name, descending, like the sorted (cost, workspace, job) lists used before
+    ranked = job_costs
+    for slice_name, (cost_column, _) in slices:
+      ranking = Window.partitionBy("job_start_date").orderBy(F.col(cost_column).desc_nulls_last(), F.col("workspace_name").desc(), F.col("job_name").desc())
+      ranked = ranked.withColumn(f"{slice_name}_rank", F.when(F.col(cost_column).isNotNull(), F.row_number().over(ranking)))
+    in_top_n = {slice_name: F.col(f"{slice_name}_rank") <= top_n for slice_name, _ in slices}
+    
+    ranked_slices = []
+    for slice_name, (cost_column, _) in slices:
+      ranked_job = F.struct(F.col(f"{slice_name}_rank").alias("rank"),
+                            F.col("workspace_name"),
+                            F.col("job_name"),
+                            F.col(cost_column).alias("cost_in_USD"))
+      top_jobs = F.array_sort(F.collect_list(F.when(in_top_n[slice_name], ranked_job)))
+      ranked_slices.append(F.transform(top_jobs, lambda job: F.struct(job["workspace_name"].alias("workspace_name"),
+                                                                      job["job_name"].alias("job_name"),
+                                                                      job["cost_in_USD"].alias("cost_in_USD"))).alias(slice_name))
+    return ranked\
+      .filter(reduce(lambda left, right: left | right, in_top_n.values()))\
+      .groupBy("job_start_date")\
+      .agg(*ranked_slices)
+  
+  
+
+  def cluster_master_filter(self,**kwargs):
+    self.include_weekend = kwargs.get("includeWeekend","Yes")
+    self.only_weekend = kwargs.get("onlyWeekend","No")
+    
+    clusterstatefact = self.read_source("clusterstatefact", dateColumn="state_start_date")
+
+    cluster = self.read_source("cluster")
+    
+    clsf_master = clusterstatefact.join(cluster, clusterstatefact["cluster_id"] == cluster["cluster_id"], "inner")\
+        .withColumn("cluster_category",
+                  F.expr("""case when is_automated = 'true' and cluster_type not in ('Serverless','SQL Analytics','Single Node') then 'Automated'
+                  when clusterstatefact.cluster_name like "dlt%" or cluster_type = 'Standard' then 'Standard' 
+                  when is_automated = 'false' and cluster_type not in ('Serverless','SQL Analytics','Single Node') then 'Interactive'
+                  when (is_automated = 'false' or is_automated = 'true' or is_automated is null) and cluster_type = 'SQL Analytics' then 'Warehouse' 
+                  when (is_automated = 'false' or is_automated = 'true' or is_automated is null) and cluster_type = 'Serverless' then 'High-Concurrency'
+                  when (is_automated = 'false' or is_automated = 'true' or is_automated is null) and cluster_type = 'Single Node' then 'Single Node'
+                  else "Unidentified"
+                  end"""))\
+        .select(clusterstatefact["*"]
+                ,cluster["created_by"]
+                ,cluster["last_edited_by"]
+                ,cluster["deleted_by"]
+                ,cluster["driver_node_type"]
+                ,cluster["node_type"].alias("worker_node_type")
+                ,cluster["autoscale"]
+                ,cluster["is_automated"]
+                ,cluster["cluster_type"]
+                ,cluster["auto_termination_minutes"]
+                ,cluster["instance_pool_id"]
+                ,cluster["instance_pool_name"]
+                ,"cluster_category"
+               )\
+    .withColumn("tag_map", F.from_json(F.col("custom_tags"), "map<string,string>"))\
+    .withColumn("SqlEndpointId", F.col("tag_map")["SqlEndpointId"])\
+    .withColumn("cluster_identity", F.regexp_replace(F.col("cluster_name"), "-run-.*$", ""))
+
+    return clsf_master
+
+  def cluster_daily_cost(self, **kwargs) -> pyspark.sql.dataframe.DataFrame:
+    """
+    Returns the cost of every cluster state spread over the days of the state (cost / days_in_state per day),
+    one row per date and cluster. Daily cluster views aggregate this frame (or its snapshot) instead of
+    exploding state_dates of the cluster master again.
+    States that started up to allocationLookbackDays before the window are read, so the days they still run in
+    the window are counted.
+
+            Parameters:
+                    includeWeekend (str): Yes/No, applied on the allocated date
+                    onlyWeekend (str): Yes/No, applied on the allocated date
+
+            Returns:
+                    DataFrame: date, organization_id, workspace_name, cluster_id, cluster_name, cluster_category, auto_termination_minutes,
+                    total_dbu_cost, total_compute_cost, total_cost, core_hours and is_weekend
+
+            Example:
+                    daily_cost = object_name.snapshot("cluster_daily_cost", includeWeekend="Yes", onlyWeekend="No")
+    """
+    self.include_weekend = kwargs.get("includeWeekend", "Yes")
+    self.only_weekend = kwargs.get("onlyWeekend", "No")
+    start = pd.to_datetime(self.start_date).date()
+    end = pd.to_datetime(self.end_date).date()
+    
+    reader = copy.copy(self)
+    reader.start_date = str(start - timedelta(days=self.allocation_lookback_days))
+    states = reader.cluster_master_filter(includeWeekend="Yes", onlyWeekend="No")
+    
+    return states\
+      .fillna(0, subset=["core_hours"])\
+      .withColumn("date", F.explode("state_dates"))\
+      .filter(F.col("date").between(pd.to_datetime(start), pd.to_datetime(end)))\
+      .groupBy("date", "organization_id", "workspace_name", "cluster_id", "cluster_name", "cluster_category", "auto_termination_minutes")\
+      .agg(F.sum(F.col("total_dbu_cost") / F.col("days_in_state")).alias("total_dbu_cost"),
+           F.sum(F.col("total_compute_cost") / F.col("days_in_state")).alias("total_compute_cost"),
+           F.sum(F.col("total_cost") / F.col("days_in_state")).alias("total_cost"),
+           F.sum(F.col("core_hours") / F.col("days_in_state")).alias("core_hours"))\
+      .transform(helpers.filter_calendar_days(self, "date", start, end, self.include_weekend, self.only_weekend))\
+      .transform(helpers.with_calendar(self, "date", start, end))
+  
+  def cluster_transitions(self, **kwargs) -> pyspark.sql.dataframe.DataFrame:
+    """
+    Returns the state transitions of every cluster: its state intervals ordered once per cluster with a single window
+    (previous / next state, next state start, last failure before the state), keeping only the starts, resizes, restarts
+    and failures. Persisted as the cluster_transitions snapshot, the stability and autoscaling charts read it instead of
+    filtering and re-sorting the cluster master for each chart. States that started up to allocationLookbackDays before the
+    window are read, so the first states of the window have their previous state and last failure.
+
+            Parameters:
+                    includeWeekend (str): Yes/No
+                    onlyWeekend (str): Yes/No
+
+            Returns:
+                    DataFrame: state_start_date, organization_id, workspace_name, cluster_id, cluster_name, cluster_category, node_type_id,
+                    is_automated, is_autoscaling, uses_pool, state, previous_state, next_state, transition, unixTimeMS_state_start,
+                    duration_h, start_latency_h, scale_direction, is_failure, hours_since_previous_failure and total_cost
+
+            Example:
+                    transitions = object_name.snapshot("cluster_transitions", includeWeekend="Yes", onlyWeekend="No")
+    """
+    self.include_weekend = kwargs.get("includeWeekend", "Yes")
+    self.only_weekend = kwargs.get("onlyWeekend", "No")
+    start = pd.to_datetime(self.start_date).date()
+    end = pd.to_datetime(self.end_date).date()
+    
+    reader = copy.copy(self)
+    reader.start_date = str(start - timedelta(days=self.allocation_lookback_days))
+    states = reader.cluster_master_filter(includeWeekend="Yes", onlyWeekend="No")
+    
+    by_cluster = Window.partitionBy("organization_id", "cluster_id").orderBy("unixTimeMS_state_start")
+    failure = F.col("state").isin(self.cluster_failure_states)
+    started = F.col("state").isin(self.cluster_start_states) & (F.col("next_state") == "RUNNING")
+    resized = F.col("state") == "RESIZING"
+    return states\
+      .select("state_start_date", "organization_id", "workspace_name", "cluster_id", "cluster_name", "cluster_category", "node_type_id",
+              "is_automated", F.col("autoscale").isNotNull().alias("is_autoscaling"), F.col("instance_pool_id").isNotNull().alias("uses_pool"),
+              "state", "unixTimeMS_state_start", F.col("uptime_in_state_H").alias("duration_h"), "current_num_workers", "target_num_workers",
+              "total_cost")\
+      .withColumn("previous_state", F.lag("state").over(by_cluster))\
+      .withColumn("next_state", F.lead("state").over(by_cluster))\
+      .withColumn("next_state_start_ms", F.lead("unixTimeMS_state_start").over(by_cluster))\
+      .withColumn("previous_failure_ms", F.last(F.when(failure, F.col("unixTimeMS_state_start")), ignorenulls=True)
+                                         .over(by_cluster.rowsBetween(Window.unboundedPreceding, -1)))\
+      .filter(F.col("state_start_date").between(pd.to_datetime(start), pd.to_datetime(end)))\
+      .filter(failure | started | resized | (F.col("state") == "RESTARTING"))\
+      .select("state_start_date", "organization_id", "workspace_name", "cluster_id", "cluster_name", "cluster_category", "node_type_id",
+              "is_automated", "is_autoscaling", "uses_pool", "state", "previous_state", "next_state",
+              F.concat_ws("->", F.coalesce(F.col("previous_state"), F.lit("")), F.col("state")).alias("transition"),
+              "unixTimeMS_state_start", "duration_h",
+              F.when(started, (F.col("next_state_start_ms") - F.col("unixTimeMS_state_start")) / 3600000).alias("start_latency_h"),
+              F.when(resized & (F.col("current_num_workers") < F.col("target_num_workers")), F.lit("up"))
+              .when(resized & (F.col("current_num_workers") > F.col("target_num_workers")), F.lit("down")).alias("scale_direction"),
+              failure.alias("is_failure"),
+              F.when(failure, (F.col("unixTimeMS_state_start") - F.col("previous_failure_ms")) / 3600000).alias("hours_since_previous_failure"),
+              "total_cost")\
+      .transform(helpers.filter_calendar_days(self, "state_start_date", start, end, self.include_weekend, self.only_weekend))
+  
+  def cluster_mtbf(self, transitions, groupBy=None) -> pyspark.sql.dataframe.DataFrame:
+    """
+    Returns the failures of a cluster transitions frame per groupBy: number of failures, failed clusters and the mean time
+    between failures (hours between consecutive failures of the same cluster).
+
+            Parameters:
+                    transitions (DataFrame): cluster transitions frame (snapshot("cluster_transitions", ...))
+                    groupBy (list): Columns of the transitions frame. Default node_type_id
+
+            Returns:
+                    DataFrame: groupBy columns, failure_count, failed_cluster_count and mtbf_h
+
+            Example:
+                    mtbf = object_name.cluster_mtbf(transitions, ["organization_id", "workspace_name", "node_type_id"])
+    """
+    groupBy = ["node_type_id"] if groupBy is None else groupBy
+    return transitions\
+      .filter(F.col("is_failure"))\
+      .groupBy(*groupBy)\
+      .agg(F.count(F.lit(1)).alias("failure_count"),
+           F.countDistinct("cluster_id").alias("failed_cluster_count"),
+           F.avg("hours_since_previous_failure").alias("mtbf_h"))
+  
+  def cluster_idle_time(self, **kwargs) -> pyspark.sql.dataframe.DataFrame:
+    """
+    Returns the uptime of every cluster with and without running Spark tasks per day. The sparkTask intervals of each cluster
+    are first merged into disjoint busy periods (one sort per cluster), then busy periods and RUNNING / RESIZING states are
+    both cut into time bins (idleBinMinutes, 15 minutes by default) and equi-joined on cluster and bin, so every state is only
+    compared with the busy periods of its own bins instead of every task of the cluster. The overlap is clipped to the bin,
+    so a busy period spanning several bins is counted once. The idle cost is the state cost times its idle share.
+
+            Parameters:
+                    includeWeekend (str): Yes/No
+                    onlyWeekend (str): Yes/No
+                    clusterTable (DataFrame): Selected clusters (tag filter), all clusters if None
+                    binMinutes (int): Width of the time bins, defaults to the master idleBinMinutes
+
+            Returns:
+                    DataFrame: date, organization_id, workspace_name, cluster_id, cluster_name, cluster_category, auto_termination_minutes,
+                    uptime_h, busy_h, idle_h, idle_pct, idle_DBU_cost and idle_cost
+
+            Example:
+                    idle = object_name.cluster_idle_time(includeWeekend="Yes", onlyWeekend="No")
+    """
+    self.include_weekend = kwargs.get("includeWeekend", "Yes")
+    self.only_weekend = kwargs.get("onlyWeekend", "No")
+    bin_ms = int(kwargs.get("binMinutes", self.idle_bin_minutes) * 60000)
+    keys = ["organization_id", "cluster_id"]
+    bins = lambda start, end: F.explode(F.sequence(F.floor(F.col(start) / bin_ms), F.floor((F.col(end) - 1) / bin_ms))).alias("bin")
+    
+    states = self.cluster_master_filter(includeWeekend=self.include_weekend, onlyWeekend=self.only_weekend)\
+      .transform(helpers.filter_clusters(self, kwargs.get("clusterTable")))\
+      .filter(F.col("state").isin(self.cluster_up_states) & (F.col("unixTimeMS_state_end") > F.col("unixTimeMS_state_start")))\
+      .select(*keys, "workspace_name", "cluster_name", "cluster_category", "auto_termination_minutes",
+              F.col("unixTimeMS_state_start").alias("up_start_ms"), F.col("unixTimeMS_state_end").alias("up_end_ms"),
+              "total_DBU_cost", "total_cost")
+    
+    tasks = self.read_source("sparkTask",
+                             columns=[*keys, "date", F.col("task_runtime.startEpochMS").alias("task_start_ms"),
+                                      F.col("task_runtime.endEpochMS").alias("task_end_ms")],
+                             dateColumn="date",
+                             weekdays=False)
+    by_cluster = Window.partitionBy(*keys).orderBy("task_start_ms", "task_end_ms")
+    busy = tasks\
+      .filter(F.col("task_end_ms") > F.col("task_start_ms"))\
+      .withColumn("covered_until_ms", F.max("task_end_ms").over(by_cluster.rowsBetween(Window.unboundedPreceding, -1)))\
+      .withColumn("busy_period", F.sum(F.when(F.col("covered_until_ms").isNull() | (F.col("task_start_ms") > F.col("covered_until_ms")), 1).otherwise(0))
+                                 .over(by_cluster.rowsBetween(Window.unboundedPreceding, Window.currentRow)))\
+      .groupBy(*keys, "busy_period")\
+      .agg(F.min("task_start_ms").alias("busy_start_ms"), F.max("task_end_ms").alias("busy_end_ms"))\
+      .select(*keys, "busy_start_ms", "busy_end_ms", bins("busy_start_ms", "busy_end_ms"))
+    
+    bin_end = (F.col("bin") + 1) * bin_ms
+    return states\
+      .select("*", bins("up_start_ms", "up_end_ms"))\
+      .join(busy, keys + ["bin"], "left")\
+      .withColumn("busy_ms", F.when(F.col("busy_start_ms").isNotNull(),
+                                  F.greatest(F.lit(0), F.least(F.col("up_end_ms"), F.col("busy_end_ms"), bin_end)
+                                                   - F.greatest(F.col("up_start_ms"), F.col("busy_start_ms"), F.col("bin") * bin_ms))))\
+      .groupBy(*keys, "up_start_ms", "bin")\
+      .agg(F.first("workspace_name").alias("workspace_name"),
+           F.first("cluster_name").alias("cluster_name"),
+           F.first("cluster_category").alias("cluster_category"),
+           F.first("auto_termination_minutes").alias("auto_termination_minutes"),
+           F.first(F.least(F.col("up_end_ms"), bin_end) - F.greatest(F.col("up_start_ms"), F.col("bin") * bin_ms)).alias("up_ms"),
+           F.coalesce(F.sum("busy_ms"), F.lit(0)).alias("busy_ms"),
+           F.first(F.col("total_DBU_cost") / (F.col("up_end_ms") - F.col("up_start_ms"))).alias("dbu_cost_per_ms"),
+           F.first(F.col("total_cost") / (F.col("up_end_ms") - F.col("up_start_ms"))).alias("cost_per_ms"))\
+      .withColumn("idle_ms", F.col("up_ms") - F.col("busy_ms"))\
+      .groupBy(F.to_date((F.col("bin") * (bin_ms // 1000)).cast("timestamp")).alias("date"),
+               "organization_id", "workspace_name", "cluster_id", "cluster_name", "cluster_category", "auto_termination_minutes")\
+      .agg(F.round(F.sum("up_ms") / 3600000, 3).alias("uptime_h"),
+           F.round(F.sum("busy_ms") / 3600000, 3).alias("busy_h"),
+           F.round(F.sum("idle_ms") / 3600000, 3).alias("idle_h"),
+           F.round(F.sum(F.col("idle_ms") * F.col("dbu_cost_per_ms")), 2).alias("idle_DBU_cost"),
+           F.round(F.sum(F.col("idle_ms") * F.col("cost_per_ms")), 2).alias("idle_cost"))\
+      .withColumn("idle_pct", F.round(F.col("idle_h") * 100 / F.col("uptime_h"), 2))
+  
+  def chargeback(self, **kwargs) -> pyspark.sql.dataframe.DataFrame:
+    """
+    Returns the daily cost of every cluster (cluster_daily_cost) allocated to the users and notebooks that ran Spark tasks on it,
+    in proportion to their task runtime that day. The spark notebook master is summed per cluster-day, user and notebook, the
+    per cluster-day runtime totals are aggregated from these sums, and each sum gets its share of the cluster-day cost through
+    two joins, everything runs on the executors. Cluster-days without tasks keep their whole cost on one unallocated row
+    (user_email "Unallocated", is_allocated false), so the allocated costs add up to the cluster costs.
+    Persisted as the chargeback snapshot, partitioned by date and organization_id.
+
+            Parameters:
+                    includeWeekend (str): Yes/No
+                    onlyWeekend (str): Yes/No
+
+            Returns:
+                    DataFrame: date, organization_id, workspace_name, cluster_id, cluster_name, cluster_category, user_email, notebook_path,
+                    Execution_type, task_runtime_h, cost_share, is_allocated, allocated_dbu_cost, allocated_compute_cost,
+                    allocated_cost and is_weekend
+
+            Example:
+                    chargeback = object_name.snapshot("chargeback", includeWeekend="Yes", onlyWeekend="No")
+    """
+    # Kept apart from self.include_weekend / self.only_weekend, which the nested master builders set to their own arguments
+    include_weekend = kwargs.get("includeWeekend", "Yes")
+    only_weekend = kwargs.get("onlyWeekend", "No")
+    start = pd.to_datetime(self.start_date).date()
+    end = pd.to_datetime(self.end_date).date()
+    keys = ["date", "organization_id", "cluster_id"]
+    
+    usage = self.spark_notebook_master(includeWeekend="Yes", onlyWeekend="No")\
+      .groupBy(*keys,
+               F.coalesce(F.col("user_email"), F.lit("Unknown")).alias("user_email"),
+               F.coalesce(F.col("notebook_path"), F.lit("")).alias("notebook_path"),
+               "Execution_type")\
+      .agg(F.sum("task_runtime.runTimeH").alias("task_runtime_h"))\
+      .filter(F.col("task_runtime_h") > 0)
+    cluster_runtime = usage\
+      .groupBy(*keys)\
+      .agg(F.sum("task_runtime_h").alias("cluster_task_runtime_h"))
+    shares = usage\
+      .join(cluster_runtime, keys)\
+      .withColumn("cost_share", F.col("task_runtime_h") / F.col("cluster_task_runtime_h"))
+    
+    return self.cluster_daily_cost(includeWeekend="Yes", onlyWeekend="No")\
+      .join(shares, keys, "left")\
+      .withColumn("is_allocated", F.col("cost_share").isNotNull())\
+      .withColumn("cost_share", F.coalesce(F.col("cost_share"), F.lit(1.0)))\
+      .select("date", "organization_id", "workspace_name", "cluster_id", "cluster_name", "cluster_category",
+              F.coalesce(F.col("user_email"), F.lit("Unallocated")).alias("user_email"),
+              F.coalesce(F.col("notebook_path"), F.lit("")).alias("notebook_path"),
+              "Execution_type",
+              F.coalesce(F.col("task_runtime_h"), F.lit(0.0)).alias("task_runtime_h"),
+              "cost_share",
+              "is_allocated",
+              (F.col("total_dbu_cost") * F.col("cost_share")).alias("allocated_dbu_cost"),
+              (F.col("total_compute_cost") * F.col("cost_share")).alias("allocated_compute_cost"),
+              (F.col("total_cost") * F.col("cost_share")).alias("allocated_cost"),
+              "is_weekend")\
+      .transform(helpers.filter_calendar_days(self, "date", start, end, include_weekend, only_weekend))
+  
+  def chargeback_rollup(self, chargeback, groupBy=None, folderLevel=None) -> pyspark.sql.dataframe.DataFrame:
+    """
+    Returns the allocated costs and task runtime of a chargeback frame summed per groupBy, with the folder_path of the
+    notebooks at folderLevel when it is given (group by folder_path to charge folders).
+
+            Parameters:
+                    chargeback (DataFrame): chargeback frame (snapshot("chargeback", ...))
+                    groupBy (list): Columns of the chargeback frame, or folder_path. Default user_email
+                    folderLevel (int): Path depth of folder_path, 1..maxPathDepth
+
+            Returns:
+                    DataFrame: groupBy columns, task_runtime_h, allocated_dbu_cost, allocated_compute_cost and allocated_cost
+
+            Example:
+                    by_folder = object_name.chargeback_rollup(chargeback, ["workspace_name", "folder_path"], folderLevel=3)
+    """
+    groupBy = ["user_email"] if groupBy is None else groupBy
+    if folderLevel is not None:
+      chargeback = self.with_folder_path(chargeback, folderLevel)
+    return chargeback\
+      .groupBy(*groupBy)\
+      .agg(F.round(F.sum("task_runtime_h"), 2).alias("task_runtime_h"),
+           F.round(F.sum("allocated_dbu_cost"), 2).alias("allocated_dbu_cost"),
+           F.round(F.sum("allocated_compute_cost"), 2).alias("allocated_compute_cost"),
+           F.round(F.sum("allocated_cost"), 2).alias("allocated_cost"))
+  
+  def concurrency_timeline(self, **kwargs) -> pyspark.sql.dataframe.DataFrame:
+    """
+    Returns the number of live clusters, their cores and the concurrent job runs at the start of every time bucket
+    (concurrencyBucketMinutes, 1 minute by default) per workspace and category, computed with a sweep line: each cluster state
+    and job run becomes a +1 event at its first bucket and a -1 event at its end, the events are summed per bucket and a
+    running sum over the buckets of each workspace and category gives the live counts. Only the event buckets are sorted, the
+    levels are then repeated until the next event, so no interval x time grid join is needed. Persisted as the
+    concurrency_timeline snapshot, buckets where nothing is live are not written.
+    Intervals that started up to allocationLookbackDays before the window and are still live are counted from the window start,
+    so every day range of the snapshot can be built on its own. Changing concurrencyBucketMinutes needs a full refresh.
+
+            Parameters:
+                    includeWeekend (str): Yes/No
+                    onlyWeekend (str): Yes/No
+
+            Returns:
+                    DataFrame: date, bucket_start, organization_id, workspace_name, category (cluster_category for clusters,
+                    cluster_type for job runs), active_clusters, active_cores and concurrent_runs
+
+            Example:
+                    timeline = object_name.snapshot("concurrency_timeline", includeWeekend="Yes", onlyWeekend="No")
+    """
+    self.include_weekend = kwargs.get("includeWeekend", "Yes")
+    self.only_weekend = kwargs.get("onlyWeekend", "No")
+    start = pd.to_datetime(self.start_date).date()
+    end = pd.to_datetime(self.end_date).date()
+    bucket_ms = int(self.concurrency_bucket_minutes * 60000)
+    window_start = F.unix_timestamp(F.lit(str(start)).cast("timestamp")) * 1000
+    window_end = F.unix_timestamp(F.lit(str(end + timedelta(days=1))).cast("timestamp")) * 1000
+    
+    reader = copy.copy(self)
+    reader.start_date = str(start - timedelta(days=self.allocation_lookback_days))
+    clusters = reader.cluster_master_filter(includeWeekend="Yes", onlyWeekend="No")\
+      .filter(~F.col("state").isin(self.cluster_idle_states))\
+      .select("organization_id", "workspace_name", F.col("cluster_category").alias("category"),
+              F.col("unixTimeMS_state_start").alias("start_ms"), F.col("unixTimeMS_state_end").alias("end_ms"),
+              F.lit(1).alias("clusters"), F.coalesce(F.col("core_hours") / F.col("uptime_in_state_H"), F.lit(0.0)).alias("cores"), F.lit(0).alias("runs"))
+    runs = reader.job_master_filter(includeWeekend="Yes", onlyWeekend="No", dateColumn="job_start_date", clusterTable=None)\
+      .select("organization_id", "workspace_name", F.coalesce(F.col("cluster_type"), F.lit("Unidentified")).alias("category"),
+              (F.unix_timestamp("startTS") * 1000).alias("start_ms"), (F.unix_timestamp("endTS") * 1000).alias("end_ms"),
+              F.lit(0).alias("clusters"), F.lit(0.0).alias("cores"), F.lit(1).alias("runs"))
+    
+    first_bucket = lambda ms: F.ceil(ms / bucket_ms).cast("long")
+    events = clusters.unionByName(runs)\
+      .filter((F.col("start_ms") < window_end) & (F.coalesce(F.col("end_ms"), window_end) > window_start))\
+      .select("organization_id", "workspace_name", "category", "clusters", "cores", "runs",
+              F.explode(F.array(F.struct(first_bucket(F.greatest(F.col("start_ms"), window_start)).alias("bucket"), F.lit(1).alias("sign")),
+                            F.struct(first_bucket(F.least(F.coalesce(F.col("end_ms"), window_end), window_end)).alias("bucket"), F.lit(-1).alias("sign"))))
+              .alias("event"))\
+      .groupBy("organization_id", "workspace_name", "category", "event.bucket")\
+      .agg(F.sum(F.col("clusters") * F.col("event.sign")).alias("clusters_delta"),
+           F.sum(F.col("cores") * F.col("event.sign")).alias("cores_delta"),
+           F.sum(F.col("runs") * F.col("event.sign")).alias("runs_delta"))
+    
+    by_category = Window.partitionBy("organization_id", "workspace_name", "category").orderBy("bucket")
+    running = by_category.rowsBetween(Window.unboundedPreceding, Window.currentRow)
+    last_bucket = first_bucket(window_end)
+    return events\
+      .withColumn("active_clusters", F.sum("clusters_delta").over(running))\
+      .withColumn("active_cores", F.round(F.sum("cores_delta").over(running), 2))\
+      .withColumn("concurrent_runs", F.sum("runs_delta").over(running))\
+      .withColumn("next_bucket", F.coalesce(F.lead("bucket").over(by_category), last_bucket))\
+      .filter((F.col("bucket") < last_bucket) & ((F.col("active_clusters") > 0) | (F.col("active_cores") > 0) | (F.col("concurrent_runs") > 0)))\
+      .withColumn("bucket", F.explode(F.sequence(F.col("bucket"), F.col("next_bucket") - 1)))\
+      .withColumn("bucket_start", (F.col("bucket") * (bucket_ms // 1000)).cast("timestamp"))\
+      .select(F.to_date("bucket_start").alias("date"), "bucket_start", "organization_id", "workspace_name", "category",
+              "active_clusters", "active_cores", "concurrent_runs")\
+      .transform(helpers.filter_calendar_days(self, "date", start, end, self.include_weekend, self.only_weekend))
+  
+  def concurrency_peaks(self, timeline, groupBy=None, period="day", percentile=0.95) -> pyspark.sql.dataframe.DataFrame:
+    """
+    Returns the peak and a percentile of the live clusters, cores and job runs of a concurrency timeline per period and groupBy.
+    The timeline is summed per bucket first, so the peaks of several categories or workspaces are the peaks of their total.
+    Buckets where nothing is live are not in the timeline, the percentile is taken over the buckets with activity.
+
+            Parameters:
+                    timeline (DataFrame): concurrency timeline (snapshot("concurrency_timeline", ...))
+                    groupBy (list): Columns of the timeline. Default organization_id, workspace_name
+                    period (str): date_trunc unit of the period (hour, day, week, ...). Default day
+                    percentile (float): Percentile reported next to the peak. Default 0.95
+
+            Returns:
+                    DataFrame: period_start, groupBy columns, peak_clusters, peak_cores, peak_runs and the
+                    p<percentile>_clusters, p<percentile>_cores, p<percentile>_runs columns
+
+            Example:
+                    peaks = object_name.concurrency_peaks(timeline, ["workspace_name"], period="hour")
+    """
+    groupBy = ["organization_id", "workspace_name"] if groupBy is None else groupBy
+    label = f"p{round(percentile * 100):g}"
+    return timeline\
+      .groupBy("bucket_start", *groupBy)\
+      .agg(F.sum("active_clusters").alias("active_clusters"),
+           F.sum("active_cores").alias("active_cores"),
+           F.sum("concurrent_runs").alias("concurrent_runs"))\
+      .groupBy(F.date_trunc(period, F.col("bucket_start")).alias("period_start"), *groupBy)\
+      .agg(F.max("active_clusters").alias("peak_clusters"),
+           F.round(F.max("active_cores"), 2).alias("peak_cores"),
+           F.max("concurrent_runs").alias("peak_runs"),
+           F.percentile_approx("active_clusters", percentile).alias(f"{label}_clusters"),
+           F.round(F.percentile_approx("active_cores", percentile), 2).alias(f"{label}_cores"),
+           F.percentile_approx("concurrent_runs", percentile).alias(f"{label}_runs"))
+  
+  def cluster_tag_index(self, **kwargs) -> pyspark.sql.dataframe.DataFrame:
+    """
+    Returns the tag inverted index of the clusters: one row per day, cluster and custom tag (tag_key, tag_value),
+    parsed once from the custom_tags JSON of clusterstatefact. Persisted as the cluster_tag_index snapshot, tag filters
+    and tag counts read it instead of parsing custom_tags again.
+
+            Parameters:
+                    includeWeekend (str): Yes/No
+                    onlyWeekend (str): Yes/No
+
+            Returns:
+                    DataFrame: state_start_date, tag_key, tag_value, organization_id, workspace_name, cluster_id and cluster_identity
+
+            Example:
+                    tag_index = object_name.snapshot("cluster_tag_index", includeWeekend="Yes", onlyWeekend="No")
+    """
+    self.include_weekend = kwargs.get("includeWeekend", "Yes")
+    self.only_weekend = kwargs.get("onlyWeekend", "No")
+    clusterstatefact = self.read_source("clusterstatefact",
+                                        columns=["organization_id", "workspace_name", "cluster_id", "cluster_name", "state_start_date", "custom_tags"],
+                                        dateColumn="state_start_date")
+    return clusterstatefact\
+      .select("state_start_date",
+              F.explode(F.from_json(F.col("custom_tags"), "map<string,string>")).alias("tag_key", "tag_value"),
+              "organization_id",
+              "workspace_name",
+              "cluster_id",
+              F.regexp_replace(F.col("cluster_name"), "-run-.*$", "").alias("cluster_identity"))\
+      .distinct()
+  
+  def tag_clusters(self, tags, **kwargs):
+    """
+    Returns the clusters carrying every selected tag in the master date window, looked up in the cluster tag index,
+    None when no tag is selected (so filter_clusters keeps every cluster).
+
+            Parameters:
+                    tags (str): Comma separated key=value or key (any value) tags, '' or 'all' for no tag filter
+                    includeWeekend (str): Yes/No
+                    onlyWeekend (str): Yes/No
+
+            Returns:
+                    DataFrame: Distinct organization_id and cluster_id
+
+            Example:
+                    tag_clusters = object_name.tag_clusters("team=data,OwnerEmail")
+                    outputDF = inputDF.transform(object_name.filter_clusters(tag_clusters))
+    """
+    specs = [tag.strip() for tag in (tags or "").split(",") if tag.strip() and tag.strip() != "all"]
+    if not specs:
+      return None
+    matches = []
+    for i, spec in enumerate(specs):
+      key, _, value = spec.partition("=")
+      condition = (F.col("tag_key") == key.strip()) & (F.col("tag_value") == value.strip()) if value.strip() else F.col("tag_key") == key.strip()
+      matches.append(F.when(condition, F.lit(i)))
+    index = self.snapshot("cluster_tag_index",
+                          includeWeekend=kwargs.get("includeWeekend", self.include_weekend),
+                          onlyWeekend=kwargs.get("onlyWeekend", self.only_weekend))
+    return index\
+      .withColumn("tag_spec", F.coalesce(*matches))\
+      .filter(F.col("tag_spec").isNotNull())\
+      .groupBy("organization_id", "cluster_id")\
+      .agg(F.countDistinct("tag_spec").alias("matched_tags"))\
+      .filter(F.col("matched_tags") == len(specs))\
+      .select("organization_id", "cluster_id")
+  
+  def node_type_rollup(self, dataframe) -> pyspark.sql.dataframe.DataFrame:
+    """
+    Returns one cached row per Cloud, node_type, organization_id and workspace_name of a cluster master frame, with the
+    number of distinct clusters (job run clusters counted once per job through cluster_identity) and the DBU cost.
+    Every per cloud node type chart is a filter of this frame instead of another pass over the cluster master, cached
+    once per input frame (see cached_frame).
+
+            Parameters:
+                    dataframe (DataFrame): cluster master frame (snapshot("cluster_master", ...))
+
+            Returns:
+                    DataFrame: Cloud, node_type, organization_id, workspace_name, cluster_count and dbu_cost
+
+            Example:
+                    node_rollup = object_name.node_type_rollup(cluster_master)
+                    azure_nodes = node_rollup.filter(col("Cloud") == "Azure")
+    """
+    clouds = self.catalog.cloud_split().select("organization_id", "Cloud")
+    return self.cached_frame("node_type_rollup", dataframe, lambda: dataframe\
+      .filter(F.col("worker_node_type").isNotNull())\
+      .join(F.broadcast(clouds), on="organization_id", how="left")\
+      .groupBy("Cloud", F.col("worker_node_type").alias("node_type"), "organization_id", "workspace_name")\
+      .agg(F.countDistinct("cluster_identity").alias("cluster_count"),
+           F.round(F.sum("total_dbu_cost"), 2).alias("dbu_cost")))
+  
+  def sketch_lg_config_k(self) -> int:
+    """
+    Returns the HLL lgConfigK whose relative standard error (1.04 / sqrt(2^lgConfigK)) is within distinctErrorBound,
+    between the 4 and 21 the sketch functions accept (the default bound of 0.02 gives their default of 12).
+    """
+    return min(21, max(4, math.ceil(math.log2((1.04 / self.distinct_error_bound) ** 2))))
+  
+  def hll_sketches_available(self) -> bool:
+    """
+    Returns True when the runtime has the HLL sketch functions (Spark 3.5, Databricks Runtime 13.3 LTS and above),
+    looked up once per master object. Without them distinct_count counts the consumer tables exactly.
+    """
+    if self.hll_sketches is None:
+      self.hll_sketches = spark.catalog.functionExists("hll_sketch_agg")
+    return self.hll_sketches
+  
+  def distinct_ids(self, table) -> pyspark.sql.dataframe.DataFrame:
+    """
+    Returns date, organization_id, workspace_name, entity, key and id of every distinct count entity read from a consumer
+    table (see master.distinct_entities), with a single scan of the table.
+    """
+    if table == "clusterstatefact":
+      df = self.read_source(table, columns=["organization_id", "workspace_name", "cluster_id", "state_start_date"], dateColumn="state_start_date")\
+        .withColumnRenamed("state_start_date", "date")
+    elif table == "jobruncostpotentialfact":
+      df = self.read_source(table,
+                            columns=["organization_id", "workspace_name", "job_id", "run_id", "job_trigger_type",
+                                     F.expr("DATE(task_runtime.startTS) as job_start_date")],
+                            dateColumn="job_start_date",
+                            timestampColumn="task_runtime.startTS")\
+        .withColumnRenamed("job_start_date", "date")
+    else:
+      df = self.read_source(table,
+                            columns=["organization_id", "workspace_name", "date", "execution_id", "notebook_id", "notebook_path", "user_email", "db_job_id"],
+                            dateColumn="date")
+    ids = [F.when(F.expr(condition) if condition else F.lit(True),
+                F.struct(F.lit(entity).alias("entity"),
+                       (F.col(key_column) if key_column else F.lit(None)).cast("string").alias("key"),
+                       F.col(id_column).cast("string").alias("id")))
+           for entity, (source, id_column, condition, key_column) in self.distinct_entities.items() if source == table]
+    return df\
+      .select("date", "organization_id", "workspace_name", F.explode(F.array(*ids)).alias("ids"))\
+      .select("date", "organization_id", "workspace_name", "ids.*")\
+      .filter(F.col("id").isNotNull())
+  
+  def distinct_sketches(self, **kwargs) -> pyspark.sql.dataframe.DataFrame:
+    """
+    Returns one HyperLogLog sketch of the distinct ids per day, workspace, entity and key (notebook_path for the spark job
+    entities), built with lgConfigK from distinctErrorBound. Sketches of any date range and workspace set merge with
+    hll_union_agg, so distinct counts are served from this daily frame instead of the raw facts (see distinct_count).
+
+            Parameters:
+                    includeWeekend (str): Yes/No
+                    onlyWeekend (str): Yes/No
+
+            Returns:
+                    DataFrame: date, organization_id, workspace_name, entity, key, sketch and lg_config_k
+
+            Example:
+                    sketches = object_name.snapshot("distinct_sketches", includeWeekend="Yes", onlyWeekend="No")
+    """
+    self.include_weekend = kwargs.get("includeWeekend", "Yes")
+    self.only_weekend = kwargs.get("onlyWeekend", "No")
+    lg_config_k = self.sketch_lg_config_k()
+    tables = list(dict.fromkeys(source for source, _, _, _ in self.distinct_entities.values()))
+    return reduce(lambda left, right: left.unionByName(right), [self.distinct_ids(table) for table in tables])\
+      .groupBy("date", "organization_id", "workspace_name", "entity", "key")\
+      .agg(F.expr(f"hll_sketch_agg(id, {lg_config_k})").alias("sketch"))\
+      .withColumn("lg_config_k", F.lit(lg_config_k))
+  
+  def distinct_count(self, entity, **kwargs) -> pyspark.sql.dataframe.DataFrame:
+    """
+    Returns the number of distinct ids of an entity over the master dates and workspaces, merged from the daily sketches
+    (an estimate within distinctErrorBound) or counted on the consumer table when exact or when the runtime has no HLL
+    sketch functions (before Spark 3.5 / Databricks Runtime 13.3 LTS).
+    Sketches built with another error bound are merged at the lowest precision, refresh the snapshot with
+    refresh_snapshot("distinct_sketches", fullRefresh=True) after changing distinctErrorBound.
+
+            Parameters:
+                    entity (str): Entity name (see master.distinct_entities)
+                    groupBy (list): Columns among date, organization_id, workspace_name, key and folder_path. Default organization_id and workspace_name
+                    folderLevel (int): Entities keyed by notebook_path only, adds the folder_path of the key at this depth
+                    exact (bool): Count the distinct ids of the consumer table. Default exactDistinctCounts of the master
+                    refresh (bool): Refresh the sketch snapshot before reading it. Default True
+                    includeWeekend (str): Yes/No
+                    onlyWeekend (str): Yes/No
+
+            Returns:
+                    DataFrame: groupBy columns and distinct_count
+
+            Example:
+                    job_count = object_name.distinct_count("job_id", groupBy=["workspace_name"])
+    """
+    if entity not in self.distinct_entities:
+      raise Exception(f"Sorry, unknown distinct count entity '{entity}' (use one of {', '.join(self.distinct_entities)})")
+    group_by = kwargs.get("groupBy", ["organization_id", "workspace_name"])
+    include_weekend = kwargs.get("includeWeekend", self.include_weekend)
+    only_weekend = kwargs.get("onlyWeekend", self.only_weekend)
+    exact = kwargs.get("exact", self.exact_distinct_counts) or not self.hll_sketches_available()
+    if exact:
+      self.include_weekend = include_weekend
+      self.only_weekend = only_weekend
+      rows = self.distinct_ids(self.distinct_entities[entity][0])
+    else:
+      rows = self.snapshot("distinct_sketches", includeWeekend=include_weekend, onlyWeekend=only_weekend, refresh=kwargs.get("refresh", True))
+    rows = rows.filter(F.col("entity") == entity)
+    if kwargs.get("folderLevel") is not None:
+      rows = self.with_folder_path(rows.withColumnRenamed("key", "notebook_path"), kwargs.get("folderLevel"))\
+        .withColumnRenamed("notebook_path", "key")
+    if exact:
+      return rows.groupBy(*group_by).agg(F.countDistinct("id").alias("distinct_count"))
+    return rows\
+      .groupBy(*group_by)\
+      .agg(F.expr("hll_sketch_estimate(hll_union_agg(sketch, true))").alias("distinct_count"))
+  
+  def quantiles(self, dataframe, valueColumn, groupBy, percentiles, **kwargs) -> pyspark.sql.dataframe.DataFrame:
+    """
+    Returns approximate percentiles of valueColumn per groupBy, all computed by one percentile_approx aggregation
+    (a mergeable quantile summary, rank error 1 / accuracy) instead of one exact percentile window per percentage.
+
+            Parameters:
+                    dataframe (DataFrame): Input frame
+                    valueColumn (str): Numeric column
+                    groupBy (list): Columns the percentiles are computed within
+                    percentiles (dict): Output column -> percentage (0 to 1)
+                    accuracy (int): percentile_approx accuracy. Default 10000
+
+            Returns:
+                    DataFrame: groupBy columns and one column per percentile
+
+            Example:
+                    cost_quantiles = object_name.quantiles(job_cost, "total_dbu_cost", ["job_start_date"], {"50%": 0.5, "99%": 0.99})
+    """
+    labels = list(percentiles)
+    return dataframe\
+      .groupBy(*groupBy)\
+      .agg(F.percentile_approx(valueColumn, [float(percentiles[label]) for label in labels], kwargs.get("accuracy", 10000)).alias("quantiles"))\
+      .select(*groupBy, *[F.col("quantiles")[i].alias(label) for i, label in enumerate(labels)])
+  
+  def box_stats(self, dataframe, valueColumn, groupBy, **kwargs) -> pyspark.sql.dataframe.DataFrame:
+    """
+    Returns the box plot statistics of valueColumn per groupBy, so a box chart gets one row per box whatever the number of points:
+    count, mean, min, approximate quartiles (percentile_approx), max, the Tukey whiskers (most extreme values within 1.5 IQR of
+    the quartiles), the number of outliers and a sample of the outliers furthest from the box.
+
+            Parameters:
+                    dataframe (DataFrame): Input frame
+                    valueColumn (str): Numeric column
+                    groupBy (list): One box per distinct value of these columns
+                    outlierSample (int): Number of outliers kept per box. Default 5
+                    accuracy (int): percentile_approx accuracy. Default 10000
+
+            Returns:
+                    DataFrame: groupBy columns, count, mean, min, q1, median, q3, max, lower_whisker, upper_whisker, outlier_count and outliers
+
+            Example:
+                    dbu_box = object_name.box_stats(dbu_spend, "total_DBU_cost(USD)", ["cluster_category", "workspace_name"])
+    """
+    group = Window.partitionBy(*groupBy)
+    quartile = lambda i: F.col("quartiles")[i]
+    iqr = quartile(2) - quartile(0)
+    values = dataframe\
+      .select(*groupBy, F.col(valueColumn).cast("double").alias("value"))\
+      .filter(F.col("value").isNotNull())\
+      .withColumn("quartiles", F.percentile_approx("value", [0.25, 0.5, 0.75], kwargs.get("accuracy", 10000)).over(group))\
+      .withColumn("distance", F.greatest(quartile(0) - 1.5 * iqr - F.col("value"), F.col("value") - quartile(2) - 1.5 * iqr))\
+      .withColumn("outlier_rank", F.row_number().over(group.orderBy(F.col("distance").desc())))
+    outside = F.col("distance") > 0
+    return values\
+      .groupBy(*groupBy)\
+      .agg(F.count("value").alias("count"),
+           F.avg("value").alias("mean"),
+           F.min("value").alias("min"),
+           F.first(quartile(0)).alias("q1"),
+           F.first(quartile(1)).alias("median"),
+           F.first(quartile(2)).alias("q3"),
+           F.max("value").alias("max"),
+           F.min(F.when(~outside, F.col("value"))).alias("lower_whisker"),
+           F.max(F.when(~outside, F.col("value"))).alias("upper_whisker"),
+           F.sum(F.when(outside, 1).otherwise(0)).alias("outlier_count"),
+           F.sort_array(F.collect_list(F.when(outside & (F.col("outlier_rank") <= kwargs.get("outlierSample", 5)), F.col("value")))).alias("outliers"))
+  
+  def job_test_filter(self,**kwargs):
+    self.cluster_id = kwargs.get("clusterID","all")
+    self.tags = kwargs.get("tags","all")
+    self.include_weekend = kwargs.get("includeWeekend","Yes")
+    self.only_weekend = kwargs.get("onlyWeekend","No")
+    self.date_col = kwargs.get("dateColumn",False)
+    self.cluster_table = kwargs.get("clusterTable",False)
+         
+    
+    jrcp = self.read_source("jobruncostpotentialfact",
+                            columns=self.source_columns["jobruncostpotentialfact"] + [F.expr("DATE(task_runtime.startTS) as job_start_date")],
+                            dateColumn=self.date_col,
+                            timestampColumn="task_runtime.startTS" if self.date_col == "job_start_date" else None)
+
+    job = self.read_source("job")
+    
+    jobrun = self.read_source("jobRun")
+
+
+    jrcp_master = jrcp\
+                  .join(jobrun, jrcp["run_id"] == jobrun["run_id"], "inner")\
+                  .join(job, jrcp["job_id"] == job["job_id"], "inner")\
+                  .select(jrcp["*"],
+                          job["notebook_path"],
+                          jobrun["cluster_type"]
+                         )\
+                  .select("organization_id", "workspace_name","job_start_date","job_id","run_id","job_name"
+                           ,"task_runtime.startTS","task_runtime.endTS","task_runtime.runTimeH","cluster_id","cluster_name","cluster_type"
+                           ,"terminal_state","worker_potential_core_H","total_compute_cost"
+                           ,"total_dbu_cost","total_cost","is_weekend","notebook_path","created_by","last_edited_by","job_run_cluster_util", "job_trigger_type")
+#                   .transform(helpers.filter_clusters(self,self.cluster_table))\
+#                   .select("organization_id", "workspace_name","job_start_date","job_id","run_id","job_name"
+#                            ,"task_runtime.startTS","task_runtime.endTS","task_runtime.runTimeH","cluster_id","cluster_name","cluster_type"
+#                            ,"terminal_state","worker_potential_core_H","total_compute_cost"
+#                            ,"total_dbu_cost","total_cost","is_weekend","notebook_path","created_by","last_edited_by","job_run_cluster_util")
+    return jrcp_master
+
+  def snapshot_table(self, name) -> str:
+    return f"{self.analysis_db}.{self.consumer_db}_{name}_snapshot"
+  
+  def snapshot_log_state(self, table):
+    """
+    Returns the latest master_snapshot_log row of a persisted table (coverage and source versions), None if it was never built.
+    """
+    log_table = f"{self.analysis_db}.master_snapshot_log"
+    if not (spark.catalog.tableExists(log_table) and spark.catalog.tableExists(table)):
+      return None
+    return spark.table(log_table)\
+      .filter((F.col("snapshot") == table) & (F.col("etl_db") == self.etl_db) & (F.col("consumer_db") == self.consumer_db))\
+      .orderBy(F.col("refreshed_at").desc())\
+      .first()
+  
+  def log_snapshot_refresh(self, table, start_date, end_date, source_versions):
+    """
+    Records the coverage and the source versions a persisted table was refreshed with in master_snapshot_log.
+    """
+    spark.createDataFrame([(table, self.etl_db, self.consumer_db, start_date, end_date, source_versions, pd.Timestamp.now().to_pydatetime())],
+                          "snapshot string, etl_db string, consumer_db string, start_date date, end_date date, source_versions map<string,bigint>, refreshed_at timestamp")\
+      .write.format("delta").mode("append").saveAsTable(f"{self.analysis_db}.master_snapshot_log")
+  
+  def snapshot_frame(self, name, from_date, until_date) -> pyspark.sql.dataframe.DataFrame:
+    """
+    Returns the rows of a master snapshot for a date range, all workspaces and all days, as written by refresh_snapshot.
+    """
+    builder_method, date_column, sources = self.snapshot_builders[name]
+    builder = copy.copy(self)
+    builder.start_date = str(from_date)
+    builder.end_date = str(until_date)
+    builder.workspace_name = None
+    builder.sources = {}
+    return getattr(builder, builder_method)(includeWeekend="Yes",
+                                            onlyWeekend="No",
+                                            dateColumn=date_column,
+                                            clusterTable=None,
+                                            folder_level=None)
+  
+  def snapshot_columns_changed(self, name) -> bool:
+    """
+    Returns True when the builder of a snapshot produces other columns than its persisted table (a column was added to
+    the master), so refresh_snapshot rebuilds it. Checked once per snapshot table and process.
+    """
+    table = self.snapshot_table(name)
+    if table in self.checked_snapshot_columns:
+      return False
+    expected = self.snapshot_frame(name, self.start_date, self.end_date).columns
+    self.checked_snapshot_columns.add(table)
+    return sorted(spark.table(table).columns) != sorted(expected)
+  
+  def snapshot_status(self, name) -> dict:
+    """
+    Returns the coverage of a master snapshot and compares the source versions it was built from with the current ones.
+
+            Parameters:
+                    name (str): Snapshot name (cluster_master, job_master or spark_notebook_master)
+
+            Returns:
+                    dict: table, start_date, end_date, built_versions, current_versions and fresh (True when no source changed)
+
+            Example:
+                    object_name.snapshot_status("cluster_master")
+    """
+    builder_method, date_column, sources = self.snapshot_builders[name]
+    table = self.snapshot_table(name)
+    current_versions = {source: self.table_version(f"{self.consumer_db}.{source}") for source in sources}
+    status = {"table": table, "start_date": None, "end_date": None, "built_versions": None,
+              "current_versions": current_versions, "fresh": False}
+    state = self.snapshot_log_state(table)
+    if state is None:
+      return status
+    built_versions = dict(state["source_versions"])
+    status.update({"start_date": state["start_date"],
+                   "end_date": state["end_date"],
+                   "built_versions": built_versions,
+                   "fresh": None not in current_versions.values() and built_versions == current_versions})
+    return status
+  
+  def source_restated_from(self, source, from_version, to_version):
+    """
+    Returns the oldest day a fact table rewrote between two Delta versions, read from the add and remove actions of its
+    _delta_log commits: the partition value of its date column, else the minimum of the date column in the file statistics.
+    Returns None when no data file changed, and date.min when the day is unknown (no date column, a file without
+    statistics, commits already cleaned up by the log retention) so the whole snapshot coverage is recomputed.
+
+            Parameters:
+                    source (str): Consumer table name (see master.source_date_columns)
+                    from_version (int): Version the snapshot was built from
+                    to_version (int): Current version
+
+            Returns:
+                    date: Oldest restated day
+
+            Example:
+                    object_name.source_restated_from("sparkTask", 120, 124)
+    """
+    date_column = self.source_date_columns.get(source)
+    if date_column is None:
+      return date.min
+    try:
+      location = spark.sql(f"describe detail {self.source_table(f'{self.consumer_db}.{source}')}").select("location").first()[0]
+      commits = spark.read.json([f"{location}/_delta_log/{version:020d}.json" for version in range(from_version + 1, to_version + 1)])
+    except Exception:
+      return date.min
+    
+    oldest = []
+    for action in ["add", "remove"]:
+      if action not in commits.columns:
+        continue
+      files = commits.filter(F.col(f"{action}.dataChange")).select(f"{action}.*")
+      days = []
+      if "partitionValues" in files.columns and date_column in files.select("partitionValues.*").columns:
+        days.append(F.col("partitionValues").getField(date_column))
+      if "stats" in files.columns:
+        days.append(F.get_json_object("stats", f"$.minValues.{date_column}"))
+      if not days:
+        return date.min
+      day = F.to_date(F.substring(F.coalesce(*days), 1, 10))
+      restated = files.agg(F.min(day).alias("day"), F.count(F.lit(1)).alias("files"), F.count(day).alias("dated_files")).first()
+      if restated["files"] > restated["dated_files"]:
+        return date.min
+      if restated["day"] is not None:
+        oldest.append(restated["day"])
+    return min(oldest) if oldest else None
+  
+  def refresh_snapshot(self, name, **kwargs):
+    """
+    Brings a master snapshot up to date for the master date window, recomputing only what changed:
+    days outside the current coverage, plus the days restated since the last refresh when a source table version moved.
+    Fact tables (master.source_date_columns) are recomputed from the oldest day their Delta commits rewrote (see
+    source_restated_from), the whole coverage when that day is unknown. Dimension tables (cluster, job, jobRun) only
+    recompute the last snapshotLookbackDays days: a rename or tag change of an older cluster or job needs fullRefresh=True.
+    A full rebuild happens on first use, when a source version goes backwards (table recreated) or with fullRefresh=True.
+
+            Parameters:
+                    name (str): Snapshot name (cluster_master, job_master or spark_notebook_master)
+                    fullRefresh (bool): Rebuild the whole window. Default False
+
+            Returns:
+                    dict: snapshot_status after the refresh
+
+            Example:
+                    object_name.refresh_snapshot("job_master")
+    """
+    builder_method, date_column, sources = self.snapshot_builders[name]
+    table = self.snapshot_table(name)
+    status = self.snapshot_status(name)
+    if status["built_versions"] is not None and self.snapshot_columns_changed(name):
+      kwargs = {**kwargs, "fullRefresh": True}
+      status["fresh"] = False
+    if status["fresh"] and status["start_date"] <= pd.to_datetime(self.start_date).date() and status["end_date"] >= pd.to_datetime(self.end_date).date():
+      return status
+    
+    start = pd.to_datetime(self.start_date).date()
+    end = pd.to_datetime(self.end_date).date()
+    built_versions = status["built_versions"]
+    current_versions = status["current_versions"]
+    rebuild = kwargs.get("fullRefresh", False) or built_versions is None or any(
+      current_versions.get(source) is not None and built_versions.get(source) is not None and current_versions[source] < built_versions[source]
+      for source in sources)
+    
+    if rebuild:
+      ranges = [(start, end)]
+      coverage = (start, end)
+    else:
+      ranges = []
+      if start < status["start_date"]:
+        ranges.append((start, status["start_date"] - timedelta(days=1)))
+      if not status["fresh"]:
+        restated_from = status["end_date"] - timedelta(days=self.snapshot_lookback_days)
+        for source in sources:
+          if source in self.source_date_columns and None not in (built_versions.get(source), current_versions.get(source)) \
+             and current_versions[source] != built_versions[source]:
+            oldest = self.source_restated_from(source, built_versions[source], current_versions[source])
+            if oldest is not None:
+              restated_from = min(restated_from, oldest)
+        ranges.append((max(status["start_date"], restated_from), max(end, status["end_date"])))
+      elif end > status["end_date"]:
+        ranges.append((status["end_date"] + timedelta(days=1), end))
+      coverage = (min(start, status["start_date"]), max(end, status["end_date"]))
+    
+    for from_date, until_date in ranges:
+      frame = self.snapshot_frame(name, from_date, until_date)
+      writer = frame.write.format("delta").mode("overwrite").partitionBy(date_column, *self.snapshot_partitions.get(name, []))
+      if rebuild:
+        writer = writer.option("overwriteSchema", "true")
+      else:
+        writer = writer.option("replaceWhere", f"{date_column} between '{from_date}' and '{until_date}'")
+      writer.saveAsTable(table)
+    
+    self.log_snapshot_refresh(table, coverage[0], coverage[1], current_versions)
+    return self.snapshot_status(name)
+  
+  def snapshot(self, name, **kwargs) -> pyspark.sql.dataframe.DataFrame:
+    """
+    Returns a master frame read from its persisted snapshot (refreshed first), filtered by the widget values.
+    Takes the same keyword arguments as the builder method of the snapshot.
+
+            Parameters:
+                    name (str): Snapshot name (cluster_master, job_master or spark_notebook_master)
+                    refresh (bool): Refresh the snapshot before reading it. Default True
+                    includeWeekend (str): Yes/No
+                    onlyWeekend (str): Yes/No
+                    clusterTable (DataFrame): job_master only, selected clusters
+                    folder_level (int): spark_notebook_master only, notebook path depth
+
+            Returns:
+                    DataFrame: Same columns as the builder method output
+
+            Example:
+                    clsf_master = object_name.snapshot("cluster_master", includeWeekend="Yes", onlyWeekend="No")
+    """
+    builder_method, date_column, sources = self.snapshot_builders[name]
+    self.include_weekend = kwargs.get("includeWeekend","Yes")
+    self.only_weekend = kwargs.get("onlyWeekend","No")
+    if kwargs.get("refresh", True):
+      self.refresh_snapshot(name, **kwargs)
+    
+    table = self.snapshot_table(name)
+    df = spark.table(table)\
+      .transform(helpers.filter_dates(self, date_column, self.start_date, self.end_date))\
+      .transform(helpers.filter_workspaces(self, self.workspace_name, table))\
+      .transform(helpers.filter_calendar_days(self, date_column, self.start_date, self.end_date, self.include_weekend, self.only_weekend))\
+      .transform(helpers.filter_clusters(self, kwargs.get("clusterTable")))
+    if kwargs.get("folder_level") is not None:
+      df = df.transform(helpers.partition_split(self, kwargs.get("folder_level"), self.consumer_db))
+    return df
+
+  def lazy_frame(self, build_df):
+    """
+    Returns a function building a dataframe on its first call and returning the same dataframe on the next ones.
+    Dashboard headers wrap their master frames with it: the snapshot refresh checks run in the first cell that
+    misses the result cache, a dashboard read from the cache runs none.
+
+            Parameters:
+                    build_df (function): Returns the dataframe (or None)
+
+            Returns:
+                    function: Returns the dataframe built by the first call
+
+            Example:
+                    job = object_name.lazy_frame(lambda: object_name.snapshot("job_master", includeWeekend="Yes", onlyWeekend="No"))
+                    job_count = object_name.cached_pandas("jobs.job_count", lambda: job().groupBy("job_start_date").count(), ["job_master"])
+    """
+    # The built dataframe is kept on the function rather than in its closure, the result cache keys a cell on the
+    # values its build function captures
+    def frame():
+      if frame.df is None:
+        frame.df = build_df()
+      return frame.df
+    frame.df = None
+    return frame
+  
+  def cached_pandas(self, cell, build_df, sources, **params) -> pd.DataFrame:
+    """
+    Returns build_df().toPandas(), read from the result cache when the same cell was charted with the same widget values
+    and unchanged source tables. The master workspaces and dates are always part of the key, the other widget values the
+    cell depends on (weekend flags, path depth, cluster filter, ...) are passed as keyword arguments. A hit only looks up
+    the source table versions, so build_df should build its master frames itself (see lazy_frame) rather than close over
+    frames refreshed in an earlier cell: a build_df capturing a dataframe or a master object in its closure raises.
+
+            Parameters:
+                    cell (str): Dashboard cell name
+                    build_df (function): Returns the Spark dataframe charted by the cell
+                    sources (list): Snapshot names (see master.snapshot_builders) or consumer table names the cell reads
+                    **params: Widget values the cell depends on
+
+            Returns:
+                    pandas.DataFrame: Frame charted by the cell
+
+            Example:
+                    dbu_cost = object_name.cached_pandas("jobs.dbu_cost", lambda: job().groupBy("job_start_date").agg(sum("total_dbu_cost")), ["job_master"],
+                                                         includeWeekend="Yes", onlyWeekend="No")
+    """
+    if not self.use_result_cache:
+      return build_df().toPandas()
+    tables = []
+    for source in sources:
+      for table in self.snapshot_builders[source][2] if source in self.snapshot_builders else [source]:
+        if f"{self.consumer_db}.{table}" not in tables:
+          tables.append(f"{self.consumer_db}.{table}")
+    key_params = {"etl_db": self.etl_db,
+                  "workspace_name": sorted(self.workspace_name) if self.workspace_name is not None else None,
+                  "start_date": str(self.start_date),
+                  "end_date": str(self.end_date),
+                  **params}
+    versions = self.result_cache.source_versions(tables, self.table_version)
+    return self.result_cache.get_or_compute(cell, build_df, key_params, versions)
+
+  def previous_period(self, **kwargs) -> tuple:
+    """
+    Returns the start and end dates of the period the master window is compared with: previousStartDate and
+    previousEndDate when given, otherwise the window of the same length ending the day before start_date.
+
+            Example:
+                    previous_start, previous_end = object_name.previous_period()
+    """
+    start = pd.to_datetime(self.start_date).date()
+    end = pd.to_datetime(self.end_date).date()
+    if kwargs.get("previousStartDate") is not None and kwargs.get("previousEndDate") is not None:
+      return pd.to_datetime(kwargs["previousStartDate"]).date(), pd.to_datetime(kwargs["previousEndDate"]).date()
+    return start - timedelta(days=(end - start).days + 1), start - timedelta(days=1)
+  
+  def period_comparison(self, name, measures, groupBy, **kwargs) -> pyspark.sql.dataframe.DataFrame:
+    """
+    Returns measures summed over the master window (current) and over the previous period per groupBy, with their
+    difference. The snapshot is read once over both periods, every row is tagged with its period and the current and
+    previous sums are conditional aggregates of the same group by, instead of a second master object and aggregation.
+
+            Parameters:
+                    name (str): Snapshot name (see master.snapshot_builders)
+                    measures (dict): Output name -> column name or Column expression summed in each period
+                    groupBy (list): Columns compared
+                    previousStartDate (str): Start of the previous period. Default the window before start_date
+                    previousEndDate (str): End of the previous period
+                    transform (function): Applied to the snapshot frame before the aggregation (extra filters)
+                    includeWeekend, onlyWeekend, clusterTable, ...: passed to snapshot
+
+            Returns:
+                    DataFrame: groupBy columns and <measure>_current, <measure>_previous, <measure>_delta and <measure>_delta_pct per measure
+
+            Example:
+                    spend = object_name.period_comparison("cluster_daily_cost", {"dbu_cost": "total_dbu_cost"}, ["workspace_name"], includeWeekend="Yes", onlyWeekend="No")
+    """
+    builder_method, date_column, sources = self.snapshot_builders[name]
+    start = pd.to_datetime(self.start_date).date()
+    end = pd.to_datetime(self.end_date).date()
+    previous_start, previous_end = self.previous_period(**kwargs)
+    # One master over the union of both periods, the snapshot is read (and refreshed) once
+    union = copy.copy(self)
+    union.start_date = str(min(start, previous_start))
+    union.end_date = str(max(end, previous_end))
+    union.sources = {}
+    snapshot_kwargs = {key: value for key, value in kwargs.items() if key not in ["previousStartDate", "previousEndDate", "transform"]}
+    df = union.snapshot(name, **snapshot_kwargs)
+    if kwargs.get("transform") is not None:
+      df = kwargs["transform"](df)
+    
+    day = F.col(date_column)
+    current = F.col("period") == "current"
+    previous = F.col("period") == "previous"
+    aggregates = []
+    for measure, value in measures.items():
+      value = F.col(value) if isinstance(value, str) else value
+      aggregates += [F.sum(F.when(current, value)).alias(f"{measure}_current"),
+                     F.sum(F.when(previous, value)).alias(f"{measure}_previous")]
+    result = df\
+      .withColumn("period", F.when(day.between(str(start), str(end)), F.lit("current"))
+                            .when(day.between(str(previous_start), str(previous_end)), F.lit("previous")))\
+      .filter(F.col("period").isNotNull())\
+      .groupBy(*groupBy)\
+      .agg(*aggregates)
+    for measure in measures:
+      delta = F.coalesce(F.col(f"{measure}_current"), F.lit(0)) - F.coalesce(F.col(f"{measure}_previous"), F.lit(0))
+      result = result\
+        .withColumn(f"{measure}_delta", delta)\
+        .withColumn(f"{measure}_delta_pct", F.when(F.col(f"{measure}_previous") != 0, F.round(delta / F.col(f"{measure}_previous") * 100, 2)))
+    return result
+  
+  def cost_cube_grouping_id(self, grouping_set) -> int:
+    n = len(self.cost_cube_columns)
+    return reduce(add, [1 << (n - 1 - i) for i, c in enumerate(self.cost_cube_columns) if c not in grouping_set], 0)
+  
+  def refresh_cost_cube(self, **kwargs):
+    """
+    Builds the cost cube of the master date window from the cluster_master snapshot, in one GROUPING SETS pass.
+    Nothing is recomputed while the window is covered and the snapshot version is unchanged.
+
+            Parameters:
+                    fullRefresh (bool): Rebuild the snapshot and the cube. Default False
+
+            Returns:
+                    str: Cost cube table name
+
+            Example:
+                    object_name.refresh_cost_cube()
+    """
+    self.refresh_snapshot("cluster_master", **kwargs)
+    snapshot_table = self.snapshot_table("cluster_master")
+    cube_table = self.snapshot_table("cost_cube")
+    start = pd.to_datetime(self.start_date).date()
+    end = pd.to_datetime(self.end_date).date()
+    versions = {snapshot_table: self.table_version(snapshot_table)}
+    
+    state = self.snapshot_log_state(cube_table)
+    if state is not None and not kwargs.get("fullRefresh", False) and dict(state["source_versions"]) == versions:
+      if state["start_date"] <= start and state["end_date"] >= end:
+        return cube_table
+      start, end = min(start, state["start_date"]), max(end, state["end_date"])
+    
+    group_by = ", ".join(self.cost_cube_columns)
+    grouping_sets = ", ".join(f"({', '.join(grouping_set)})" for grouping_set in self.cost_cube_sets)
+    spark.table(snapshot_table)\
+      .transform(helpers.filter_dates(self, "state_start_date", start, end))\
+      .withColumn("is_autoscaling", F.col("autoscale").isNotNull())\
+      .withColumn("potential_worker_cost", F.when(F.col("worker_potential_core_H").isNotNull(), F.col("total_worker_cost")))\
+      .createOrReplaceTempView("cost_cube_source")
+    cube = spark.sql(f"""
+      select {group_by},
+             grouping_id() as grouping_id,
+             {", ".join(f"sum({measure}) as {measure}" for measure in self.cost_cube_measures)},
+             count(distinct cluster_id) as cluster_count
+      from cost_cube_source
+      group by {group_by} grouping sets ({grouping_sets})
+    """)
+    writer = cube.write.format("delta").mode("overwrite").partitionBy("state_start_date")
+    if spark.catalog.tableExists(cube_table):
+      writer = writer.option("replaceWhere", f"state_start_date between '{start}' and '{end}'")
+    writer.saveAsTable(cube_table)
+    self.log_snapshot_refresh(cube_table, start, end, versions)
+    return cube_table
+  
+  def cost_cube(self, **kwargs) -> pyspark.sql.dataframe.DataFrame:
+    """
+    Returns a cost aggregation answered from the cost cube, filtered by the master date window, workspaces and weekend widgets.
+    Sums are read from the smallest grouping set holding every requested column, distinct cluster counts across
+    days or across dimensions outside groupBy are recounted from the cluster level rows of the cube.
+
+            Parameters:
+                    groupBy (list): Columns among master.cost_cube_columns
+                    filters (dict): column -> value or list of values, columns among master.cost_cube_columns
+                    includeWeekend (str): Yes/No, defaults to the value used for the master frames
+                    onlyWeekend (str): Yes/No, defaults to the value used for the master frames
+                    clusterTable (DataFrame): Selected clusters (tag_clusters), answered from the cluster level rows
+
+            Returns:
+                    DataFrame: groupBy columns, the cost_cube_measures sums and cluster_count
+
+            Example:
+                    cluster_count_SN = object_name.cost_cube(groupBy=["organization_id", "workspace_name", "cluster_category"],
+                                                             filters={"cluster_category": "Single Node"})
+    """
+    group_by = kwargs.get("groupBy", [])
+    filters = kwargs.get("filters", {})
+    include_weekend = kwargs.get("includeWeekend", self.include_weekend)
+    only_weekend = kwargs.get("onlyWeekend", self.only_weekend)
+    cluster_table = kwargs.get("clusterTable")
+    cube_table = self.refresh_cost_cube()
+    
+    needed = set(group_by) | set(filters) | {"state_start_date", "is_weekend", "organization_id"}
+    if cluster_table is not None:
+      needed.add("cluster_id")
+    candidates = sorted([grouping_set for grouping_set in self.cost_cube_sets if needed <= set(grouping_set)], key=len)
+    if not candidates:
+      raise Exception(f"Sorry, the cost cube has no grouping set for {sorted(needed)}")
+    grouping_set = candidates[0]
+    recount = "state_start_date" not in group_by or not set(grouping_set) <= (set(group_by) | {"state_start_date", "is_weekend"})
+    if recount:
+      grouping_set = self.cost_cube_sets[0]
+    
+    df = spark.table(cube_table)\
+      .filter(F.col("grouping_id") == self.cost_cube_grouping_id(grouping_set))\
+      .transform(helpers.filter_dates(self, "state_start_date", self.start_date, self.end_date))\
+      .transform(helpers.filter_workspaces(self, self.workspace_name, cube_table))\
+      .transform(helpers.filter_calendar_days(self, "state_start_date", self.start_date, self.end_date, include_weekend, only_weekend))
+    for column, value in filters.items():
+      df = df.filter(F.col(column).isin(value if isinstance(value, list) else [value]))
+    df = df.transform(helpers.filter_clusters(self, cluster_table))
+    
+    cluster_count = F.countDistinct("cluster_id") if recount else F.sum("cluster_count")
+    return df\
+      .groupBy(*group_by)\
+      .agg(*[F.sum(measure).alias(measure) for measure in self.cost_cube_measures],
+           cluster_count.alias("cluster_count"))
@@ -0,0 +1,147 @@
+"""
+Workspace catalog of an Overwatch ETL database.
+
+pipeline_report is read once per Python process and ETL database, then kept in
+driver memory. It is reloaded only when the TTL has expired and the Delta
+version of pipeline_report changed since the last load.
+"""
+import pyspark.sql.functions as F
+import pyspark
+import pandas as pd
+import time
+
+from overwatch_analysis.session import spark
+
+
+class workspace_catalog:
+
+  # One catalog per ETL database, shared by every helpers/master object of the process
+  catalogs = {}
+  default_ttl_seconds = 600
+  columns = ["organization_id", "workspace_name", "Cloud", "last_successful_run"]
+
+  @classmethod
+  def get(cls, etl_db, **kwargs):
+    """
+    Returns the shared catalog of an ETL database, created on first use. The TTL is set when the catalog is created,
+    asking an existing catalog for another TTL raises instead of changing it for every other user of the catalog.
+
+            Parameters:
+                    etl_db (str): ETL database name
+                    ttlSeconds (int): Seconds the loaded catalog is used without checking the pipeline_report version
+
+            Returns:
+                    workspace_catalog: Catalog of the ETL database
+
+            Example:
+                    workspace_catalog.get(etlDB).workspace_names()
+    """
+    if etl_db not in cls.catalogs:
+      cls.catalogs[etl_db] = cls(etl_db, **kwargs)
+    elif "ttlSeconds" in kwargs and kwargs["ttlSeconds"] != cls.catalogs[etl_db].ttl_seconds:
+      raise Exception(f"Sorry, the workspace catalog of {etl_db} already uses a TTL of {cls.catalogs[etl_db].ttl_seconds} seconds")
+    return cls.catalogs[etl_db]
+
+  def __init__(self, _etl_db, **kwargs):
+    self.etl_db = _etl_db
+    self.ttl_seconds = kwargs.get("ttlSeconds", self.default_ttl_seconds)
+    self.table_name = f"{_etl_db}.pipeline_report"
+    self._rows = None
+    self._lookup = None
+    self._version = None
+    self._checked_at = None
+
+  def table_version(self):
+    try:
+      return spark.sql(f"describe history {self.table_name} limit 1").select("version").first()[0]
+    except Exception:
+      return None
+
+  def load(self) -> pd.DataFrame:
+    """
+    Returns one row per workspace of pipeline_report (organization_id, workspace_name, Cloud, last_successful_run),
+    read with a single scan of the table.
+    """
+    report = spark.table(self.table_name)
+    cloud = "case when inputConfig.auditLogConfig.azureAuditLogEventhubConfig is null then 'AWS' else 'Azure' end"
+    success = F.col("status").startswith("SUCCESS") if "status" in report.columns else F.lit(True)
+    return report\
+      .groupBy("organization_id", "workspace_name")\
+      .agg(F.first(F.expr(cloud)).alias("Cloud"),
+           F.max(F.when(success, F.col("Pipeline_SnapTS"))).alias("last_successful_run"))\
+      .orderBy("workspace_name")\
+      .toPandas()
+
+  def invalidate(self):
+    self._rows = None
+    self._lookup = None
+    self._checked_at = None
+
+  def rows(self) -> pd.DataFrame:
+    """
+    Returns the catalog rows, loading them on first use. Once the TTL has expired the pipeline_report
+    version is checked and the rows are only reloaded when it changed.
+
+            Returns:
+                    DataFrame: pandas dataframe with organization_id, workspace_name, Cloud and last_successful_run
+
+            Example:
+                    workspace_catalog.get(etlDB).rows()
+    """
+    now = time.monotonic()
+    if self._rows is not None and now - self._checked_at < self.ttl_seconds:
+      return self._rows
+    version = self.table_version()
+    if self._rows is None or version is None or version != self._version:
+      self._rows = self.load()
+      self._lookup = None
+      self._version = version
+    self._checked_at = now
+    return self._rows
+
+  def workspace_names(self) -> list:
+    """
+    Returns the workspace names of the ETL database, used to fill the workspace widgets.
+
+            Example:
+                    dbutils.widgets.multiselect("workspace_name", "all", workspace_catalog.get(etlDB).workspace_names() + ["all"])
+    """
+    return self.rows()["workspace_name"].drop_duplicates().tolist()
+
+  def org_ids(self, workspace_names) -> list:
+    """
+    Returns the organization ids of the selected workspaces.
+
+            Parameters:
+                    workspace_names (list): Workspace Names
+
+            Returns:
+                    list: organization_id of every selected workspace
+    """
+    if isinstance(workspace_names, str):
+      workspace_names = [workspace_names]
+    rows = self.rows()
+    return rows[rows["workspace_name"].isin(workspace_names)]["organization_id"].drop_duplicates().tolist()
+
+  def lookup(self) -> pyspark.sql.dataframe.DataFrame:
+    """
+    Returns the catalog as a Spark dataframe built from the rows held by the driver (a local relation,
+    pipeline_report is not scanned again), small enough to be broadcast in joins.
+
+            Example:
+                    df.join(broadcast(catalog.lookup()), on="organization_id", how="left_semi")
+    """
+    rows = self.rows()
+    if self._lookup is None:
+      self._lookup = spark.createDataFrame(rows[self.columns].astype({"last_successful_run": "datetime64[ns]"}),
+                                           "organization_id string, workspace_name string, Cloud string, last_successful_run timestamp")
+    return self._lookup
+
+  def cloud_split(self) -> pyspark.sql.dataframe.DataFrame:
+    """
+    Returns organization_id, workspace_name and Cloud ('AWS' or 'Azure') of every workspace.
+
+            Example:
+                    splitByCloud = masters.catalog.cloud_split()
+    """
+    return self.lookup().select("organization_id", "workspace_name", "Cloud")
@@ -0,0 +1,206 @@
+"""
+Parquet cache of the pandas frames charted by the dashboards.
+
+An entry is keyed by the dashboard cell, the code that builds it (and the
+values it captures), the widget values and the Delta versions of the consumer
+tables it reads, so reopening an
+unchanged dashboard reads the charted frames from disk instead of running
+their Spark jobs again. Entries are evicted least recently used first, once
+the cache holds more than maxEntries files or maxBytes bytes.
+"""
+import hashlib
+import json
+import os
+import tempfile
+import time
+import types
+import uuid
+from datetime import date
+
+import pandas as pd
+
+
+class result_cache:
+
+  # One cache per directory, shared by every master object of the process
+  caches = {}
+  default_dir = "/dbfs/tmp/overwatch_analysis/result_cache" if os.path.isdir("/dbfs") else os.path.join(tempfile.gettempdir(), "overwatch_analysis_result_cache")
+  default_max_entries = 500
+  default_max_bytes = 2 * 1024 ** 3
+  # Source versions are read on every lookup unless a TTL is opted in with versionTTLSeconds (an entry written
+  # from tables that changed within the TTL is then served until it expires)
+  default_version_ttl_seconds = 0
+
+  @classmethod
+  def get(cls, cache_dir=None, **kwargs):
+    """
+    Returns the shared cache of a directory, created on first use.
+
+            Parameters:
+                    cache_dir (str): Local or /dbfs directory holding the Parquet files
+                    maxEntries (int): Number of cached frames kept
+                    maxBytes (int): Total size of the cached frames kept
+                    versionTTLSeconds (int): Seconds a source table version is reused before it is read again. Default 0 (always read)
+
+            Returns:
+                    result_cache: Cache of the directory
+
+            Example:
+                    cache = result_cache.get("/dbfs/tmp/overwatch_analysis/result_cache")
+    """
+    cache_dir = cache_dir or cls.default_dir
+    if cache_dir not in cls.caches:
+      cls.caches[cache_dir] = cls(cache_dir, **kwargs)
+    return cls.caches[cache_dir]
+
+  def __init__(self, _cache_dir, **kwargs):
+    self.cache_dir = _cache_dir
+    self.max_entries = kwargs.get("maxEntries", self.default_max_entries)
+    self.max_bytes = kwargs.get("maxBytes", self.default_max_bytes)
+    self.version_ttl_seconds = kwargs.get("versionTTLSeconds", self.default_version_ttl_seconds)
+    self.versions = {}
+    self.hits = 0
+    self.misses = 0
+
+  def source_versions(self, tables, table_version) -> dict:
+    """
+    Returns the Delta version of every table, each read with table_version(table) at most once per version TTL.
+    """
+    now = time.monotonic()
+    for table in tables:
+      if table not in self.versions or now - self.versions[table][1] >= self.version_ttl_seconds:
+        self.versions[table] = (table_version(table), now)
+    return {table: self.versions[table][0] for table in tables}
+
+  def key(self, cell, build, params, versions) -> str:
+    """
+    Returns the cache key of a cell: a hash of its name, the bytecode, constants and captured values of its build
+    function, the widget values and the source table versions.
+    """
+    identity = {"cell": cell,
+                "code": self.function_identity(build),
+                "params": params,
+                "versions": versions}
+    return hashlib.sha256(json.dumps(identity, sort_keys=True, default=str).encode()).hexdigest()
+
+  def code_identity(self, code) -> list:
+    # Nested code objects (lambdas inside the cell) are hashed too, their repr holds a memory address
+    consts = [self.code_identity(c) if isinstance(c, types.CodeType) else repr(c) for c in code.co_consts]
+    return [hashlib.sha256(code.co_code).hexdigest(), consts, list(code.co_names)]
+
+  def function_identity(self, function, seen=None) -> list:
+    """
+    Returns the code identity of a function and the values of its closure cells. Captured functions (lazy_frame,
+    helper lambdas) are followed, captured plain values (str, number, date, None and lists or dicts of them) are part
+    of the key. Any other captured value (a dataframe, a master object) would be served from the cache after it changed,
+    so it raises: the cell should pass the value as a widget keyword argument of cached_pandas instead.
+    """
+    seen = seen if seen is not None else set()
+    if id(function) in seen:
+      return "<recursive>"
+    seen.add(id(function))
+    cells = [[name, self.value_identity(name, cell.cell_contents, seen)]
+             for name, cell in zip(function.__code__.co_freevars, function.__closure__ or ())]
+    return [self.code_identity(function.__code__), cells]
+
+  def value_identity(self, name, value, seen):
+    if isinstance(value, types.FunctionType):
+      return self.function_identity(value, seen)
+    if value is None or isinstance(value, (str, int, float, bool, date)):
+      return repr(value)
+    if isinstance(value, (list, tuple, set, frozenset)):
+      values = [self.value_identity(name, v, seen) for v in value]
+      return sorted(values, key=repr) if isinstance(value, (set, frozenset)) else values
+    if isinstance(value, dict):
+      return sorted([[repr(k), self.value_identity(name, v, seen)] for k, v in value.items()], key=repr)
+    raise Exception(f"Sorry, the build function of the cell captures {name} ({type(value).__name__}), "
+                    "pass its value to cached_pandas as a keyword argument or build it inside the function")
+
+  def path(self, key) -> str:
+    return os.path.join(self.cache_dir, f"{key}.parquet")
+
+  def read(self, key):
+    path = self.path(key)
+    try:
+      frame = pd.read_parquet(path)
+    except (FileNotFoundError, OSError, ValueError):
+      return None
+    # The modification time orders the entries for the LRU eviction
+    os.utime(path)
+    return frame
+
+  def write(self, key, frame):
+    os.makedirs(self.cache_dir, exist_ok=True)
+    path = self.path(key)
+    staging = f"{path}.{uuid.uuid4().hex}.tmp"
+    try:
+      frame.to_parquet(staging, index=False)
+    except Exception:
+      if os.path.exists(staging):
+        os.remove(staging)
+      raise
+    os.replace(staging, path)
+    self.evict()
+
+  def entries(self) -> list:
+    """
+    Returns (modification time, size, path) of every cached frame, least recently used first.
+    """
+    if not os.path.isdir(self.cache_dir):
+      return []
+    entries = []
+    for name in os.listdir(self.cache_dir):
+      if name.endswith(".parquet"):
+        path = os.path.join(self.cache_dir, name)
+        try:
+          stat = os.stat(path)
+        except FileNotFoundError:
+          continue
+        entries.append((stat.st_mtime, stat.st_size, path))
+    return sorted(entries)
+
+  def evict(self):
+    entries = self.entries()
+    total_bytes = sum(size for _, size, _ in entries)
+    while entries and (len(entries) > self.max_entries or total_bytes > self.max_bytes):
+      _, size, path = entries.pop(0)
+      try:
+        os.remove(path)
+      except FileNotFoundError:
+        pass
+      total_bytes -= size
+
+  def clear(self):
+    for _, _, path in self.entries():
+      os.remove(path)
+    self.versions = {}
+
+  def get_or_compute(self, cell, build, params, versions) -> pd.DataFrame:
+    """
+    Returns the cached frame of a cell, or builds it with build().toPandas() and caches it.
+    Nothing is cached when a source version is unknown (not a Delta table).
+
+            Parameters:
+                    cell (str): Dashboard cell name
+                    build (function): Returns the Spark dataframe of the cell
+                    params (dict): Widget values the cell depends on
+                    versions (dict): Delta version of every source table
+
+            Returns:
+                    pandas.DataFrame: Frame charted by the cell
+    """
+    if None in versions.values():
+      return build().toPandas()
+    key = self.key(cell, build, params, versions)
+    frame = self.read(key)
+    if frame is not None:
+      self.hits += 1
+      return frame
+    self.misses += 1
+    frame = build().toPandas()
+    try:
+      self.write(key, frame)
+    except (OSError, ValueError, TypeError):
+      # Frames Parquet cannot hold (nested rows, mixed object columns) are charted without caching
+      pass
+    return frame
@@ -0,0 +1,17 @@
+"""
+Spark session used by the overwatch_analysis classes.
+
+Notebooks get `spark` injected by the runtime, an imported module does not. The
+proxy below resolves the active session on each use, so importing the package
+never starts or looks up a session by itself.
+"""
+from pyspark.sql import SparkSession
+
+
+class _ActiveSession:
+  
+  def __getattr__(self, name):
+    return getattr(SparkSession.builder.getOrCreate(), name)
+
+
+spark = _ActiveSession()
@@ -0,0 +1,128 @@
+"""
+Fixtures of the overwatch_analysis test suite: a local Spark session and synthetic Overwatch databases written by the
+SyntheticData notebook (run as a script with `spark` injected, as `%run` does on Databricks).
+
+Delta is not needed, the synthetic tables are written as Parquet: sources without a Delta history are read as is and the
+snapshot and result cache layers are skipped (table versions are None). The session is started with delta-spark when it
+is installed and its jars can be fetched, the tests of the snapshot, result cache and catalog reload layers use
+synthetic_delta_db and are skipped otherwise.
+"""
+import os
+import runpy
+
+import pytest
+
+try:
+  from pyspark.sql import SparkSession
+  from overwatch_analysis import master, workspace_catalog
+except ImportError:
+  SparkSession = None
+
+try:
+  from delta import configure_spark_with_delta_pip
+except ImportError:
+  configure_spark_with_delta_pip = None
+
+SYNTHETIC_DATA = os.path.join(os.path.dirname(__file__), "..", "..", "notebooks", "SyntheticData.py")
+
+# Small enough for a laptop, every master method and dashboard aggregation still has several workspaces, days and clusters
+TEST_SCALE = {"workspaces": 2, "days": 7, "clustersPerWorkspace": 4, "jobsPerWorkspace": 4, "notebooksPerWorkspace": 5,
+              "sparkJobsPerDay": 8, "tasksPerJob": 2}
+# Benchmark scale, set OVERWATCH_BENCHMARK_TASKS to time a larger sparkTask table
+BENCHMARK_SCALE = {"workspaces": 4, "days": 14, "clustersPerWorkspace": 10, "jobsPerWorkspace": 10, "notebooksPerWorkspace": 20,
+                   "sparkJobsPerDay": 40, "tasksPerJob": int(os.environ.get("OVERWATCH_BENCHMARK_TASKS", 10))}
+
+
+def spark_builder(warehouse):
+  return SparkSession.builder\
+    .master("local[2]")\
+    .appName("overwatch_analysis_tests")\
+    .config("spark.sql.warehouse.dir", warehouse)\
+    .config("spark.sql.shuffle.partitions", "4")\
+    .config("spark.sql.session.timeZone", "UTC")\
+    .config("spark.ui.enabled", "false")\
+    .config("spark.ui.showConsoleProgress", "false")
+
+
+@pytest.fixture(scope="session")
+def spark(tmp_path_factory):
+  if SparkSession is None:
+    pytest.skip("pyspark is not installed")
+  warehouse = str(tmp_path_factory.mktemp("warehouse"))
+  session = None
+  if configure_spark_with_delta_pip is not None:
+    try:
+      session = configure_spark_with_delta_pip(spark_builder(warehouse)
+        .config("spark.sql.extensions", "io.delta.sql.DeltaSparkSessionExtension")
+        .config("spark.sql.catalog.spark_catalog", "org.apache.spark.sql.delta.catalog.DeltaCatalog")).getOrCreate()
+    except Exception:
+      # The Delta jars could not be fetched (offline), the Parquet tests still run
+      session = None
+  if session is None:
+    try:
+      session = spark_builder(warehouse).getOrCreate()
+    except Exception as error:
+      pytest.skip(f"no local Spark session ({error})")
+  session.sparkContext.setLogLevel("ERROR")
+  yield session
+  session.stop()
+
+
+def has_delta(spark):
+  return "DeltaSparkSessionExtension" in spark.conf.get("spark.sql.extensions", "")
+
+
+@pytest.fixture(scope="session")
+def synthetic_overwatch(spark):
+  return runpy.run_path(SYNTHETIC_DATA, init_globals={"spark": spark})["synthetic_overwatch"]
+
+
+def write_synthetic(synthetic_overwatch, db, scale, table_format="parquet"):
+  synthetic = synthetic_overwatch(db, **scale)
+  counts = synthetic.write_tables(format=table_format)
+  workspace_catalog.get(db).invalidate()
+  return synthetic, counts
+
+
+@pytest.fixture(scope="session")
+def synthetic_db(synthetic_overwatch):
+  return write_synthetic(synthetic_overwatch, "overwatch_test", TEST_SCALE)
+
+
+@pytest.fixture(scope="session")
+def synthetic_delta_db(spark, synthetic_overwatch):
+  if not has_delta(spark):
+    pytest.skip("the local Spark session has no Delta Lake")
+  return write_synthetic(synthetic_overwatch, "overwatch_delta_test", TEST_SCALE, "delta")
+
+
+@pytest.fixture(scope="session")
+def benchmark_db(synthetic_overwatch):
+  return write_synthetic(synthetic_overwatch, "overwatch_benchmark", BENCHMARK_SCALE)
+
+
+@pytest.fixture(scope="session")
+def benchmark_delta_db(spark, synthetic_overwatch):
+  if not has_delta(spark):
+    pytest.skip("the local Spark session has no Delta Lake")
+  return write_synthetic(synthetic_overwatch, "overwatch_delta_benchmark", BENCHMARK_SCALE, "delta")
+
+
+def new_master(synthetic, **kwargs):
+  return master(synthetic.db, synthetic.db, synthetic.workspace_names(), str(synthetic.start_date), str(synthetic.end_date),
+                **{"analysisDB": synthetic.db, "resultCache": "No", **kwargs})
+
+
+@pytest.fixture
+def synthetic_master(synthetic_db):
+  return new_master(synthetic_db[0])
+
+
+@pytest.fixture
+def benchmark_master(benchmark_db):
+  return new_master(benchmark_db[0])
+
+
+@pytest.fixture
+def benchmark_delta_master(benchmark_delta_db):
+  return new_master(benchmark_delta_db[0])
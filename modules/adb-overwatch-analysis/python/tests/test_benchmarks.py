@@ -0,0 +1,168 @@
+"""
+Benchmarks of the master builders and dashboard aggregations on a local Spark session (pytest-benchmark).
+
+Every benchmark fully executes its frame (noop sink). The snapshot, cost cube, sketch and result cache benchmarks need
+Delta Lake and are skipped without it. Save a baseline with
+    python -m pytest tests/test_benchmarks.py --benchmark-autosave
+and fail on regressions against it with
+    python -m pytest tests/test_benchmarks.py --benchmark-compare --benchmark-compare-fail=median:25%
+"""
+import pytest
+
+pytest.importorskip("pyspark")
+pytest.importorskip("pytest_benchmark")
+from pyspark.sql import DataFrame
+from pyspark.sql import functions as F
+
+from conftest import new_master
+from overwatch_analysis import helpers, workspace_catalog
+
+BASE = {"includeWeekend": "Yes", "onlyWeekend": "No"}
+
+BUILDERS = {
+  "cluster_master_filter": lambda m: m.cluster_master_filter(**BASE),
+  "job_master_filter": lambda m: m.job_master_filter(**BASE, dateColumn="job_start_date", clusterTable=None),
+  "spark_notebook_master": lambda m: m.spark_notebook_master(**BASE),
+  "expensive_jobs_top_n": lambda m: m.expensive_jobs_top_n(m.job_master_filter(**BASE, dateColumn="job_start_date", clusterTable=None), topN=3),
+  "notebook_folder_rollup": lambda m: m.notebook_folder_rollup(m.spark_notebook_master(**BASE)).unpersist(),
+  "cluster_daily_cost": lambda m: m.cluster_daily_cost(**BASE),
+  "cluster_transitions": lambda m: m.cluster_transitions(**BASE),
+  "cluster_idle_time": lambda m: m.cluster_idle_time(**BASE),
+  "concurrency_timeline": lambda m: m.concurrency_timeline(**BASE),
+  "chargeback": lambda m: m.chargeback(**BASE),
+  "top_k_with_others": lambda m: m.cluster_master_filter(**BASE)\
+    .groupBy("state_start_date", "workspace_name")\
+    .agg(F.sum("total_DBU_cost").alias("cost"))\
+    .transform(m.top_k_with_others("cost", ["workspace_name"], 2, partitionBy=["state_start_date"])),
+  "box_stats": lambda m: m.box_stats(m.cluster_master_filter(**BASE), "total_DBU_cost", ["cluster_category", "workspace_name"]),
+  "quantiles": lambda m: m.quantiles(m.job_master_filter(**BASE, dateColumn="job_start_date", clusterTable=None)\
+    .groupBy("job_start_date", "workspace_name")\
+    .agg(F.sum("total_dbu_cost").alias("total_dbu_cost")), "total_dbu_cost", ["job_start_date"], {"50%": 0.5, "90%": 0.9, "99%": 0.99, "max": 1.0}),
+  "distinct_count (exact)": lambda m: m.distinct_count("job_id", groupBy=["workspace_name"], exact=True, **BASE),
+  "cluster_tag_index": lambda m: m.cluster_tag_index(**BASE),
+  "node_type_rollup": lambda m: m.node_type_rollup(m.cluster_master_filter(**BASE)).unpersist(),
+}
+
+# Main cell of every dashboard, built from the master builders (the dashboards read the same frames from the snapshots)
+DASHBOARD_CELLS = {
+  "Cluster: DBU spend box statistics": lambda m: m.box_stats(m.cluster_master_filter(**BASE)\
+    .groupBy("cluster_category", "state_start_date", "workspace_name")\
+    .agg(F.sum("total_DBU_cost").alias("total_DBU_cost")), "total_DBU_cost", ["cluster_category", "workspace_name"]),
+  "Jobs: DBU cost by workspace and date": lambda m: jobs_dbu_cost(m),
+  "Notebook: total throughput per folder": lambda m: m.notebook_folder_metrics(m.spark_notebook_master(**BASE), 3)\
+    .select("folder_path", "organization_id", "workspace_name",
+            (F.col("shuffle_total") + F.col("read_total") + F.col("write_total")).alias("throughput"))\
+    .where(F.col("folder_path") != "")\
+    .orderBy(F.col("throughput").desc())\
+    .limit(10),
+  "Workspace: daily cost by workspace": lambda m: workspace_cost_by_date(m),
+}
+
+# Snapshot layer (Delta only): refreshes and the frames read from the snapshots
+DELTA_BENCHMARKS = {
+  "refresh_snapshot (full rebuild)": lambda m: m.refresh_snapshot("cluster_master", fullRefresh=True),
+  "refresh_snapshot (fresh)": lambda m: m.refresh_snapshot("cluster_master"),
+  "snapshot": lambda m: m.snapshot("cluster_master", **BASE),
+  "refresh_cost_cube (full rebuild)": lambda m: m.refresh_cost_cube(fullRefresh=True),
+  "cost_cube": lambda m: m.cost_cube(groupBy=["workspace_name", "cluster_category"], **BASE),
+  "refresh distinct_sketches (full rebuild)": lambda m: m.refresh_snapshot("distinct_sketches", fullRefresh=True),
+  "distinct_count (sketches)": lambda m: m.distinct_count("job_id", groupBy=["workspace_name"], **BASE),
+  "period_comparison": lambda m: m.period_comparison("cluster_daily_cost", {"dbu_cost": "total_dbu_cost"}, ["workspace_name"], **BASE),
+  "tag_clusters": lambda m: m.tag_clusters("team=team_1", **BASE),
+  "Cluster: DBU spend box statistics (cost cube)": lambda m: m.box_stats(
+    m.cost_cube(groupBy=["cluster_category", "state_start_date", "workspace_name"], **BASE), "total_DBU_cost", ["cluster_category", "workspace_name"]),
+}
+
+
+def jobs_dbu_cost(m):
+  jobs = m.job_master_filter(**BASE, dateColumn="job_start_date", clusterTable=None)
+  job_cost = jobs\
+    .groupBy("job_start_date", "workspace_name")\
+    .agg(F.round(F.sum("total_dbu_cost"), 2).alias("total_dbu_cost"))
+  return job_cost\
+    .join(m.expensive_jobs_top_n(jobs, topN=3).select("job_start_date", "top_expensive_jobs", "top_expensive_failures"), ["job_start_date"])\
+    .join(m.quantiles(job_cost, "total_dbu_cost", ["job_start_date"], {"50%": 0.5, "90%": 0.9, "99%": 0.99, "max": 1.0}), ["job_start_date"], "left")
+
+
+def workspace_cost_by_date(m):
+  return m.cluster_daily_cost(**BASE)\
+    .groupBy("date", "organization_id", "workspace_name")\
+    .agg(F.round(F.sum("total_dbu_cost"), 2).alias("DBU_Cost (USD)"))\
+    .transform(m.top_k_with_others("DBU_Cost (USD)", ["organization_id", "workspace_name"], 20, partitionBy=["date"]))
+
+
+def execute(result):
+  # Frames are run to the noop sink, refreshes return their status or table name
+  if isinstance(result, DataFrame):
+    result.write.format("noop").mode("overwrite").save()
+
+
+@pytest.mark.parametrize("name", list(BUILDERS))
+def test_master_builder(benchmark, benchmark_master, name):
+  build = BUILDERS[name]
+  benchmark.pedantic(lambda: build(benchmark_master).write.format("noop").mode("overwrite").save(), rounds=3, warmup_rounds=1)
+
+
+@pytest.mark.parametrize("name", list(DASHBOARD_CELLS))
+def test_dashboard_cell(benchmark, benchmark_master, name):
+  build = DASHBOARD_CELLS[name]
+  benchmark.pedantic(lambda: execute(build(benchmark_master)), rounds=3, warmup_rounds=1)
+
+
+@pytest.mark.parametrize("name", list(DELTA_BENCHMARKS))
+def test_snapshot_layer(benchmark, benchmark_delta_master, name):
+  build = DELTA_BENCHMARKS[name]
+  benchmark.pedantic(lambda: execute(build(benchmark_delta_master)), rounds=3, warmup_rounds=1)
+
+
+@pytest.fixture(scope="module", params=[10, 100, 1000])
+def workspace_filter_db(request, spark):
+  # Half of n workspaces selected, as in a typical widget selection
+  n = request.param
+  db = f"overwatch_wsfilter_{n}"
+  spark.sql(f"create database if not exists {db}")
+  spark.range(n)\
+    .select(F.concat(F.lit("org_"), F.col("id")).alias("organization_id"),
+            F.concat(F.lit("workspace_"), F.col("id")).alias("workspace_name"),
+            # The columns the workspace catalog reads
+            F.struct(F.struct(F.lit(None).cast("struct<connectionString:string>").alias("azureAuditLogEventhubConfig"))
+                     .alias("auditLogConfig")).alias("inputConfig"),
+            F.current_timestamp().alias("Pipeline_SnapTS"))\
+    .write.mode("overwrite").format("parquet").saveAsTable(f"{db}.pipeline_report")
+  spark.range(n * 100)\
+    .select(F.concat(F.lit("org_"), (F.col("id") % n)).alias("organization_id"),
+            (F.rand(seed=42) * 100).alias("total_dbu_cost"))\
+    .write.mode("overwrite").format("parquet").partitionBy("organization_id").saveAsTable(f"{db}.clusterstatefact")
+  workspace_catalog.get(db).invalidate()
+  return db, [f"workspace_{i}" for i in range(0, n, 2)]
+
+
+@pytest.mark.parametrize("mode", ["isin", "semi_join"])
+def test_filter_workspaces(benchmark, spark, workspace_filter_db, mode):
+  db, selected = workspace_filter_db
+  bench = helpers(db, db)
+  fact_table = f"{db}.clusterstatefact"
+  build = lambda: spark.table(fact_table)\
+    .transform(bench.filter_workspaces(selected, fact_table, mode))\
+    .groupBy("organization_id")\
+    .agg(F.sum("total_dbu_cost").alias("total_dbu_cost"))
+  benchmark.pedantic(lambda: execute(build()), rounds=3, warmup_rounds=1)
+
+
+# As in the dashboards, the cached cell reads the master object from the module globals
+cached_cell_master = None
+
+
+def cached_cell():
+  return workspace_cost_by_date(cached_cell_master)
+
+
+@pytest.mark.parametrize("view", ["first view", "re-view"])
+def test_cached_pandas(benchmark, benchmark_delta_db, tmp_path, view):
+  global cached_cell_master
+  cached_cell_master = new_master(benchmark_delta_db[0], resultCache="Yes", resultCacheDir=str(tmp_path))
+  cell = lambda: cached_cell_master.cached_pandas("benchmark.daily_cost", cached_cell, ["cluster_daily_cost"], **BASE)
+  def first_view():
+    cached_cell_master.result_cache.clear()
+    cell()
+  benchmark.pedantic(first_view if view == "first view" else cell, rounds=3, warmup_rounds=1)
@@ -0,0 +1,67 @@
+"""
+Workspace catalog of a synthetic Overwatch database: Cloud derivation from pipeline_report, reuse of the loaded rows
+within the TTL and reload when the pipeline_report version changes.
+"""
+import pytest
+
+pytest.importorskip("pyspark")
+
+from overwatch_analysis import workspace_catalog
+
+
+def counted_catalog(db, **kwargs):
+  # Catalog of its own (not the shared one) counting the pipeline_report scans
+  catalog = workspace_catalog(db, **kwargs)
+  catalog.loads = 0
+  load = catalog.load
+  def counted_load():
+    catalog.loads += 1
+    return load()
+  catalog.load = counted_load
+  return catalog
+
+
+def test_cloud_is_azure_when_the_eventhub_config_is_set(synthetic_db):
+  synthetic = synthetic_db[0]
+  rows = counted_catalog(synthetic.db).rows()
+  expected = {f"workspace_{w}": "Azure" if w % 2 == 0 else "AWS" for w in range(synthetic.workspaces)}
+  assert dict(zip(rows["workspace_name"], rows["Cloud"])) == expected
+  split = {row["workspace_name"]: row["Cloud"] for row in counted_catalog(synthetic.db).cloud_split().collect()}
+  assert split == expected
+
+
+def test_rows_are_reused_within_the_ttl(synthetic_db):
+  catalog = counted_catalog(synthetic_db[0].db, ttlSeconds=600)
+  rows = catalog.rows()
+  assert catalog.rows() is rows
+  catalog.workspace_names()
+  catalog.org_ids("workspace_0")
+  catalog.lookup().count()
+  assert catalog.loads == 1
+
+
+def test_rows_without_a_delta_version_are_reloaded_once_the_ttl_expired(synthetic_db):
+  catalog = counted_catalog(synthetic_db[0].db, ttlSeconds=0)
+  catalog.rows()
+  catalog.rows()
+  assert catalog.loads == 2
+
+
+def test_rows_are_reloaded_when_the_delta_version_changes(spark, synthetic_delta_db):
+  synthetic = synthetic_delta_db[0]
+  catalog = counted_catalog(synthetic.db, ttlSeconds=0)
+  catalog.rows()
+  catalog.rows()
+  assert catalog.loads == 1
+  synthetic.write_tables(tables=["pipeline_report"])
+  catalog.rows()
+  assert catalog.loads == 2
+
+
+def test_get_rejects_another_ttl(synthetic_db):
+  db = synthetic_db[0].db
+  catalog = workspace_catalog.get(db)
+  assert workspace_catalog.get(db, ttlSeconds=catalog.ttl_seconds) is catalog
+  with pytest.raises(Exception, match="already uses a TTL"):
+    workspace_catalog.get(db, ttlSeconds=catalog.ttl_seconds + 1)
+  assert workspace_catalog.get(db).ttl_seconds == catalog.ttl_seconds
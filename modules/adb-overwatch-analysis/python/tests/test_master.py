@@ -0,0 +1,390 @@
+"""
+Invariants of the master builders on a small synthetic Overwatch database: costs are neither lost nor counted twice,
+rankings match a plain window ranking and the interval algorithms match a brute-force computation.
+"""
+from datetime import date, datetime, timedelta, timezone
+
+import pytest
+
+pytest.importorskip("pyspark")
+from pyspark.sql import functions as F
+from pyspark.sql.window import Window
+
+from conftest import TEST_SCALE, new_master, write_synthetic
+from overwatch_analysis import master
+
+BASE = {"includeWeekend": "Yes", "onlyWeekend": "No"}
+
+
+def test_spark_notebook_master_attributes_every_task_once(synthetic_master, synthetic_db):
+  _, counts = synthetic_db
+  assert synthetic_master.spark_notebook_master(**BASE).count() == counts["sparkTask"]
+
+
+def test_spark_task_attribution_check_counts_each_task_once(synthetic_db):
+  synthetic, counts = synthetic_db
+  result = new_master(synthetic).spark_task_attribution_check()
+  assert result["task_keys"] == result["stage_rows"] == counts["sparkTask"]
+  assert result["unattributed_tasks"] == 0
+  # The timestamp join repeats each task once per stage of its spark job
+  assert result["timestamp_rows"] == counts["sparkTask"] * synthetic.stages_per_spark_job
+
+
+def test_spark_task_attribution_check_raises_on_repeated_tasks(spark, synthetic_db):
+  synthetic, _ = synthetic_db
+  db = "overwatch_test_repeated_stages"
+  spark.sql(f"create database if not exists {db}")
+  spark.sql(f"create or replace view {db}.pipeline_report as select * from {synthetic.db}.pipeline_report")
+  spark.sql(f"create or replace view {db}.sparkTask as select * from {synthetic.db}.sparkTask")
+  # Every stage is listed twice, once by a job id of its own: a mapping keyed on the job would attribute tasks twice
+  jobs = spark.table(f"{synthetic.db}.sparkJob")
+  jobs.unionByName(jobs.withColumn("job_id", F.col("job_id") + 1000000))\
+    .write.format("parquet").mode("overwrite").saveAsTable(f"{db}.sparkJob")
+  checker = master(db, db, synthetic.workspace_names(), str(synthetic.start_date), str(synthetic.end_date), resultCache="No")
+  assert checker.spark_task_attribution_check()["stage_rows"] > 0
+  checker.stage_job_map = lambda sparkJob, job_columns: sparkJob\
+    .select("organization_id", "cluster_id", "spark_context_id", "job_id", *job_columns, F.explode("stage_ids").alias("stage_id"))
+  with pytest.raises(Exception, match="does not attribute each spark task once"):
+    checker.spark_task_attribution_check()
+
+
+def test_cluster_daily_cost_keeps_the_cluster_cost(synthetic_master):
+  states = synthetic_master.cluster_master_filter(**BASE).agg(F.sum("total_DBU_cost")).first()[0]
+  daily = synthetic_master.cluster_daily_cost(**BASE).agg(F.sum("total_dbu_cost")).first()[0]
+  assert daily == pytest.approx(states)
+
+
+def test_top_k_with_others_keeps_k_labels_and_the_totals(synthetic_master):
+  costs = synthetic_master.cluster_master_filter(**BASE)\
+    .groupBy("state_start_date", "cluster_id")\
+    .agg(F.sum("total_DBU_cost").alias("cost"))
+  labelled = costs.transform(synthetic_master.top_k_with_others("cost", ["cluster_id"], 3, partitionBy=["state_start_date"]))
+  per_day = labelled\
+    .groupBy("state_start_date")\
+    .agg(F.countDistinct("cluster_id").alias("labels"), F.sum("cost").alias("cost"))\
+    .join(costs.groupBy("state_start_date").agg(F.sum("cost").alias("expected")), "state_start_date")
+  for row in per_day.collect():
+    assert row["labels"] <= 4
+    assert row["cost"] == pytest.approx(row["expected"])
+
+
+def test_expensive_jobs_top_n_matches_a_row_number_ranking(synthetic_master):
+  jobs = synthetic_master.job_master_filter(**BASE, dateColumn="job_start_date", clusterTable=None)
+  top_jobs = synthetic_master.expensive_jobs_top_n(jobs, topN=3).collect()
+  for slice_name, (_, condition) in synthetic_master.top_n_slices.items():
+    ranked = {row["job_start_date"]: [job["cost_in_USD"] for job in row[slice_name]]
+              for row in top_jobs if row[slice_name]}
+    costs = jobs\
+      .where(F.expr(condition))\
+      .groupBy("job_name", "job_start_date", "workspace_name")\
+      .agg(F.round(F.sum("total_dbu_cost"), 2).alias("cost"))\
+      .withColumn("rank", F.row_number().over(Window.partitionBy("job_start_date").orderBy(F.col("cost").desc())))\
+      .filter(F.col("rank") <= 3)
+    expected = {}
+    for row in costs.orderBy("rank").collect():
+      expected.setdefault(row["job_start_date"], []).append(row["cost"])
+    assert ranked == expected, slice_name
+
+
+def test_chargeback_allocates_the_whole_cluster_cost(synthetic_master):
+  chargeback = synthetic_master.chargeback(**BASE)
+  cluster_cost = synthetic_master.cluster_daily_cost(**BASE).agg(F.sum("total_cost")).first()[0]
+  assert chargeback.agg(F.sum("allocated_cost")).first()[0] == pytest.approx(cluster_cost)
+  shares = chargeback\
+    .groupBy("date", "organization_id", "cluster_id")\
+    .agg(F.sum("cost_share").alias("cost_share"))
+  assert all(row["cost_share"] == pytest.approx(1.0) for row in shares.collect())
+
+
+def test_distinct_count_is_exact_without_hll_sketches(synthetic_master):
+  # Runtimes before Spark 3.5 have no hll_sketch_agg, the distinct ids are then counted on the consumer table
+  synthetic_master.hll_sketches = False
+  job_count = synthetic_master.distinct_count("job_id", groupBy=["workspace_name"], **BASE)
+  expected = synthetic_master.read_source("jobruncostpotentialfact",
+                                         columns=["organization_id", "workspace_name", "job_id", F.expr("DATE(task_runtime.startTS) as job_start_date")],
+                                         dateColumn="job_start_date",
+                                         timestampColumn="task_runtime.startTS")\
+    .groupBy("workspace_name")\
+    .agg(F.countDistinct("job_id").alias("distinct_count"))
+  assert sorted(job_count.collect()) == sorted(expected.collect())
+
+
+def test_chargeback_keeps_the_selected_days(synthetic_master):
+  weekdays = synthetic_master.chargeback(includeWeekend="No", onlyWeekend="No")
+  assert weekdays.count() > 0
+  assert weekdays.filter(F.col("is_weekend") == 1).count() == 0
+  weekends = synthetic_master.chargeback(includeWeekend="Yes", onlyWeekend="Yes")
+  assert weekends.filter(F.col("is_weekend") == 0).count() == 0
+  assert weekdays.count() + weekends.count() == synthetic_master.chargeback(**BASE).count()
+
+
+@pytest.mark.parametrize("include_weekend, only_weekend, selected", [
+  ("Yes", "No", "true"),
+  ("Yes", "Yes", "dayofweek(date) in (1, 7)"),
+  ("No", "No", "dayofweek(date) not in (1, 7)"),
+  (True, False, "true"),
+  (True, True, "dayofweek(date) in (1, 7)"),
+  (False, False, "dayofweek(date) not in (1, 7)"),
+])
+def test_filter_calendar_days_matches_the_dayofweek_filter(synthetic_master, include_weekend, only_weekend, selected):
+  start, end = synthetic_master.start_date, synthetic_master.end_date
+  days = synthetic_master.calendar(start, end).select("date")
+  filtered = days.transform(synthetic_master.filter_calendar_days("date", start, end, include_weekend, only_weekend))
+  expected = days.filter(F.expr(selected))
+  assert expected.count() > 0
+  assert sorted(filtered.collect()) == sorted(expected.collect())
+
+
+def test_builders_default_to_every_day(synthetic_master):
+  assert synthetic_master.cluster_master_filter().count() == synthetic_master.cluster_master_filter(**BASE).count()
+
+
+def test_concurrency_timeline_matches_a_time_grid_count(synthetic_db):
+  synthetic = synthetic_db[0]
+  hourly = new_master(synthetic, concurrencyBucketMinutes=60)
+  timeline = hourly.concurrency_timeline(**BASE)\
+    .groupBy("bucket_start")\
+    .agg(F.sum("active_clusters").alias("clusters"), F.sum("concurrent_runs").alias("runs"))
+  swept = {row["bucket_start"]: (row["clusters"], row["runs"]) for row in timeline.collect()}
+  
+  # Brute force: every interval against every hour of the window, live when start <= hour < end
+  window_start = F.unix_timestamp(F.lit(str(synthetic.start_date)).cast("timestamp")) * 1000
+  hours = hourly.calendar(synthetic.start_date, synthetic.end_date)\
+    .select(F.explode(F.sequence(F.unix_timestamp(F.col("date").cast("timestamp")) * 1000,
+                                 F.unix_timestamp(F.col("date").cast("timestamp")) * 1000 + 23 * 3600000,
+                                 F.lit(3600000))).alias("hour_ms"))\
+    .filter(F.col("hour_ms") >= window_start)
+  clusters = hourly.cluster_master_filter(**BASE)\
+    .filter(~F.col("state").isin(hourly.cluster_idle_states))\
+    .select(F.col("unixTimeMS_state_start").alias("start_ms"), F.col("unixTimeMS_state_end").alias("end_ms"),
+            F.lit(1).alias("clusters"), F.lit(0).alias("runs"))
+  runs = hourly.job_master_filter(**BASE, dateColumn="job_start_date", clusterTable=None)\
+    .select((F.unix_timestamp("startTS") * 1000).alias("start_ms"), (F.unix_timestamp("endTS") * 1000).alias("end_ms"),
+            F.lit(0).alias("clusters"), F.lit(1).alias("runs"))
+  counted = clusters.unionByName(runs)\
+    .crossJoin(hours)\
+    .filter((F.col("start_ms") <= F.col("hour_ms")) & (F.col("hour_ms") < F.col("end_ms")))\
+    .groupBy((F.col("hour_ms") / 1000).cast("timestamp").alias("bucket_start"))\
+    .agg(F.sum("clusters").alias("clusters"), F.sum("runs").alias("runs"))
+  assert swept
+  assert swept == {row["bucket_start"]: (row["clusters"], row["runs"]) for row in counted.collect()}
+
+
+def test_cluster_idle_time_matches_the_merged_task_intervals(synthetic_master):
+  idle = synthetic_master.cluster_idle_time(**BASE)
+  totals = idle.agg(F.sum("uptime_h"), F.sum("busy_h"), F.sum("idle_h"), F.count(F.lit(1))).first()
+  tolerance = totals[3] * 0.001
+  assert idle.filter((F.col("busy_h") > F.col("uptime_h") + 0.001) | (F.col("idle_h") < -0.001)).count() == 0
+  
+  # Brute force on the driver: tasks merged per cluster, overlap with every up state
+  states = synthetic_master.cluster_master_filter(**BASE)\
+    .filter(F.col("state").isin(synthetic_master.cluster_up_states) & (F.col("unixTimeMS_state_end") > F.col("unixTimeMS_state_start")))\
+    .select("organization_id", "cluster_id", "unixTimeMS_state_start", "unixTimeMS_state_end")\
+    .collect()
+  tasks = synthetic_master.read_source("sparkTask",
+                                       columns=["organization_id", "cluster_id", "date", "task_runtime.startEpochMS", "task_runtime.endEpochMS"],
+                                       dateColumn="date",
+                                       weekdays=False)\
+    .collect()
+  busy_periods = {}
+  for task in sorted(tasks, key=lambda task: (task["startEpochMS"], task["endEpochMS"])):
+    periods = busy_periods.setdefault((task["organization_id"], task["cluster_id"]), [])
+    if periods and task["startEpochMS"] <= periods[-1][1]:
+      periods[-1][1] = max(periods[-1][1], task["endEpochMS"])
+    else:
+      periods.append([task["startEpochMS"], task["endEpochMS"]])
+  uptime_ms = busy_ms = 0
+  for state in states:
+    start, end = state["unixTimeMS_state_start"], state["unixTimeMS_state_end"]
+    uptime_ms += end - start
+    for busy_start, busy_end in busy_periods.get((state["organization_id"], state["cluster_id"]), []):
+      busy_ms += max(0, min(end, busy_end) - max(start, busy_start))
+  assert totals[0] == pytest.approx(uptime_ms / 3600000, abs=tolerance)
+  assert totals[1] == pytest.approx(busy_ms / 3600000, abs=tolerance)
+  assert totals[2] == pytest.approx((uptime_ms - busy_ms) / 3600000, abs=tolerance)
+
+
+def test_box_stats_are_ordered(synthetic_master):
+  costs = synthetic_master.cluster_master_filter(**BASE)
+  for row in synthetic_master.box_stats(costs, "total_DBU_cost", ["workspace_name"]).collect():
+    assert row["min"] <= row["lower_whisker"] <= row["q1"] <= row["median"] <= row["q3"] <= row["upper_whisker"] <= row["max"]
+    assert row["count"] > 0
+
+
+def test_cost_cube_grouping_id_matches_the_spark_grouping_id(spark, synthetic_master):
+  columns = synthetic_master.cost_cube_columns
+  spark.createDataFrame([tuple(range(len(columns)))], columns).createOrReplaceTempView("cost_cube_levels")
+  grouping_sets = ", ".join(f"({', '.join(grouping_set)})" for grouping_set in synthetic_master.cost_cube_sets)
+  levels = spark.sql(f"""
+    select grouping_id() as grouping_id, {", ".join(columns)}
+    from cost_cube_levels
+    group by {", ".join(columns)} grouping sets ({grouping_sets})
+  """).collect()
+  assert {row["grouping_id"]: [column for column in columns if row[column] is not None] for row in levels} == \
+    {synthetic_master.cost_cube_grouping_id(grouping_set): grouping_set for grouping_set in synthetic_master.cost_cube_sets}
+
+
+def test_notebook_folder_rollup_is_cached_once_per_input_frame(synthetic_master):
+  notebooks = synthetic_master.spark_notebook_master(**BASE)
+  rollup = synthetic_master.notebook_folder_rollup(notebooks)
+  hierarchy = synthetic_master.notebook_path_hierarchy(notebooks)
+  assert rollup.is_cached and hierarchy.is_cached
+  assert synthetic_master.notebook_folder_rollup(notebooks) is rollup
+  assert synthetic_master.notebook_folder_metrics(notebooks, 2).count() == rollup.filter(F.col("path_depth") == 2).count()
+
+  other = synthetic_master.notebook_folder_rollup(synthetic_master.spark_notebook_master(**BASE))
+  assert other is not rollup and other.is_cached
+  assert not rollup.is_cached and not hierarchy.is_cached
+  for _, frame in synthetic_master.cached_frames.values():
+    frame.unpersist()
+
+
+def test_node_type_rollup_matches_the_per_cloud_blocks(spark, synthetic_master, synthetic_db):
+  clusters = synthetic_master.cluster_master_filter(**BASE)
+  rollup = synthetic_master.node_type_rollup(clusters)
+  assert synthetic_master.node_type_rollup(clusters) is rollup
+  # The Workspace dashboard used to join pipeline_report and aggregate the cluster master once per cloud and chart
+  split_by_cloud = spark.table(f"{synthetic_db[0].db}.pipeline_report")\
+    .withColumn("Cloud", F.expr("case when inputConfig.auditLogConfig.azureAuditLogEventhubConfig is null then 'AWS' else 'Azure' end"))\
+    .select("organization_id", "workspace_name", "Cloud").distinct()
+  for cloud in ["Azure", "AWS"]:
+    per_cloud = clusters\
+      .join(split_by_cloud, clusters.organization_id == split_by_cloud.organization_id, "left").select(clusters["*"], split_by_cloud.Cloud)\
+      .withColumn("job_id", clusters["cluster_name"].substr(F.lit(1), F.instr(F.col("cluster_name"), "run") - 2))\
+      .withColumn("clusterName", F.expr("case when cluster_name like '%-run-%' then job_id else cluster_name end"))\
+      .where((F.col("Cloud") == cloud) & F.col("worker_node_type").isNotNull())\
+      .groupBy("organization_id", "workspace_name", F.col("worker_node_type").alias("node_type"))\
+      .agg(F.countDistinct("clusterName").alias("cluster_count"), F.sum("total_dbu_cost").alias("dbu_cost"))
+    expected = {(row["organization_id"], row["workspace_name"], row["node_type"]): (row["cluster_count"], row["dbu_cost"]) for row in per_cloud.collect()}
+    actual = {(row["organization_id"], row["workspace_name"], row["node_type"]): (row["cluster_count"], row["dbu_cost"])
+              for row in rollup.filter(F.col("Cloud") == cloud).collect()}
+    assert len(expected) > 0, cloud
+    assert actual.keys() == expected.keys(), cloud
+    for key, (cluster_count, dbu_cost) in expected.items():
+      assert actual[key][0] == cluster_count, key
+      assert actual[key][1] == pytest.approx(dbu_cost, abs=0.006), key
+  rollup.unpersist()
+
+
+def test_tag_map_matches_json_tuple(synthetic_master):
+  keys = ["JobId", "SqlEndpointId", "Owner", "team"]
+  clusters = synthetic_master.cluster_master_filter(**BASE)\
+    .select("tag_map", F.json_tuple("custom_tags", *keys).alias(*keys))
+  assert clusters.count() > 0
+  for key in keys:
+    assert clusters.filter(~F.col("tag_map")[key].eqNullSafe(F.col(key))).count() == 0, key
+  assert clusters.filter(F.col("SqlEndpointId").isNotNull()).count() > 0
+
+
+@pytest.mark.parametrize("tags, condition", [
+  ("team=team_1", "team = 'team_1'"),
+  ("team = team_3, SqlEndpointId", "team = 'team_3' and SqlEndpointId is not null"),
+  ("Owner=user3@example.com,JobId=3", "Owner = 'user3@example.com' and JobId = '3'"),
+])
+def test_tag_clusters_returns_the_clusters_with_the_tags(synthetic_master, tags, condition):
+  # The tag index is built directly rather than read from its Delta snapshot (see test_snapshot.py)
+  synthetic_master.snapshot = lambda name, **kwargs: getattr(synthetic_master, synthetic_master.snapshot_builders[name][0])(**kwargs)
+  selected = synthetic_master.tag_clusters(tags, **BASE)
+  expected = synthetic_master.read_source("clusterstatefact", dateColumn="state_start_date")\
+    .select("organization_id", "cluster_id", F.json_tuple("custom_tags", "JobId", "SqlEndpointId", "Owner", "team").alias("JobId", "SqlEndpointId", "Owner", "team"))\
+    .where(F.expr(condition))\
+    .select("organization_id", "cluster_id")\
+    .distinct()
+  assert expected.count() > 0
+  assert sorted(selected.collect()) == sorted(expected.collect())
+  assert synthetic_master.tag_clusters("all") is None and synthetic_master.tag_clusters("") is None
+
+
+@pytest.fixture(scope="module")
+def calendar_db(synthetic_overwatch):
+  # Fixed dates ending on Monday 2024-01-08: the window Sunday-Monday and the previous one Friday-Saturday both cross a weekend
+  return write_synthetic(synthetic_overwatch, "overwatch_calendar_test", {**TEST_SCALE, "endDate": "2024-01-08"})
+
+
+def built_snapshot(self, name, **kwargs):
+  # The snapshot frame built by its builder method instead of read from Delta (see test_snapshot.py)
+  builder_method = self.snapshot_builders[name][0]
+  return getattr(self, builder_method)(**{key: kwargs[key] for key in ["includeWeekend", "onlyWeekend"] if key in kwargs})
+
+
+@pytest.mark.parametrize("weekend", [
+  {"includeWeekend": "Yes", "onlyWeekend": "No"},
+  {"includeWeekend": "Yes", "onlyWeekend": "Yes"},
+  {"includeWeekend": "No", "onlyWeekend": "No"},
+])
+def test_period_comparison_matches_two_master_runs(monkeypatch, calendar_db, weekend):
+  monkeypatch.setattr(master, "snapshot", built_snapshot)
+  synthetic = calendar_db[0]
+  run = lambda start, end: master(synthetic.db, synthetic.db, synthetic.workspace_names(), start, end, analysisDB=synthetic.db, resultCache="No")
+  current = run("2024-01-07", "2024-01-08")
+  assert current.previous_period() == (date(2024, 1, 5), date(2024, 1, 6))
+  comparison = {row["workspace_name"]: row for row in
+                current.period_comparison("cluster_daily_cost", {"dbu_cost": "total_dbu_cost"}, ["workspace_name"], **weekend).collect()}
+  spend = lambda start, end: {row["workspace_name"]: row["dbu_cost"] for row in run(start, end).cluster_daily_cost(**weekend)
+                                .groupBy("workspace_name").agg(F.sum("total_dbu_cost").alias("dbu_cost")).collect()}
+  expected_current = spend("2024-01-07", "2024-01-08")
+  expected_previous = spend("2024-01-05", "2024-01-06")
+  assert expected_current or expected_previous
+  assert comparison.keys() == expected_current.keys() | expected_previous.keys()
+  for workspace_name, row in comparison.items():
+    assert row["dbu_cost_current"] == pytest.approx(expected_current.get(workspace_name))
+    assert row["dbu_cost_previous"] == pytest.approx(expected_previous.get(workspace_name))
+    assert row["dbu_cost_delta"] == pytest.approx(expected_current.get(workspace_name, 0) - expected_previous.get(workspace_name, 0))
+  if weekend["onlyWeekend"] == "Yes":
+    # Sunday in the current window, Saturday in the previous one
+    assert set(expected_current) == set(expected_previous) == set(synthetic.workspace_names())
+
+
+def test_cluster_transitions_and_mtbf_on_a_state_sequence(spark, synthetic_db):
+  synthetic = synthetic_db[0]
+  analysis = master(synthetic.db, synthetic.db, synthetic.workspace_names(), "2024-01-02", "2024-01-02", resultCache="No")
+  day = datetime(2024, 1, 2, tzinfo=timezone.utc)
+  # cluster, hours since 2024-01-02, state, current / target workers, hours in state
+  sequence = [
+    ("c1", 0, "PENDING", 0, 2, 0.5), ("c1", 0.5, "RUNNING", 2, 2, 1.5), ("c1", 2, "RESIZING", 2, 4, 0.25), ("c1", 2.25, "RUNNING", 4, 4, 0.75),
+    ("c1", 3, "SPARK_EXCEPTION", 4, 4, 0.1), ("c1", 3.1, "RESTARTING", 0, 4, 0.5), ("c1", 3.6, "RUNNING", 4, 4, 2.4),
+    ("c1", 6, "NODES_LOST", 4, 4, 0.05), ("c1", 6.05, "RESIZING", 4, 2, 0.1), ("c1", 6.15, "RUNNING", 2, 2, 5.85),
+    ("c1", 12, "DRIVER_UNAVAILABLE", 2, 2, 0.1), ("c1", 12.1, "TERMINATING", 2, 0, 0.1),
+    # A failure the day before the window: the first failure of the window is counted from it
+    ("c2", -4, "METASTORE_DOWN", 2, 2, 0.1), ("c2", 1, "STARTING", 0, 2, 0.25), ("c2", 1.25, "RUNNING", 2, 2, 3.75),
+    ("c2", 5, "DBFS_DOWN", 2, 2, 4.0), ("c2", 9, "DBFS_DOWN", 2, 2, 1.0),
+  ]
+  states = spark.createDataFrame(
+    [((day + timedelta(hours=h)).date(), "1000000000", "workspace_0", cluster, cluster, "Standard", "Standard_DS3_v2",
+      False, state, int((day + timedelta(hours=h)).timestamp() * 1000), duration, current, target, 1.0)
+     for cluster, h, state, current, target, duration in sequence],
+    "state_start_date date, organization_id string, workspace_name string, cluster_id string, cluster_name string, cluster_category string, "
+    "node_type_id string, is_automated boolean, state string, unixTimeMS_state_start bigint, uptime_in_state_H double, current_num_workers int, "
+    "target_num_workers int, total_cost double")\
+    .withColumn("autoscale", F.struct(F.lit(2).alias("min_workers"), F.lit(4).alias("max_workers")))\
+    .withColumn("instance_pool_id", F.lit(None).cast("string"))
+  analysis.cluster_master_filter = lambda **kwargs: states
+
+  transitions = analysis.cluster_transitions(**BASE)
+  starts = {(row["cluster_id"], row["state"]): row["start_latency_h"] for row in transitions.filter(F.col("start_latency_h").isNotNull()).collect()}
+  assert starts == {("c1", "PENDING"): pytest.approx(0.5), ("c1", "RESTARTING"): pytest.approx(0.5), ("c2", "STARTING"): pytest.approx(0.25)}
+  resizes = {row["scale_direction"]: row["duration_h"] for row in transitions.filter(F.col("state") == "RESIZING").collect()}
+  assert resizes == {"up": pytest.approx(0.25), "down": pytest.approx(0.1)}
+  failures = [(row["cluster_id"], row["hours_since_previous_failure"])
+              for row in transitions.filter(F.col("is_failure")).orderBy("cluster_id", "unixTimeMS_state_start").collect()]
+  assert failures == [("c1", None), ("c1", pytest.approx(3)), ("c1", pytest.approx(6)), ("c2", pytest.approx(9)), ("c2", pytest.approx(4))]
+
+  mtbf = analysis.cluster_mtbf(transitions).collect()
+  assert len(mtbf) == 1
+  assert (mtbf[0]["failure_count"], mtbf[0]["failed_cluster_count"]) == (5, 2)
+  assert mtbf[0]["mtbf_h"] == pytest.approx((3 + 6 + 9 + 4) / 4)
+
+
+@pytest.mark.parametrize("table", ["clusterstatefact", "sparkTask", "cluster"])
+@pytest.mark.parametrize("selected", [["workspace_1"], ["workspace_0", "workspace_1"], ["workspace_missing"]])
+def test_filter_workspaces_modes_return_the_same_rows(spark, synthetic_master, synthetic_db, table, selected):
+  source = f"{synthetic_db[0].db}.{table}"
+  # Parquet tables have no Delta detail, the partition filter of the semi join is forced for the partitioned ones
+  if table != "cluster":
+    synthetic_master.partition_columns[source] = ["organization_id"]
+  filtered = {mode: spark.table(source).transform(synthetic_master.filter_workspaces(selected, source, mode))
+              .select("organization_id").groupBy("organization_id").count()
+              for mode in ["isin", "semi_join"]}
+  assert sorted(filtered["isin"].collect()) == sorted(filtered["semi_join"].collect())
+  expected = ["1000000001"] if selected == ["workspace_1"] else ["1000000000", "1000000001"] if len(selected) == 2 else []
+  assert sorted(row["organization_id"] for row in filtered["isin"].collect()) == expected
@@ -0,0 +1,112 @@
+"""
+Result cache of the dashboard frames: keys follow the code, the captured values, the widget values and the source
+versions of a cell, entries are evicted least recently used first and a cell is served from the cache until one of its
+Delta sources changes.
+"""
+import time
+
+import pandas as pd
+import pytest
+
+pytest.importorskip("pyspark")
+from pyspark.sql import functions as F
+
+from conftest import new_master
+from overwatch_analysis import master, result_cache
+
+BASE = {"includeWeekend": "Yes", "onlyWeekend": "No"}
+
+
+class counted_frame:
+  # Stands in for the Spark dataframe of a cell, counts the toPandas calls
+  calls = 0
+
+  def __init__(self, value):
+    self.value = value
+
+  def toPandas(self):
+    counted_frame.calls += 1
+    return pd.DataFrame({"value": [self.value]})
+
+
+def cell_of(value):
+  return lambda: counted_frame(value)
+
+
+def test_key_includes_the_captured_values(tmp_path):
+  cache = result_cache(str(tmp_path))
+  key = lambda build: cache.key("cell", build, {}, {"db.table": 1})
+  assert key(cell_of(1)) == key(cell_of(1))
+  assert key(cell_of(1)) != key(cell_of(2))
+  assert key(cell_of([1, "a"])) != key(cell_of([1, "b"]))
+
+
+def test_key_rejects_captured_objects(tmp_path):
+  cache = result_cache(str(tmp_path))
+  with pytest.raises(Exception, match="captures value"):
+    cache.key("cell", cell_of(object()), {}, {"db.table": 1})
+
+
+def test_key_follows_lazy_frames(tmp_path):
+  cache = result_cache(str(tmp_path))
+  frames = [master.lazy_frame(None, cell_of(value)) for value in [1, 1, 2]]
+  cell = lambda frame: lambda: frame().value
+  keys = [cache.key("cell", cell(frame), {}, {"db.table": 1}) for frame in frames]
+  frames[0]()
+  assert cache.key("cell", cell(frames[0]), {}, {"db.table": 1}) == keys[0]
+  assert keys[0] == keys[1] != keys[2]
+
+
+def test_least_recently_used_entries_are_evicted(tmp_path):
+  cache = result_cache(str(tmp_path), maxEntries=2)
+  versions = {"db.table": 1}
+  for value in ["a", "b"]:
+    cache.get_or_compute(value, cell_of(value), {}, versions)
+    time.sleep(0.01)
+  cache.get_or_compute("a", cell_of("a"), {}, versions)
+  time.sleep(0.01)
+  cache.get_or_compute("c", cell_of("c"), {}, versions)
+  assert (cache.hits, cache.misses) == (1, 3)
+  assert len(cache.entries()) == 2
+  calls = counted_frame.calls
+  assert cache.get_or_compute("a", cell_of("a"), {}, versions)["value"].tolist() == ["a"]
+  assert counted_frame.calls == calls
+  cache.get_or_compute("b", cell_of("b"), {}, versions)
+  assert counted_frame.calls == calls + 1
+
+
+def test_sources_without_a_version_are_not_cached(tmp_path):
+  cache = result_cache(str(tmp_path))
+  cache.get_or_compute("cell", cell_of(1), {}, {"db.table": None})
+  assert cache.entries() == []
+
+
+# As in the dashboards, the charted frame reads the master object from the globals of the notebook
+cache_master = None
+
+
+def daily_cost():
+  return cache_master.cluster_daily_cost(**BASE).groupBy("date").agg(F.sum("total_cost").alias("total_cost"))
+
+
+def test_cached_pandas_misses_when_a_source_or_a_widget_changes(synthetic_delta_db, tmp_path):
+  global cache_master
+  synthetic = synthetic_delta_db[0]
+  cache_master = new_master(synthetic, resultCache="Yes", resultCacheDir=str(tmp_path))
+  cache = cache_master.result_cache
+  assert cache.version_ttl_seconds == 0
+
+  first = cache_master.cached_pandas("test.daily_cost", daily_cost, ["cluster_daily_cost"], **BASE)
+  again = cache_master.cached_pandas("test.daily_cost", daily_cost, ["cluster_daily_cost"], **BASE)
+  assert (cache.hits, cache.misses) == (1, 1)
+  pd.testing.assert_frame_equal(first.sort_values("date").reset_index(drop=True), again.sort_values("date").reset_index(drop=True))
+
+  cache_master.cached_pandas("test.daily_cost", daily_cost, ["cluster_daily_cost"], includeWeekend="No", onlyWeekend="No")
+  assert (cache.hits, cache.misses) == (1, 2)
+
+  # An Overwatch run rewriting a source moves its Delta version
+  synthetic.write_tables(tables=["cluster"])
+  cache_master.cached_pandas("test.daily_cost", daily_cost, ["cluster_daily_cost"], **BASE)
+  assert (cache.hits, cache.misses) == (1, 3)
+  cache_master.cached_pandas("test.daily_cost", daily_cost, ["cluster_daily_cost"], **BASE)
+  assert (cache.hits, cache.misses) == (2, 3)
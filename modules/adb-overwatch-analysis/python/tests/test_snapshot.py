@@ -0,0 +1,181 @@
+"""
+Snapshot layer of the master frames on local Delta tables: a snapshot built, extended or refreshed after a source
+restatement or a column change holds the same rows as a build from scratch, and master_snapshot_log records its
+coverage and source versions. Skipped when the local Spark session has no Delta Lake.
+"""
+from datetime import timedelta
+
+import pytest
+
+pytest.importorskip("pyspark")
+from pyspark.sql import functions as F
+
+from conftest import TEST_SCALE, has_delta, new_master
+from overwatch_analysis import master, workspace_catalog
+
+BASE = {"includeWeekend": "Yes", "onlyWeekend": "No"}
+SOURCES = ["pipeline_report", "cluster", "clusterstatefact"]
+
+
+@pytest.fixture
+def snapshot_source(spark, synthetic_overwatch, request):
+  # The sources of cluster_master in a database of the test, which may restate them
+  if not has_delta(spark):
+    pytest.skip("the local Spark session has no Delta Lake")
+  synthetic = synthetic_overwatch(f"snapshot_{request.node.name}", **TEST_SCALE)
+  synthetic.write_tables(tables=SOURCES)
+  workspace_catalog.get(synthetic.db).invalidate()
+  master.checked_snapshot_columns.clear()
+  return synthetic
+
+
+def window_master(synthetic, start_date, end_date):
+  return master(synthetic.db, synthetic.db, synthetic.workspace_names(), str(start_date), str(end_date),
+                analysisDB=synthetic.db, resultCache="No")
+
+
+def comparable(df):
+  # exceptAll cannot compare map columns
+  return df.select(*[F.to_json(column).alias(column) if dtype.startswith("map") else F.col(column) for column, dtype in sorted(df.dtypes)])
+
+
+def assert_same_rows(left, right):
+  left, right = comparable(left), comparable(right)
+  assert left.columns == right.columns
+  assert left.exceptAll(right).count() == 0
+  assert right.exceptAll(left).count() == 0
+
+
+def log_rows(spark, table):
+  return spark.table(f"{table.split('.')[0]}.master_snapshot_log")\
+    .filter(F.col("snapshot") == table)\
+    .orderBy("refreshed_at")\
+    .collect()
+
+
+def test_first_refresh_builds_the_whole_window(spark, snapshot_source):
+  analysis = new_master(snapshot_source)
+  before = analysis.snapshot_status("cluster_master")
+  assert before["built_versions"] is None and not before["fresh"]
+
+  status = analysis.refresh_snapshot("cluster_master")
+  assert status["fresh"]
+  assert (status["start_date"], status["end_date"]) == (snapshot_source.start_date, snapshot_source.end_date)
+  assert status["built_versions"] == status["current_versions"]
+  assert set(status["current_versions"]) == {"clusterstatefact", "cluster"}
+
+  log = log_rows(spark, status["table"])
+  assert len(log) == 1
+  assert dict(log[0]["source_versions"]) == status["current_versions"]
+  assert_same_rows(spark.table(status["table"]),
+                   analysis.snapshot_frame("cluster_master", snapshot_source.start_date, snapshot_source.end_date))
+  assert_same_rows(analysis.snapshot("cluster_master", **BASE), analysis.cluster_master_filter(**BASE))
+
+
+def test_refresh_of_a_fresh_snapshot_writes_nothing(spark, snapshot_source):
+  analysis = new_master(snapshot_source)
+  table = analysis.refresh_snapshot("cluster_master")["table"]
+  version = analysis.table_version(table)
+  assert analysis.refresh_snapshot("cluster_master")["fresh"]
+  assert analysis.table_version(table) == version
+  assert len(log_rows(spark, table)) == 1
+
+
+def test_refresh_appends_the_days_after_the_coverage(spark, snapshot_source):
+  start, end = snapshot_source.start_date, snapshot_source.end_date
+  window_master(snapshot_source, start, end - timedelta(days=2)).refresh_snapshot("cluster_master")
+
+  analysis = window_master(snapshot_source, start, end)
+  assert analysis.snapshot_status("cluster_master")["end_date"] == end - timedelta(days=2)
+  status = analysis.refresh_snapshot("cluster_master")
+  assert (status["start_date"], status["end_date"]) == (start, end)
+
+  table = status["table"]
+  predicate = spark.sql(f"describe history {table} limit 1").first()["operationParameters"]["predicate"]
+  assert str(end - timedelta(days=1)) in predicate
+  assert [row["end_date"] for row in log_rows(spark, table)] == [end - timedelta(days=2), end]
+  assert_same_rows(spark.table(table), analysis.snapshot_frame("cluster_master", start, end))
+
+
+def test_refresh_recomputes_the_days_a_source_restated(spark, synthetic_overwatch, snapshot_source):
+  analysis = new_master(snapshot_source)
+  built = analysis.refresh_snapshot("cluster_master")
+
+  # An Overwatch run appending states of an older day (same generator, other seed)
+  day = snapshot_source.start_date + timedelta(days=2)
+  synthetic_overwatch(snapshot_source.db, **TEST_SCALE, seed=7).clusterstatefact()\
+    .filter(F.col("state_start_date") == F.lit(str(day)).cast("date"))\
+    .write.format("delta").mode("append").saveAsTable(f"{snapshot_source.db}.clusterstatefact")
+
+  status = analysis.snapshot_status("cluster_master")
+  assert not status["fresh"]
+  assert analysis.source_restated_from("clusterstatefact", status["built_versions"]["clusterstatefact"],
+                                       status["current_versions"]["clusterstatefact"]) == day
+
+  refreshed = analysis.refresh_snapshot("cluster_master")
+  assert refreshed["fresh"]
+  assert refreshed["built_versions"] != built["built_versions"]
+  predicate = spark.sql(f"describe history {refreshed['table']} limit 1").first()["operationParameters"]["predicate"]
+  assert str(day) in predicate
+  assert_same_rows(spark.table(refreshed["table"]),
+                   analysis.snapshot_frame("cluster_master", snapshot_source.start_date, snapshot_source.end_date))
+
+
+def test_refresh_rebuilds_a_snapshot_with_other_columns(spark, snapshot_source):
+  analysis = new_master(snapshot_source)
+  table = analysis.refresh_snapshot("cluster_master")["table"]
+
+  # A snapshot written by an older master, with a column the builder no longer produces
+  spark.table(table).withColumn("stale_column", F.lit(1))\
+    .write.format("delta").mode("overwrite").option("overwriteSchema", "true").saveAsTable(table)
+  master.checked_snapshot_columns.clear()
+  assert analysis.snapshot_columns_changed("cluster_master")
+  assert not analysis.snapshot_columns_changed("cluster_master")
+
+  master.checked_snapshot_columns.clear()
+  status = analysis.refresh_snapshot("cluster_master")
+  assert status["fresh"]
+  assert "stale_column" not in spark.table(table).columns
+  assert len(log_rows(spark, table)) == 2
+  assert_same_rows(spark.table(table),
+                   analysis.snapshot_frame("cluster_master", snapshot_source.start_date, snapshot_source.end_date))
+
+
+def cube_source(analysis, synthetic):
+  return analysis.snapshot_frame("cluster_master", synthetic.start_date, synthetic.end_date)\
+    .withColumn("is_autoscaling", F.col("autoscale").isNotNull())\
+    .withColumn("potential_worker_cost", F.when(F.col("worker_potential_core_H").isNotNull(), F.col("total_worker_cost")))
+
+
+def rounded_sums(analysis, df, group_by):
+  # Sums of the same rows in another order differ in the last bits
+  return df.select(*group_by, *[F.round(measure, 6).alias(measure) for measure in analysis.cost_cube_measures], "cluster_count")
+
+
+def test_cost_cube_grouping_sets_match_a_group_by(spark, snapshot_source):
+  analysis = new_master(snapshot_source)
+  cube = spark.table(analysis.refresh_cost_cube())
+  source = cube_source(analysis, snapshot_source)
+  for grouping_set in analysis.cost_cube_sets:
+    level = cube.filter(F.col("grouping_id") == analysis.cost_cube_grouping_id(grouping_set))
+    assert level.count() > 0, grouping_set
+    expected = source\
+      .groupBy(*grouping_set)\
+      .agg(*[F.sum(measure).alias(measure) for measure in analysis.cost_cube_measures],
+           F.countDistinct("cluster_id").alias("cluster_count"))
+    assert_same_rows(rounded_sums(analysis, level, grouping_set), rounded_sums(analysis, expected, grouping_set))
+
+
+@pytest.mark.parametrize("group_by", [
+  ["state_start_date", "workspace_name", "cluster_category"],
+  ["workspace_name", "node_type_id"],
+  ["state_start_date", "cluster_id"],
+])
+def test_cost_cube_matches_a_group_by(snapshot_source, group_by):
+  analysis = new_master(snapshot_source)
+  expected = cube_source(analysis, snapshot_source)\
+    .groupBy(*group_by)\
+    .agg(*[F.sum(measure).alias(measure) for measure in analysis.cost_cube_measures],
+         F.countDistinct("cluster_id").alias("cluster_count"))
+  assert_same_rows(rounded_sums(analysis, analysis.cost_cube(groupBy=group_by, **BASE), group_by),
+                   rounded_sums(analysis, expected, group_by))